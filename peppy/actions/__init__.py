@@ -30,7 +30,7 @@ import wx
 from peppy.debug import *
 from peppy.lib.multikey import KeyAccelerator
 from peppy.lib.iconstorage import *
-from peppy.lib.userparams import getAllSubclassesOf
+from peppy.lib.userparams import getAllSubclassesOf, SubclassRegistryMetaClass
 
 
 class ActionNeedsFocusException(Exception):
@@ -181,6 +181,8 @@ class SelectAction(debugmixin):
     L{OnDemandActionMixin} class, or using the L{OnDemandGlobalListAction}
     class.
     """
+    __metaclass__ = SubclassRegistryMetaClass
+    
     #: This is the name of the menu entry as it appears in the menu bar. i18n processing happens within the menu system, so no need to wrap this string in a call to the _ function
     name = None
     
@@ -10,11 +10,14 @@ Most of these are designed to be associated with L{FundamentalMode} major modes
 (and any modes derived from FundamentalMode).
 """
 
+import threading
+
 import wx
 import wx.stc
 
 from peppy.actions import *
 from peppy.stcbase import *
+from peppy.lib.threadutils import ThreadStatus
 
 class BufferBusyActionMixin(object):
     """Mixin to disable an action when the buffer is being modified.
@@ -76,6 +79,180 @@ class TextModificationAction(BufferBusyActionMixin, SelectAction):
         """
         return origtext != newtext
 
+class MutateThread(threading.Thread):
+    """Background thread to run the text transformation of a
+    L{BackgroundMutateMixin} action.
+    
+    If a chunk size is specified, the data (a list of lines) is passed to the
+    transformation function in pieces of that many lines so that progress can
+    be reported and the operation can be cancelled between pieces.
+    Otherwise, the data is transformed all at once and a cancel request only
+    causes the result to be discarded.
+    """
+    def __init__(self, func, data, chunk_size, status):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.func = func
+        self.data = data
+        self.chunk_size = chunk_size
+        self.status = status
+        self.stop_request = False
+    
+    def stopMutate(self):
+        """Request that the transformation stop at the next chunk boundary.
+        
+        This may be called from a different thread than the one performing the
+        transformation.
+        """
+        self.stop_request = True
+    
+    def run(self):
+        try:
+            if self.chunk_size:
+                num = len(self.data)
+                result = []
+                for start in xrange(0, num, self.chunk_size):
+                    if self.stop_request:
+                        break
+                    result.extend(self.func(self.data[start:start + self.chunk_size]))
+                    self.status.updateStatus(min(start + self.chunk_size, num), num)
+            else:
+                self.status.updateStatus(0, 1)
+                result = self.func(self.data)
+            if self.stop_request:
+                self.status.reportFailure("Cancelled.")
+            else:
+                self.status.reportSuccess("Completed.", result)
+        except:
+            import traceback
+            error = traceback.format_exc()
+            self.status.reportFailure(error)
+
+
+class MutateStatus(ThreadStatus):
+    """Report the status of a L{MutateThread} to the mode's status bar and
+    apply the result when finished.
+    """
+    def __init__(self, action, mode, pos, end):
+        ThreadStatus.__init__(self)
+        self.action = action
+        self.mode = mode
+        self.pos = pos
+        self.end = end
+        self.length = mode.GetTextLength()
+        self.thread = None
+    
+    def updateStatusGUI(self, perc, text=None):
+        if self.mode.status_info.isCancelled():
+            self.thread.stopMutate()
+        self.mode.status_info.updateProgress(int(perc), text)
+    
+    def reportSuccessGUI(self, text, data):
+        self.mode.buffer.setBusy(False)
+        if self.mode.status_info.isCancelled():
+            # Transformations that aren't split into chunks can only be
+            # cancelled by throwing away the result
+            self.mode.status_info.stopProgress("Cancelled; %s not applied." % self.action.getName())
+            return
+        if self.mode.GetTextLength() != self.length:
+            # The mode is disabled while busy, so this shouldn't happen
+            self.mode.status_info.stopProgress("Document changed; %s not applied." % self.action.getName())
+            return
+        self.action.applyBackgroundMutate(self.mode, self.pos, self.end, self.thread.data, data)
+        self.mode.status_info.stopProgress(text)
+    
+    def reportFailureGUI(self, text):
+        self.mode.buffer.setBusy(False)
+        self.mode.status_info.stopProgress(text)
+
+
+class BackgroundMutateMixin(object):
+    """Mixin to run the text transformation of a mutate action in a
+    background thread when the region is large.
+    
+    The buffer is marked busy while the transformation is running, which
+    disables user input to the major mode and all the actions that use
+    L{BufferBusyActionMixin}.  The result is applied in the GUI thread as a
+    single replacement so it can be undone in one step.
+    """
+    #: Regions larger than this many bytes are transformed in a background
+    #: thread; smaller regions are transformed immediately
+    background_threshold = 100000
+    
+    #: Set to False if the transformation calls methods of the mode, because
+    #: the stc isn't thread safe
+    background_safe = True
+    
+    #: Set to True if each line is transformed independently of the others,
+    #: allowing the transformation to be performed in chunks that report
+    #: progress and can be cancelled
+    independent_lines = False
+    
+    #: Number of lines in each chunk if the lines are independent
+    chunk_lines = 10000
+    
+    def isBackgroundMutate(self, pos, end):
+        return self.background_safe and end - pos > self.background_threshold
+    
+    def startBackgroundMutate(self, s, pos, end, func, data, chunk_size=0):
+        """Start the transformation thread
+        
+        @param s: the major mode
+        
+        @param pos: start of the region
+        
+        @param end: end of the region
+        
+        @param func: the transformation function, called in the background
+        thread with the data as its only argument
+        
+        @param data: text or list of lines of the region
+        
+        @param chunk_size: if non-zero, the number of lines to pass to the
+        transformation function at a time
+        """
+        status = MutateStatus(self, s, pos, end)
+        thread = MutateThread(func, data, chunk_size, status)
+        status.thread = thread
+        s.buffer.setBusy(True)
+        s.status_info.startProgress("%s..." % _(self.getName()).replace('&', ''), 100, cancel=True, delay=0.5)
+        thread.start()
+    
+    def replaceRegion(self, s, pos, end, text):
+        """Replace the region as a single undoable action
+        
+        @return: the end position of the new text
+        """
+        s.BeginUndoAction()
+        s.SetTargetStart(pos)
+        s.SetTargetEnd(end)
+        s.ReplaceTarget(text)
+        end = s.GetTargetEnd()
+        s.EndUndoAction()
+        s.updateRegion(pos, end)
+        return end
+    
+    def applyBackgroundMutate(self, s, pos, end, orig, data):
+        """Apply the result of the background transformation
+        
+        Called in the GUI thread when the transformation has completed.  The
+        default implementation replaces the region with the transformed text
+        if it is different from the original; subclasses can override this to
+        also set the cursor position or the selection.
+        
+        @param orig: the original text or list of lines
+        
+        @param data: the transformed text or list of lines
+        
+        @return: the end position of the new text
+        """
+        if data != orig:
+            if not isinstance(data, basestring):
+                data = "".join(data)
+            end = self.replaceRegion(s, pos, end, data)
+        return end
+
+
 class ScintillaCmdKeyExecute(TextModificationAction):
     """Base class for an action that uses one of the scintilla key commands.
     
@@ -98,8 +275,11 @@ class ScintillaCmdKeyExecute(TextModificationAction):
         for i in range(multiplier):
             self.mode.CmdKeyExecute(self.cmd)
 
-class RegionMutateAction(TextModificationAction):
+class RegionMutateAction(BackgroundMutateMixin, TextModificationAction):
     """Mixin class to operate only on a selected region.
+    
+    Large regions are transformed in a background thread; see
+    L{BackgroundMutateMixin}.
     """
 
     def isActionAvailable(self):
@@ -134,6 +314,10 @@ class RegionMutateAction(TextModificationAction):
         (pos, end) = s.GetSelection()
         if pos==end:
             return
+        if self.isBackgroundMutate(pos, end):
+            orig = s.GetTextRange(pos, end)
+            self.startBackgroundMutate(s, pos, end, self.mutate, orig)
+            return
         s.BeginUndoAction()
         orig = s.GetTextRange(pos, end)
         s.SetTargetStart(pos)
@@ -144,6 +328,11 @@ class RegionMutateAction(TextModificationAction):
             s.updateRegion(pos, end)
         s.GotoPos(end)
         s.EndUndoAction()
+    
+    def applyBackgroundMutate(self, s, pos, end, orig, newtext):
+        if self.isModified(newtext, orig):
+            self.replaceRegion(s, pos, end, newtext)
+        s.GotoPos(end)
 
     def action(self, index=-1, multiplier=1):
         assert self.dprint("id=%x name=%s index=%s" % (id(self),self.name,str(index)))
@@ -200,9 +389,14 @@ class WordOrRegionMutateAction(TextModificationAction):
         assert self.dprint("id=%x name=%s index=%s" % (id(self),self.name,str(index)))
         self.mutateSelection(self.mode)
         
-class LineOrRegionMutateAction(TextModificationAction):
+class LineOrRegionMutateAction(BackgroundMutateMixin, TextModificationAction):
     """Mixin class to operate on a line or the selected region extended
     to include full lines
+    
+    Large regions are transformed in a background thread; see
+    L{BackgroundMutateMixin}.  Subclasses whose L{mutateLines} transforms each
+    line independently should set C{independent_lines} so the
+    transformation can show its progress and be cancelled.
     """
 
     def mutateLines(self, lines):
@@ -263,6 +457,17 @@ class LineOrRegionMutateAction(TextModificationAction):
         #dprint("range: %d - %d, text=-->%s<--" % (pos, end, text))
         lines = text.splitlines(True) # keep line endings on
         #dprint(lines)
+        if self.isBackgroundMutate(pos, end):
+            # The cursor movement above is its own undo action; the
+            # replacement will be a separate undo action when the thread
+            # finishes
+            s.EndUndoAction()
+            if self.independent_lines:
+                chunk_size = self.chunk_lines
+            else:
+                chunk_size = 0
+            self.startBackgroundMutate(s, pos, end, self.mutateLines, lines, chunk_size)
+            return
         newlines = self.mutateLines(lines)
         if self.isModified(lines, newlines):
             #dprint(newlines)
@@ -273,6 +478,12 @@ class LineOrRegionMutateAction(TextModificationAction):
         s.GotoPos(end)
         s.SetSelection(pos, end)
         s.EndUndoAction()
+    
+    def applyBackgroundMutate(self, s, pos, end, lines, newlines):
+        if self.isModified(lines, newlines):
+            end = self.replaceRegion(s, pos, end, "".join(newlines))
+        s.GotoPos(end)
+        s.SetSelection(pos, end)
 
     def action(self, index=-1, multiplier=1):
         assert self.dprint("id=%x name=%s index=%s" % (id(self),self.name,str(index)))
@@ -12,6 +12,7 @@ from peppy.debug import *
 from peppy.lib.textctrl_autocomplete import TextCtrlAutoComplete
 from peppy.lib.iconstorage import *
 from peppy.lib.controls import StatusBarButton
+from peppy.lib.userparams import SubclassRegistryMetaClass
 
 class MinibufferMixin(object):
     minibuffer = None
@@ -70,6 +71,8 @@ class MinibufferRepeatAction(MinibufferAction):
 
 
 class MinibufferKeyboardAction(object):
+    __metaclass__ = SubclassRegistryMetaClass
+    
     #: Map of platform to default keybinding.  This is used to assign the class attribute keyboard, which is the current keybinding.  Currently, the defined platforms are named "win", "mac", and "emacs".  A platform named 'default' may also be included that will be the default key unless overridden by a specific platform
     key_bindings = None
     
@@ -14,6 +14,8 @@ from peppy.lib.iconstorage import *
 from peppy.lib.controls import *
 from peppy.lib.userparams import *
 from peppy.lib.bufferedreader import *
+from peppy.lib.idlescheduler import getIdleScheduler
+from peppy.lib.backgroundwriter import getBackgroundWriter
 
 from peppy.dialogs import *
 from peppy.stcinterface import *
@@ -461,6 +463,7 @@ class Buffer(BufferVFSMixin):
             basename=self.stc.getShortDisplayName(self.raw_url)
 
             BufferList.removeBuffer(self)
+            getIdleScheduler().cancelTasks(self)
             # Need to destroy the base STC or self will never get garbage
             # collected
             self.stc.Destroy()
@@ -556,6 +559,9 @@ class Buffer(BufferVFSMixin):
                 saveas = self.url
             else:
                 saveas = vfs.normalize(url)
+            # Make sure the backup copy of the original file has been made
+            # before it is overwritten
+            getBackgroundWriter().wait((self, "backup"))
             self.stc.prepareEncoding()
             fh = self.stc.openFileForWriting(saveas)
             self.stc.writeTo(fh, saveas)
@@ -671,8 +677,18 @@ class Buffer(BufferVFSMixin):
             self.saveTemporaryCopy(temp_url)
 
     def saveTemporaryCopy(self, temp_url):
+        """Save a copy of the document to the url
+        
+        If the stc is able to provide a snapshot of the document, the encoding
+        and writing is done by the background writer; otherwise the copy is
+        written before returning.
+        """
         self.dprint(u"Saving backup copy to %s" % temp_url)
         try:
+            encoder = self.stc.getSnapshotEncoder()
+            if encoder is not None:
+                getBackgroundWriter().write((self, "autosave"), temp_url, encoder)
+                return
             self.stc.prepareEncoding()
             fh = vfs.open_write(temp_url)
             self.stc.writeTo(fh, temp_url)
@@ -681,6 +697,8 @@ class Buffer(BufferVFSMixin):
             self.dprint(u"Failed autosaving to %s with %s" % (temp_url, e))
     
     def removeAutosaveIfExists(self):
+        # A pending autosave would recreate the file after it is removed
+        getBackgroundWriter().cancel((self, "autosave"))
         temp_url = self.stc.getAutosaveTemporaryFilename(self)
         if temp_url and vfs.exists(temp_url):
             try:
@@ -720,14 +738,16 @@ class Buffer(BufferVFSMixin):
             # it won't need to be backed up.
             return
         
-        try:
-            temp_url = self.stc.getBackupTemporaryFilename(self)
-            if temp_url:
-                if vfs.exists(temp_url):
-                    vfs.remove(temp_url)
-                vfs.copy(self.url, temp_url)
-        except NotImplementedError:
-            # Some URI schemes won't be writable, so don't cause a failure in
-            # this case; just ignore it.
-            pass
+        temp_url = self.stc.getBackupTemporaryFilename(self)
+        if temp_url:
+            # The copy is made by the background writer.  Some URI schemes
+            # won't be writable, but failures there are only logged.
+            url = self.url
+            def read():
+                fh = vfs.open(url)
+                try:
+                    return fh.read()
+                finally:
+                    fh.close()
+            getBackgroundWriter().write((self, "backup"), temp_url, read)
 
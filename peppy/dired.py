@@ -5,7 +5,7 @@
 Major mode for displaying a list of files in a directory
 """
 
-import os, datetime
+import os, datetime, time, threading
 
 import wx
 from wx.lib.pubsub import Publisher
@@ -48,6 +48,10 @@ class DiredPopupActions(ContextMenuActions):
         ContextMenuActions.__init__(self)
         self.mode = mode
         self.entries = entries
+        # The context menu actions use the metadata of the entries, which may
+        # not have arrived yet from the background thread
+        for entry in self.entries:
+            entry.loadMetadata()
     
     def getMajorMode(self):
         return self.mode
@@ -79,13 +83,18 @@ class DiredPopupActions(ContextMenuActions):
 class DiredEntry(object):
     """Helper class representing one line in the dired list
     
+    The entry is created with only the name of the file so that the list can
+    be displayed immediately; the metadata is filled in later through
+    L{setMetadata}, usually from the L{DiredMetadataThread}.
     """
     def __init__(self, index, base_url, name):
         self.index = index
         self.basename = name
-        self.url, self.mode = self.getKey(base_url, name)
+        self.url = vfs.get_child_reference(base_url, name)
+        self.mode = ""
         self.flags = ""
-        self.metadata = vfs.get_metadata(self.url)
+        self.metadata = None
+        self.loaded = False
     
     def __getitem__(self, k):
         if k==0:
@@ -102,31 +111,43 @@ class DiredEntry(object):
             return self.getDescription()
         return self.getURL()
 
-    def getKey(self, base_url, name):
-        if isinstance(name, unicode):
-            name = name.encode("utf-8")
+    def setMetadata(self, metadata):
+        """Set the metadata of the entry
         
-        # Force the URL to remove any special meaning of the ? and # characters
-        import urllib
-        name = urllib.quote(name)
-        url = base_url.resolve2(name)
+        @param metadata: dict as returned by L{vfs.get_entry_metadata}, or None
+        if the metadata couldn't be determined
+        """
+        self.metadata = metadata
+        self.loaded = True
+        if metadata is None:
+            self.mode = "?"
+            return
         
         mode = []
-        if vfs.is_folder(url):
-            url.path.endswith_slash = True
+        if metadata['is_folder']:
+            self.url.path.endswith_slash = True
             mode.append("d")
         else:
-            url.path.endswith_slash = False
+            self.url.path.endswith_slash = False
             mode.append("-")
-        if vfs.can_read(url):
+        if metadata['can_read']:
             mode.append("r")
         else:
             mode.append("-")
-        if vfs.can_write(url):
+        if metadata['can_write']:
             mode.append("w")
         else:
             mode.append("-")
-        return url, "".join(mode)
+        self.mode = "".join(mode)
+    
+    def loadMetadata(self):
+        """Synchronously load the metadata if it hasn't been loaded yet"""
+        if not self.loaded:
+            try:
+                metadata = vfs.get_entry_metadata(self.url)
+            except (OSError, IOError):
+                metadata = None
+            self.setMetadata(metadata)
 
     def getBasename(self):
         return self.basename
@@ -138,25 +159,35 @@ class DiredEntry(object):
         return unicode(self.url)
     
     def getSize(self):
-        return self.metadata['size']
+        if self.metadata:
+            return self.metadata['size']
+        return None
     
     def getDate(self):
-        return self.metadata['mtime']
+        if self.metadata:
+            return self.metadata['mtime']
+        return None
     
     def getCompactDate(self):
-        return getCompactDate(self.metadata['mtime'])
+        if self.metadata:
+            return getCompactDate(self.metadata['mtime'])
+        return u""
     
     def getMode(self):
         return self.mode
     
     def getDescription(self):
+        if not self.metadata:
+            return ""
         desc = self.metadata['description']
         if not desc:
             desc = self.metadata['mimetype']
         return desc
     
     def getMimeType(self):
-        return self.metadata['mimetype']
+        if self.metadata:
+            return self.metadata['mimetype']
+        return None
 
     def getFlags(self):
         """Get the flags for the given key.
@@ -174,6 +205,48 @@ class DiredEntry(object):
         self.flags = flags
 
 
+class DiredMetadataThread(threading.Thread, debugmixin):
+    """Background thread that loads the metadata of the entries in a folder
+    
+    The metadata is requested from the vfs in a single batch using
+    L{vfs.get_folder_metadata}, which uses a single directory listing with
+    attributes where the backend supports it.  Results are passed back to the
+    major mode in batches, at most one batch per L{batch_interval}, so the
+    GUI thread isn't flooded with a call for every entry.
+    """
+    #: Minimum time in seconds between updates sent to the GUI thread
+    batch_interval = 0.25
+    
+    def __init__(self, mode, url, names):
+        threading.Thread.__init__(self)
+        self.mode = mode
+        self.url = url
+        self.names = names
+        self.stop = False
+        self.setDaemon(True)
+    
+    def stopLoading(self):
+        self.stop = True
+    
+    def run(self):
+        batch = []
+        last = time.time()
+        try:
+            for name, metadata in vfs.get_folder_metadata(self.url, self.names):
+                if self.stop:
+                    return
+                batch.append((name, metadata))
+                now = time.time()
+                if now - last > self.batch_interval:
+                    wx.CallAfter(self.mode.metadataReceived, self, batch, False)
+                    batch = []
+                    last = now
+        except Exception, e:
+            dprint("Failed loading metadata for %s: %s" % (self.url, e))
+        if not self.stop:
+            wx.CallAfter(self.mode.metadataReceived, self, batch, True)
+
+
 class DiredSTC(NonResidentSTC):
     """Dummy STC just to prevent other modes from being able to change their
     major mode to this one.
@@ -205,13 +278,8 @@ class DiredMode(ListMode):
 
     def __init__(self, parent, wrapper, buffer, frame):
         self.url = buffer.url
-        
-        # Need to maintain two maps; the original order based on the index
-        # number when the entries were inserted into the list, and the
-        # standard itemDataMap list.  itemDataMap maintains the current order
-        # that is used by the ColumnSorterMixin to reorder the list when one
-        # of the column headings is clicked.
-        self.origDataMap = {}
+        self.metadata_thread = None
+        self.metadata_index = {}
         
         ListMode.__init__(self, parent, wrapper, buffer, frame)
     
@@ -225,8 +293,15 @@ class DiredMode(ListMode):
             self.list.SortListItems(1)
         self.list.OnSortOrderChanged()
     
-    def GetSecondarySortValues(self, col, key1, key2, itemDataMap):
-        return (itemDataMap[key1].getBasename(), itemDataMap[key2].getBasename())
+    def getSecondarySortValue(self, col, entry):
+        return entry.getBasename()
+    
+    def getSortKey(self, col, entry):
+        # Entries whose metadata hasn't arrived yet are sorted by name ahead
+        # of the others
+        if not entry.loaded and col > 1:
+            return (0, getSortableValue(entry.getBasename()))
+        return (1, ListMode.getSortKey(self, col, entry))
 
     def createColumns(self, list):
         list.InsertSizedColumn(0, "Flags", min=30, max=30, greedy=True)
@@ -240,6 +315,8 @@ class DiredMode(ListMode):
     def OnItemActivated(self, evt):
         index = evt.GetIndex()
         entry = self.getEntryFromIndex(index)
+        # The folder flag is needed to open the url correctly
+        entry.loadMetadata()
         url = entry.getURL()
         self.dprint("clicked on %d: path=%s" % (index, unicode(url.path).encode('utf-8')))
         self.frame.open(url)
@@ -299,24 +376,13 @@ class DiredMode(ListMode):
             if 'D' in flags:
                 dprint("Not actually deleting %s" % url)
             elif 'M' in flags:
+                # The folder flag is needed to open the url correctly
+                entry.loadMetadata()
                 self.frame.open(url)
             flags = ""
             entry.setFlags(flags)
             self.list.SetStringItem(index, 0, flags)
     
-    def getEntryFromIndex(self, index):
-        """Return the DiredEntry from the list index.
-        
-        This is not as simple as it may seem because the list can be reordered,
-        changing the meaning of index as it was originally created.  To
-        return the correct entry given the list index, an additional layer of
-        abstraction is needed: the ItemData field of the list points to the
-        real entry.
-        """
-        orig_index = self.list.GetItemData(index)
-        entry = self.origDataMap[orig_index]
-        return entry
-
     def getSelectedEntries(self):
         """Return the currently selected entries.
         
@@ -338,7 +404,6 @@ class DiredMode(ListMode):
             # don't process if we're currently updating the list
             dprint("skipping an update while we're in the middle of an execute")
             return
-        self.origDataMap = {}
         
         self.list.Freeze()
         ListMode.resetList(self, msg)
@@ -347,6 +412,55 @@ class DiredMode(ListMode):
             self.list.SortListItems()
         self.list.Thaw()
     
+    def resetListPostHook(self):
+        """Start loading the metadata of the entries in the background"""
+        self.stopMetadataLoading()
+        names = []
+        self.metadata_index = {}
+        for data_index, entry in enumerate(self.list.itemDataMap):
+            names.append(entry.getBasename())
+            self.metadata_index[entry.getBasename()] = data_index
+        if names:
+            self.metadata_thread = DiredMetadataThread(self, self.url, names)
+            self.metadata_thread.start()
+    
+    def stopMetadataLoading(self):
+        if self.metadata_thread is not None:
+            self.metadata_thread.stopLoading()
+            self.metadata_thread = None
+    
+    def metadataReceived(self, thread, batch, finished):
+        """Update the entries with the metadata loaded by the background
+        thread.
+        
+        Called in the GUI thread through wx.CallAfter.
+        """
+        if not self or thread is not self.metadata_thread:
+            # Either the mode has been deleted or the list has been reset
+            # since the thread was started
+            return
+        changed = []
+        for name, metadata in batch:
+            data_index = self.metadata_index.get(name)
+            if data_index is not None:
+                self.list.itemDataMap[data_index].setMetadata(metadata)
+                changed.append(data_index)
+        if finished:
+            for data_index, entry in enumerate(self.list.itemDataMap):
+                if not entry.loaded:
+                    entry.setMetadata(None)
+                    changed.append(data_index)
+            self.metadata_thread = None
+        self.list.invalidateItems(changed)
+        if finished and self.list.GetSortState()[0] > 1:
+            # The sort column depends on the metadata, so the temporary sort
+            # by name has to be replaced
+            self.list.SortListItems()
+    
+    def deleteWindowPreHook(self):
+        self.stopMetadataLoading()
+        ListMode.deleteWindowPreHook(self)
+    
     def getListItems(self):
         use_hidden = self.classprefs.show_hidden
         for name in vfs.get_names(self.url):
@@ -354,12 +468,13 @@ class DiredMode(ListMode):
                 yield name
     
     def getItemRawValues(self, index, name):
-        entry = DiredEntry(index, self.url, name)
-        self.origDataMap[index] = entry
-        return entry
+        return DiredEntry(index, self.url, name)
     
     def convertRawValuesToStrings(self, entry):
-        return (entry.getFlags(), entry.getBasename(), str(entry.getSize()),
+        size = entry.getSize()
+        if size is None:
+            size = ""
+        return (entry.getFlags(), entry.getBasename(), str(size),
                 entry.getCompactDate(), entry.getMode(), entry.getDescription(),
                 entry.getUnicode())
     
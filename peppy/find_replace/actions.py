@@ -20,6 +20,7 @@ from peppy.actions.base import *
 from peppy.debug import *
 
 from services import *
+from highlight import *
 
 
 class FindBar(wx.Panel, debugmixin):
@@ -28,6 +29,9 @@ class FindBar(wx.Panel, debugmixin):
     """
     debuglevel = 0
     
+    #: If True, all matches are indexed in the background and highlighted
+    use_match_index = True
+    
     def __init__(self, parent, frame, stc, storage=None, service=None, direction=1, **kwargs):
         wx.Panel.__init__(self, parent, style=wx.NO_BORDER|wx.TAB_TRAVERSAL)
         self.frame = frame
@@ -42,6 +46,11 @@ class FindBar(wx.Panel, debugmixin):
         else:
             self.service = FindService(self.stc, self.settings)
         
+        if self.use_match_index:
+            self.match_index = MatchIndex(self.stc, self.service, self.OnMatchIndexUpdated)
+        else:
+            self.match_index = None
+        
         self.createCtrls()
         
         # PyPE compat
@@ -56,6 +65,8 @@ class FindBar(wx.Panel, debugmixin):
         sizer.Add(self.label, 0, wx.CENTER)
         self.find = wx.TextCtrl(self, -1, size=(-1,-1), style=wx.TE_PROCESS_ENTER)
         sizer.Add(self.find, 1, wx.EXPAND)
+        self.matches = wx.StaticText(self, -1, "")
+        sizer.Add(self.matches, 0, wx.CENTER|wx.LEFT, 5)
         self.SetSizer(sizer)
         
         self.find.Bind(wx.EVT_TEXT, self.OnChanged)
@@ -76,12 +87,77 @@ class FindBar(wx.Panel, debugmixin):
 
         self.service.setFindString(self.find.GetValue())
         self.service.resetFirstFound()
+        self.resetMatchIndex()
         
         #search in whatever direction we were before
         self._lastcall(evt, incremental=True)
         
         evt.Skip()
     
+    def resetMatchIndex(self):
+        """Restart the background scan for all matches of the find string"""
+        if self.match_index:
+            self.match_index.setService(self.service)
+            self.match_index.start()
+    
+    def stopMatchIndex(self):
+        if self.match_index:
+            self.match_index.stop()
+    
+    def OnMatchIndexUpdated(self, index):
+        if not self.settings.find:
+            text = ""
+        else:
+            count = index.getCount()
+            if count == 1:
+                text = _("%d match") % count
+            else:
+                text = _("%d matches") % count
+            if not index.isComplete():
+                text += u"\u2026"
+        if text != self.matches.GetLabel():
+            self.matches.SetLabel(text)
+            self.Layout()
+    
+    def doFindNext(self, start=-1, incremental=False):
+        """Find the next match, using the match index if it is complete.
+        
+        Incremental searches always use the find service because the index
+        is being rebuilt while the user is typing.
+        
+        @return: same as L{FindService.doFindNext}
+        """
+        index = self.match_index
+        if incremental or index is None or not index.isComplete():
+            return self.service.doFindNext(start, incremental)
+        if start < 0:
+            start, end = self.stc.GetSelection()
+            start, end = min(start, end), max(start, end)
+        else:
+            end = start - 1
+        return self.selectIndexedMatch(index.findNext(start, end), start)
+    
+    def doFindPrev(self, start=-1, incremental=False):
+        """Find the previous match, using the match index if it is complete.
+        
+        @return: same as L{FindService.doFindPrev}
+        """
+        index = self.match_index
+        if incremental or index is None or not index.isComplete():
+            return self.service.doFindPrev(start, incremental)
+        if start < 0:
+            start = min(self.stc.GetSelection())
+        return self.selectIndexedMatch(index.findPrev(start), start)
+    
+    def selectIndexedMatch(self, match, start):
+        self.service.resetSearchState()
+        if match is None:
+            return -1, start
+        self.stc.SetSelection(match[0], match[1])
+        if self.settings.first_found == -1:
+            self.settings.first_found = match[0]
+        return match[0], start
+    
     def OnNotFound(self, msg=None):
         self.find.SetForegroundColour(wx.RED)
         if msg is None:
@@ -134,7 +210,7 @@ class FindBar(wx.Panel, debugmixin):
     def OnFindN(self, evt, allow_wrap=True, help='', interactive=True, incremental=False):
         self._lastcall = self.OnFindN
         
-        posn, st = self.service.doFindNext(incremental=incremental)
+        posn, st = self.doFindNext(incremental=incremental)
         self.dprint("start=%s pos=%s" % (st, posn))
         if posn is None:
             self.cancel()
@@ -150,7 +226,7 @@ class FindBar(wx.Panel, debugmixin):
             return
         
         if allow_wrap and st != 0:
-            posn, st = self.service.doFindNext(0)
+            posn, st = self.doFindNext(0)
             self.dprint("wrapped: start=%d pos=%d" % (st, posn))
         self.service.setWrapped()
         
@@ -167,7 +243,7 @@ class FindBar(wx.Panel, debugmixin):
     def OnFindP(self, evt, allow_wrap=True, help='', incremental=False):
         self._lastcall = self.OnFindP
         
-        posn, st = self.service.doFindPrev(incremental=incremental)
+        posn, st = self.doFindPrev(incremental=incremental)
         if posn is None:
             self.cancel()
             return
@@ -180,7 +256,7 @@ class FindBar(wx.Panel, debugmixin):
             return
         
         if allow_wrap and st != self.stc.GetTextLength():
-            posn, st = self.service.doFindPrev(self.stc.GetTextLength())
+            posn, st = self.doFindPrev(self.stc.GetTextLength())
         self.service.setWrapped()
         
         if posn != -1:
@@ -201,6 +277,7 @@ class FindBar(wx.Panel, debugmixin):
             self.find.ChangeValue(self.settings.find_user)
             self.find.SetInsertionPointEnd()
             self.find.SetSelection(0, self.find.GetLastPosition())
+            self.resetMatchIndex()
             return True
         return False
 
@@ -208,6 +285,7 @@ class FindBar(wx.Panel, debugmixin):
         self.resetColor()
         if service is not None:
             self.service = service(self.stc, self.settings)
+            self.resetMatchIndex()
         
         if direction < 0:
             self.setDirection(-1)
@@ -294,6 +372,7 @@ class FindReplaceMinibufferMixin(object):
     
     def closePreHook(self):
         self.win.saveState()
+        self.win.stopMatchIndex()
         self.dprint(self.search_storage)
 
 
@@ -376,6 +455,10 @@ class ReplaceBar(FindBar):
     """
     help_status = "y: replace, n: skip, q: exit, !:replace all, f: edit find, r: edit replace, ?: help"
     
+    # The replacement depends on the state of the find service after each
+    # search, so the match index can't be used to jump between matches
+    use_match_index = False
+    
     def __init__(self, *args, **kwargs):
         FindBar.__init__(self, *args, **kwargs)
         
@@ -547,28 +630,31 @@ class ReplaceBar(FindBar):
         return False
     
     def OnReplaceAll(self, evt):
+        if self.stc.GetReadOnly():
+            return
         self.count = 0
-        last_cursor = self.stc.GetCurrentPos()
         self.service.setWrapped(False)
         
-        # FIXME: this takes more time than it should, probably because there's
-        # a lot of redundant stuff going on in OnReplace.  This should be
-        # rewritten for speed at some point.
+        # Replacement starts with the current match if there is one, otherwise
+        # at the cursor.  Either way, it's the start of the selection.
+        start = self.stc.GetSelectionStart()
         if hasattr(self.stc, 'showBusy'):
             self.stc.showBusy(True)
             wx.Yield()
-        self.stc.BeginUndoAction()
         valid = True
         try:
-            while not self.service.isWrapped() and valid:
-                valid = self.OnReplace(None, interactive=False)
-                last_cursor = self.stc.GetSelectionEnd()
-            self.stc.GotoPos(last_cursor)
+            try:
+                self.count, last_cursor = self.service.doReplaceAll(start)
+                if last_cursor >= 0:
+                    self.stc.GotoPos(last_cursor)
+            except ReplacementError, e:
+                self.OnReplaceError(str(e))
+                valid = False
         finally:
-            self.stc.EndUndoAction()
+            if hasattr(self.stc, 'showBusy'):
+                self.stc.showBusy(False)
+        self.service.setWrapped()
         
-        if hasattr(self.stc, 'showBusy'):
-            self.stc.showBusy(False)
         if valid:
             if self.count == 1:
                 occurrences = _("Replaced %d occurrence")
@@ -0,0 +1,308 @@
+# peppy Copyright (c) 2006-2010 Rob McMullen
+# Licenced under the GPLv2; see http://peppy.flipturn.org for more info
+"""Match index used to highlight all matches of a find service
+
+The L{MatchIndex} scans the document for matches of a L{FindService} in
+small chunks on a timer so that the user interface stays responsive while
+typing.  Modifications to the document only cause the changed lines to be
+scanned again; all other matches are shifted to their new positions.
+
+The index provides the total number of matches, highlights the matches in
+the visible part of the document using an indicator, and can be used to
+move to the next or previous match without searching the document again.
+"""
+import time
+from bisect import bisect_left, bisect_right
+
+import wx
+import wx.stc
+
+from peppy.debug import *
+
+
+class MatchIndex(debugmixin):
+    """Sorted list of all matches of a find service in an stc
+
+    Matches are stored as two parallel sorted lists of start and end
+    positions.  Because matches never overlap, both lists are in increasing
+    order and can be searched with the bisect module.
+
+    The regions of the document that still need to be scanned are kept in
+    the list of pending ranges.  The index is complete once there are no
+    pending ranges.
+    """
+    #: Maximum number of lines to search in a single call to the find service
+    chunk_lines = 1000
+
+    #: Maximum time in seconds spent scanning before yielding to the GUI
+    time_slice = 0.02
+
+    #: Time in milliseconds between scanning time slices
+    delay = 10
+
+    #: Indicator number used for the highlighting if the stc supports
+    #: container indicators
+    container_indicator = 8
+
+    #: Style bit indicator number used if the stc doesn't support container
+    #: indicators
+    style_indicator = 1
+
+    def __init__(self, stc, service, callback=None, color="#FFD700"):
+        """Create the index.
+
+        @param stc: stc to search
+
+        @param service: L{FindService} instance that performs the search
+
+        @param callback: optional function that is called with the index as
+        its argument whenever the match count changes
+
+        @param color: color of the highlight indicator
+        """
+        self.stc = stc
+        self.service = service
+        self.callback = callback
+        self.starts = []
+        self.ends = []
+        self.pending = []
+        self.timer = None
+        self.highlighted = None
+        self.active = False
+        self.setIndicator(color)
+
+    def setIndicator(self, color):
+        if hasattr(self.stc, 'IndicatorFillRange'):
+            self.indicator = self.container_indicator
+            self.indicator_mask = None
+        else:
+            self.indicator = self.style_indicator
+            self.indicator_mask = wx.stc.STC_INDIC1_MASK
+        self.stc.IndicatorSetStyle(self.indicator, wx.stc.STC_INDIC_ROUNDBOX)
+        self.stc.IndicatorSetForeground(self.indicator, color)
+
+    def setService(self, service):
+        self.service = service
+
+    def start(self):
+        """Start indexing the whole document in the background"""
+        if not self.active:
+            self.active = True
+            if hasattr(self.stc, 'addModifyCallback'):
+                self.stc.addModifyCallback(self.OnModified)
+            self.stc.Bind(wx.stc.EVT_STC_UPDATEUI, self.OnUpdateUI)
+        self.starts = []
+        self.ends = []
+        self.clearHighlight()
+        if self.service.settings.find:
+            self.pending = [(0, self.stc.GetTextLength())]
+            self.schedule()
+        else:
+            self.pending = []
+        self.notify()
+
+    def stop(self):
+        """Stop indexing and remove all highlighting"""
+        if self.active:
+            self.active = False
+            if hasattr(self.stc, 'removeModifyCallback'):
+                self.stc.removeModifyCallback(self.OnModified)
+            self.stc.Unbind(wx.stc.EVT_STC_UPDATEUI, handler=self.OnUpdateUI)
+        if self.timer is not None:
+            self.timer.Stop()
+            self.timer = None
+        self.clearHighlight()
+        self.starts = []
+        self.ends = []
+        self.pending = []
+
+    def isComplete(self):
+        return self.active and not self.pending
+
+    def getCount(self):
+        return len(self.starts)
+
+    def notify(self):
+        if self.callback:
+            self.callback(self)
+
+    def schedule(self):
+        if self.timer is None:
+            self.timer = wx.CallLater(self.delay, self.processSlice)
+
+    def processSlice(self):
+        """Scan chunks of the document until the time slice is used up"""
+        self.timer = None
+        if not self.active:
+            return
+        start = time.time()
+        while self.pending and time.time() - start < self.time_slice:
+            self.scanChunk()
+        self.highlightVisible(True)
+        self.notify()
+        if self.pending:
+            self.schedule()
+
+    def scanChunk(self):
+        """Scan the first chunk of the first pending range"""
+        start, end = self.pending[0]
+        line = self.stc.LineFromPosition(start) + self.chunk_lines
+        if line < self.stc.GetLineCount():
+            chunk_end = min(end, self.stc.PositionFromLine(line))
+        else:
+            chunk_end = end
+        if chunk_end <= start:
+            chunk_end = end
+        matches = self.service.findAll(start, chunk_end)
+        self.setMatches(start, chunk_end, matches)
+        if chunk_end >= end:
+            self.pending.pop(0)
+        else:
+            self.pending[0] = (chunk_end, end)
+
+    def setMatches(self, start, end, matches):
+        """Replace the matches that start within the range [start, end)"""
+        i = bisect_left(self.starts, start)
+        if end < self.stc.GetTextLength():
+            # Matches at the end position belong to the next range
+            matches = [m for m in matches if m[0] < end]
+            j = bisect_left(self.starts, end)
+        else:
+            j = len(self.starts)
+        self.starts[i:j] = [m[0] for m in matches]
+        self.ends[i:j] = [m[1] for m in matches]
+
+    def OnModified(self, evt):
+        mod = evt.GetModificationType()
+        if not self.active or not mod & (wx.stc.STC_MOD_INSERTTEXT | wx.stc.STC_MOD_DELETETEXT):
+            return
+        pos = evt.GetPosition()
+        length = evt.GetLength()
+        if mod & wx.stc.STC_MOD_INSERTTEXT:
+            delta = length
+            old_end = pos
+        else:
+            delta = -length
+            old_end = pos + length
+        new_end = old_end + delta
+        self.updatePositions(pos, old_end, new_end, delta)
+
+    def updatePositions(self, pos, old_end, new_end, delta):
+        """Update the index after the text between pos and old_end was
+        replaced by the text between pos and new_end.
+
+        Matches after the change are shifted, and the lines containing the
+        change are added to the pending ranges to be scanned again.
+        """
+        stc = self.stc
+        dirty_start = stc.PositionFromLine(stc.LineFromPosition(pos))
+        line = stc.LineFromPosition(new_end) + 1
+        if line < stc.GetLineCount():
+            dirty_end = stc.PositionFromLine(line)
+        else:
+            dirty_end = stc.GetTextLength()
+        old_dirty_end = dirty_end - delta
+
+        # Remove the matches in the changed lines, including any match that
+        # starts before the changed lines and extends into them
+        i = min(bisect_left(self.starts, dirty_start),
+                bisect_right(self.ends, dirty_start))
+        if dirty_end < stc.GetTextLength():
+            j = bisect_left(self.starts, old_dirty_end)
+        else:
+            j = len(self.starts)
+        del self.starts[i:j]
+        del self.ends[i:j]
+        if delta:
+            self.starts[i:] = [s + delta for s in self.starts[i:]]
+            self.ends[i:] = [e + delta for e in self.ends[i:]]
+
+        def adjust(p):
+            if p < pos:
+                return p
+            elif p >= old_end:
+                return p + delta
+            return new_end
+
+        ranges = [(adjust(s), adjust(e)) for s, e in self.pending]
+        ranges.append((dirty_start, dirty_end))
+        ranges.sort()
+        self.pending = []
+        for s, e in ranges:
+            if self.pending and s <= self.pending[-1][1]:
+                self.pending[-1] = (self.pending[-1][0], max(e, self.pending[-1][1]))
+            else:
+                self.pending.append((s, e))
+
+        # Indicators move along with the text, so the highlighted range
+        # must be moved as well in order to be cleared properly
+        if self.highlighted:
+            self.highlighted = (adjust(self.highlighted[0]), adjust(self.highlighted[1]))
+        self.schedule()
+
+    def findNext(self, start, end):
+        """Find the first match after the given selection
+
+        @return: (start, end) tuple of the match, or None if there's no match
+        after the selection
+        """
+        i = bisect_left(self.starts, start)
+        while i < len(self.starts):
+            if self.starts[i] > start or self.ends[i] > end:
+                return self.starts[i], self.ends[i]
+            i += 1
+        return None
+
+    def findPrev(self, start):
+        """Find the last match starting before the given position
+
+        @return: (start, end) tuple of the match, or None if there's no match
+        before the position
+        """
+        i = bisect_left(self.starts, start)
+        if i > 0:
+            return self.starts[i - 1], self.ends[i - 1]
+        return None
+
+    def applyIndicator(self, start, end, state):
+        if end <= start:
+            return
+        if self.indicator_mask is None:
+            self.stc.SetIndicatorCurrent(self.indicator)
+            if state:
+                self.stc.IndicatorFillRange(start, end - start)
+            else:
+                self.stc.IndicatorClearRange(start, end - start)
+        else:
+            self.stc.StartStyling(start, self.indicator_mask)
+            if state:
+                self.stc.SetStyling(end - start, self.indicator_mask)
+            else:
+                self.stc.SetStyling(end - start, 0)
+
+    def clearHighlight(self):
+        if self.highlighted:
+            start, end = self.highlighted
+            self.applyIndicator(start, min(end, self.stc.GetTextLength()), False)
+        self.highlighted = None
+
+    def highlightVisible(self, force=False):
+        """Highlight the matches in the visible part of the document"""
+        stc = self.stc
+        first = stc.DocLineFromVisible(stc.GetFirstVisibleLine())
+        last = stc.DocLineFromVisible(stc.GetFirstVisibleLine() + stc.LinesOnScreen())
+        start = stc.PositionFromLine(first)
+        end = stc.GetLineEndPosition(min(last, stc.GetLineCount() - 1))
+        if not force and self.highlighted == (start, end):
+            return
+        self.clearHighlight()
+        i = bisect_left(self.starts, start)
+        j = bisect_right(self.starts, end)
+        for k in range(i, j):
+            self.applyIndicator(self.starts[k], self.ends[k], True)
+        self.highlighted = (start, end)
+
+    def OnUpdateUI(self, evt):
+        if self.active and self.highlighted is not None:
+            self.highlightVisible()
+        evt.Skip()
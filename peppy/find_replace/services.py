@@ -346,6 +346,119 @@ class FindService(debugmixin):
         self.stc.SetSelection(start, end)
         if start < self.settings.first_found:
             self.settings.first_found += (end - start) - (orig_end - orig_start)
+    
+    def getMatchEnd(self, pos, count):
+        """Return the end position of a match given the number of characters
+        returned by L{findMatchLength}
+        """
+        return self.getRange(pos, count)[1]
+    
+    def resetSearchState(self):
+        """Forget any state saved from the previous search so the next search
+        starts from the current selection.
+        
+        This is used when the selection is moved to a match without going
+        through L{doFindNext} or L{doFindPrev}.
+        """
+        pass
+    
+    def findAll(self, start=0, end=-1):
+        """Find all the matches in the document without changing the selection
+        
+        @param start: starting position in the text
+        
+        @param end: ending position in the text, or -1 for the end of the
+        document
+        
+        @return: list of (start, end) tuples of positions in the stc, in
+        increasing order.  Matches don't overlap.
+        """
+        matches = []
+        if not self.settings.find:
+            return matches
+        flags = self.getFlags(wx.FR_DOWN)
+        if end < 0:
+            last = self.stc.GetTextLength()
+        else:
+            last = end
+        while start <= last:
+            pos = self.stc.FindText(start, last, self.settings.find, flags)
+            if pos < 0:
+                break
+            count = self.findMatchLength(pos)
+            if count < 0:
+                start = pos + 1
+                continue
+            match_end = self.getMatchEnd(pos, count)
+            matches.append((pos, match_end))
+            if match_end > pos:
+                start = match_end
+            else:
+                start = pos + 1
+        return matches
+    
+    def getReplacementText(self, first, last, matches):
+        """Build the replacement for the entire range of text covering all
+        the matches.
+        
+        The text between matches is copied unchanged, and each match is
+        replaced by the result of L{getReplacement} so bulk replacement has
+        the same semantics as replacing the matches one at a time.
+        
+        @param first: starting position of the range of text
+        @param last: ending position of the range of text
+        @param matches: list of (start, end) tuples as returned by
+        L{findAll}
+        @return: unicode string of the replacement text
+        """
+        # Positions in the stc are offsets into the utf-8 encoded bytes, so
+        # work on the raw bytes to avoid converting between character and byte
+        # positions for every match
+        data = self.stc.GetStyledText(first, last)[::2]
+        output = []
+        prev = first
+        for start, end in matches:
+            output.append(data[prev - first:start - first])
+            replacing = data[start - first:end - first].decode('utf-8')
+            output.append(self.getReplacement(replacing).encode('utf-8'))
+            prev = end
+        output.append(data[prev - first:])
+        return "".join(output).decode('utf-8')
+    
+    def replaceMatches(self, matches):
+        """Replace all the matches using a single replacement of the text
+        
+        @return: position in the stc of the end of the last replacement
+        """
+        first = matches[0][0]
+        last = matches[-1][1]
+        replacement = self.getReplacementText(first, last, matches)
+        self.stc.SetTargetStart(first)
+        self.stc.SetTargetEnd(last)
+        self.stc.ReplaceTarget(replacement)
+        return first + len(replacement.encode('utf-8'))
+    
+    def doReplaceAll(self, start=0):
+        """Replace all the matches from the starting position to the end of
+        the document.
+        
+        All the matches are found before any text is changed, and all the
+        replacements are applied as a single undo action.
+        
+        @param start: starting position in the text
+        
+        @return: tuple containing the number of replacements and the position
+        of the end of the last replacement, or -1 if nothing was replaced
+        """
+        matches = self.findAll(start)
+        if not matches:
+            return 0, -1
+        self.stc.BeginUndoAction()
+        try:
+            pos = self.replaceMatches(matches)
+        finally:
+            self.stc.EndUndoAction()
+        return len(matches), pos
         
 
 
@@ -410,6 +523,28 @@ $ 	This matches the end of a line.
         count = self.stc.ReplaceTargetRE(self.settings.replace)
 
         self.updateSelection(start, end, start, start + count)
+    
+    def getMatchEnd(self, pos, count):
+        # findMatchLength returns the length in stc positions, not characters
+        return pos + count
+    
+    def replaceMatches(self, matches):
+        """Replace the matches using scintilla's regex replacement
+        
+        Scintilla's tagged regions are only available through
+        ReplaceTargetRE, so each match is replaced separately.  The matches
+        are processed from the end of the document backwards so that the
+        earlier positions remain valid.
+        """
+        self.stc.SetSearchFlags(self.flags)
+        last = matches[-1][1]
+        length = self.stc.GetTextLength()
+        for start, end in reversed(matches):
+            self.stc.SetTargetStart(start)
+            self.stc.SetTargetEnd(end)
+            self.stc.SearchInTarget(self.settings.find)
+            self.stc.ReplaceTargetRE(self.settings.replace)
+        return last + self.stc.GetTextLength() - length
 
 
 class FindWildcardService(FindService):
@@ -767,6 +902,41 @@ class FindRegexService(FindService):
         text = "".join(output)
         return text
 
+    def resetSearchState(self):
+        self.shadow = None
+    
+    def findAll(self, start=0, end=-1):
+        """Find all matches using a single pass of the regex over the text
+        
+        The positions of the matches are converted from unicode character
+        offsets in the text to utf-8 byte offsets in the stc incrementally,
+        so each character is only encoded once.
+        """
+        matches = []
+        if not self.settings.find:
+            return matches
+        self.getFlags()
+        if self.regex is None:
+            return matches
+        if end < 0:
+            end = self.stc.GetTextLength()
+        text = self.stc.GetTextRange(start, end)
+        char_pos = 0
+        pos = start
+        for match in self.regex.finditer(text):
+            pos += len(text[char_pos:match.start(0)].encode('utf-8'))
+            end = pos + len(match.group(0).encode('utf-8'))
+            matches.append((pos, end))
+            pos = end
+            char_pos = match.end(0)
+        return matches
+    
+    def doReplaceAll(self, start=0):
+        count, pos = FindService.doReplaceAll(self, start)
+        # The text has changed, so force a new shadow copy on the next search
+        self.shadow = None
+        return count, pos
+
     def doReplace(self):
         """Replace the selection
         
@@ -816,10 +816,13 @@ class FundamentalMode(FoldExplorerMixin, EditraSTCMixin,
         spelling_classes = []
         Publisher().sendMessage('spelling.provider', spelling_classes)
         if spelling_classes:
-            self.spell = spelling_classes[0](self, check_region=self.isSpellCheckRegion)
+            # The idle scheduler limits the time spent spell checking, so
+            # a block is checked at every idle task call
+            self.spell = spelling_classes[0](self, check_region=self.isSpellCheckRegion, idle_count=1)
             self.spell.clearAll()
             if self.classprefs.spell_check:
                 self.spell.startIdleProcessing()
+            self.addIdleTask(self.spellCheckIdleTask, "spell check", active_only=True, repeat=True)
 
     def spellCheckUpdate(self, evt):
         if self.spell:
@@ -839,19 +842,30 @@ class FundamentalMode(FoldExplorerMixin, EditraSTCMixin,
         Publisher().sendMessage('fundamental.context_menu', action_classes)
         return action_classes
 
-    def idlePostHook(self):
+    def spellCheckIdleTask(self):
+        """Idle task that spell checks the document one block at a time
+        
+        @return: True if there are more blocks to check
+        """
         if self.spell and self.classprefs.spell_check:
             try:
-                self.spell.processIdleBlock()
+                return self.spell.processIdleBlock()
             except Exception, e:
                 import traceback
                 error = traceback.format_exc()
                 print(error)
                 print("Problem with %s.  Turning off spell checking." % self.spell.getLibraryInfo())
                 self.spell = None
+        return False
+
+    def idlePostHook(self):
         if self.calltip_driver:
             self.showCalltip()
     
+    def deleteWindowPreHook(self):
+        if self.spell:
+            self.spell.stopBackgroundCheck()
+    
     def isSpellCheckRegion(self, pos):
         if self.classprefs.spell_check_strings_only:
             style = self.GetStyleAt(pos)
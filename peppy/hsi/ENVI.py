@@ -80,12 +80,21 @@ def findHeaders(url):
         if vfs.exists(header):
             urls.append(header)
 
-    name,ext = os.path.splitext(str(url))
+    name,cube_ext = os.path.splitext(str(url))
     for ext in _header_extensions:
         header = vfs.normalize(name+ext)
         if vfs.exists(header):
             urls.append(header)
 
+    # Compressed cubes (e.g. cube.bil.gz) may use the header name of the
+    # uncompressed cube (e.g. cube.hdr)
+    if cube_ext.lower() in ['.gz', '.bz2']:
+        name,cube_ext = os.path.splitext(name)
+        for ext in _header_extensions:
+            header = vfs.normalize(name+ext)
+            if vfs.exists(header):
+                urls.append(header)
+
     return urls
 
 
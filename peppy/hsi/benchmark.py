@@ -0,0 +1,334 @@
+# peppy Copyright (c) 2006-2010 Rob McMullen
+# Licenced under the GPLv2; see http://peppy.flipturn.org for more info
+"""Benchmarks for the HSI cube readers and processing code.
+
+Synthetic cubes are written to a temporary directory in each combination of
+interleave, data type and size, then read back using both the memory mapped
+and the direct file access cube readers.  Each operation is timed several
+times and the best time is reported, along with the mean, so that results
+can be compared across releases.
+
+Results are emitted as JSON, either to stdout or to a file:
+
+    python -m peppy.hsi.benchmark -s small -s medium -o results.json
+
+Use --help to see the available options.
+"""
+
+import os, sys, time, platform, shutil, tempfile
+
+from peppy.debug import *
+import peppy.vfs as vfs
+import peppy.hsi.common as HSI
+import peppy.hsi.ENVI as ENVI
+from peppy.hsi.filter import *
+
+import numpy
+
+
+#: Named cube sizes as (lines, samples, bands)
+benchmark_sizes = {
+    'tiny': (16, 16, 8),
+    'small': (64, 64, 32),
+    'medium': (256, 256, 128),
+    'large': (512, 512, 224),
+    }
+
+benchmark_interleaves = ['bip', 'bil', 'bsq']
+
+benchmark_datatypes = ['uint8', 'int16', 'float32']
+
+benchmark_readers = {
+    'mmap': HSI.getMMapCubeReader,
+    'file': HSI.getFileCubeReader,
+    }
+
+
+def getSampleIndexes(count, num=8):
+    """Return up to num indexes spread evenly through the range of count"""
+    if count <= num:
+        return range(count)
+    step = float(count - 1) / (num - 1)
+    return [int(i * step) for i in range(num)]
+
+
+class CubeBenchmark(debugmixin):
+    """Time cube operations over a matrix of cube formats and readers.
+
+    Each benchmarked operation is a method named with a "bench" prefix that
+    takes the cube as its argument and returns a callable and the number of
+    calls to the cube that the callable performs.  The callable is timed
+    L{repeat} times, and any block cache in the reader is emptied before
+    each repetition so that cached data from a previous run doesn't skew the
+    results.
+    """
+    def __init__(self, sizes=None, interleaves=None, datatypes=None,
+                 readers=None, repeat=3, tempdir=None):
+        if sizes is None:
+            sizes = ['small']
+        if interleaves is None:
+            interleaves = benchmark_interleaves
+        if datatypes is None:
+            datatypes = benchmark_datatypes
+        if readers is None:
+            readers = ['mmap', 'file']
+        self.sizes = sizes
+        self.interleaves = interleaves
+        self.datatypes = datatypes
+        self.readers = readers
+        self.repeat = repeat
+        self.tempdir = tempdir
+        self.results = []
+        
+        # Additional cubes opened by the current operation
+        self.opened = []
+
+    def getOperations(self):
+        """Return the list of benchmark method names in a stable order"""
+        names = [name for name in dir(self) if name.startswith('bench')]
+        names.sort()
+        return names
+
+    def createCube(self, dims, datatype):
+        """Create an in-memory BIP cube with reproducible random data"""
+        lines, samples, bands = dims
+        dtype = numpy.dtype(datatype)
+        cube = HSI.createCube('bip', lines, samples, bands, dtype.type)
+        random = numpy.random.RandomState(lines * samples * bands)
+        if dtype.kind == 'f':
+            data = random.uniform(0.0, 1000.0, (lines, samples, bands))
+        else:
+            info = numpy.iinfo(dtype)
+            data = random.randint(max(info.min, -1000), min(info.max, 1000),
+                                  (lines, samples, bands))
+        raw = cube.getNumpyArray()
+        raw[:,:,:] = data.astype(dtype)
+        cube.wavelengths = [400.0 + 10.0 * i for i in range(bands)]
+        cube.wavelength_units = 'nm'
+        cube.fwhm = [10.0] * bands
+        return cube
+
+    def writeCube(self, cube, interleave, basename):
+        """Write the cube and its ENVI header to the temporary directory
+
+        @return: the filename of the cube data
+        """
+        filename = os.path.join(self.tempdir, "%s.%s" % (basename, interleave))
+        url = vfs.normalize(filename)
+        fh = vfs.open_write(url)
+        cube.writeRawData(fh, options={'interleave': interleave})
+        fh.close()
+        header = ENVI.Header()
+        header.getCubeAttributes(cube)
+        header['interleave'] = interleave
+        header['header offset'] = 0
+        header.save(filename + ".hdr")
+        return filename
+
+    def openCube(self, filename, reader):
+        """Open the cube using the specified type of cube reader"""
+        header = ENVI.Header(filename)
+        cube = header.getCube()
+        cube_reader = benchmark_readers[reader](cube)
+        cube.cube_io = cube_reader(cube, cube.url)
+        return cube
+
+    def closeCube(self, cube):
+        if cube.cube_io is not None:
+            cube.cube_io.close()
+            cube.cube_io = None
+
+    def clearCache(self, cube):
+        fh = getattr(cube.cube_io, 'fh', None)
+        if hasattr(fh, 'clearCache'):
+            fh.clearCache()
+        band_statistics.clear()
+
+    def timeOperation(self, cube, func):
+        times = []
+        for i in range(self.repeat):
+            self.clearCache(cube)
+            start = time.time()
+            func()
+            times.append(time.time() - start)
+        return times
+
+    def benchGetBandRaw(self, cube):
+        indexes = getSampleIndexes(cube.bands)
+        def func():
+            for i in indexes:
+                cube.getBandRaw(i, use_progress=False)
+        return func, len(indexes)
+
+    def benchGetSpectraRaw(self, cube):
+        lines = getSampleIndexes(cube.lines)
+        samples = getSampleIndexes(cube.samples)
+        def func():
+            for line in lines:
+                for sample in samples:
+                    cube.getSpectraRaw(line, sample)
+        return func, len(lines) * len(samples)
+
+    def benchGetFocalPlaneRaw(self, cube):
+        indexes = getSampleIndexes(cube.lines)
+        def func():
+            for i in indexes:
+                cube.getFocalPlaneRaw(i, use_progress=False)
+        return func, len(indexes)
+
+    def benchGetFocalPlaneDepthRaw(self, cube):
+        samples = getSampleIndexes(cube.samples)
+        bands = getSampleIndexes(cube.bands)
+        def func():
+            for sample in samples:
+                for band in bands:
+                    cube.getFocalPlaneDepthRaw(sample, band)
+        return func, len(samples) * len(bands)
+
+    def getCompare(self, cube):
+        # Compare the cube against a copy of itself opened with the same
+        # reader so that both cubes are read through the code under test
+        other = self.openCube(str(cube.url.path), self.current_reader)
+        self.opened.append(other)
+        return HSI.CubeCompare(cube, other)
+
+    def benchCompareEuclideanDistance(self, cube):
+        compare = self.getCompare(cube)
+        return compare.getEuclideanDistance, 1
+
+    def benchCompareSpectralAngle(self, cube):
+        compare = self.getCompare(cube)
+        return compare.getSpectralAngle, 1
+
+    def benchCompareDifference(self, cube):
+        compare = self.getCompare(cube)
+        return compare.getDifference, 1
+
+    def benchFilterContrast(self, cube):
+        band = cube.getBandRaw(cube.bands / 2, use_progress=False)
+        contrast = ContrastFilter(0.1)
+        mapper = RGBMapper()
+        def func():
+            mapper.getGrayMapping(contrast.getPlane(band))
+        return func, 1
+
+    def benchFilterPalette(self, cube):
+        band = cube.getBandRaw(cube.bands / 2, use_progress=False)
+        mapper = PaletteMapper('bone')
+        def func():
+            mapper.getRGB(cube.lines, cube.samples, [band])
+        return func, 1
+
+    def benchExport(self, cube):
+        filename = os.path.join(self.tempdir, "export.raw")
+        url = vfs.normalize(filename)
+        def func():
+            for interleave in benchmark_interleaves:
+                fh = vfs.open_write(url)
+                cube.writeRawData(fh, options={'interleave': interleave})
+                fh.close()
+        return func, len(benchmark_interleaves)
+
+    def runCube(self, filename, reader, info):
+        self.current_reader = reader
+        cube = self.openCube(filename, reader)
+        try:
+            for name in self.getOperations():
+                try:
+                    func, calls = getattr(self, name)(cube)
+                    times = self.timeOperation(cube, func)
+                finally:
+                    for other in self.opened:
+                        self.closeCube(other)
+                    self.opened = []
+                result = dict(info)
+                result.update({
+                    'reader': reader,
+                    'operation': name[5:],
+                    'calls': calls,
+                    'best': min(times),
+                    'mean': sum(times) / len(times),
+                    })
+                self.dprint(result)
+                self.results.append(result)
+        finally:
+            self.closeCube(cube)
+
+    def run(self):
+        """Run all the benchmarks
+
+        @return: list of result dicts, one for each combination of cube,
+        reader and operation
+        """
+        cleanup = self.tempdir is None
+        if cleanup:
+            self.tempdir = tempfile.mkdtemp(prefix="peppy-hsi-benchmark-")
+        try:
+            for size in self.sizes:
+                dims = benchmark_sizes[size]
+                for datatype in self.datatypes:
+                    source = self.createCube(dims, datatype)
+                    for interleave in self.interleaves:
+                        basename = "%s-%s" % (size, datatype)
+                        filename = self.writeCube(source, interleave, basename)
+                        info = {
+                            'size': size,
+                            'lines': dims[0],
+                            'samples': dims[1],
+                            'bands': dims[2],
+                            'datatype': datatype,
+                            'interleave': interleave,
+                            }
+                        for reader in self.readers:
+                            self.runCube(filename, reader, info)
+        finally:
+            if cleanup:
+                shutil.rmtree(self.tempdir, ignore_errors=True)
+                self.tempdir = None
+        return self.results
+
+    def getReport(self):
+        """Return the results along with information about the environment
+        they were generated in, suitable for serializing as JSON.
+        """
+        import peppy
+        return {
+            'peppy': peppy.__version__,
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'platform': platform.platform(),
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'repeat': self.repeat,
+            'results': self.results,
+            }
+
+
+if __name__ == "__main__":
+    import json
+    from optparse import OptionParser
+    usage="usage: %prog [options]"
+    parser=OptionParser(usage=usage)
+    parser.add_option("-s", "--size", action="append", dest="sizes",
+                      help="Cube size to benchmark (one of %s); may be specified multiple times" % ", ".join(sorted(benchmark_sizes.keys())))
+    parser.add_option("-i", "--interleave", action="append", dest="interleaves",
+                      help="Interleave to benchmark; may be specified multiple times")
+    parser.add_option("-d", "--datatype", action="append", dest="datatypes",
+                      help="Numpy data type to benchmark; may be specified multiple times")
+    parser.add_option("-r", "--reader", action="append", dest="readers",
+                      help="Cube reader to benchmark (mmap or file); may be specified multiple times")
+    parser.add_option("-n", "--repeat", action="store", type="int", default=3,
+                      help="Number of times to repeat each operation")
+    parser.add_option("-o", "--output", action="store", default=None,
+                      help="Filename for JSON output (default stdout)")
+    (options, args) = parser.parse_args()
+
+    bench = CubeBenchmark(options.sizes, options.interleaves,
+                          options.datatypes, options.readers, options.repeat)
+    bench.run()
+    text = json.dumps(bench.getReport(), indent=2, sort_keys=True)
+    if options.output:
+        fh = open(options.output, 'w')
+        fh.write(text)
+        fh.close()
+    else:
+        print text
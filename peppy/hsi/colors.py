@@ -91,6 +91,9 @@ class Colormap:
         self._i_over = N+1
         self._i_bad = N+2
         self._isinit = False
+        # uint8 version of the lookup table is cached, but it depends on alpha
+        self._lut_bytes = None
+        self._lut_bytes_alpha = None
 
 
     def __call__(self, X, alpha=1.0, bytes=False):
@@ -129,7 +132,10 @@ class Colormap:
         if mask_bad is not None and mask_bad.shape == xa.shape:
             np.putmask(xa, mask_bad, self._i_bad)
         if bytes:
-            lut = (self._lut * 255).astype(np.uint8)
+            if self._lut_bytes is None or self._lut_bytes_alpha != alpha:
+                self._lut_bytes = (self._lut * 255).astype(np.uint8)
+                self._lut_bytes_alpha = alpha
+            lut = self._lut_bytes
         else:
             lut = self._lut
         rgba = np.empty(shape=xa.shape+(4,), dtype=lut.dtype)
@@ -171,6 +177,7 @@ class Colormap:
         else:
             self._lut[self._i_over] = self._lut[self.N-1]
         self._lut[self._i_bad] = self._rgba_bad
+        self._lut_bytes = None
 
     def _init():
         '''Generate the lookup table, self._lut'''
@@ -6,7 +6,7 @@ This class supports reading HSI data cubes (that are stored in raw,
 uncompressed formats) using memory mapped file access.
 """
 
-import os,sys,re,random, glob
+import os,sys,re,random, glob, copy, threading
 from cStringIO import StringIO
 from datetime import datetime
 
@@ -14,6 +14,7 @@ import numpy
 import utils
 
 import peppy.vfs as vfs
+from peppy.lib.bufferedreader import *
 
 from peppy.debug import *
 
@@ -116,6 +117,17 @@ class CubeReader(debugmixin):
     def hasInvalid(self):
         return False
     
+    def clone(self):
+        """Return a reader that can be used independently of this one.
+        
+        Readers that don't keep any file position can simply be shared.
+        """
+        return self
+    
+    def close(self):
+        """Release the resources used to read the cube"""
+        pass
+    
     def getSizeFromCube(self, cube):
         self.lines = cube.lines
         self.samples = cube.samples
@@ -250,17 +262,42 @@ class FileCubeReader(CubeReader):
     
     Note: this is (potentially much) slower than mmap access of the
     L{MMapCubeReader}, but won't throw out of memory exceptions.
+    
+    Reads go through a L{BlockCacheReader} so that the many small reads needed
+    to assemble a band or spectrum from a non-optimal interleave are satisfied
+    from memory rather than from separate reads of the file.  This is
+    especially important for remote files, and for compressed files where the
+    file is read through a L{DecompressingReader}.
+    
+    Each thread reading from the cube gets its own clone of the block cache
+    reader through the L{fh} property, so a background thread (e.g. a cube
+    reduction) can't move the file position out from under the GUI thread.
     """
+    #: size of the aligned blocks read from the file
+    block_size = 256 * 1024
+    
+    #: maximum number of blocks held in the cache
+    max_cached_blocks = 64
+    
+    #: map of filename extension to function returning an uncompressed view
+    #: of the file
+    decompressors = {
+        '.gz': getGzipReader,
+        '.bz2': getBz2Reader,
+        }
+    
     def __init__(self, cube, url=None, array=None):
         CubeReader.__init__(self)
-        self.fh = vfs.open(url)
+        fh = vfs.open(url)
         # If we're using a WindowReader on a NITF file, the offset is already
         # accounted for within the WindowReader
-        if hasattr(self.fh, 'offset') and self.fh.offset == cube.data_offset:
+        if hasattr(fh, 'offset') and fh.offset == cube.data_offset:
             self.offset = 0
         else:
             self.offset = cube.data_offset
-        self.dprint("url=%s file=%s offset=%d" % (url, self.fh, self.offset))
+        self._fh = self.getCachedFile(fh, url)
+        self._local = threading.local()
+        self.dprint("url=%s file=%s offset=%d" % (url, self._fh, self.offset))
         self.getSizeFromCube(cube)
         self.data_type = cube.data_type
         self.itemsize = cube.itemsize
@@ -272,6 +309,44 @@ class FileCubeReader(CubeReader):
         
         self.invalid_after = -1
     
+    def getThreadFile(self):
+        """Return the view of the file used by the current thread.
+        
+        The views share the block cache, but each has its own file position
+        so that the seek and read pairs of one thread don't interleave with
+        those of another.
+        """
+        fh = getattr(self._local, 'fh', None)
+        if fh is None:
+            fh = self._fh.clone()
+            self._local.fh = fh
+        return fh
+    fh = property(getThreadFile)
+    
+    def clone(self):
+        """Return a reader with its own views of the file, sharing the block
+        cache with this reader.
+        """
+        other = copy.copy(self)
+        other._local = threading.local()
+        return other
+    
+    def close(self):
+        self._fh.close()
+    
+    def getCachedFile(self, fh, url):
+        """Wrap the file handle in the block cache, decompressing the file
+        first if necessary.
+        """
+        if url is not None:
+            url = vfs.normalize(url)
+            name, ext = os.path.splitext(url.path.get_name())
+            decompressor = self.decompressors.get(ext.lower())
+            if decompressor:
+                self.dprint("Using %s to decompress %s" % (decompressor, url))
+                fh = decompressor(fh)
+        return BlockCacheReader(fh, self.block_size, self.max_cached_blocks)
+    
     def isInvalid(self, pos):
         if self.invalid_after >= 0:
             return pos >= self.invalid_after
@@ -685,6 +760,11 @@ class MMapCubeReader(CubeReader):
         """Return the raw numpy array"""
         return self.raw
     
+    def close(self):
+        # The memory map is closed when the last reference is released
+        self.mmap = None
+        self.raw = None
+    
     def save(self, url):
         if self.mmap:
             self.mmap.flush()
@@ -842,6 +922,12 @@ class MMapBSQCubeReader(BSQMixin, MMapCubeReader):
 
 
 def getMMapCubeReader(cube, check_size=True):
+    if cube.url is not None:
+        # Compressed files have to be read through the decompressing file
+        # reader; mapping them would expose the compressed bytes
+        name, ext = os.path.splitext(cube.url.path.get_name())
+        if ext.lower() in FileCubeReader.decompressors:
+            raise TypeError("Not using mmap for compressed cube %s" % cube.url)
     if check_size:
         pixels = cube.samples * cube.lines * cube.bands
         if cube.mmap_size_limit > 0 and pixels > cube.mmap_size_limit:
@@ -5,19 +5,154 @@
 This file is a repository of actions that operate on the HSI mode.
 """
 
-import os, struct, mmap, math
+import os, struct, mmap, math, weakref
 from cStringIO import StringIO
 
 from peppy.hsi.common import *
 from peppy.hsi.subcube import *
 import peppy.hsi.colors as colors
+from peppy.lib.dictutils import LRUDict
 
 # hsi mode and the plotting utilities require numpy, the check for which is
 # handled by the major mode wrapper
 import numpy
 
 
+def isLookupTableType(dtype):
+    """Return True if the data type is an integer type small enough that
+    every possible value can be represented in a lookup table.
+    """
+    return dtype.kind in 'iu' and dtype.itemsize <= 2
+
+def getLookupIndexes(raw):
+    """Return an unsigned view of the integer data so that the bit pattern of
+    each value can be used as an index into a lookup table.
+    
+    The view doesn't copy the data, and keeps the byte order of the original
+    array.
+    """
+    return raw.view(raw.dtype.str.replace('i', 'u'))
+
+def getLookupValues(dtype):
+    """Return the array of values in the order of their bit patterns, so that
+    the value at index i of the returned array corresponds to the value
+    represented by the lookup index i.
+    """
+    unsigned = numpy.dtype(dtype.str.replace('i', 'u'))
+    size = 1 << (8 * dtype.itemsize)
+    return numpy.arange(size).astype(unsigned).view(dtype)
+
+
+class BandStatistics(object):
+    """Statistics about a band or other 2D array of data
+    
+    For integer types that are eligible for lookup tables, a histogram of
+    every possible value is computed in a single pass over the data, from which
+    the minimum, maximum and any percentile can be found without looking at
+    the data again.  Other types only compute the min and max.
+    """
+    def __init__(self, raw=None):
+        self.histogram = None
+        self.offset = 0
+        self.minval = 0
+        self.maxval = 0
+        self.size = 0
+        if raw is not None:
+            self.calcStatistics(raw)
+    
+    def calcStatistics(self, raw):
+        self.size = raw.size
+        if isLookupTableType(raw.dtype):
+            size = 1 << (8 * raw.dtype.itemsize)
+            hist = numpy.bincount(getLookupIndexes(raw).ravel(), minlength=size)
+            if raw.dtype.kind == 'i':
+                # rearrange so the histogram is in order of increasing value:
+                # the negative numbers are in the upper half of the bit
+                # patterns
+                hist = numpy.roll(hist, size / 2)
+                self.offset = -(size / 2)
+            self.setHistogram(hist)
+        else:
+            # Without the following casts, raw.min() and raw.max() remain as
+            # ctype variables rather than python ints and will be clamped to
+            # the ctype max value.
+            self.minval = float(raw.min())
+            self.maxval = float(raw.max())
+    
+    def setHistogram(self, hist):
+        self.histogram = hist
+        nonzero = numpy.flatnonzero(hist)
+        if len(nonzero) > 0:
+            self.minval = int(nonzero[0]) + self.offset
+            self.maxval = int(nonzero[-1]) + self.offset
+    
+    def getClipped(self, lo, hi):
+        """Return the statistics of the data after clipping to the range
+        [lo, hi] without having to look at the data.
+        """
+        clipped = BandStatistics()
+        clipped.size = self.size
+        clipped.offset = self.offset
+        hist = self.histogram.copy()
+        ilo = lo - self.offset
+        ihi = hi - self.offset
+        hist[ilo] = hist[:ilo + 1].sum()
+        hist[:ilo] = 0
+        hist[ihi] = hist[ihi:].sum()
+        hist[ihi + 1:] = 0
+        clipped.setHistogram(hist)
+        return clipped
+    
+    def getBinnedHistogram(self, bins):
+        """Return the histogram of the data using the given number of bins
+        spanning the range of values, without having to look at the data.
+        
+        The bins are the same as numpy.histogram(raw, bins, range=(minval,
+        maxval + 1)).
+        """
+        values = numpy.arange(self.minval, self.maxval + 1)
+        counts = self.histogram[self.minval - self.offset:self.maxval - self.offset + 1]
+        h, edges = numpy.histogram(values, bins, range=(self.minval, self.maxval + 1), weights=counts)
+        return h
+
+
+class BandStatisticsCache(object):
+    """Small cache of L{BandStatistics} for the most recently seen arrays.
+    
+    Arrays are identified by object identity, but the cache only holds weak
+    references to them so it doesn't keep any arrays alive.  The entry of an
+    array is removed as soon as the array is garbage collected, so a new
+    array that reuses the id of an old one won't find the old statistics.
+    """
+    def __init__(self, size=8):
+        self.cache = LRUDict(size)
+    
+    def get(self, raw):
+        entry = self.cache.get(id(raw))
+        if entry is not None and entry[0]() is raw:
+            return entry[1]
+        stats = BandStatistics(raw)
+        self.set(raw, stats)
+        return stats
+    
+    def set(self, raw, stats):
+        key = id(raw)
+        cache = self.cache
+        def remove(ref):
+            cache.pop(key, None)
+        self.cache[key] = (weakref.ref(raw, remove), stats)
+    
+    def clear(self):
+        self.cache.clear()
+
+band_statistics = BandStatisticsCache()
+
+
 class RGBMapper(debugmixin):
+    def __init__(self):
+        self.lut_key = None
+        self.lut = None
+    
     def scaleChunk(self, raw, minval, maxval, u1, u2, v1, v2, output):
         assert self.dprint("processing chunk [%d:%d, %d:%d], min=%d max=%d" % (u1, u2, v1, v2, minval, maxval))
         if minval == maxval:
@@ -28,6 +163,44 @@ class RGBMapper(debugmixin):
             temp2 = temp1 * (255.0/(maxval-minval))
             output[u1:u2, v1:v2] = temp2.astype(numpy.uint8)
 
+    def getGrayLookupTable(self, dtype, minval, maxval):
+        """Return the table mapping every possible value of the integer data
+        type to a gray level, given the range of the data.
+        
+        The lookup table is indexed by the bit pattern of the value (see
+        L{getLookupIndexes}) and is cached until the range or data type
+        changes.
+        """
+        key = (dtype.str, minval, maxval)
+        if key != self.lut_key:
+            values = getLookupValues(dtype).astype(numpy.float64)
+            if minval == maxval:
+                lut = numpy.zeros(values.shape, dtype=numpy.uint8)
+            else:
+                values -= minval
+                values *= 255.0 / (maxval - minval)
+                lut = numpy.clip(values, 0, 255).astype(numpy.uint8)
+            self.lut = lut
+            self.lut_key = key
+        return self.lut
+    
+    def getMappedLookup(self, raw, lookup=None):
+        """Map the integer data through a lookup table in a single pass
+        
+        @param lookup: function taking the data type, min and max values and
+        returning the lookup table; defaults to L{getGrayLookupTable}
+        
+        @return: mapped array, or None if the data isn't eligible for lookup
+        table mapping.
+        """
+        if isLookupTableType(raw.dtype):
+            if lookup is None:
+                lookup = self.getGrayLookupTable
+            stats = band_statistics.get(raw)
+            lut = lookup(raw.dtype, stats.minval, stats.maxval)
+            return lut.take(getLookupIndexes(raw), axis=0)
+        return None
+
     def getGray(self, raw, tile_size=256):
         # Without the following casts, raw.min() and raw.max() remain as ctype
         # variables rather than python ints and will be clamped to the ctype
@@ -53,7 +226,10 @@ class RGBMapper(debugmixin):
         return gray
 
     def getGrayMapping(self,raw):
-        return self.getGray(raw)
+        gray = self.getMappedLookup(raw)
+        if gray is None:
+            gray = self.getGray(raw)
+        return gray
 
     def getRGB(self, lines, samples, planes):
         rgb = numpy.zeros((lines, samples, 3),numpy.uint8)
@@ -70,29 +246,52 @@ class RGBMapper(debugmixin):
 
 class PaletteMapper(RGBMapper):
     def __init__(self, name=None):
+        RGBMapper.__init__(self)
         self.colormap_name = name
         if name:
             self.colormap = colors.getColormap(name)
         else:
             self.colormap = None
+        self.palette = None
+        self.rgb_lut_key = None
+        self.rgb_lut = None
+    
+    def getPalette(self):
+        """Return the (256 x 3) table mapping gray levels to RGB values"""
+        if self.palette is None:
+            # Matplotlib returns alpha values in the colormap, so we only need
+            # the first 3 bands
+            gray = numpy.arange(256, dtype=numpy.uint8)
+            rgba = self.colormap(gray, bytes=True)
+            self.palette = rgba[:, 0:3].copy()
+        return self.palette
+    
+    def getRGBLookupTable(self, dtype, minval, maxval):
+        """Return the table mapping every possible value of the integer data
+        type directly to an RGB triple.
+        
+        This combines the gray level lookup table with the palette so that the
+        data only needs a single pass through the lookup.
+        """
+        key = (dtype.str, minval, maxval)
+        if key != self.rgb_lut_key:
+            gray = self.getGrayLookupTable(dtype, minval, maxval)
+            self.rgb_lut = self.getPalette().take(gray, axis=0)
+            self.rgb_lut_key = key
+        return self.rgb_lut
         
     def getRGB(self, lines, samples, planes):
         # This is designed for grayscale images only; if there is more than one
         # plane, the standard RGB method is used
         count = len(planes)
         if count > 1 or self.colormap is None:
-            return RGBMapper.getRGB(lines, samples, planes)
+            return RGBMapper.getRGB(self, lines, samples, planes)
         
         if count > 0:
-            gray = self.getGrayMapping(planes[0])
-            
-            # Matplotlib returns alpha values in the colormap, so we only need
-            # the first 3 bands
-            rgba = self.colormap(gray, bytes=True)
-            rgb = numpy.zeros((lines, samples, 3),numpy.uint8)
-            for i in range(3):
-                rgb[:,:,i] = rgba[:,:,i]
-            #rgb = rgba[:,:,0:3]
+            rgb = self.getMappedLookup(planes[0], self.getRGBLookupTable)
+            if rgb is None:
+                gray = self.getGray(planes[0])
+                rgb = self.getPalette().take(gray, axis=0)
         else:
             # blank image
             rgb = numpy.zeros((lines, samples, 3),numpy.uint8)
@@ -137,6 +336,9 @@ class ContrastFilter(GeneralFilter):
         if self.contraststretch <= 0.0:
             return raw
         
+        if isLookupTableType(raw.dtype):
+            return self.getPlaneFromStatistics(raw)
+        
         minval=raw.min()
         maxval=raw.max()
         valrange=maxval-minval
@@ -147,8 +349,18 @@ class ContrastFilter(GeneralFilter):
         assert self.dprint("h[%d]=%d" % (self.bins-1,h[self.bins-1]))
         #dprint(h)
 
-        shape=raw.shape
-        numpixels=raw.size
+        minscaled, maxscaled = self.getScaledRange(h, minval, maxval, raw.size)
+        filtered = numpy.clip(raw, minscaled, maxscaled)
+        return filtered
+    
+    def getScaledRange(self, h, minval, maxval, numpixels):
+        """Return the range of values that excludes the contrast stretch
+        fraction of pixels at either end of the histogram.
+        
+        @param h: histogram of the data in self.bins bins spanning the range
+        minval to maxval + 1
+        """
+        valrange=maxval-minval
         lo=numpixels*self.contraststretch
         hi=numpixels*(1.0-self.contraststretch)
         assert self.dprint("lo=%d hi=%d" % (lo,hi))
@@ -165,7 +377,21 @@ class ContrastFilter(GeneralFilter):
             count-=h[i]
         maxscaled=minval+valrange*i/self.bins
         assert self.dprint("scaled: min=%d max=%d" % (minscaled,maxscaled))
+        return minscaled, maxscaled
+    
+    def getPlaneFromStatistics(self, raw):
+        """Clip the integer data using the cached histogram of the data.
+        
+        The cut points are found from the same bins as L{getPlane} uses for
+        other data types.  The statistics of the clipped plane are derived
+        from the statistics of the raw data and stored in the cache so that
+        the gray level mapping doesn't have to compute them again.
+        """
+        stats = band_statistics.get(raw)
+        h = stats.getBinnedHistogram(self.bins)
+        minscaled, maxscaled = self.getScaledRange(h, stats.minval, stats.maxval, stats.size)
         filtered = numpy.clip(raw, minscaled, maxscaled)
+        band_statistics.set(filtered, stats.getClipped(minscaled, maxscaled))
         return filtered
 
 
@@ -19,11 +19,13 @@ from peppy.stcinterface import *
 
 from peppy.lib.iconstorage import *
 from peppy.lib.bitmapscroller import *
+from peppy.lib.threadutils import *
 
 from peppy.hsi.common import *
 from peppy.hsi.subcube import *
 from peppy.hsi.filter import *
 from peppy.hsi.view import *
+from peppy.hsi.reduce import *
 
 # hsi mode and the plotting utilities require numpy, the check for which is
 # handled by the major mode wrapper
@@ -279,57 +281,108 @@ class SpatialSubset(HSIActionMixin, SelectAction):
         self.frame.open(name)
 
 
-class FocalPlaneAverage(HSIActionMixin, SelectAction):
+class CubeReductionStatus(ThreadStatus):
+    """Report the status of a L{ThreadedCubeReduction} to the HSI mode's
+    status bar and open the resulting cube when finished.
+    """
+    def __init__(self, action, name, options=None):
+        ThreadStatus.__init__(self)
+        self.mode = action.mode
+        self.frame = action.frame
+        self.name = name
+        self.options = options
+        self.thread = None
+    
+    def updateStatusGUI(self, perc, text=None):
+        if self.mode.status_info.isCancelled():
+            self.thread.stopReduction()
+        self.mode.status_info.updateProgress(int(perc), text)
+    
+    def reportSuccessGUI(self, text, data):
+        self.mode.status_info.stopProgress(text)
+        fh = vfs.make_file(self.name)
+        fh.setCube(data)
+        # must close file handle or it won't be registered with the DatasetFS
+        # file system
+        fh.close()
+        self.frame.open(self.name, options=self.options)
+    
+    def reportFailureGUI(self, text):
+        self.mode.status_info.stopProgress(text)
+
+
+class CubeReductionMixin(HSIActionMixin):
+    """Mixin for actions that create a new cube by reducing one dimension of
+    the current cube.
+    
+    The reduction is performed in a background thread, streaming the data in
+    the fastest order of the cube's interleave.  Progress is shown in the
+    status bar, which also provides a cancel button.
+    """
+    testcube = 1
+    
+    #: Dimension to collapse: 'lines', 'samples', or 'bands'
+    reduction_axis = None
+    
+    def getTempName(self, operator):
+        name = "%s_%s%d" % (operator.lower().replace(' ', '_'), self.reduction_axis, CubeReductionMixin.testcube)
+        CubeReductionMixin.testcube += 1
+        return self.getDatasetPath(name)
+    
+    def getReductionOptions(self):
+        """Return the options used to open the resulting cube"""
+        if self.reduction_axis == 'lines':
+            return {'view': 'focalplane'}
+        return None
+    
+    def startReduction(self, operator):
+        cube = self.mode.cube
+        name = self.getTempName(operator)
+        status = CubeReductionStatus(self, name, self.getReductionOptions())
+        thread = ThreadedCubeReduction(cube, operator, self.reduction_axis, status)
+        status.thread = thread
+        self.mode.status_info.startProgress("%s of %s..." % (operator, self.reduction_axis), 100, cancel=True)
+        thread.start()
+
+
+class FocalPlaneAverage(CubeReductionMixin, SelectAction):
     """Average all focal planes down to a single focal plane.
     
     """
     name = "Average Focal Planes"
     default_menu = ("Tools", -100)
+    reduction_axis = 'lines'
     
-    testcube = 1
+    def action(self, index=-1, multiplier=1):
+        self.startReduction(MeanOperator.name)
+
+
+class ReduceLines(CubeReductionMixin, ListAction):
+    """Collapse all lines into a single line using a statistical operator"""
+    name = "Reduce Lines"
+    default_menu = ("Tools", 101)
+    reduction_axis = 'lines'
     
-    def getTempName(self):
-        name = "focal_plane_average%d" % self.__class__.testcube
-        self.__class__.testcube += 1
-        return self.getDatasetPath(name)
+    def getItems(self):
+        return getReductionOperatorNames()
     
     def action(self, index=-1, multiplier=1):
-        cube = self.mode.cube
-        name = self.getTempName()
-        fh = vfs.make_file(name)
-        avg = createCubeLike(cube, lines=1, interleave='bip')
-        data = avg.getNumpyArray()
-        #dprint("%d,%d,%d: %s" %(avg.lines, avg.samples, avg.bands, data.shape))
-        if cube.isFasterFocalPlane():
-            self.mode.status_info.startProgress("Averaging...", cube.lines, delay=1.0)
-            temp = numpy.zeros((avg.bands, avg.samples), dtype=numpy.float32)
-            line = 0
-            for plane in cube.iterFocalPlanes():
-                temp += plane
-                line += 1
-                self.mode.status_info.updateProgress(line)
-            temp /= cube.lines
-            data[0,:,:] = temp.T
-            self.mode.status_info.stopProgress("Averaged %s" % cube.url)
-        else:
-            self.mode.status_info.startProgress("Averaging...", cube.bands, delay=1.0)
-            band = 0
-            for plane in cube.iterBands():
-                a = numpy.average(plane, axis=0)
-                #dprint("band=%d: plane=%s a=%s" % (band, str(plane.shape), str(a.shape)))
-                data[0,:,band] = a
-                band += 1
-                self.mode.status_info.updateProgress(band)
-            self.mode.status_info.stopProgress("Averaged %s" % cube.url)
-            
-        fh.setCube(avg)
-        # must close file handle or it won't be registered with the DatasetFS
-        # file system
-        fh.close()
-        options = {
-            'view': 'focalplane',
-            }
-        self.frame.open(name, options=options)
+        self.startReduction(self.getItems()[index])
+
+
+class ReduceSamples(ReduceLines):
+    """Collapse all samples into a single sample using a statistical
+    operator"""
+    name = "Reduce Samples"
+    default_menu = ("Tools", 102)
+    reduction_axis = 'samples'
+
+
+class ReduceBands(ReduceLines):
+    """Collapse all bands into a single band using a statistical operator"""
+    name = "Reduce Bands"
+    default_menu = ("Tools", 103)
+    reduction_axis = 'bands'
 
 
 class ScaledImageMixin(HSIActionMixin):
@@ -90,6 +90,9 @@ class HSIPlugin(IPeppyPlugin):
                         peppy.hsi.hsi_menu.TestSubset,
                         peppy.hsi.hsi_menu.SpatialSubset,
                         peppy.hsi.hsi_menu.FocalPlaneAverage,
+                        peppy.hsi.hsi_menu.ReduceLines,
+                        peppy.hsi.hsi_menu.ReduceSamples,
+                        peppy.hsi.hsi_menu.ReduceBands,
                         peppy.hsi.hsi_menu.ScaleImageDimensions,
                         peppy.hsi.hsi_menu.ReduceImageDimensions,
                         
@@ -54,6 +54,7 @@ class HSIPlotMinorMode(HSIMinorModeMixin, plotter.MultiPlotter,
         IntParam('best_height', 400),
         IntParam('min_width', 300),
         IntParam('min_height', 100),
+        IntParam('update_delay', 20, help="Time in milliseconds to collect mouse motion events before redrawing the plot"),
         )
     plot_proxy = None
 
@@ -65,6 +66,8 @@ class HSIPlotMinorMode(HSIMinorModeMixin, plotter.MultiPlotter,
         self.rgblookup=['red','green','blue']
         self.setProxy(self)
         self.last_coords = (0,0)
+        self.pending_coords = None
+        self.update_timer = None
     
     def isPlottableView(self, cubeview):
         return True
@@ -120,6 +123,29 @@ class HSIPlotMinorMode(HSIMinorModeMixin, plotter.MultiPlotter,
         self.updateListenerExtrema()
     
     def updateProxies(self, *coords):
+        """Schedule the plot to be redrawn at the given coordinates.
+        
+        Mouse motion events arrive much faster than the plot can be redrawn,
+        so rather than redrawing for every event, only the most recent
+        coordinates are remembered and the plot is redrawn from a timer.  This
+        keeps the crosshair responsive no matter how long the plot takes.
+        """
+        self.pending_coords = coords
+        if self.update_timer is None:
+            self.update_timer = wx.CallLater(self.classprefs.update_delay,
+                                             self.processPendingUpdate)
+    
+    def processPendingUpdate(self):
+        if not self:
+            # the minor mode may have been deleted before the timer fired
+            return
+        self.update_timer = None
+        coords = self.pending_coords
+        self.pending_coords = None
+        if coords is not None:
+            self.renderProxies(*coords)
+    
+    def renderProxies(self, *coords):
         plotproxy = self.proxies[0]
         plotproxy.updateLines(*coords)
         try:
@@ -130,7 +156,7 @@ class HSIPlotMinorMode(HSIMinorModeMixin, plotter.MultiPlotter,
         self.last_coords = coords
     
     def redisplayProxies(self):
-        self.updateProxies(*self.last_coords)
+        self.renderProxies(*self.last_coords)
 
 
 class SpectrumXLabelAction(HSIActionMixin, RadioAction):
@@ -164,6 +190,11 @@ class HSISpectrumMinorMode(HSIPlotMinorMode):
     """
     keyword = "Depth Profile"
 
+    def __init__(self, parent, **kwargs):
+        HSIPlotMinorMode.__init__(self, parent, **kwargs)
+        self.prefetch_coords = (None, None)
+        self.prefetch_timer = None
+
     def getPopupActions(self, evt, x, y):
         return [
             SpectrumXLabelAction,
@@ -200,6 +231,33 @@ class HSISpectrumMinorMode(HSIPlotMinorMode):
         line = plot.PolyLine(data, legend= '%d, %d' % (x, y), colour='blue')
         return [line]
     
+    def renderProxies(self, *coords):
+        HSIPlotMinorMode.renderProxies(self, *coords)
+        self.startPrefetch(*coords)
+    
+    def startPrefetch(self, x, y):
+        """Start loading the data near the cursor in small time slices so
+        the next depth profiles can be plotted without waiting for the cube.
+        """
+        self.prefetch_coords = (x, y)
+        if self.prefetch_timer is None:
+            self.prefetch_timer = wx.CallLater(self.classprefs.update_delay,
+                                               self.processPrefetch)
+    
+    def processPrefetch(self):
+        if not self:
+            return
+        self.prefetch_timer = None
+        if self.pending_coords is not None:
+            # Mouse motion takes priority; the prefetch will be restarted
+            # after the plot is redrawn
+            return
+        x, y = self.prefetch_coords
+        self.prefetch_coords = (None, None)
+        if self.mode.cubeview.prefetchDepthProfiles(x, y):
+            self.prefetch_timer = wx.CallLater(self.classprefs.update_delay,
+                                               self.processPrefetch)
+    
 
 class HSIXProfileMinorMode(HSIPlotMinorMode):
     """Display the X profile at the current crosshair line.
@@ -0,0 +1,348 @@
+# peppy Copyright (c) 2006-2010 Rob McMullen
+# Licenced under the GPLv2; see http://peppy.flipturn.org for more info
+"""Cube reduction operators.
+
+Reductions collapse one dimension of a cube (lines, samples, or bands) into a
+single value using a statistical operator like the mean or median.  The data
+is streamed through the operator in whatever order is fastest for the cube's
+interleave: focal planes for BIP and BIL cubes, bands for BSQ cubes.  That
+means only one focal plane or band is held in memory at a time (except for the
+median along the streaming dimension, which needs all the values at once).
+
+The L{CubeReduction} class does the work and may be used directly, or through
+L{ThreadedCubeReduction} to run the calculation in a background thread that
+reports its status through a L{peppy.lib.threadutils.ProgressUpdater}.
+"""
+
+import threading
+
+from peppy.debug import *
+
+import numpy
+
+import cube as HSI
+
+
+class ReductionOperator(object):
+    """Base class for statistical operators used in a L{CubeReduction}.
+
+    An operator must be able to perform two types of reduction: the direct
+    reduction of a single array along one of its axes (used when the reduced
+    dimension is contained within one chunk of streamed data), and an
+    accumulation over successive chunks (used when the reduced dimension is
+    the one being streamed).
+    """
+    #: Name of the operator as displayed to the user
+    name = None
+
+    #: If True, the operator keeps the datatype of the source cube; otherwise
+    #: the output cube will be floating point
+    preserves_datatype = False
+
+    def reduce(self, data, axis):
+        """Reduce a single array along the specified axis"""
+        raise NotImplementedError
+
+    def start(self, shape):
+        """Prepare to accumulate chunks of the given shape"""
+        self.count = 0
+
+    def accumulate(self, data):
+        """Add a chunk of data to the accumulation"""
+        raise NotImplementedError
+
+    def finish(self):
+        """Return the result of the accumulation"""
+        raise NotImplementedError
+
+
+class MeanOperator(ReductionOperator):
+    name = "Mean"
+
+    def reduce(self, data, axis):
+        return numpy.mean(data, axis=axis, dtype=numpy.float64)
+
+    def start(self, shape):
+        self.count = 0
+        self.sum = numpy.zeros(shape, dtype=numpy.float64)
+
+    def accumulate(self, data):
+        self.sum += data
+        self.count += 1
+
+    def finish(self):
+        return self.sum / max(self.count, 1)
+
+
+class StdDevOperator(ReductionOperator):
+    """Population standard deviation, accumulated as a running sum and sum of
+    squares so that only two temporary arrays are needed.
+    """
+    name = "Std Dev"
+
+    def reduce(self, data, axis):
+        return numpy.std(data, axis=axis, dtype=numpy.float64)
+
+    def start(self, shape):
+        self.count = 0
+        self.sum = numpy.zeros(shape, dtype=numpy.float64)
+        self.sumsq = numpy.zeros(shape, dtype=numpy.float64)
+
+    def accumulate(self, data):
+        data = data.astype(numpy.float64)
+        self.sum += data
+        self.sumsq += data * data
+        self.count += 1
+
+    def finish(self):
+        count = max(self.count, 1)
+        mean = self.sum / count
+        variance = (self.sumsq / count) - (mean * mean)
+        # round-off error can cause tiny negative variances
+        return numpy.sqrt(numpy.clip(variance, 0.0, None))
+
+
+class MinOperator(ReductionOperator):
+    name = "Minimum"
+    preserves_datatype = True
+
+    def reduce(self, data, axis):
+        return numpy.amin(data, axis=axis)
+
+    def start(self, shape):
+        self.count = 0
+        self.value = None
+
+    def accumulate(self, data):
+        if self.value is None:
+            self.value = data.copy()
+        else:
+            numpy.minimum(self.value, data, self.value)
+        self.count += 1
+
+    def finish(self):
+        return self.value
+
+
+class MaxOperator(MinOperator):
+    name = "Maximum"
+
+    def reduce(self, data, axis):
+        return numpy.amax(data, axis=axis)
+
+    def accumulate(self, data):
+        if self.value is None:
+            self.value = data.copy()
+        else:
+            numpy.maximum(self.value, data, self.value)
+        self.count += 1
+
+
+class MedianOperator(ReductionOperator):
+    """Median operator.
+
+    There's no streaming algorithm for an exact median, so when the median is
+    taken along the streaming dimension all the chunks are stored until the
+    end of the accumulation.  This requires memory equal to the size of the
+    cube.
+    """
+    name = "Median"
+
+    def reduce(self, data, axis):
+        return numpy.median(data, axis=axis)
+
+    def start(self, shape):
+        self.count = 0
+        self.chunks = []
+
+    def accumulate(self, data):
+        self.chunks.append(data.copy())
+        self.count += 1
+
+    def finish(self):
+        stack = numpy.array(self.chunks)
+        self.chunks = []
+        return numpy.median(stack, axis=0)
+
+
+reduction_operators = [MeanOperator, MedianOperator, MinOperator, MaxOperator,
+                       StdDevOperator]
+
+def getReductionOperatorNames():
+    return [op.name for op in reduction_operators]
+
+def getReductionOperator(name):
+    """Return a new instance of the reduction operator given its name"""
+    for op in reduction_operators:
+        if op.name == name:
+            return op()
+    raise KeyError("Unknown reduction operator %s" % name)
+
+
+class CubeReduction(debugmixin):
+    """Reduce a cube along one dimension using a L{ReductionOperator}.
+
+    The output cube is in BIP format and has the same dimensions as the
+    source cube except for the reduced dimension, which is collapsed to one.
+
+    The source cube is always read in its fastest order.  For BIP and BIL
+    cubes, each focal plane (bands x samples) is read once; for BSQ cubes,
+    each band (lines x samples) is read once.  Depending on the reduced
+    dimension, each chunk is either reduced directly into a single line, sample
+    or band of the output, or it is accumulated into the operator and the
+    output is filled once all chunks have been read.
+    """
+    axes = ['lines', 'samples', 'bands']
+
+    def __init__(self, cube, operator, axis):
+        if axis not in self.axes:
+            raise ValueError("Unknown reduction axis %s" % axis)
+        if isinstance(operator, basestring):
+            operator = getReductionOperator(operator)
+        self.cube = cube
+        self.operator = operator
+        self.axis = axis
+        self.stop_request = False
+
+    def stopReduction(self):
+        """Request that the reduction stop at the next chunk boundary.
+
+        This may be called from a different thread than the one performing the
+        reduction.
+        """
+        self.stop_request = True
+
+    def isFocalPlaneOrder(self):
+        return self.cube.isFasterFocalPlane()
+
+    def getNumChunks(self):
+        if self.isFocalPlaneOrder():
+            return self.cube.lines
+        return self.cube.bands
+
+    def getDescription(self):
+        return "%s of %s" % (self.operator.name, self.axis)
+
+    def createOutputCube(self):
+        cube = self.cube
+        dims = {'lines': cube.lines, 'samples': cube.samples, 'bands': cube.bands}
+        dims[self.axis] = 1
+        if self.operator.preserves_datatype:
+            datatype = cube.data_type
+        else:
+            datatype = numpy.float32
+        output = HSI.createCubeLike(cube, interleave='bip',
+                                    lines=dims['lines'],
+                                    samples=dims['samples'],
+                                    bands=dims['bands'], datatype=datatype,
+                                    byteorder=HSI.nativeByteOrder)
+        if self.axis != 'bands':
+            # band metadata is still valid if the bands weren't collapsed
+            output.wavelengths = cube.wavelengths[:]
+            output.wavelength_units = cube.wavelength_units
+            output.bbl = cube.bbl[:]
+            output.fwhm = cube.fwhm[:]
+            output.band_names = cube.band_names[:]
+        else:
+            output.band_names = [self.getDescription()]
+        output.scale_factor = cube.scale_factor
+        output.description = "%s of %s" % (self.getDescription(), cube.url)
+        return output
+
+    def iterChunks(self):
+        """Iterate over the source cube in its fastest order"""
+        if self.isFocalPlaneOrder():
+            return self.cube.iterFocalPlanes()
+        return self.cube.iterBands()
+
+    def reduce(self, updater=None):
+        """Perform the reduction
+
+        @param updater: optional L{ProgressUpdater} to report progress
+
+        @return: output cube, or None if the reduction was stopped by
+        L{stopReduction}
+        """
+        output = self.createOutputCube()
+        data = output.getNumpyArray()
+        op = self.operator
+        focal = self.isFocalPlaneOrder()
+        num = self.getNumChunks()
+        text = "Calculating %s" % self.getDescription()
+
+        # The accumulating case is when the reduced dimension is the one that
+        # the chunks are streamed along.
+        if focal:
+            accumulate = self.axis == 'lines'
+        else:
+            accumulate = self.axis == 'bands'
+
+        index = 0
+        for chunk in self.iterChunks():
+            if self.stop_request:
+                return None
+            if updater:
+                updater.updateStatus(index, num, text)
+            if accumulate:
+                if index == 0:
+                    op.start(chunk.shape)
+                op.accumulate(chunk)
+            elif focal:
+                # focal plane chunk is (bands x samples) at line = index
+                if self.axis == 'samples':
+                    data[index, 0, :] = op.reduce(chunk, 1)
+                else:
+                    data[index, :, 0] = op.reduce(chunk, 0)
+            else:
+                # band chunk is (lines x samples) at band = index
+                if self.axis == 'lines':
+                    data[0, :, index] = op.reduce(chunk, 0)
+                else:
+                    data[:, 0, index] = op.reduce(chunk, 1)
+            index += 1
+
+        if accumulate:
+            result = op.finish()
+            if focal:
+                # (bands x samples) -> (samples x bands) in the single line
+                data[0, :, :] = result.T
+            else:
+                # (lines x samples) in the single band
+                data[:, :, 0] = result
+        if updater:
+            updater.updateStatus(num, num, text)
+        return output
+
+
+class ThreadedCubeReduction(threading.Thread):
+    """Background cube reduction thread.
+
+    Uses peppy.lib.threadutils.ThreadStatus to communicate with GUI thread
+    """
+    def __init__(self, cube, operator, axis, updater):
+        threading.Thread.__init__(self)
+        self.reduction = CubeReduction(cube, operator, axis)
+        self.updater = updater
+        self.output = None
+
+    def stopReduction(self):
+        self.reduction.stopReduction()
+
+    def run(self):
+        try:
+            self.output = self.reduction.reduce(updater=self.updater)
+            if self.output is None:
+                self.updater.reportFailure("Cancelled %s" % self.reduction.getDescription())
+            else:
+                self.updater.reportSuccess("Finished %s" % self.reduction.getDescription(), self.output)
+        except:
+            import traceback
+            error = traceback.format_exc()
+            self.updater.reportFailure(error)
+
+
+__all__ = ['ReductionOperator', 'MeanOperator', 'StdDevOperator',
+           'MinOperator', 'MaxOperator', 'MedianOperator',
+           'getReductionOperatorNames', 'getReductionOperator',
+           'CubeReduction', 'ThreadedCubeReduction',
+           ]
@@ -11,6 +11,7 @@ import os, sys, math, time, threading
 from cStringIO import StringIO
 
 from peppy.debug import *
+from peppy.lib.dictutils import LRUDict
 
 import numpy
 
@@ -354,6 +355,92 @@ class Histogram(object):
             print "  Threshold %f reflectance units: valid=%d  percentage=%f" % ((self.thresholds[i]*1.0),pixelsbelowthreshold[i],(pixelsbelowthreshold[i]*100.0/validpixels))
 
 
+class FocalPlaneCache(debugmixin):
+    """LRU cache of focal planes used to look up spectra.
+    
+    On cubes that aren't in focal plane order (i.e.  file-based BSQ cubes),
+    reading a single spectrum requires a seek for every band.  Reading the
+    whole focal plane costs the same number of seeks but returns every
+    spectrum on the line, so caching focal planes makes cursor motion along a
+    line free.  Lines near the cursor can also be loaded ahead of time using
+    L{setCenter} and L{prefetch} so that motion across lines is fast, too.
+    
+    Focal planes are read through a private clone of the cube's reader so
+    that prefetching doesn't share a file position with any other reads of
+    the cube.
+    """
+    def __init__(self, cube, max_planes=32, radius=4):
+        self.cube = cube
+        cube_io = getattr(cube, 'cube_io', None)
+        if cube_io is not None:
+            self.reader = cube_io.clone()
+        else:
+            self.reader = cube
+        self.max_planes = max_planes
+        self.radius = radius
+        self.planes = LRUDict(max_planes)
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+    
+    def clear(self):
+        self.planes.clear()
+        self.pending = []
+    
+    def getFocalPlane(self, line):
+        """Return the raw (bands x samples) focal plane at the given line"""
+        try:
+            plane = self.planes[line]
+            self.hits += 1
+        except KeyError:
+            plane = self.loadFocalPlane(line)
+            self.misses += 1
+        return plane
+    
+    def loadFocalPlane(self, line):
+        plane = self.reader.getFocalPlaneRaw(line, use_progress=False)
+        self.planes[line] = plane
+        return plane
+    
+    def getSpectra(self, line, sample):
+        """Get the spectra at the given pixel.
+        
+        Same as L{Cube.getSpectra}, including updating the cube's extrema, but
+        read through the cache.
+        """
+        spectra = self.getFocalPlane(line)[:, sample].copy()
+        spectra *= self.cube.bbl
+        self.cube.updateExtrema(spectra)
+        return spectra
+    
+    def setCenter(self, line):
+        """Set the list of lines to be prefetched, in order of increasing
+        distance from the specified line.
+        """
+        self.pending = []
+        for offset in range(1, self.radius + 1):
+            for neighbor in (line + offset, line - offset):
+                if neighbor >= 0 and neighbor < self.cube.lines and neighbor not in self.planes:
+                    self.pending.append(neighbor)
+    
+    def prefetch(self, timeout=0.02):
+        """Load pending focal planes until the time limit is reached.
+        
+        Always loads at least one plane if any are pending, so progress is
+        made even if a single plane takes longer than the time limit.
+        
+        @return: True if there are still planes to be loaded
+        """
+        start = time.time()
+        while self.pending:
+            line = self.pending.pop(0)
+            if line not in self.planes:
+                self.loadFocalPlane(line)
+            if time.time() - start > timeout:
+                break
+        return bool(self.pending)
+
+
 class CubeCompare(debugmixin):
     """Compare two HSI cubes for differences.
     
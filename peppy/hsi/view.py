@@ -75,6 +75,13 @@ class CubeView(debugmixin):
             self.width = 128
             self.height = 128
         self.swap = False
+        
+        # Focal planes near the cursor are cached so that the depth profile
+        # can be plotted without reading the cube for every mouse motion
+        if self.cube:
+            self.spectrum_cache = FocalPlaneCache(self.cube)
+        else:
+            self.spectrum_cache = None
 
         # Delay loading real bitmap till requested.  Make an empty one
         # for now.
@@ -182,11 +189,25 @@ class CubeView(debugmixin):
 
     def getDepthProfile(self, x, y):
         """Get the profile into the monitor at the given x,y position"""
-        profile = self.cube.getSpectra(y,x)
+        profile = self.spectrum_cache.getSpectra(y,x)
         if self.swap:
             profile.byteswap(True) # swap in place
         return profile
     
+    def prefetchDepthProfiles(self, x, y, timeout=0.02):
+        """Load data near the given x,y position so that subsequent calls to
+        L{getDepthProfile} near that position are fast.
+        
+        This is designed to be called repeatedly in small time slices from
+        the GUI thread, initially with the x,y position and subsequently with
+        x and y set to None to continue the previous prefetch.
+        
+        @return: True if there is more data to be loaded
+        """
+        if y is not None:
+            self.spectrum_cache.setCenter(y)
+        return self.spectrum_cache.prefetch(timeout)
+    
     def getBandName(self, band_index):
         """Return the band name given the index"""
         text = self.cube.getDescriptiveBandName(band_index)
@@ -394,6 +415,9 @@ class FocalPlaneView(CubeView):
             profile = profile.byteswap()
         return profile
 
+    def prefetchDepthProfiles(self, x, y, timeout=0.02):
+        return False
+
     def getBandLegend(self, band_index):
         """Return the band name given the index"""
         return u"Frame %d" % (band_index + self.mode.classprefs.band_number_offset)
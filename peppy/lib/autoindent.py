@@ -27,6 +27,80 @@ import wx.stc
 from peppy.debug import *
 
 
+class AutoindentCache(debugmixin):
+    """Cache of line information used by the autoindenters.
+    
+    Finding the indent of a line can require scanning backwards through many
+    lines of the document, which is slow when reindenting a large region or
+    when editing deep inside a large function.  This cache stores the results
+    of the per-line calculations (fold section starts, code characters,
+    brace nesting at the start of each line, etc.) so that subsequent queries
+    can start from the nearest cached line instead of scanning again.
+    
+    Every cached value depends only on the text, styling, and folding of the
+    document up to and including its line, so a modification at a line
+    invalidates the cached values of that line and all the lines after it;
+    the values of the lines before remain valid.  Each table is a list
+    indexed by line number, so invalidation just truncates the list.
+    
+    One cache is created for each stc, and it is kept up to date through the
+    stc's modification callbacks.  Stcs that don't support modification
+    callbacks don't get a cache.
+    """
+    def __init__(self, stc):
+        self.stc = stc
+        self.tables = {}
+        stc.addModifyCallback(self.OnModified)
+    
+    @classmethod
+    def getCache(cls, stc):
+        """Return the cache for the stc, or None if the stc doesn't support
+        modification callbacks.
+        """
+        try:
+            return stc._autoindent_cache
+        except AttributeError:
+            pass
+        if hasattr(stc, 'addModifyCallback'):
+            cache = cls(stc)
+        else:
+            cache = None
+        stc._autoindent_cache = cache
+        return cache
+    
+    def OnModified(self, evt):
+        mod = evt.GetModificationType()
+        if mod & (wx.stc.STC_MOD_INSERTTEXT | wx.stc.STC_MOD_DELETETEXT | wx.stc.STC_MOD_CHANGESTYLE):
+            self.invalidate(self.stc.LineFromPosition(evt.GetPosition()))
+        elif mod & wx.stc.STC_MOD_CHANGEFOLD:
+            self.invalidate(evt.GetLine())
+    
+    def invalidate(self, line=0):
+        """Remove the cached values of the line and all lines after it"""
+        for table in self.tables.itervalues():
+            del table[line:]
+    
+    def get(self, key, line):
+        """Return the cached value of the line, or None if it isn't cached
+        
+        @param key: hashable key identifying the type of value
+        @param line: line number
+        """
+        try:
+            return self.tables[key][line]
+        except (KeyError, IndexError):
+            return None
+    
+    def set(self, key, line, value):
+        try:
+            table = self.tables[key]
+        except KeyError:
+            table = self.tables[key] = []
+        if line >= len(table):
+            table.extend([None] * (line + 1 - len(table)))
+        table[line] = value
+
+
 class BasicAutoindent(debugmixin):
     """Simple autoindent that indents the line to the level of the line above it.
     
@@ -285,13 +359,24 @@ class FoldingAutoindent(BasicAutoindent):
 
         @return: the line number of the start of the fold section
         """
+        cache = AutoindentCache.getCache(stc)
         fold = self.getFold(stc, linenum)
         ln = linenum
+        walked = []
         while ln > 0:
+            if cache:
+                start = cache.get((self, 'section'), ln)
+                if start is not None:
+                    # Any line in the same section has the same section start
+                    ln = start
+                    break
+                walked.append(ln)
             f = self.getFold(stc, ln - 1)
             if f != fold:
                 break
             ln -= 1
+        for line in walked:
+            cache.set((self, 'section'), line, ln)
         return ln
     
     def getNonCodeStyles(self, stc):
@@ -319,6 +404,14 @@ class FoldingAutoindent(BasicAutoindent):
         @param lc: optional integer specifying the last position on the
         line to consider
         """
+        if lc < 0:
+            cache = AutoindentCache.getCache(stc)
+            if cache:
+                out = cache.get((self, 'code'), ln)
+                if out is None:
+                    out = self.getCodeChars(stc, ln, stc.GetLineEndPosition(ln))
+                    cache.set((self, 'code'), ln, out)
+                return out
         fc = stc.PositionFromLine(ln)
         if lc < 0:
             lc = stc.GetLineEndPosition(ln)
@@ -551,11 +644,42 @@ class CStyleAutoindent(FoldingAutoindent):
 
         start = self.getFoldSectionStart(stc, linenum)
         self.dprint("fold start=%d, linenum=%d" % (start, linenum))
-        text = self.getCodeChars(stc, start, pos)
-        parens = self.getBraceMatch(text)
+        text = self.getCodeChars(stc, linenum, pos)
+        parens = self.getSectionBraceMatch(stc, start, linenum) + self.getBraceMatch(text)
         self.dprint("text=%s, parens=%d" % (text, parens))
         return parens != 0
     
+    def getSectionBraceMatch(self, stc, start, linenum):
+        """Find the paren mismatch count at the start of the line
+        
+        The mismatch count of all the code in the fold section before the line
+        is returned.  The count is cached for each line so that only the lines
+        between the nearest cached line and the given line have to be scanned.
+        
+        @param start: line number of the start of the fold section
+        @param linenum: line number
+        
+        @return: brace mismatch count as in L{getBraceMatch}
+        """
+        cache = AutoindentCache.getCache(stc)
+        ln = linenum
+        parens = 0
+        if cache:
+            while ln > start:
+                count = cache.get((self, 'parens'), ln)
+                if count is not None:
+                    parens = count
+                    break
+                ln -= 1
+        else:
+            ln = start
+        while ln < linenum:
+            parens += self.getBraceMatch(self.getCodeChars(stc, ln))
+            ln += 1
+            if cache:
+                cache.set((self, 'parens'), ln, parens)
+        return parens
+    
     def findIndent(self, stc, linenum=None):
         """Reindent the specified line to the correct level.
 
@@ -831,22 +955,14 @@ class RegexAutoindent(BasicAutoindent):
 
         #// find the first line with content that is not starting with comment text,
         #// and take the position from that
-        ln = linenum
-        pos = 0
-        above = ''
-        while ln > 0:
-            ln -= 1
-            fc = stc.GetLineIndentPosition(ln)
-            lc = stc.GetLineEndPosition(ln)
-            self.dprint("ln=%d fc=%d lc=%d line=-->%s<--" % (ln, fc, lc, stc.GetLine(ln)))
-            # skip blank lines
-            if fc < lc:
-                s = stc.GetStyleAt(fc)
-                if stc.isStyleComment(s):
-                    continue
-                pos = stc.GetLineIndentation(ln)
-                above = stc.GetTextRange(fc, lc)
-                break
+        ln = self.findPrevContentLine(stc, linenum)
+        if ln < 0:
+            ln = 0
+            pos = 0
+            above = ''
+        else:
+            pos = stc.GetLineIndentation(ln)
+            above = stc.GetTextRange(stc.GetLineIndentPosition(ln), stc.GetLineEndPosition(ln))
 
         #  // try 'couples' for an opening on the above line first. since we only adjust by 1 unit,
         #  // we only need 1 match.
@@ -945,9 +1061,69 @@ class RegexAutoindent(BasicAutoindent):
         
         return pos
     
+    def isContentLine(self, stc, ln):
+        """Return True if the line is not blank and doesn't start with a
+        comment
+        """
+        fc = stc.GetLineIndentPosition(ln)
+        lc = stc.GetLineEndPosition(ln)
+        self.dprint("ln=%d fc=%d lc=%d line=-->%s<--" % (ln, fc, lc, stc.GetLine(ln)))
+        # skip blank lines
+        if fc < lc:
+            s = stc.GetStyleAt(fc)
+            return not stc.isStyleComment(s)
+        return False
+    
+    def findPrevContentLine(self, stc, linenum):
+        """Find the first line above the given line that has content
+        
+        The result is cached for each line, so the search stops at the first
+        line whose result is already known.
+        
+        @return: line number, or -1 if there are no lines with content above
+        the line
+        """
+        cache = AutoindentCache.getCache(stc)
+        ln = linenum
+        walked = []
+        found = -1
+        while ln > 0:
+            if cache:
+                prev = cache.get((self, 'content'), ln)
+                if prev is not None:
+                    found = prev
+                    break
+                walked.append(ln)
+            ln -= 1
+            if self.isContentLine(stc, ln):
+                found = ln
+                break
+        # All the lines walked so far are blank or comments, so they have the
+        # same line with content above them
+        for line in walked:
+            cache.set((self, 'content'), line, found)
+        return found
+    
     def coupleBalance(self, stc, ln, open, close):
         """Search the line to see if there are unmatched braces
         
+        The result is cached for each line; see L{getCoupleBalance} for the
+        calculation.
+        """
+        if ln < 0:
+            return 0
+        cache = AutoindentCache.getCache(stc)
+        if cache:
+            r = cache.get((self, open, close), ln)
+            if r is None:
+                r = self.getCoupleBalance(stc, ln, open, close)
+                cache.set((self, open, close), ln, r)
+            return r
+        return self.getCoupleBalance(stc, ln, open, close)
+    
+    def getCoupleBalance(self, stc, ln, open, close):
+        """Search the line to see if there are unmatched braces
+        
         Search the line for unmatched braces given the open and close matching
         pair.  This takes into account the style of the document to make sure
         that the brace isn't in a comment or string.
@@ -0,0 +1,199 @@
+# peppy Copyright (c) 2006-2010 Rob McMullen
+# Licenced under the GPLv2; see http://peppy.flipturn.org for more info
+"""Background thread for writing files without blocking the user interface
+
+Autosave and backup copies are written by the L{BackgroundWriter} rather than
+by the GUI thread.  The GUI thread only takes a cheap snapshot of the data and
+passes a callable that produces the bytes to be written; the encoding and the
+writing both happen in the writer thread.
+
+Requests are identified by a key, usually the buffer and the kind of copy.
+If a request for a key is queued while an earlier request with the same key
+is still waiting to be written, the earlier request is replaced so that only
+the most recent snapshot is written.
+
+Files are first written to a temporary file in the same directory and then
+renamed over the destination, so a crash in the middle of writing never
+leaves a truncated file behind.
+"""
+
+import threading
+
+import peppy.vfs as vfs
+
+from peppy.debug import *
+
+
+class WriteRequest(object):
+    """A pending write of data to a url
+
+    Created by L{BackgroundWriter.write}; shouldn't be instantiated directly.
+    """
+    def __init__(self, key, url, data, callback):
+        self.key = key
+        self.url = url
+        self.data = data
+        self.callback = callback
+
+    def __str__(self):
+        return "WriteRequest for %s" % self.url
+
+    def getBytes(self):
+        if callable(self.data):
+            return self.data()
+        return self.data
+
+
+class BackgroundWriter(threading.Thread, debugmixin):
+    """Thread that writes queued requests one at a time
+
+    The thread is started when the first request is queued and runs until the
+    application exits.
+    """
+    #: Suffix of the temporary file used before renaming to the destination
+    temp_suffix = u".tmp"
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="BackgroundWriter")
+        self.setDaemon(True)
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.order = []
+        self.current = None
+        self.written = 0
+
+    def write(self, key, url, data, callback=None):
+        """Queue data to be written to the url
+
+        @param key: identifier of the request; a queued request that hasn't
+        started writing is replaced by a newer request with the same key
+
+        @param url: destination url
+
+        @param data: the bytes to write, or a callable that takes no arguments
+        and returns the bytes.  The callable is called in the writer thread,
+        so it must not use any GUI objects.
+
+        @param callback: optional callable that is called in the writer thread
+        after the write with the arguments (request, exception), where
+        exception is None if the write succeeded
+        """
+        request = WriteRequest(key, vfs.normalize(url), data, callback)
+        self.condition.acquire()
+        try:
+            if key in self.pending:
+                assert self.dprint("Replacing queued %s" % self.pending[key])
+            else:
+                self.order.append(key)
+            self.pending[key] = request
+            if not self.isAlive():
+                self.start()
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def cancel(self, key):
+        """Remove the queued request for the key
+
+        If the request for the key is currently being written, wait for it to
+        finish so the caller can safely remove the file afterwards.
+        """
+        self.condition.acquire()
+        try:
+            if key in self.pending:
+                del self.pending[key]
+                self.order.remove(key)
+            while self.current is not None and self.current.key == key:
+                self.condition.wait()
+        finally:
+            self.condition.release()
+
+    def isPending(self, key):
+        """Return True if a request for the key is queued or being written"""
+        self.condition.acquire()
+        try:
+            return key in self.pending or (self.current is not None and self.current.key == key)
+        finally:
+            self.condition.release()
+
+    def wait(self, key=None):
+        """Block until the request for the key has been written
+        
+        @param key: key of the request, or None to wait until all queued
+        requests have been written
+        """
+        self.condition.acquire()
+        try:
+            if key is None:
+                while self.order or self.current is not None:
+                    self.condition.wait()
+            else:
+                while key in self.pending or (self.current is not None and self.current.key == key):
+                    self.condition.wait()
+        finally:
+            self.condition.release()
+
+    def getTempURL(self, url):
+        name = vfs.get_filename(url) + self.temp_suffix
+        return vfs.get_child_reference(vfs.get_dirname(url), name)
+
+    def writeRequest(self, request):
+        """Write the data to a temporary file and rename it to the
+        destination url.
+        """
+        bytes = request.getBytes()
+        temp = self.getTempURL(request.url)
+        try:
+            fh = vfs.open_write(temp)
+            try:
+                fh.write(bytes)
+            finally:
+                fh.close()
+            vfs.replace(temp, request.url)
+        except:
+            if vfs.exists(temp):
+                try:
+                    vfs.remove(temp)
+                except OSError:
+                    pass
+            raise
+        assert self.dprint("Wrote %d bytes to %s" % (len(bytes), request.url))
+
+    def run(self):
+        while True:
+            self.condition.acquire()
+            try:
+                while not self.order:
+                    self.condition.wait()
+                key = self.order.pop(0)
+                request = self.pending.pop(key)
+                self.current = request
+            finally:
+                self.condition.release()
+
+            error = None
+            try:
+                self.writeRequest(request)
+            except Exception, e:
+                dprint(u"Failed writing %s: %s" % (request.url, e))
+                error = e
+            if request.callback:
+                request.callback(request, error)
+
+            self.condition.acquire()
+            try:
+                self.current = None
+                self.written += 1
+                self.condition.notifyAll()
+            finally:
+                self.condition.release()
+
+
+_background_writer = None
+
+def getBackgroundWriter():
+    """Return the application wide L{BackgroundWriter}"""
+    global _background_writer
+    if _background_writer is None:
+        _background_writer = BackgroundWriter()
+    return _background_writer
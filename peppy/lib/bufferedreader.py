@@ -13,8 +13,14 @@
 
 BufferedReader allows a streamed file to be accessed like a
 random-access file by buffering the first n bytes in memory.
+
+BlockCacheReader keeps an LRU cache of aligned blocks of a file, and
+DecompressingReader provides a seekable view of a compressed file.
 """
 
+import copy, threading
+
+
 class BufferedReplacementReader(object):
     """Buffered file-like object wrapper that replaces the first n
     bytes of the file with the specified buffer.  The remainder of the
@@ -159,3 +165,293 @@ class WindowReader(object):
     def close(self):
         self.fh.close()
         self.fh = None
+
+
+class BlockCacheReader(object):
+    """File-like object wrapper that reads the underlying file in fixed size
+    blocks aligned on multiples of the block size, keeping the most recently
+    used blocks in memory.
+    
+    This is designed for access patterns that make many small reads scattered
+    around the file, where each read on the wrapped file handle is expensive:
+    remote files where each read is a network round trip, or compressed files
+    where each seek potentially restarts the decompression.  The wrapped file
+    handle must support seek and tell.
+    
+    Reads larger than the bypass size are passed directly to the wrapped file
+    so that a single large read doesn't flush the cache.
+    
+    Each thread that reads from the file should use its own L{clone}, which
+    has an independent file position but shares the cache and the wrapped
+    file handle.  Access to the wrapped file handle is serialized by a lock
+    shared among the clones.
+    """
+    def __init__(self, fh, block_size=262144, max_blocks=64, bypass_size=None):
+        self.fh = fh
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        if bypass_size is None:
+            bypass_size = (block_size * max_blocks) / 4
+        self.bypass_size = bypass_size
+        self.pos = 0
+        self.size = None
+        self.debug = False
+        
+        # LRU cache of blocks keyed on block number
+        from peppy.lib.dictutils import LRUDict
+        self.blocks = LRUDict(max_blocks)
+        self.hits = 0
+        self.misses = 0
+        
+        # Protects the cache and the position of the wrapped file handle
+        self.lock = threading.Lock()
+    
+    def clone(self):
+        """Return a view of the same file with its own file position.
+        
+        The clone shares the block cache and the wrapped file handle, so it
+        can be used from another thread without disturbing the position of
+        this reader.
+        """
+        other = copy.copy(self)
+        other.pos = 0
+        other.hits = 0
+        other.misses = 0
+        return other
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.getSize()
+        if pos < 0:
+            raise IOError("Invalid seek to negative position %d" % pos)
+        self.pos = pos
+
+    def tell(self):
+        return self.pos
+    
+    def getSize(self):
+        if self.size is None:
+            self.lock.acquire()
+            try:
+                self.fh.seek(0, 2)
+                self.size = self.fh.tell()
+            finally:
+                self.lock.release()
+        return self.size
+    
+    def getBlock(self, index):
+        """Return the data in the block, reading it from the wrapped file if
+        it isn't already in the cache.
+        
+        Blocks are always full size except for the last block in the file.
+        """
+        self.lock.acquire()
+        try:
+            block = self.blocks.get(index)
+            if block is None:
+                self.misses += 1
+                self.fh.seek(index * self.block_size)
+                block = self.fh.read(self.block_size)
+                if len(block) < self.block_size:
+                    self.size = (index * self.block_size) + len(block)
+                self.blocks[index] = block
+            else:
+                self.hits += 1
+        finally:
+            self.lock.release()
+        return block
+    
+    def read(self, size=None):
+        if size is None or size < 0:
+            size = max(self.getSize() - self.pos, 0)
+        if size >= self.bypass_size:
+            self.lock.acquire()
+            try:
+                self.fh.seek(self.pos)
+                txt = self.fh.read(size)
+            finally:
+                self.lock.release()
+            self.pos += len(txt)
+            return txt
+        
+        pieces = []
+        while size > 0:
+            index, offset = divmod(self.pos, self.block_size)
+            block = self.getBlock(index)
+            txt = block[offset:offset + size]
+            if not txt:
+                break
+            pieces.append(txt)
+            self.pos += len(txt)
+            size -= len(txt)
+        txt = "".join(pieces)
+        if self.debug: print "BlockCacheReader: read %d to %d (hits=%d misses=%d)" % (len(txt), self.pos, self.hits, self.misses)
+        return txt
+    
+    def clearCache(self):
+        self.blocks.clear()
+
+    def close(self):
+        self.blocks.clear()
+        self.fh.close()
+        self.fh = None
+
+
+class DecompressingReader(object):
+    """Seekable file-like object that provides the uncompressed view of a
+    compressed file.
+    
+    The wrapped file handle must be seekable and contain data compressed in a
+    format supported by the decompressor factory, which must return a new
+    object with the same interface as zlib.decompressobj.
+    
+    Seeking backwards in a compressed stream normally means restarting the
+    decompression at the beginning of the file.  To avoid that, if the
+    decompressor supports the copy method (as zlib's does), seek points are
+    recorded as the file is decompressed.  A seek point is a copy of the
+    decompressor's state along with the compressed and uncompressed positions,
+    so decompression can be restarted from the nearest seek point rather than
+    the start of the file.
+    """
+    def __init__(self, fh, factory, seek_point_interval=4194304, chunk_size=65536):
+        self.fh = fh
+        self.factory = factory
+        self.seek_point_interval = seek_point_interval
+        self.chunk_size = chunk_size
+        self.debug = False
+        
+        self.pos = 0
+        self.size = None
+        
+        dec = self.factory()
+        self.use_seek_points = hasattr(dec, 'copy')
+        # seek points are stored as (uncompressed pos, compressed pos,
+        # decompressor) and are in increasing order
+        self.seek_points = [(0, 0, dec)]
+        self.restoreSeekPoint(self.seek_points[0])
+    
+    def restoreSeekPoint(self, point):
+        upos, cpos, dec = point
+        if self.use_seek_points:
+            # a copy is used so the seek point can be restored again later
+            self.dec = dec.copy()
+        else:
+            self.dec = self.factory()
+        self.fh.seek(cpos)
+        self.cpos = cpos
+        self.eof = False
+        
+        # buffer of uncompressed data that starts at buf_pos
+        self.buf = ""
+        self.buf_pos = upos
+    
+    def findSeekPoint(self, pos):
+        import bisect
+        i = bisect.bisect_right([p[0] for p in self.seek_points], pos)
+        return self.seek_points[i - 1]
+    
+    def decompressChunk(self):
+        """Decompress the next chunk of the compressed file and append it to
+        the uncompressed buffer.
+        """
+        data = self.fh.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            if hasattr(self.dec, 'flush'):
+                self.buf += self.dec.flush()
+            self.size = self.buf_pos + len(self.buf)
+            return
+        self.cpos += len(data)
+        out = []
+        while data:
+            try:
+                out.append(self.dec.decompress(data))
+            except EOFError:
+                # bz2 decompressor raises an error if it's fed data after the
+                # end of the stream rather than putting it in unused_data
+                self.dec = self.factory()
+                continue
+            # Concatenated streams (e.g. multi-member gzip files) leave the
+            # start of the next stream in unused_data
+            data = getattr(self.dec, 'unused_data', '')
+            if data:
+                self.dec = self.factory()
+        self.buf += "".join(out)
+        
+        end = self.buf_pos + len(self.buf)
+        if self.use_seek_points and end >= self.seek_points[-1][0] + self.seek_point_interval:
+            self.seek_points.append((end, self.cpos, self.dec.copy()))
+            if self.debug: print "DecompressingReader: seek point #%d at %d (compressed %d)" % (len(self.seek_points), end, self.cpos)
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.getSize()
+        if pos < 0:
+            raise IOError("Invalid seek to negative position %d" % pos)
+        self.pos = pos
+    
+    def tell(self):
+        return self.pos
+    
+    def getSize(self):
+        if self.size is None:
+            # the entire file must be decompressed to find the size, but the
+            # decompressed data doesn't need to be kept
+            point = self.seek_points[-1]
+            if point[0] > self.buf_pos:
+                self.restoreSeekPoint(point)
+            while not self.eof:
+                self.decompressChunk()
+                self.buf_pos += len(self.buf)
+                self.buf = ""
+        return self.size
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            size = self.getSize() - self.pos
+        if self.pos < self.buf_pos:
+            self.restoreSeekPoint(self.findSeekPoint(self.pos))
+        else:
+            # if there's a seek point between the end of the current buffer
+            # and the requested position, jump ahead to it
+            point = self.findSeekPoint(self.pos)
+            if point[0] > self.buf_pos + len(self.buf):
+                self.restoreSeekPoint(point)
+        
+        end = self.pos + size
+        while self.buf_pos + len(self.buf) < end and not self.eof:
+            self.decompressChunk()
+            # discard uncompressed data before the requested position so
+            # skipping forward doesn't accumulate the whole file in memory
+            skip = min(self.pos - self.buf_pos, len(self.buf))
+            if skip > 0:
+                self.buf = self.buf[skip:]
+                self.buf_pos += skip
+        start = self.pos - self.buf_pos
+        txt = self.buf[start:start + size]
+        self.pos += len(txt)
+        return txt
+
+    def close(self):
+        self.fh.close()
+        self.fh = None
+        self.seek_points = []
+
+
+def getGzipReader(fh, **kwargs):
+    """Return a seekable uncompressed view of a gzip file"""
+    import zlib
+    return DecompressingReader(fh, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS), **kwargs)
+
+def getBz2Reader(fh, **kwargs):
+    """Return a seekable uncompressed view of a bzip2 file.
+    
+    Note that the bz2 decompressor can't be copied, so seeking backwards
+    always restarts decompression at the start of the file.
+    """
+    import bz2
+    return DecompressingReader(fh, bz2.BZ2Decompressor, **kwargs)
@@ -154,6 +154,10 @@ class TimeExpiringDict(dict):
             for k, v in kwargs.iteritems():
                 self[k] = v
     
+    def clear(self):
+        self._expires_at.clear()
+        dict.clear(self)
+    
     def expire_at(self, key, when):
         # make sure the element exists before allowing the change in expiration
         # time.  Need to avoid the case where the key has expired but hasn't
@@ -166,6 +170,108 @@ class TimeExpiringDict(dict):
 
 
 
+class LRUDict(object):
+    """Dictionary with a maximum size that discards the least recently used
+    item when a new item is added to a full dictionary
+
+    Getting or setting an item makes it the most recently used; checking for
+    membership doesn't.  The usage order is a doubly linked list so that all
+    operations are constant time without needing collections.OrderedDict,
+    which isn't available before python 2.7.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        # links are [prev, next, key, value]; the root link is a sentinel
+        # where root[1] is the least and root[0] the most recently used
+        self._root = root = []
+        root[:] = [root, root, None, None]
+        self._map = {}
+    
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+    
+    def _append(self, link):
+        root = self._root
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = link
+        root[0] = link
+    
+    def __len__(self):
+        return len(self._map)
+    
+    def __contains__(self, key):
+        return key in self._map
+    
+    def __getitem__(self, key):
+        link = self._map[key]
+        self._unlink(link)
+        self._append(link)
+        return link[3]
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def __setitem__(self, key, value):
+        link = self._map.get(key)
+        if link is not None:
+            link[3] = value
+            self._unlink(link)
+        else:
+            while self._map and len(self._map) >= self.max_size:
+                self.popitem()
+            link = [None, None, key, value]
+            self._map[key] = link
+        self._append(link)
+    
+    def __delitem__(self, key):
+        link = self._map.pop(key)
+        self._unlink(link)
+    
+    def pop(self, key, *default):
+        try:
+            link = self._map.pop(key)
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        self._unlink(link)
+        return link[3]
+    
+    def popitem(self):
+        """Remove and return the least recently used (key, value) pair"""
+        link = self._root[1]
+        if link is self._root:
+            raise KeyError("dictionary is empty")
+        del self[link[2]]
+        return link[2], link[3]
+    
+    def clear(self):
+        root = self._root
+        root[:] = [root, root, None, None]
+        self._map.clear()
+    
+    def keys(self):
+        """Return the keys in order from least to most recently used"""
+        keys = []
+        root = self._root
+        link = root[1]
+        while link is not root:
+            keys.append(link[2])
+            link = link[1]
+        return keys
+    
+    def __iter__(self):
+        return iter(self.keys())
+
+
+
 if __name__ == "__main__":
     # Dict testcase code borrowed from the Python source code
     import unittest
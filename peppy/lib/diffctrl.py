@@ -23,12 +23,12 @@
 
 """
 
-import os, re
-from difflib import SequenceMatcher
+import os, sys, re
 
 import wx
 
 from peppy.lib.column_autosize import *
+from peppy.lib.linediff import get_line_opcodes
 
 
 def expandtabs(s, tabstop=8, ignoring=None):
@@ -75,7 +75,7 @@ def _get_change_extent(str1, str2):
 def _get_opcodes(fromlines, tolines, ignore_blank_lines=False,
                  ignore_case=False, ignore_space_changes=False):
     """
-    Generator built on top of SequenceMatcher.get_opcodes().
+    Generator built on top of the line hashing diff in L{get_line_opcodes}.
     
     This function detects line changes that should be ignored and emits them
     as tagged as 'equal', possibly joined with the preceding and/or following
@@ -103,9 +103,8 @@ def _get_opcodes(fromlines, tolines, ignore_blank_lines=False,
                     return False
             return True
 
-    matcher = SequenceMatcher(None, fromlines, tolines)
     previous = None
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    for tag, i1, i2, j1, j2 in get_line_opcodes(fromlines, tolines):
         if tag == 'equal':
             if previous:
                 previous = (tag, previous[1], i2, previous[3], j2)
@@ -160,6 +159,25 @@ def _group_opcodes(opcodes, n=3):
             group[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
         yield group
 
+def get_intraline_markup(fromline, toline):
+    """Mark the changed part of a pair of lines
+    
+    The start of the changed part of each line is marked with a '\\0' and the
+    end with a '\\1'.  This is only called for lines that are actually
+    displayed, rather than for every changed line up front.
+    
+    @returns: tuple of the marked up versions of fromline and toline
+    """
+    (start, end) = _get_change_extent(fromline, toline)
+    if start != 0 or end != 0:
+        last = end+len(fromline)
+        fromline = fromline[:start] + '\0' + fromline[start:last] + \
+                   '\1' + fromline[last:]
+        last = end+len(toline)
+        toline = toline[:start] + '\0' + toline[start:last] + \
+                 '\1' + toline[last:]
+    return fromline, toline
+
 def diff_blocks(fromlines, tolines, context=None, tabwidth=8,
                 ignore_blank_lines=0, ignore_case=0, ignore_space_changes=0):
     """Return an array that is adequate for adding to the data dictionary
@@ -174,15 +192,7 @@ def diff_blocks(fromlines, tolines, context=None, tabwidth=8,
         for tag, i1, i2, j1, j2 in opcodes:
             if tag == 'replace' and i2 - i1 == j2 - j1:
                 for i in range(i2 - i1):
-                    fromline, toline = fromlines[i1 + i], tolines[j1 + i]
-                    (start, end) = _get_change_extent(fromline, toline)
-                    if start != 0 or end != 0:
-                        last = end+len(fromline)
-                        fromlines[i1+i] = fromline[:start] + '\0' + fromline[start:last] + \
-                                       '\1' + fromline[last:]
-                        last = end+len(toline)
-                        tolines[j1+i] = toline[:start] + '\0' + toline[start:last] + \
-                                     '\1' + toline[last:]
+                    fromlines[i1+i], tolines[j1+i] = get_intraline_markup(fromlines[i1 + i], tolines[j1 + i])
             yield tag, i1, i2, j1, j2
 
     changes = []
@@ -224,8 +234,15 @@ def diff_blocks(fromlines, tolines, context=None, tabwidth=8,
 
 
 class DiffCtrl(wx.ListCtrl, ColumnAutoSizeMixin):
+    """Virtual list control showing the differences between two lists of
+    lines
+    
+    Only the row descriptions are created when the lines are loaded; the text
+    of each row, including the intraline markup of modified lines, is
+    generated when the row is displayed.
+    """
     def __init__(self, *args, **kwargs):
-        kwargs['style'] = wx.LC_REPORT
+        kwargs['style'] = wx.LC_REPORT|wx.LC_VIRTUAL
         wx.ListCtrl.__init__(self, *args, **kwargs)
         ColumnAutoSizeMixin.__init__(self)
         self.createColumns()
@@ -238,80 +255,122 @@ class DiffCtrl(wx.ListCtrl, ColumnAutoSizeMixin):
         self.removed_border_color = wx.Colour(0xcc, 0x00, 0x00)
         self.show_unmodified = True
         self.context = 2
+        self.tabwidth = 8
+        
+        self.added_attr = wx.ListItemAttr()
+        self.added_attr.SetBackgroundColour(self.added_color)
+        self.removed_attr = wx.ListItemAttr()
+        self.removed_attr.SetBackgroundColour(self.removed_color)
+        
+        self.clear()
         
     def createColumns(self):
         self.InsertSizedColumn(0, "Old", min=30)
         self.InsertSizedColumn(1, "New", min=30)
         self.InsertSizedColumn(2, "Diff", ok_offscreen=True)
     
-    def showModified(self, group):
-        print "type: %s" % group['type']
-        print "base: %s" % group['base']
-        print "changed: %s" % group['changed']
-        print
-        self.append(group['base']['offset'], "", group['base']['lines'], self.removed_color)
-        self.append("", group['changed']['offset'], group['changed']['lines'], self.added_color)
+    def clear(self):
+        self.old_lines = []
+        self.new_lines = []
+        
+        # Each row is a tuple (tag, old line number, new line number, partner)
+        # where the line numbers are None if the row doesn't show a line of
+        # that side.  Partner is the line number on the other side used for
+        # the intraline markup of modified lines, or None.
+        self.rows = []
+        self.text_cache = {}
+        self.SetItemCount(0)
     
-    def showRemoved(self, group):
-        print "type: %s" % group['type']
-        print "base: %s" % group['base']
-        print "changed: %s" % group['changed']
-        print
-        self.append(group['base']['offset'], "", group['base']['lines'], self.removed_color)
+    def load(self, old_lines, new_lines):
+        self.clear()
+        self.old_lines = old_lines
+        self.new_lines = new_lines
+        rows = self.rows
+        opcodes = _get_opcodes(old_lines, new_lines)
+        for group in _group_opcodes(opcodes, self.context):
+            if rows:
+                rows.append(('sep', None, None, None))
+            for tag, i1, i2, j1, j2 in group:
+                if tag == 'equal':
+                    if self.show_unmodified:
+                        for i in range(i2 - i1):
+                            rows.append(('unmod', i1 + i, j1 + i, None))
+                    continue
+                paired = tag == 'replace' and i2 - i1 == j2 - j1
+                if tag in ('replace', 'delete'):
+                    for i in range(i1, i2):
+                        if paired:
+                            partner = j1 + i - i1
+                        else:
+                            partner = None
+                        rows.append(('rem', i, None, partner))
+                if tag in ('replace', 'insert'):
+                    for j in range(j1, j2):
+                        if paired:
+                            partner = i1 + j - j1
+                        else:
+                            partner = None
+                        rows.append(('add', None, j, partner))
+        self.SetItemCount(len(rows))
+        self.Refresh()
     
-    def showAdded(self, group):
-        print "type: %s" % group['type']
-        print "base: %s" % group['base']
-        print "changed: %s" % group['changed']
-        print
-        self.append("", group['changed']['offset'], group['changed']['lines'], self.added_color)
+    def getLineText(self, index):
+        """Return the text of the diff column of the row, computing the
+        intraline markup if necessary.
+        """
+        try:
+            return self.text_cache[index]
+        except KeyError:
+            pass
+        tag, left, right, partner = self.rows[index]
+        if tag == 'sep':
+            text = u""
+        elif tag == 'unmod':
+            text = unicode(self.old_lines[left].expandtabs(self.tabwidth))
+        else:
+            if tag == 'rem':
+                line = self.old_lines[left]
+                if partner is not None:
+                    line = get_intraline_markup(line, self.new_lines[partner])[0]
+                markup = 'del'
+            else:
+                line = self.new_lines[right]
+                if partner is not None:
+                    line = get_intraline_markup(self.old_lines[partner], line)[1]
+                markup = 'ins'
+            line = expandtabs(line, self.tabwidth, '\0\1')
+            line = ('<%s>' % markup).join(line.split('\0'))
+            line = line.replace('\1', '</%s>' % markup)
+            text = unicode(line)
+        self.text_cache[index] = text
+        return text
     
-    def showUnmodified(self, group):
-        print "type: %s" % group['type']
-        print "base: %s" % group['base']
-        print "changed: %s" % group['changed']
-        print
-        left = group['base']['offset']
-        right = group['changed']['offset']
-        if left > self.last_left + 1:
-            self.append("...", "...", [""], show_if_first=False)
-        self.append(left, right, group['base']['lines'])
+    def OnGetItemText(self, index, col):
+        tag, left, right, partner = self.rows[index]
+        if tag == 'sep':
+            if col < 2:
+                return "..."
+            return ""
+        if col == 0:
+            if left is None:
+                return ""
+            return str(left)
+        elif col == 1:
+            if right is None:
+                return ""
+            return str(right)
+        return self.getLineText(index)
     
-    type_map = {
-        'mod': showModified,
-        'rem': showRemoved,
-        'add': showAdded,
-        'unmod': showUnmodified,
-        }
+    def OnGetItemImage(self, index):
+        return -1
     
-    def load(self, old_lines, new_lines):
-        blocks = diff_blocks(old_lines, new_lines, self.context)
-        self.last_left = -1
-        for block in blocks:
-            print block
-            for group in block:
-                func = self.type_map[group['type']]
-                print(func)
-                func(self, group)
-
-    def append(self, left, right, lines, color=None, show_if_first=True):
-        index = self.GetItemCount()
-        if index == 0 and not show_if_first:
-            return
-        for line in lines:
-            self.InsertStringItem(sys.maxint, str(left))
-            self.SetStringItem(index, 1, str(right))
-            self.SetStringItem(index, 2, line)
-            if color:
-                self.SetItemBackgroundColour(index, color)
-            if isinstance(left, int):
-                left += 1
-                self.last_left = left
-            if isinstance(right, int):
-                right += 1
-            index += 1
-        if isinstance(left, int):
-            self.last_left = left
+    def OnGetItemAttr(self, index):
+        tag = self.rows[index][0]
+        if tag == 'add':
+            return self.added_attr
+        elif tag == 'rem':
+            return self.removed_attr
+        return None
 
 
 if __name__ == "__main__":
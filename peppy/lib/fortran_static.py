@@ -96,6 +96,13 @@ class Callable(object):
         self.common_blocks = set()
         self.stops = []
         
+        # Calls that can be determined from the body alone, and the names
+        # (with their number of occurrences) that might be function calls
+        # depending on the functions defined elsewhere.  See scanBody.
+        self.local_callees = set()
+        self.local_num_calls = 0
+        self.function_candidates = None
+        
         self.gprof = None
         self.displayed = False
         self.displayed_edges = set()
@@ -217,12 +224,29 @@ class Callable(object):
     def scan(self, functions):
         print("Scanning %s" % self.name)
         #print("  Possible functions: %s" % functions)
+        if self.function_candidates is None:
+            self.scanBody()
+        self.resolveCallees(functions)
+    
+    def scanBody(self):
+        """Find the calls and stops that only depend on the body text
+        
+        Subroutine calls and external references are known from the body
+        alone, but a function call looks like an array reference so it can
+        only be identified once the names of all functions are known.  The
+        names before each open paren are stored as function candidates to be
+        checked later by L{resolveCallees}.
+        """
+        self.local_callees = set(self.callees)
+        self.local_num_calls = self.num_calls
+        self.function_candidates = {}
+        self.stops = []
         for line in self.body:
             match = subroutine.search(line)
             if match:
                 callee = match.group(1)
-                self.num_calls += 1
-                self.callees.add(callee)
+                self.local_num_calls += 1
+                self.local_callees.add(callee)
             match = stop.search(line)
             if match:
                 reason = match.group(1)
@@ -232,9 +256,9 @@ class Callable(object):
                 self.stops.append(reason)
             if "(" in line:
                 #print("Scanning line: %s" % line)
-                self.scanLineForFunction(line, functions)
+                self.scanLineForFunction(line, self.function_candidates)
     
-    def scanLineForFunction(self, line, functions):
+    def scanLineForFunction(self, line, candidates):
         # open paren seems to be the only way to tell if a function call
         # happens.  You can't check for "=" because the return value might be
         # used in a comparison
@@ -245,10 +269,20 @@ class Callable(object):
             if match:
                 possible = match.group(1).strip()
                 #print possible
-                if possible in functions:
-                    print "Found function %s in %s" % (possible, line)
-                    self.num_calls += 1
-                    self.callees.add(possible)
+                candidates[possible] = candidates.get(possible, 0) + 1
+    
+    def resolveCallees(self, functions):
+        """Set the callees given the set of names of all known functions
+        
+        This may be called repeatedly as the set of functions changes without
+        scanning the body again.
+        """
+        self.callees = set(self.local_callees)
+        self.num_calls = self.local_num_calls
+        for possible, count in self.function_candidates.iteritems():
+            if possible in functions:
+                self.num_calls += count
+                self.callees.add(possible)
     
     def writeDot(self, fh, callee_map, exclude, no_callees=False):
         self.displayed_edges = set()
@@ -283,15 +317,78 @@ class Callable(object):
                     print("Unknown callee: %s" % callee)
 
 
+class FortranFile(object):
+    """Scan results of a single source file
+    
+    The modification time and size of the file are stored so that the scan
+    can be reused until the file changes.
+    """
+    def __init__(self, filename, mtime, size):
+        self.filename = filename
+        self.mtime = mtime
+        self.size = size
+        self.callables = []
+        self.program = None
+    
+    def isCurrent(self):
+        """Return True if the file hasn't changed since it was scanned"""
+        try:
+            stat = os.stat(self.filename)
+        except OSError:
+            return False
+        return stat.st_mtime == self.mtime and stat.st_size == self.size
+
+
+def scanFortranFile(filename):
+    """Scan a single Fortran source file
+    
+    All the information that depends only on the contents of the file is
+    gathered here; the call graph is resolved later once all files have been
+    scanned.  This is a module level function so that it can be used in a
+    multiprocessing pool.
+    
+    @return: L{FortranFile} instance
+    """
+    stat = os.stat(filename)
+    info = FortranFile(filename, stat.st_mtime, stat.st_size)
+    current = None
+    reader = FixedFormatLineReader(filename)
+    for line in reader():
+        # More than one function might be in the file
+        match = program_unit_cre.match(line)
+        if match:
+            #print "%s %s(%s)" % (match.group(1), match.group(2), match.group(4))
+            current = Callable(match.group(2), match.group(1), match.group(4))
+            info.callables.append(current)
+            if match.group(1) == "program":
+                info.program = match.group(2)
+        elif current is not None:
+            current.addBody(line, reader.comments)
+    reader.fh.close()
+    for c in info.callables:
+        c.scanBody()
+    return info
+
+
 class FortranStaticAnalysis(PickleSerializerMixin):
     """Static analysis of Fortran code
     
+    Source files can either be added one at a time with L{scan} followed by a
+    call to L{analyze}, or the whole set of source files can be passed to
+    L{update}.  The results of L{update} are cached for each file, so calling
+    it again only scans the files that have changed and updates the call
+    graph incrementally.  By default the files are scanned in the current
+    process; a pool of processes is only used when explicitly requested and
+    there are many files to scan.
     """
     default_serialized_filename = "fortran.static-analysis"
     
+    #: Minimum number of files to scan before a process pool is used
+    min_files_for_pool = 8
+    
     def __init__(self, name="", serialized_filename=None, regenerate=False, pickledata=None):
-        PickleSerializerMixin.__init__(self)
-        self.createVersion1()
+        PickleSerializerMixin.__init__(self, 2)
+        self.createVersion2()
         self.name = name
         if serialized_filename:
             if not regenerate:
@@ -322,6 +419,25 @@ class FortranStaticAnalysis(PickleSerializerMixin):
         self.callables = data[1]
         self.block_data = data[2]
     
+    def createVersion2(self):
+        self.createVersion1()
+        self.files = {}
+        self.callers = {}
+        self.functions = set()
+    
+    def packVersion2(self):
+        return (self.name, self.callables, self.block_data, self.files, self.callers, self.functions)
+    
+    def unpackVersion2(self, data):
+        self.name, self.callables, self.block_data, self.files, self.callers, self.functions = data
+    
+    def convertVersion1ToVersion2(self):
+        # There are no per-file results in version 1, so the next call to
+        # update will scan all the files
+        self.files = {}
+        self.callers = {}
+        self.functions = set()
+    
     def isEmpty(self):
         return len(self.callables) == 0
 
@@ -348,25 +464,138 @@ class FortranStaticAnalysis(PickleSerializerMixin):
         fh.close()
         
     def scan(self, filename):
-        current = None
-        reader = FixedFormatLineReader(filename)
-        for line in reader():
-            # More than one function might be in the file
-            match = program_unit_cre.match(line)
-            if match:
-                #print "%s %s(%s)" % (match.group(1), match.group(2), match.group(4))
-                if current is not None:
-                    print current
-                name = match.group(2)
-                current = Callable(name, match.group(1), match.group(4))
-                if name in self.callables:
-                    print "WARNING: %s redefined from %s" % (name, self.callables[name])
-                self.callables[name] = current
-                
-                if match.group(1) == "program":
-                    self.name = match.group(2)
-            elif current is not None:
-                current.addBody(line, reader.comments)
+        info = scanFortranFile(filename)
+        self.addFile(info, self.callables)
+    
+    def addFile(self, info, callables):
+        for current in info.callables:
+            name = current.name
+            if name in callables:
+                print "WARNING: %s redefined from %s" % (name, callables[name])
+            callables[name] = current
+        if info.program:
+            self.name = info.program
+    
+    def scanFiles(self, filenames, processes=1):
+        """Scan the files, using a process pool if there are enough of them
+        
+        A process pool is never used in a frozen executable, because the
+        worker processes would start another copy of the application.  It
+        also shouldn't be used from the GUI, because the workers are forked
+        from the GUI process.
+        
+        @param processes: number of worker processes, None to use the number
+        of cpus, or 1 (the default) to scan in the current process
+        
+        @return: list of L{FortranFile} instances in the same order as the
+        filenames
+        """
+        pool = None
+        if processes != 1 and len(filenames) >= self.min_files_for_pool and not getattr(sys, 'frozen', False):
+            try:
+                import multiprocessing
+                if processes is None:
+                    processes = multiprocessing.cpu_count()
+                pool = multiprocessing.Pool(processes)
+            except (ImportError, OSError, NotImplementedError), e:
+                print("Process pool not available (%s); scanning serially" % e)
+        if pool is None:
+            return [scanFortranFile(filename) for filename in filenames]
+        try:
+            chunksize = max(1, len(filenames) / (8 * processes))
+            return pool.map(scanFortranFile, filenames, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    
+    def update(self, filenames, processes=1):
+        """Bring the analysis up to date with the given set of source files
+        
+        Only the files that are new or have been modified since the last
+        update are scanned.  Files that were part of the previous update but
+        are not in the list are removed from the analysis.
+        
+        @param filenames: list of all the source files; if a program unit is
+        defined more than once, the definition from the later file is used
+        
+        @param processes: number of worker processes as in L{scanFiles}
+        
+        @return: list of the filenames that were scanned
+        """
+        changed = []
+        for filename in filenames:
+            info = self.files.get(filename)
+            if info is None or not info.isCurrent():
+                changed.append(filename)
+        for info in self.scanFiles(changed, processes):
+            self.files[info.filename] = info
+        current = set(filenames)
+        for filename in self.files.keys():
+            if filename not in current:
+                del self.files[filename]
+        
+        old = self.callables
+        self.callables = {}
+        for filename in filenames:
+            self.addFile(self.files[filename], self.callables)
+        self.updateCallGraph(old)
+        return changed
+    
+    def updateCallGraph(self, old):
+        """Update the callees and called_by sets after some callables have
+        changed.
+        
+        Callables are compared by identity, so a changed callable is one that
+        was replaced by a rescan of its file.  Only changed callables have
+        their callees resolved, unless the set of function names has changed,
+        in which case all callables are resolved again.  The reverse index of
+        callers is updated one edge at a time so the called_by sets of
+        unchanged callables don't have to be rebuilt.
+        
+        @param old: dict of name to callable before the change
+        """
+        callables = self.callables
+        added = [c for name, c in callables.iteritems() if old.get(name) is not c]
+        removed = [c for name, c in old.iteritems() if callables.get(name) is not c]
+        for c in removed:
+            for callee in c.callees:
+                self.removeEdge(c.name, callee)
+        
+        functions = set([c.name for c in callables.itervalues() if c.isFunction()])
+        if functions != self.functions:
+            self.functions = functions
+            for c in callables.itervalues():
+                if old.get(c.name) is c:
+                    before = c.callees
+                    c.resolveCallees(functions)
+                    for callee in before - c.callees:
+                        self.removeEdge(c.name, callee)
+                    for callee in c.callees - before:
+                        self.addEdge(c.name, callee)
+        for c in added:
+            c.resolveCallees(functions)
+            for callee in c.callees:
+                self.addEdge(c.name, callee)
+        for c in added:
+            c.called_by = set(self.callers.get(c.name, ()))
+        
+        self.block_data = set([c for c in callables.itervalues() if c.isBlockData()])
+    
+    def addEdge(self, caller, callee):
+        try:
+            self.callers[callee].add(caller)
+        except KeyError:
+            self.callers[callee] = set([caller])
+        if callee in self.callables:
+            self.callables[callee].called_by.add(caller)
+    
+    def removeEdge(self, caller, callee):
+        if callee in self.callers:
+            self.callers[callee].discard(caller)
+            if not self.callers[callee]:
+                del self.callers[callee]
+        if callee in self.callables:
+            self.callables[callee].called_by.discard(caller)
     
     def summary(self):
         num_func = 0
@@ -409,6 +638,13 @@ class FortranStaticAnalysis(PickleSerializerMixin):
             if c.isBlockData():
                 print("Found block data: %s" % c.name)
                 self.block_data.add(c)
+        
+        # Index the callers so the call graph can be updated incrementally
+        self.functions = functions
+        self.callers = {}
+        for c in self.callables.values():
+            for callee in c.callees:
+                self.addEdge(c.name, callee)
     
     def getCallableNames(self):
         names = self.callables.keys()
@@ -700,6 +936,12 @@ class StaticComparison(object):
 
 
 if __name__ == "__main__":
+    try:
+        import multiprocessing
+        multiprocessing.freeze_support()
+    except ImportError:
+        pass
+    
     usage="usage: %prog unified_diff [...]"
     parser=OptionParser(usage=usage)
     parser.add_option(
@@ -748,6 +990,9 @@ if __name__ == "__main__":
     parser.add_option(
         "-s", type="string", dest="serialize_filename", default="",
         help="Use data from serialized filename [default: %default]")
+    parser.add_option(
+        "-j", type="int", dest="processes", default=None,
+        help="Number of processes used to scan source files [default: number of cpus]")
     parser.add_option(
         "-d", dest="dot", default="",
         help="Create graphviz .dot file")
@@ -786,9 +1031,11 @@ if __name__ == "__main__":
             stats = FortranStaticAnalysis(serialized_filename=options.serialize_filename)
         else:
             stats = FortranStaticAnalysis()
-            for name in args:
-                stats.scan(name)
-            stats.analyze()
+        if args:
+            # Only the files changed since the serialized data was created
+            # are scanned again
+            changed = stats.update(args, options.processes)
+            print("Scanned %d of %d files" % (len(changed), len(args)))
             stats.summary()
             stats.saveStateToFile()
         
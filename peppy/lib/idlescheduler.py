@@ -0,0 +1,299 @@
+# peppy Copyright (c) 2006-2010 Rob McMullen
+# Licenced under the GPLv2; see http://peppy.flipturn.org for more info
+"""Cooperative scheduler for work performed during idle time
+
+Work that would otherwise be performed synchronously in an idle event handler
+is registered as an L{IdleTask} with the L{IdleScheduler}.  Each time the
+application gets an idle event, the scheduler runs tasks in priority order
+until the time budget for that idle event is used up.  Tasks that don't get a
+chance to run are continued at the next idle event, so the user interface is
+never blocked for longer than the budget plus the time of a single task step.
+
+A task is a callable that performs a small amount of work and returns True if
+it has more work to do.  One-shot tasks are removed once they return False;
+repeating tasks stay scheduled until they are cancelled and are run at most
+once every C{interval} seconds.
+
+Tasks may be associated with an owner, typically a major mode or a buffer.
+The owner is only weakly referenced, and all of its tasks are cancelled when
+the owner goes away or when L{IdleScheduler.cancelTasks} is called.  Bound
+methods used as the task or its ready callable are also weakly referenced so
+that they don't keep their instance alive.
+
+Timing statistics are accumulated for each task name to help find the idle
+tasks that are using the most time.
+"""
+
+import time, weakref
+
+from peppy.debug import *
+
+
+class IdleTaskStats(object):
+    """Timing statistics for all the tasks with the same name"""
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.over_budget = 0
+
+    def add(self, elapsed, budget):
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if elapsed > budget:
+            self.over_budget += 1
+
+    def getMeanTime(self):
+        if self.calls:
+            return self.total_time / self.calls
+        return 0.0
+
+    def __str__(self):
+        return "%s: %d calls, total %.3fs, mean %.2fms, max %.2fms, %d over budget" % (self.name, self.calls, self.total_time, self.getMeanTime() * 1000, self.max_time * 1000, self.over_budget)
+
+
+class WeakCallable(object):
+    """Callable that only holds a weak reference to the instance of a bound
+    method.
+
+    Other callables are held normally.  Calling it after the instance has
+    been deleted returns None.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.instance = None
+        if getattr(func, 'im_self', None) is not None:
+            try:
+                self.instance = weakref.ref(func.im_self)
+                self.func = func.im_func
+            except TypeError:
+                pass
+
+    def isAlive(self):
+        return self.instance is None or self.instance() is not None
+
+    def __call__(self):
+        if self.instance is None:
+            return self.func()
+        instance = self.instance()
+        if instance is None:
+            return None
+        return self.func(instance)
+
+
+class IdleTask(object):
+    """A unit of work to be performed during idle time.
+
+    Created by L{IdleScheduler.addTask}; shouldn't be instantiated directly.
+    """
+    def __init__(self, func, name, priority, owner, interval, repeat, ready):
+        self.func = WeakCallable(func)
+        self.name = name
+        self.priority = priority
+        if owner is not None:
+            try:
+                self.owner = weakref.ref(owner)
+            except TypeError:
+                self.owner = lambda: owner
+        else:
+            self.owner = None
+        self.interval = interval
+        self.repeat = repeat
+        if ready is not None:
+            ready = WeakCallable(ready)
+        self.ready = ready
+        self.cancelled = False
+        self.next_time = 0.0
+        self.more = True
+        self.order = 0
+
+    def __str__(self):
+        return "IdleTask %s (priority %d)" % (self.name, self.priority)
+
+    def getOwner(self):
+        if self.owner is not None:
+            return self.owner()
+        return None
+
+    def isAlive(self):
+        """Return True if the task hasn't been cancelled and its owner (if
+        it has one) still exists.
+        """
+        return not self.cancelled and self.func.isAlive() and (self.owner is None or self.owner() is not None)
+
+    def isReady(self):
+        return self.ready is None or self.ready()
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class IdleScheduler(debugmixin):
+    """Run registered tasks in priority order within a time budget
+
+    The scheduler doesn't depend on wx; the application calls L{process} from
+    its idle event handler and requests more idle events if L{process}
+    indicates that there's still work to be done.
+    """
+    #: Default time budget in seconds per call to L{process}
+    default_budget = 0.02
+
+    #: Task priorities; lower numbers are run first
+    HIGH = 0
+    NORMAL = 50
+    LOW = 100
+
+    def __init__(self, budget=None):
+        if budget is None:
+            budget = self.default_budget
+        self.budget = budget
+        self.tasks = []
+        self.order = 0
+        self.deadline = 0.0
+        self.stats = {}
+
+    def addTask(self, func, name=None, priority=NORMAL, owner=None, interval=0.0, repeat=False, ready=None):
+        """Schedule a task
+
+        If a task with the same name and owner is already scheduled, that task
+        is returned instead of adding a new one, so it is safe to call this
+        every time new work is generated for a task.
+
+        @param func: callable that takes no arguments and returns True if
+        it has more work to do
+
+        @param name: name used to identify the task in the statistics;
+        defaults to the name of the callable
+
+        @param priority: tasks with lower priority numbers are run first
+
+        @param owner: optional object that owns the task.  The task is
+        cancelled when the owner is deleted or by L{cancelTasks}
+
+        @param interval: minimum time in seconds between calls of a
+        repeating task
+
+        @param repeat: if True, the task stays scheduled after it returns
+        False
+
+        @param ready: optional callable that returns False if the task
+        shouldn't run yet; a task that isn't ready doesn't cause more idle
+        events to be requested
+
+        @return: the L{IdleTask}
+        """
+        if name is None:
+            name = getattr(func, '__name__', str(func))
+        for task in self.tasks:
+            if task.name == name and task.isAlive() and task.getOwner() is owner:
+                task.more = True
+                return task
+        task = IdleTask(func, name, priority, owner, interval, repeat, ready)
+        task.order = self.getNextOrder()
+        self.tasks.append(task)
+        assert self.dprint("Added %s" % task)
+        return task
+
+    def getNextOrder(self):
+        self.order += 1
+        return self.order
+
+    def cancelTasks(self, owner):
+        """Cancel all tasks owned by the specified object"""
+        for task in self.tasks:
+            if task.getOwner() is owner:
+                assert self.dprint("Cancelling %s" % task)
+                task.cancel()
+        self.tasks = [task for task in self.tasks if task.isAlive()]
+
+    def getTimeRemaining(self):
+        """Return the time remaining in the budget of the current call to
+        L{process}.
+
+        Tasks that are able to split their work into small pieces may use
+        this to perform as many pieces as possible in a single call.
+        """
+        return self.deadline - time.time()
+
+    def process(self):
+        """Run tasks until the time budget is exhausted
+
+        Tasks are run in priority order, and tasks of the same priority are
+        run round-robin.  If time remains after all tasks have been run once,
+        the tasks that have more work to do are run again, including
+        repeating tasks whose interval has passed.  At least one task is run
+        on every call so that progress is always made.
+
+        @return: True if there is more work to be done, meaning that the
+        caller should request another idle event.
+        """
+        self.deadline = time.time() + self.budget
+        ran = False
+        first = True
+        out_of_time = False
+        while not out_of_time:
+            now = time.time()
+            self.tasks.sort(key=lambda t: (t.priority, t.order))
+            runnable = [t for t in self.tasks if t.isAlive() and t.next_time <= now and (first or t.more) and t.isReady()]
+            if not runnable:
+                break
+            for task in runnable:
+                if ran and time.time() >= self.deadline:
+                    out_of_time = True
+                    break
+                self.runTask(task)
+                ran = True
+            first = False
+        self.tasks = [task for task in self.tasks if task.isAlive()]
+        for task in self.tasks:
+            if task.more and task.isReady():
+                return True
+        return False
+
+    def runTask(self, task):
+        start = time.time()
+        try:
+            more = task.func()
+        except Exception, e:
+            import traceback
+            dprint("Cancelling %s after exception: %s" % (task, traceback.format_exc()))
+            more = False
+            task.cancel()
+        end = time.time()
+        self.getStats(task.name).add(end - start, self.budget)
+        task.more = bool(more)
+        task.order = self.getNextOrder()
+        if task.repeat:
+            task.next_time = end + task.interval
+        elif not more:
+            task.cancel()
+
+    def getStats(self, name):
+        try:
+            stats = self.stats[name]
+        except KeyError:
+            stats = IdleTaskStats(name)
+            self.stats[name] = stats
+        return stats
+
+    def getAllStats(self):
+        """Return the list of L{IdleTaskStats}, sorted by total time"""
+        stats = self.stats.values()
+        stats.sort(key=lambda s: s.total_time, reverse=True)
+        return stats
+
+    def resetStats(self):
+        self.stats = {}
+
+
+_idle_scheduler = None
+
+def getIdleScheduler():
+    """Return the application wide L{IdleScheduler}"""
+    global _idle_scheduler
+    if _idle_scheduler is None:
+        _idle_scheduler = IdleScheduler()
+    return _idle_scheduler
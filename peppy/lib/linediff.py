@@ -0,0 +1,236 @@
+# peppy Copyright (c) 2006-2010 Rob McMullen
+# Licenced under the GPLv2; see http://peppy.flipturn.org for more info
+"""Line based diff engine
+
+This is a replacement for difflib.SequenceMatcher when comparing lists of
+lines.  The lines are first hashed into integer ids so that all further
+comparisons are between small integers rather than strings.  The sequences
+are then aligned using the patience diff heuristic: lines that occur exactly
+once in both sequences are used as anchors, and the longest increasing
+subsequence of the anchors splits the problem into smaller independent
+pieces.  Pieces without unique lines are diffed using the linear space
+variant of the Myers O(ND) algorithm.
+
+Common prefixes and suffixes are stripped at every level, so the time
+required is mostly proportional to the size of the changes rather than the
+size of the files.
+
+The results are returned in the same format as the get_matching_blocks and
+get_opcodes methods of difflib.SequenceMatcher.  These utilities have no
+dependencies on any other part of peppy.
+"""
+
+from bisect import bisect_left
+from itertools import izip, islice
+
+
+def hash_lines(fromlines, tolines):
+    """Convert the two lists of lines into lists of integer ids, where equal
+    lines get the same id.
+    """
+    ids = {}
+    a = []
+    for line in fromlines:
+        try:
+            a.append(ids[line])
+        except KeyError:
+            ids[line] = len(ids)
+            a.append(ids[line])
+    b = []
+    for line in tolines:
+        try:
+            b.append(ids[line])
+        except KeyError:
+            ids[line] = len(ids)
+            b.append(ids[line])
+    return a, b
+
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    """Return the longest increasing sequence of (i, j) pairs of lines that
+    are unique in both ranges.
+    """
+    # Building dicts from the forward and reversed sequences gives the last
+    # and first index of every line without looping in python
+    indexes = xrange(alo, ahi)
+    last_a = dict(izip(a[alo:ahi], indexes))
+    first_a = dict(izip(reversed(a[alo:ahi]), reversed(indexes)))
+    indexes = xrange(blo, bhi)
+    last_b = dict(izip(b[blo:bhi], indexes))
+    first_b = dict(izip(reversed(b[blo:bhi]), reversed(indexes)))
+    pairs = [(i, last_b[line]) for line, i in last_a.iteritems() if first_a[line] == i and line in last_b and first_b[line] == last_b[line]]
+    if not pairs:
+        return pairs
+    pairs.sort()
+    if all(p1[1] < p2[1] for p1, p2 in izip(pairs, islice(pairs, 1, None))):
+        # Common case where no lines have been moved
+        return pairs
+
+    # Patience sorting to find the longest increasing subsequence of the
+    # positions in b
+    tails = []
+    tail_indexes = []
+    backpointers = []
+    for index, (i, j) in enumerate(pairs):
+        k = bisect_left(tails, j)
+        if k > 0:
+            backpointers.append(tail_indexes[k - 1])
+        else:
+            backpointers.append(-1)
+        if k == len(tails):
+            tails.append(j)
+            tail_indexes.append(index)
+        else:
+            tails[k] = j
+            tail_indexes[k] = index
+    anchors = []
+    index = tail_indexes[-1]
+    while index >= 0:
+        anchors.append(pairs[index])
+        index = backpointers[index]
+    anchors.reverse()
+    return anchors
+
+
+def _middle_snake(a, alo, ahi, b, blo, bhi):
+    """Find the middle snake of the shortest edit script using the linear
+    space refinement of the Myers algorithm.
+
+    @returns: tuple (x, y, u, v) where a[x:u] == b[y:v] is the diagonal
+    in the middle of an optimal path, in absolute coordinates.
+    """
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    maxd = (n + m + 1) // 2
+    offset = maxd + 1
+    vf = [0] * (2 * offset + 1)
+    vb = [0] * (2 * offset + 1)
+    for d in xrange(maxd + 1):
+        for k in xrange(-d, d + 1, 2):
+            if k == -d or (k != d and vf[offset + k - 1] < vf[offset + k + 1]):
+                x = vf[offset + k + 1]
+            else:
+                x = vf[offset + k - 1] + 1
+            y = x - k
+            x0 = x
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            vf[offset + k] = x
+            if odd and delta - d < k < delta + d and x + vb[offset + delta - k] >= n:
+                return alo + x0, blo + x0 - k, alo + x, blo + y
+        for k in xrange(-d, d + 1, 2):
+            if k == -d or (k != d and vb[offset + k - 1] < vb[offset + k + 1]):
+                x = vb[offset + k + 1]
+            else:
+                x = vb[offset + k - 1] + 1
+            y = x - k
+            x0 = x
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            vb[offset + k] = x
+            if not odd and -d <= delta - k <= d and x + vf[offset + delta - k] >= n:
+                return ahi - x, bhi - y, ahi - x0, bhi - x0 + k
+    raise RuntimeError("Middle snake not found")
+
+
+def get_matching_blocks(a, b):
+    """Return the list of matching blocks of the two sequences of hashable
+    items.
+
+    @returns: list of (i, j, n) triples meaning that a[i:i+n] == b[j:j+n],
+    in increasing order of i and j, terminated by the dummy triple
+    (len(a), len(b), 0) as in difflib.SequenceMatcher.get_matching_blocks
+    """
+    matches = []
+    # Ranges still to be processed, along with a flag indicating whether the
+    # patience heuristic should be tried
+    stack = [(0, len(a), 0, len(b), True)]
+    while stack:
+        alo, ahi, blo, bhi, patience = stack.pop()
+
+        # Strip the common prefix and suffix
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        if alo > start:
+            matches.append((start, blo - (alo - start), alo - start))
+        end = ahi
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        if end > ahi:
+            matches.append((ahi, bhi, end - ahi))
+        if alo == ahi or blo == bhi:
+            continue
+
+        if patience:
+            anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+            if anchors:
+                # Runs of adjacent anchors are combined into a single match,
+                # and only the gaps that have lines on both sides need to be
+                # diffed further
+                i0, j0 = alo, blo
+                run = None
+                for i, j in anchors:
+                    if i == i0 and j == j0 and run is not None:
+                        run[2] += 1
+                    else:
+                        if i0 < i and j0 < j:
+                            stack.append((i0, i, j0, j, True))
+                        if run is not None:
+                            matches.append(tuple(run))
+                        run = [i, j, 1]
+                    i0, j0 = i + 1, j + 1
+                matches.append(tuple(run))
+                stack.append((i0, ahi, j0, bhi, True))
+                continue
+
+        x, y, u, v = _middle_snake(a, alo, ahi, b, blo, bhi)
+        if u > x:
+            matches.append((x, y, u - x))
+        stack.append((alo, x, blo, y, False))
+        stack.append((u, ahi, v, bhi, False))
+
+    # Merge adjacent blocks
+    matches.sort()
+    blocks = []
+    for i, j, n in matches:
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1] = (blocks[-1][0], blocks[-1][1], blocks[-1][2] + n)
+        else:
+            blocks.append((i, j, n))
+    blocks.append((len(a), len(b), 0))
+    return blocks
+
+
+def get_opcodes(a, b):
+    """Return the list of 5-tuples describing how to turn a into b, in the
+    same format as difflib.SequenceMatcher.get_opcodes
+    """
+    opcodes = []
+    i = j = 0
+    for ai, bj, size in get_matching_blocks(a, b):
+        if i < ai and j < bj:
+            opcodes.append(('replace', i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(('delete', i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(('insert', i, ai, j, bj))
+        i = ai + size
+        j = bj + size
+        if size:
+            opcodes.append(('equal', ai, i, bj, j))
+    return opcodes
+
+
+def get_line_opcodes(fromlines, tolines):
+    """Return the opcodes describing how to turn the list of lines fromlines
+    into tolines.
+    """
+    a, b = hash_lines(fromlines, tolines)
+    return get_opcodes(a, b)
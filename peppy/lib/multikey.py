@@ -33,9 +33,11 @@ Emacs-style Prefixes:
  A-   aliased to M- on all platforms
 """
 
-import os, sys
+import os, sys, time, threading
 import wx, wx.stc
 
+from peppy.lib.dictutils import LRUDict
+
 try:
     from peppy.debug import *
 except:
@@ -587,29 +589,192 @@ class QuotedData(object):
         return self.multiplier
 
 
-class AcceleratorList(object):
-    """Driver class for multi-keystroke processing of CommandEvents.
+class KeymapStats(object):
+    """Timing statistics of keymap compilation and keystroke lookup"""
+    def __init__(self):
+        self.reset()
     
-    This class creates nested accelerator tables for processing multi-keystroke
-    commands.  The tables are switched in and out dynamically as key events
-    come into the L{processEvent} method.  Menu actions are also handled here.
-    If the user selects a menu item, any in-progress multi-key sequence is
-    cancelled.
+    def reset(self):
+        self.rebuilds = 0
+        self.rebuild_time = 0.0
+        self.compiles = 0
+        self.compile_time = 0.0
+        self.cache_hits = 0
+        self.lookups = 0
+        self.lookup_time = 0.0
+        self.max_lookup_time = 0.0
+    
+    def addRebuild(self, elapsed):
+        self.rebuilds += 1
+        self.rebuild_time += elapsed
+    
+    def addCompile(self, elapsed):
+        self.compiles += 1
+        self.compile_time += elapsed
+    
+    def addLookup(self, elapsed):
+        self.lookups += 1
+        self.lookup_time += elapsed
+        if elapsed > self.max_lookup_time:
+            self.max_lookup_time = elapsed
+    
+    def __str__(self):
+        lines = []
+        lines.append("rebuilds: %d, total %.2fms" % (self.rebuilds, self.rebuild_time * 1000))
+        lines.append("compiled keymaps: %d, total %.2fms; %d cache hits" % (self.compiles, self.compile_time * 1000, self.cache_hits))
+        if self.lookups:
+            mean = self.lookup_time / self.lookups
+        else:
+            mean = 0.0
+        lines.append("lookups: %d, mean %.3fms, max %.3fms" % (self.lookups, mean * 1000, self.max_lookup_time * 1000))
+        return os.linesep.join(lines)
+
+
+class CompiledKeymap(object):
+    """Trie of keystrokes compiled from a set of key binding strings.
+    
+    Each instance represents one level of multi-key processing.  Keystrokes
+    that lead to another level are stored in L{id_next_level}, and
+    keystrokes that complete a key sequence are stored in
+    L{keystroke_id_to_bindings} along with the tuple of key binding strings
+    that end with that keystroke.  Actions are not stored in the keymap; they
+    are looked up from the key binding strings by the L{AcceleratorList}, so
+    a compiled keymap only depends on the set of key binding strings and can
+    be shared by every L{AcceleratorList} that uses the same set.
+    
+    Compiled keymaps are cached, so the keymap for a combination of major
+    mode, minor modes, and minibuffer is only compiled once.  Keymaps must
+    not be modified once they have been compiled.
+    """
+    # Cache of the most recently used compiled keymaps keyed on the frozenset
+    # of key binding strings
+    cache = LRUDict(32)
+    
+    # Protects the cache
+    cache_lock = threading.Lock()
+    
+    def __init__(self):
+        # Map of ID to keystroke for this level
+        self.id_to_keystroke = {}
+        
+        # Map of all IDs that have additional keystrokes, used in multi-key
+        # processing.
+        self.id_next_level = {}
+        
+        # Map of all keystroke IDs in this level to the key binding strings
+        # that end at this keystroke
+        self.keystroke_id_to_bindings = {}
+        
+        # List of binding tuples in this level and all sub levels that have
+        # more than one key binding string.  Only used in the root level.
+        self.shared_bindings = []
+    
+    @classmethod
+    def get(cls, key_bindings, stats=None):
+        """Return the compiled keymap for the set of key binding strings,
+        compiling it if it isn't already in the cache.
+        """
+        key = frozenset(key_bindings)
+        cls.cache_lock.acquire()
+        try:
+            keymap = cls.cache.get(key)
+        finally:
+            cls.cache_lock.release()
+        if keymap is None:
+            start = time.time()
+            keymap = cls.compile(key)
+            if stats:
+                stats.addCompile(time.time() - start)
+            cls.cache_lock.acquire()
+            try:
+                cls.cache[key] = keymap
+            finally:
+                cls.cache_lock.release()
+        elif stats:
+            stats.cache_hits += 1
+        return keymap
     
-    Multiple instances of this class are nested in the root instance.  The
-    root instance holds the first character in all keystroke commands as
-    well as all menu IDs.  Any multi-key combinations additional instances of
-    AcceleratorList to the root level so that when the first keystroke is hit,
-    the class switches out the frame's accelerator table to the table holding
-    the next level's valid keystrokes.  This can be nested as far as necessary.
+    @classmethod
+    def clearCache(cls):
+        cls.cache_lock.acquire()
+        try:
+            cls.cache.clear()
+        finally:
+            cls.cache_lock.release()
+    
+    @classmethod
+    def compile(cls, key_bindings):
+        """Create the trie from the key binding strings"""
+        root = cls()
+        
+        # Sort to get a repeatable order of bindings sharing the same keystrokes
+        for key_binding in sorted(key_bindings):
+            keystrokes = KeyAccelerator.split(key_binding)
+            current = root
+            last = len(keystrokes) - 1
+            for count, keystroke in enumerate(keystrokes):
+                current.id_to_keystroke[keystroke.id] = keystroke
+                if count == last:
+                    current.keystroke_id_to_bindings.setdefault(keystroke.id, []).append(key_binding)
+                else:
+                    try:
+                        current = current.id_next_level[keystroke.id]
+                    except KeyError:
+                        next = cls()
+                        current.id_next_level[keystroke.id] = next
+                        current = next
+        root.freeze(root)
+        return root
+    
+    def freeze(self, root):
+        for keystroke_id, bindings in self.keystroke_id_to_bindings.iteritems():
+            bindings = tuple(bindings)
+            self.keystroke_id_to_bindings[keystroke_id] = bindings
+            if len(bindings) > 1:
+                root.shared_bindings.append(bindings)
+        for next in self.id_next_level.itervalues():
+            next.freeze(root)
     
+    def __str__(self):
+        return self.getPrettyStr()
     
+    def getPrettyStr(self, prefix=""):
+        """Recursive-capable function to return a list of keystrokes at this
+        level and below.
+        """
+        lines = []
+        keys = self.id_to_keystroke.keys()
+        keys.sort()
+        for key in keys:
+            keystroke = self.id_to_keystroke[key]
+            lines.append("%skey %d: %s %s" % (prefix, key, keystroke.getEmacsAccelerator(), str(keystroke.getAcceleratorTableEntry())))
+            if key in self.id_next_level:
+                lines.append(self.id_next_level[key].getPrettyStr(prefix + "  "))
+        return os.linesep.join(lines)
+
+
+class AcceleratorList(object):
+    """Driver class for multi-keystroke processing of CommandEvents.
+    
+    This class holds the key bindings and uses a L{CompiledKeymap} to process
+    multi-keystroke commands.  The levels of the keymap are switched in and
+    out dynamically as key events come into the L{processEvent} method.  Menu
+    actions are also handled here.  If the user selects a menu item, any
+    in-progress multi-key sequence is cancelled.
+    
+    The root level of the keymap holds the first character in all keystroke
+    commands.  Any multi-key combinations add levels to the keymap so that
+    when the first keystroke is hit, the class switches to the level holding
+    the next valid keystrokes.  This can be nested as far as necessary.
     """
     # Set the debug level to 1 for debugging output as keystrokes are typed,
     # and 2 for debugging info during the accelerator list creation and
     # deletion process
     debug = 0
     
+    # Timing statistics shared by all lists
+    stats = KeymapStats()
+    
     esc_keystroke = KeyAccelerator.split("ESC")[0]
     meta_esc_keystroke = KeyAccelerator.split("M-ESC")[0]
     
@@ -663,81 +828,64 @@ class AcceleratorList(object):
                 del self.actions[window]
     
     def __init__(self):
-        # Map of ID to keystroke for the current level
-        self.id_to_keystroke = {}
-        
-        # Map of all IDs that have additional keystrokes, used in multi-key
-        # processing.
-        self.id_next_level = {}
-        
-        # Map of all keystroke IDs in this level to actions
-        self.keystroke_id_to_action = {}
-        
         # Map used to rebuild key bindings when reset
         self.multikey_binding_to_action = {}
         
+        # Compiled keymap of all the current key bindings; this is the root
+        # level of multi-key processing
+        self.keymap = CompiledKeymap()
+        
     def __str__(self):
-        return self.getPrettyStr()
+        return self.keymap.getPrettyStr()
     
     def __del__(self):
         if self.debug > 1: dprint("deleting %s" % (repr(self), ))
     
     
     def cleanSubLevels(self):
-        """Recursive function to remove all references to the root object
+        """Remove all references to the keymap and actions
         """
         self.current_level = None
-#        for accel_list in self.id_next_level.values():
-#            accel_list.cleanSubLevels()
-        self.id_next_level = None
+        self.keymap = None
         self.menu_id_to_action = None
-        self.keystroke_id_to_action = None
+        self.multikey_binding_to_action = None
 
-    def getPrettyStr(self, prefix=""):
-        """Recursive-capable function to return a list of keystrokes at this
-        level and below.
-        """
-        lines = []
-        keys = self.id_to_keystroke.keys()
-        keys.sort()
-        for key in keys:
-            keystroke = self.id_to_keystroke[key]
-            lines.append("%skey %d: %s %s" % (prefix, key, keystroke.getEmacsAccelerator(), str(keystroke.getAcceleratorTableEntry())))
-            if key in self.id_next_level:
-                lines.append(self.id_next_level[key].getPrettyStr(prefix + "  "))
-        return os.linesep.join(lines)
-
-    def getCurrentKeyBindings(self, binding_of, previous_keystrokes=None):
+    def getCurrentKeyBindings(self, binding_of, level=None, previous_keystrokes=None):
         """Recursive-capable function to return dict of actions and keystrokes
         that trigger the actions.
         
         """
+        if level is None:
+            level = self.keymap
         if previous_keystrokes is None:
             previous_keystrokes = []
-        for keystroke_id, actionmap in self.keystroke_id_to_action.iteritems():
-            keystroke = self.id_to_keystroke[keystroke_id]
+        for keystroke_id, bindings in level.keystroke_id_to_bindings.iteritems():
+            keystroke = level.id_to_keystroke[keystroke_id]
             keystrokes = previous_keystrokes[:]
             keystrokes.append(keystroke)
-            for ctrl, action in actionmap.actions.iteritems():
+            for window in self.getBindingWindows():
+                action = self.getBindingAction(bindings, window)
                 if action is not None:
                     acc = KeyAccelerator.getEmacsAccelerator(keystrokes)
                     binding_of[acc] = action
                     if self.debug > 1: dprint("found action: %s, keystroke %s" % (action, acc))
-            if keystroke_id in self.id_next_level:
-                next = self.id_next_level[keystroke_id]
-                next.getCurrentKeyBindings(binding_of, keystrokes)
+        for keystroke_id, next in level.id_next_level.iteritems():
+            keystrokes = previous_keystrokes[:]
+            keystrokes.append(level.id_to_keystroke[keystroke_id])
+            self.getCurrentKeyBindings(binding_of, next, keystrokes)
 
     def addKeyBinding(self, key_binding, action=None, window=None):
         """Add a key binding to the list.
         
+        Key bindings don't take effect until L{rebuildKeyBindings} is called.
+        
         @param key_binding: text string representing the keystroke(s) to
         trigger the action.
         
         @param action: action to be called by this key binding
         
-        @param cancel_Key: if True, this keystroke will be added to all levels
-        and will cause the current keystrokes to be cancelled along with
-        calling the action.
+        @param window: if specified, the action is only called when this
+        window has the focus.
         """
         if isinstance(key_binding, list):
             for key_binding_entry in key_binding:
@@ -763,57 +911,85 @@ class AcceleratorList(object):
                 window.multikey_binding_to_action = {}
             window.multikey_binding_to_action[key_binding] = action
     
-    def rebuildRootKeyBindings(self):
-        self.id_to_keystroke = {}
-        self.id_next_level = {}
-        self.keystroke_id_to_action = {}
+    def getBindingWindows(self):
+        """Return the list of windows that have window specific key bindings.
         
-        self.rebuildWindowKeyBindings(self.multikey_binding_to_action)
+        The list always starts with None, representing the bindings that
+        aren't specific to any window.
+        """
+        return [None]
     
-    def rebuildWindowKeyBindings(self, key_binding_to_action, window=None):
-        if not key_binding_to_action:
-            return
-        for key_binding, action in key_binding_to_action.iteritems():
-            self.bindKeystrokes(key_binding, action, window)
+    def getBindingMap(self, window=None):
+        """Return the key binding to action map of the window"""
+        if window is None:
+            return self.multikey_binding_to_action
+        return getattr(window, 'multikey_binding_to_action', None)
     
-    def bindKeystrokes(self, key_binding, action, window=None):
-        keystrokes = KeyAccelerator.split(key_binding)
-        keycount = len(keystrokes)
-        count = 0
-        current = self
-        while count < keycount:
-            keystroke = keystrokes[count]
-            count += 1
-            current.id_to_keystroke[keystroke.id] = keystroke
-            if count == keycount:
-                try:
-                    existing = current.keystroke_id_to_action[keystroke.id]
-                    existing_action = existing.getActionOfWindow(window)
-                    if existing_action != action and existing_action != None and action != None:
-                        # Unless it's a placeholder action, if there are
-                        # different actions for the same keystroke, raise
-                        # an error.
-                        raise DuplicateKeyError("Key sequence %s for action %s already mapped to %s for window %s" % (str([str(k) for k in keystrokes[:-1]]), action, existing.getAction(window), window))
-                except KeyError:
-                    existing = None
-                if existing is not None:
-                    # Only add an action if the action is not None, because
-                    # action == None only serves as a placeholder and if there
-                    # is an existing action we already have something linked
-                    # to the keystroke
+    def getBindingAction(self, bindings, window=None):
+        """Determine the action of a keystroke based on the targeted window
+        
+        The key bindings of the window are checked first, and if none of them
+        has an action the key bindings that aren't specific to a window are
+        used.  Placeholder bindings (those bound to None) are ignored if
+        another binding of the same keystroke has a real action.
+        
+        @param bindings: tuple of key binding strings that end at the
+        keystroke, as stored in L{CompiledKeymap.keystroke_id_to_bindings}
+        
+        @param window: the currently targeted window
+        """
+        if window is not None and window in self.getBindingWindows():
+            binding_map = self.getBindingMap(window)
+            if binding_map:
+                for key_binding in bindings:
+                    action = binding_map.get(key_binding, None)
                     if action is not None:
-                        existing.addAction(action, window)
-                    else:
-                        if self.debug > 1: dprint("Ignoring placeholder key %s (%s) because there's already an existing action" % (key_binding, keystroke))
-                else:
-                    current.keystroke_id_to_action[keystroke.id] = AcceleratorList.ActionMap(action, window)
-            else:
-                try:
-                    current = current.id_next_level[keystroke.id]
-                except KeyError:
-                    accel_list = AcceleratorList()
-                    current.id_next_level[keystroke.id] = accel_list
-                    current = accel_list
+                        return action
+        binding_map = self.multikey_binding_to_action
+        for key_binding in bindings:
+            action = binding_map.get(key_binding, None)
+            if action is not None:
+                return action
+        return None
+    
+    def rebuildKeyBindings(self):
+        """Replace the keymap with the compiled keymap of the current set of
+        key bindings.
+        
+        The compiled keymap is shared with all other lists that use the same
+        set of key bindings, so switching back and forth between major modes
+        only compiles the keymap the first time the key bindings are seen.
+        
+        @raises DuplicateKeyError: if different key binding strings that
+        represent the same key sequence are bound to different actions in the
+        same window
+        """
+        start = time.time()
+        windows = self.getBindingWindows()
+        key_bindings = set()
+        for window in windows:
+            binding_map = self.getBindingMap(window)
+            if binding_map:
+                key_bindings.update(binding_map.iterkeys())
+        self.keymap = CompiledKeymap.get(key_bindings, self.stats)
+        self.checkDuplicateBindings(windows)
+        self.stats.addRebuild(time.time() - start)
+    
+    def checkDuplicateBindings(self, windows):
+        for bindings in self.keymap.shared_bindings:
+            for window in windows:
+                binding_map = self.getBindingMap(window)
+                if not binding_map:
+                    continue
+                previous = None
+                for key_binding in bindings:
+                    action = binding_map.get(key_binding, None)
+                    if action is None:
+                        # Placeholders never conflict with other bindings
+                        continue
+                    if previous is not None and action != previous:
+                        raise DuplicateKeyError("Key sequence %s for action %s already mapped to %s for window %s" % (key_binding, action, previous, window))
+                    previous = action
     
     def findKeyBinding(self, key_binding):
         """Given text representing a key binding, find the list of keystroke
@@ -821,27 +997,29 @@ class AcceleratorList(object):
         
         @return: tuple containing the list of ids and the action.  Each entry
         in the list represents one level in the id_next_level chain except for
-        the last entry which is the value of the keystroke_id_to_action entry.
+        the last entry which is the keystroke that triggers the action.
         """
         keystrokes = KeyAccelerator.split(key_binding)
         ids = []
         action = None
-        current = self
+        current = self.keymap
         for keystroke in keystrokes:
             ids.append(keystroke.id)
             try:
                 current = current.id_next_level[keystroke.id]
             except KeyError:
-                action = current.keystroke_id_to_action[keystroke.id]
+                action = self.getBindingAction(current.keystroke_id_to_bindings[keystroke.id])
                 break
         return ids, action
         
     def addCancelKeysToLevels(self, key_binding, action):
-        """Recursive function to add the cancel keybinding to the current level
-        and all sub levels
+        """Add the cancel keybinding
+        
+        Compiled keymaps are shared and can't be modified, so the cancel key
+        is only added to the root level as a regular key binding.
+        L{AcceleratorManager.processMultiKey} falls back to the cancel keys of
+        the root level when a keystroke isn't found in a multi-key level.
         """
-        for accel_list in self.id_next_level.values():
-            accel_list.addCancelKeysToLevels(key_binding, action)
         self.addKeyBinding(key_binding, action)
     
     def isModifierOnly(self, evt):
@@ -963,6 +1141,9 @@ class AcceleratorManager(AcceleratorList):
     """
     use_meta_escape = True
     
+    # Cache of placeholder key bindings, keyed on the meta escape flag
+    placeholder_cache = {}
+    
     @classmethod
     def setMetaEscapeAllowed(cls, state=True):
         #dprint("allowing meta escape: %s" % state)
@@ -976,8 +1157,9 @@ class AcceleratorManager(AcceleratorList):
     def __init__(self, *args, **kwargs):
         AcceleratorList.__init__(self)
         
-        # The root keeps track of the current level that is another
-        # instance of AcceleratorList from the id_next_level map
+        # The root keeps track of the current level of the compiled keymap,
+        # which is either the keymap itself or a level from its id_next_level
+        # map
         self.current_level = None
         
         # Map of all menu IDs to actions.  Note that menu actions only occur
@@ -1005,6 +1187,9 @@ class AcceleratorManager(AcceleratorList):
         self.quoted_raw_callback = None
         
         self.pending_cancel_key_registration = []
+        
+        # Keystroke IDs of the first keystroke of each cancel key binding
+        self.cancel_keystroke_ids = set()
 
         self.bound_controls = []
         
@@ -1041,28 +1226,45 @@ class AcceleratorManager(AcceleratorList):
             self.addKeyBinding(arg)
         
         # Add default and dummy actions
+        for key_binding in self.getPlaceholderKeyBindings():
+            if key_binding not in self.multikey_binding_to_action:
+                self.multikey_binding_to_action[key_binding] = None
+    
+    @classmethod
+    def getPlaceholderKeyBindings(cls):
+        """Return the list of key bindings that are always present, even if
+        they aren't bound to an action.
+        
+        The list is created once and cached because a new manager is created
+        for every change of major mode.
+        """
+        try:
+            return cls.placeholder_cache[cls.use_meta_escape]
+        except KeyError:
+            pass
+        placeholders = []
         for i in range(10):
-            self.addKeyBinding("M-%d" % i)
-            if self.use_meta_escape:
-                self.addKeyBinding("ESC %d" % i)
-            self.addKeyBinding("C-%d" % i)
-            self.addKeyBinding("M-%d" % i)
-            self.addKeyBinding("S-C-%d" % i)
-            self.addKeyBinding("S-M-%d" % i)
-            self.addKeyBinding("S-C-M-%d" % i)
+            placeholders.append("M-%d" % i)
+            if cls.use_meta_escape:
+                placeholders.append("ESC %d" % i)
+            placeholders.append("C-%d" % i)
+            placeholders.append("S-C-%d" % i)
+            placeholders.append("S-M-%d" % i)
+            placeholders.append("S-C-M-%d" % i)
         for i in range(26):
-            self.addKeyBinding("C-%s" % chr(ord('A') + i))
-            self.addKeyBinding("M-%s" % chr(ord('A') + i))
-            self.addKeyBinding("S-C-%s" % chr(ord('A') + i))
-            self.addKeyBinding("S-M-%s" % chr(ord('A') + i))
-            self.addKeyBinding("S-C-M-%s" % chr(ord('A') + i))
+            placeholders.append("C-%s" % chr(ord('A') + i))
+            placeholders.append("M-%s" % chr(ord('A') + i))
+            placeholders.append("S-C-%s" % chr(ord('A') + i))
+            placeholders.append("S-M-%s" % chr(ord('A') + i))
+            placeholders.append("S-C-M-%s" % chr(ord('A') + i))
         for c in "/,.?<>'[]\-=`\"{}|_+~":
-            self.addKeyBinding("C-%s" % c)
-            self.addKeyBinding("M-%s" % c)
-            self.addKeyBinding("S-C-%s" % c) # this one overwrites C-Q
-            self.addKeyBinding("S-M-%s" % c)
-            self.addKeyBinding("S-C-M-%s" % c)
-            
+            placeholders.append("C-%s" % c)
+            placeholders.append("M-%s" % c)
+            placeholders.append("S-C-%s" % c) # this one overwrites C-Q
+            placeholders.append("S-M-%s" % c)
+            placeholders.append("S-C-M-%s" % c)
+        cls.placeholder_cache[cls.use_meta_escape] = placeholders
+        return placeholders
     
     def __del__(self):
         if self.debug > 1: dprint("deleting %s" % (repr(self), ))
@@ -1136,7 +1338,7 @@ class AcceleratorManager(AcceleratorList):
     def addCancelKeyBinding(self, key_binding, action=None):
         """Add a cancel key binding.
         
-        Cancel keys are special keystrokes that are added to all levels.  A
+        Cancel keys are special keystrokes that work at all levels.  A
         cancel key will cancel the current keystrokes without processing them,
         and will also call the action specified here.
         
@@ -1146,22 +1348,22 @@ class AcceleratorManager(AcceleratorList):
         @param action: optional action to be called when the cancel key
         keystroke combination is pressed.
         """
-        # Cancel keys can't be added until all other keystrokes have been added
-        # to the list because a copy of the cancel key binding is added to all
-        # levels.  If the key binding were added when this method is called,
-        # key bindings added later that create new levels wouldn't have the
-        # cancel key binding in them.  So, this is used as a flag to create
-        # new keybindings when bindEvents is called.
+        # Cancel keys are added to the root level when bindEvents is called.
+        # Inside a multi-key sequence, a keystroke that isn't defined at the
+        # current level but starts a cancel key binding is looked up from the
+        # root level instead; see processMultiKey.
         self.pending_cancel_key_registration.append((key_binding, action))
     
     def addCancelKeys(self):
-        """Add cancel keys to all keybinding levels
+        """Add cancel keys to the root keybinding level
         
         """
         if self.pending_cancel_key_registration:
             for key_binding, action in self.pending_cancel_key_registration:
                 if self.debug: dprint("Adding cancel key %s" % key_binding)
                 self.addCancelKeysToLevels(key_binding, action)
+                keystrokes = KeyAccelerator.split(key_binding)
+                self.cancel_keystroke_ids.add(keystrokes[0].id)
         self.pending_cancel_key_registration = []
     
     def registerElectricChar(self, uchar, action, target):
@@ -1174,7 +1376,7 @@ class AcceleratorManager(AcceleratorList):
         self.electric_char_actions[(uchar, target)] = action
     
     def isRoot(self):
-        return self.current_level == self
+        return self.current_level is self.keymap
     
     def bindEvents(self, frame, *ctrls):
         """Initialization function to create all necessary event bindings
@@ -1188,7 +1390,6 @@ class AcceleratorManager(AcceleratorList):
         for ctrl in ctrls:
             self.addEventBinding(ctrl)
         self.rebuildAllKeyBindings()
-        self.current_level = self
     
     def addEventBinding(self, ctrl):
         if self.debug > 1: dprint("Adding event bindings for %s" % ctrl)
@@ -1210,11 +1411,20 @@ class AcceleratorManager(AcceleratorList):
         self.rebuildAllKeyBindings()
     
     def rebuildAllKeyBindings(self):
-        self.rebuildRootKeyBindings()
-        for ctrl in self.bound_controls:
-            if hasattr(ctrl, 'multikey_binding_to_action'):
-                if self.debug > 1: dprint("key binding storage for %s: %s" % (ctrl, ctrl.multikey_binding_to_action))
-                self.rebuildWindowKeyBindings(ctrl.multikey_binding_to_action, ctrl)
+        """Rebuild the keymap after the key bindings of the frame or any of
+        the bound controls have changed.
+        
+        Any in-progress multi-key sequence is abandoned because the levels of
+        the old keymap may not exist in the new keymap.
+        """
+        if self.debug > 1:
+            for ctrl in self.bound_controls:
+                dprint("key binding storage for %s: %s" % (ctrl, getattr(ctrl, 'multikey_binding_to_action', None)))
+        self.rebuildKeyBindings()
+        self.current_level = self.keymap
+    
+    def getBindingWindows(self):
+        return [None] + self.bound_controls
     
     def removeBindings(self, ctrls):
         for ctrl in ctrls:
@@ -1483,15 +1693,18 @@ class AcceleratorManager(AcceleratorList):
         in this method (for instance if it is an unknown keystroke for this
         level) it will return False.
         """
+        start = time.time()
         eid = keystroke.id
         if eid in self.current_level.id_next_level:
             if self.debug: dprint("in processEvent: evt=%s id=%s FOUND MULTI-KEYSTROKE" % (str(evt.__class__), eid))
             self.current_level = self.current_level.id_next_level[eid]
+            self.stats.addLookup(time.time() - start)
             self.updateCurrentKeystroke(keystroke, pending=True)
             return True
-        elif eid in self.current_level.keystroke_id_to_action:
-            if self.debug: dprint("in processEvent: evt=%s id=%s FOUND ACTION %s repeat=%s" % (str(evt.__class__), eid, self.current_level.keystroke_id_to_action[eid].actions, self.entry.repeat_value))
+        elif eid in self.current_level.keystroke_id_to_bindings:
+            if self.debug: dprint("in processEvent: evt=%s id=%s FOUND ACTION %s repeat=%s" % (str(evt.__class__), eid, self.current_level.keystroke_id_to_bindings[eid], self.entry.repeat_value))
             action = self.getKeystrokeAction(eid)
+            self.stats.addLookup(time.time() - start)
             if self.report_next:
                 self.processReportNext(action)
                 return True
@@ -1510,6 +1723,12 @@ class AcceleratorManager(AcceleratorList):
             if not self.entry.quoted_next:
                 self.resetKeyboardSuccess()
             return True
+        elif eid in self.cancel_keystroke_ids and not self.isRoot():
+            # Cancel keys are only defined in the root level, so restart the
+            # lookup from there.
+            if self.debug: dprint("in processEvent: evt=%s id=%s FOUND CANCEL KEY" % (str(evt.__class__), eid))
+            self.current_level = self.keymap
+            return self.processMultiKey(evt, keystroke)
         return False
     
     def getKeystrokeAction(self, eid):
@@ -1518,9 +1737,8 @@ class AcceleratorManager(AcceleratorList):
         The default action is used if the currently targeted window doesn't
         exist in the action map for this keystroke.
         """
-        actionmap = self.current_level.keystroke_id_to_action[eid]
-        action = actionmap.getAction(self.current_target)
-        return action
+        bindings = self.current_level.keystroke_id_to_bindings[eid]
+        return self.getBindingAction(bindings, self.current_target)
 
     def getMenuAction(self, eid):
         """Determine the action to use based on the currently targeted window
@@ -1566,7 +1784,7 @@ class AcceleratorManager(AcceleratorList):
         # If a toolbar button is clicked while in the middle of a multi-key
         # keystroke combination, kill the multi-key combo and allow the
         # toolbar ID to be processed.
-        if isinstance(evt.GetEventObject(), wx.ToolBar) and self.current_level != self:
+        if isinstance(evt.GetEventObject(), wx.ToolBar) and not self.isRoot():
             self.cancelMultiKey()
             
         if self.debug: dprint("id=%d event=%s" % (evt.GetId(), evt))
@@ -1585,7 +1803,7 @@ class AcceleratorManager(AcceleratorList):
             eid = evt.GetId()
             if self.entry.quoted_next:
                 try:
-                    keystroke = self.id_to_keystroke[eid]
+                    keystroke = self.keymap.id_to_keystroke[eid]
                 except KeyError:
                     keystroke = self.findKeystrokeFromMenuId(eid)
                 if self.debug: dprint(keystroke)
@@ -1617,14 +1835,13 @@ class AcceleratorManager(AcceleratorList):
         target of None.  Transient controls currently aren't allowed to change
         the menu bar to include their own menu items.
         """
-        if self.debug: dprint("checking for action %s: keystroke IDs=%s" % (action, str(self.keystroke_id_to_action.keys())))
-        for keystroke_id, actionmap in self.keystroke_id_to_action.iteritems():
-            # NOTE: this is not actionmap.getAction(self.current_target)
-            # because all menu items that have key bindings will have a window
-            # target of None.
-            keystroke_action = actionmap.getAction(None)
+        if self.debug: dprint("checking for action %s: keystroke IDs=%s" % (action, str(self.keymap.keystroke_id_to_bindings.keys())))
+        for keystroke_id, bindings in self.keymap.keystroke_id_to_bindings.iteritems():
+            # NOTE: this is not using self.current_target because all menu
+            # items that have key bindings will have a window target of None.
+            keystroke_action = self.getBindingAction(bindings, None)
             if action == keystroke_action:
-                keystroke = self.id_to_keystroke[keystroke_id]
+                keystroke = self.keymap.id_to_keystroke[keystroke_id]
                 return keystroke
         raise KeyError
     
@@ -1632,7 +1849,7 @@ class AcceleratorManager(AcceleratorList):
         """Fire off an action found in menu item or toolbar item list
         """
         eid = evt.GetId()
-        if self.current_level != self:
+        if not self.isRoot():
             # Events won't be processed as a menu action if we are in the
             # middle of a multi-key keystroke.  We need to get the keystroke
             # equivalent of the menu item and process it as a multi-key action.
@@ -1699,8 +1916,8 @@ class AcceleratorManager(AcceleratorList):
         action's actionKeystroke method.
         """
         keystroke = self.findKeystrokeFromMenuAction(action)
-        actionmap = self.keystroke_id_to_action[keystroke.id]
-        action = actionmap.getAction(self.current_target)
+        bindings = self.keymap.keystroke_id_to_bindings[keystroke.id]
+        action = self.getBindingAction(bindings, self.current_target)
         if action:
             evt = FakeQuotedCharEvent(self.current_target, keystroke)
         else:
@@ -1725,23 +1942,23 @@ class AcceleratorManager(AcceleratorList):
             self.frame.SetStatusText(text, self.status_column)
     
     def cancelMultiKey(self):
-        if self.current_level != self:
+        if not self.isRoot():
             self.reset(_("Cancelled multi-key keystroke"))
             
     def reset(self, message=""):
         self.entry = CurrentKeystrokes()
         if self.debug: dprint("resetting status text to %s" % message)
         self.frame.SetStatusText(message, self.status_column)
-        self.current_level = self
+        self.current_level = self.keymap
     
     def resetKeyboardSuccess(self):
         self.entry = CurrentKeystrokes()
-        self.current_level = self
+        self.current_level = self.keymap
     
     def resetKeyboardFail(self, keystroke, info=None):
         self.updateCurrentKeystroke(keystroke, info)
         self.entry = CurrentKeystrokes()
-        self.current_level = self
+        self.current_level = self.keymap
     
     def resetMenuSuccess(self):
         self.reset()
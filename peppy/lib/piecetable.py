@@ -0,0 +1,277 @@
+# peppy Copyright (c) 2006-2010 Rob McMullen
+# Licenced under the GPLv2; see http://peppy.flipturn.org for more info
+"""Piece table for editing huge files without loading them into memory
+
+The original file is never modified or read in its entirety.  It is
+accessed through a random access file-like object (an mmap of a local file
+or a L{BlockCacheReader} for other files) and all edits are stored as an
+overlay of pieces.  Each piece either refers to a range of bytes in the
+original file or holds the string of bytes that were inserted by an edit.
+
+Lookups use a binary search on the starting offsets of the pieces, so the
+time to read from any offset doesn't depend on the size of the file.  When
+the length of the file hasn't changed, only the pages that contain edited
+bytes need to be written back to the original file.
+"""
+
+from bisect import bisect_right
+
+
+class PieceTable(object):
+    """Editable view of a random access file
+
+    A piece is a (data, start, length) tuple.  If data is None, the piece
+    refers to the bytes start:start+length in the original file.  Otherwise,
+    data is a string of inserted bytes and start is the offset into that
+    string.
+    """
+    #: Size of the aligned pages written by L{writeChanges}
+    page_size = 65536
+
+    def __init__(self, fh=None, size=None):
+        """Create a piece table over the original file
+
+        @param fh: file-like object that supports seek and read, or None for
+        an empty file
+
+        @param size: size of the original file; if None, the size is found
+        by seeking to the end of the file handle
+        """
+        self.fh = fh
+        if size is None:
+            if fh is None:
+                size = 0
+            else:
+                fh.seek(0, 2)
+                size = fh.tell()
+        self.original_size = size
+        if size > 0:
+            self.pieces = [(None, 0, size)]
+        else:
+            self.pieces = []
+        self.calcOffsets()
+
+    def calcOffsets(self):
+        """Recalculate the starting offset of each piece and the total length
+        """
+        self.offsets = []
+        pos = 0
+        for data, start, length in self.pieces:
+            self.offsets.append(pos)
+            pos += length
+        self.length = pos
+
+    def __len__(self):
+        return self.length
+
+    def isModified(self):
+        """Return True if any piece contains bytes that aren't in the original
+        file at the same offset.
+        """
+        if self.length != self.original_size:
+            return True
+        for pos, (data, start, length) in zip(self.offsets, self.pieces):
+            if data is not None or start != pos:
+                return True
+        return False
+
+    def findPiece(self, pos):
+        """Return the index of the piece containing the offset"""
+        return bisect_right(self.offsets, pos) - 1
+
+    def readOriginal(self, start, length):
+        self.fh.seek(start)
+        return self.fh.read(length)
+
+    def read(self, start=0, end=-1):
+        """Return the bytes between start and end-1, inclusive
+
+        Just like python slicing, the range is clipped to the length of the
+        file.
+
+        @param start: first byte offset
+
+        @param end: ending offset, or -1 for the end of the file
+        """
+        if end < 0 or end > self.length:
+            end = self.length
+        if start >= end:
+            return ""
+        index = self.findPiece(start)
+        offset = start - self.offsets[index]
+        remaining = end - start
+        chunks = []
+        while remaining > 0:
+            data, piece_start, length = self.pieces[index]
+            count = min(length - offset, remaining)
+            if data is None:
+                chunks.append(self.readOriginal(piece_start + offset, count))
+            else:
+                chunks.append(data[piece_start + offset:piece_start + offset + count])
+            remaining -= count
+            offset = 0
+            index += 1
+        return "".join(chunks)
+
+    def splitAt(self, pos):
+        """Make sure a piece boundary exists at the offset
+
+        @returns: index of the piece that starts at the offset, which is
+        the number of pieces if the offset is the end of the file
+        """
+        if pos >= self.length:
+            return len(self.pieces)
+        index = self.findPiece(pos)
+        offset = pos - self.offsets[index]
+        if offset > 0:
+            data, start, length = self.pieces[index]
+            self.pieces[index:index + 1] = [(data, start, offset), (data, start + offset, length - offset)]
+            self.offsets[index + 1:index + 1] = [pos]
+            index += 1
+        return index
+
+    def replace(self, start, end, bytes):
+        """Replace the bytes in the range with the new string of bytes
+
+        The new string doesn't have to be the same length as the range, so
+        this can also be used to insert and delete bytes.
+
+        @returns: the bytes that were replaced
+        """
+        if end < 0 or end > self.length:
+            end = self.length
+        if start > end:
+            start = end
+        old = self.read(start, end)
+        first = self.splitAt(start)
+        last = self.splitAt(end)
+        if bytes:
+            new = [(bytes, 0, len(bytes))]
+        else:
+            new = []
+
+        # Coalesce with the adjacent pieces so that a sequence of small edits
+        # doesn't grow the table by one piece per edit
+        if first > 0:
+            first -= 1
+            new[0:0] = [self.pieces[first]]
+        if last < len(self.pieces):
+            new.append(self.pieces[last])
+            last += 1
+        self.pieces[first:last] = self.merge(new)
+        self.calcOffsets()
+        return old
+
+    def merge(self, pieces):
+        """Combine adjacent pieces where possible"""
+        merged = []
+        for piece in pieces:
+            if merged:
+                data, start, length = merged[-1]
+                if data is None and piece[0] is None and start + length == piece[1]:
+                    merged[-1] = (None, start, length + piece[2])
+                    continue
+                elif data is not None and piece[0] is not None and length + piece[2] <= self.page_size:
+                    combined = data[start:start + length] + piece[0][piece[1]:piece[1] + piece[2]]
+                    merged[-1] = (combined, 0, len(combined))
+                    continue
+            merged.append(piece)
+        return merged
+
+    def getModifiedRanges(self):
+        """Return the list of (start, end) ranges that differ from the bytes
+        at the same offsets in the original file.
+        """
+        ranges = []
+        for pos, (data, start, length) in zip(self.offsets, self.pieces):
+            if data is not None or start != pos:
+                if ranges and ranges[-1][1] == pos:
+                    ranges[-1] = (ranges[-1][0], pos + length)
+                else:
+                    ranges.append((pos, pos + length))
+        return ranges
+
+    def getModifiedPages(self):
+        """Return the list of (start, end) ranges of the aligned pages that
+        contain modified bytes, with adjacent pages merged together.
+        """
+        pages = []
+        size = self.page_size
+        for start, end in self.getModifiedRanges():
+            start = (start // size) * size
+            end = min(((end + size - 1) // size) * size, self.length)
+            if pages and pages[-1][1] >= start:
+                pages[-1] = (pages[-1][0], max(end, pages[-1][1]))
+            else:
+                pages.append((start, end))
+        return pages
+
+    def getMoveDirection(self):
+        """Return the direction that bytes of the original file have moved
+
+        @returns: 1 if bytes have only moved to higher offsets, -1 if only to
+        lower offsets, 0 if no bytes have moved, or None if bytes have moved
+        in both directions
+        """
+        direction = 0
+        for pos, (data, start, length) in zip(self.offsets, self.pieces):
+            if data is None and start != pos:
+                if start < pos:
+                    move = 1
+                else:
+                    move = -1
+                if direction == 0:
+                    direction = move
+                elif direction != move:
+                    return None
+        return direction
+
+    def canWriteChanges(self):
+        """Return True if L{writeChanges} can be used to update the original
+        file in place.
+
+        The length must be unchanged, and bytes of the original file must not
+        have moved in both directions because there would be no order to
+        write the pages that doesn't overwrite bytes before they are read.
+        """
+        return self.length == self.original_size and self.getMoveDirection() is not None
+
+    def writeChanges(self, fh, chunk_size=1048576):
+        """Write only the modified pages into the original file
+
+        The file handle must be opened for update on the original file, and
+        L{canWriteChanges} must be True.  The pages are copied a chunk at a
+        time, and because the original file is also the source of the bytes
+        that have moved, the chunks are written back to front when bytes
+        have moved to higher offsets and front to back otherwise.  This way
+        no chunk overwrites bytes that a later chunk still has to read.
+
+        @returns: number of bytes written
+        """
+        if not self.canWriteChanges():
+            raise ValueError("Length has changed or data has moved in both directions; the entire file must be written")
+        chunks = []
+        for start, end in self.getModifiedPages():
+            for pos in xrange(start, end, chunk_size):
+                chunks.append((pos, min(pos + chunk_size, end)))
+        if self.getMoveDirection() > 0:
+            chunks.reverse()
+        count = 0
+        for start, end in chunks:
+            data = self.read(start, end)
+            fh.seek(start)
+            fh.write(data)
+            count += end - start
+        return count
+
+    def write(self, fh, chunk_size=1048576):
+        """Write the entire file to the file handle, a chunk at a time
+
+        @returns: number of bytes written
+        """
+        pos = 0
+        while pos < self.length:
+            end = min(pos + chunk_size, self.length)
+            fh.write(self.read(pos, end))
+            pos = end
+        return pos
@@ -21,7 +21,7 @@ Converted to threads using wxWidgets licensed code from Editra:
 http://svn.wxwidgets.org/viewvc/wx/wxPython/3rdParty/Editra/src/eclib/outbuff.py?view=markup
 """
 
-import os, sys, types, errno, time, threading, signal, subprocess, weakref
+import os, sys, types, errno, time, threading, signal, subprocess, weakref, codecs
 from Queue import Queue, Empty
 # Platform specific modules needed for killing processes
 if subprocess.mswindows:
@@ -178,46 +178,74 @@ def mslex(cmdline):
    
    
 class ReadThread(threading.Thread):
-    def __init__(self, name, fh, job, callback):
+    """Read the output of one of the streams of a process in large chunks
+    
+    Whatever data is available in the pipe is read at once, up to
+    L{chunk_size} bytes, and decoded with an incremental decoder so that
+    multibyte characters split across chunk boundaries are decoded correctly.
+    The decoded text is placed on the queue shared with the L{JobThread} as a
+    tuple of (stream name, text); the end of the stream is signaled with
+    a text of None.
+    """
+    #: Maximum number of bytes read from the pipe at once
+    chunk_size = 65536
+    
+    def __init__(self, name, fh, queue):
         threading.Thread.__init__(self)
         
         self._name = name
         self._fh = fh
-        self._job = job
-        self._callback = callback
-        self._queue = Queue()
+        self._queue = queue
+        encoding = sys.getfilesystemencoding() or "utf-8"
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self.setDaemon(True)
     
-    def _do_callback(self, result):
-        # Ignore encoding errors and return an empty line instead
-        try:
-            result = result.decode(sys.getfilesystemencoding())
-        except UnicodeDecodeError:
-            result = os.linesep
-
-        #print("sending %s to %s" % (result, callback))
-        wx.CallAfter(self._callback, self._job, result)
+    def _read(self):
+        while True:
+            try:
+                return os.read(self._fh.fileno(), self.chunk_size)
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    return ""
     
     #---- Public Member Functions ----#
     def run(self):
-        for line in iter(self._fh.readline, ''):
-            self._queue.put(line)
+        while True:
+            data = self._read()
+            if not data:
+                break
+            text = self._decoder.decode(data)
+            if text:
+                self._queue.put((self._name, text))
+        text = self._decoder.decode("", True)
+        if text:
+            self._queue.put((self._name, text))
         self._fh.close()
-    
-    def read_queue(self):
-        """Called from parent thread to get any data queued up.
-        
-        """
-        try:
-            while True:
-                line = self._queue.get_nowait()
-                #dprint("%s-->%s<--" % (self._name, line.rstrip()))
-                self._do_callback(line)
-        except Empty:
-            #dprint("%s empty" % self._name)
-            pass
+        self._queue.put((self._name, None))
 
 
 class JobThread(threading.Thread):
+    """Run a process and pass its output to the L{JobOutputMixin}
+    
+    The output of stdout and stderr is collected from the L{ReadThread}s and
+    delivered to the GUI thread in batches: text received within
+    L{batch_interval} seconds of the first unsent text is combined and
+    passed to the callbacks using a single wx.CallAfter, so a process that
+    produces a large amount of output doesn't flood the event queue.  The
+    job ends when both streams have been closed, or when the process has
+    exited and no more output arrives within L{poll_interval} seconds.  The
+    latter handles child processes that inherit the pipes and keep them open
+    after the process itself has finished.
+    """
+    #: Maximum time in seconds that output is held before being delivered
+    batch_interval = 0.1
+    
+    #: Time in seconds to wait for output before checking if the process exited
+    poll_interval = 0.2
+    
+    #: Number of characters that causes a batch to be delivered immediately
+    max_batch_size = 1000000
+    
     def __init__(self, job, cmd, stdin=None, cwd=None, env=None):
         """Initialize the ProcessThread object
         Example:
@@ -240,6 +268,7 @@ class JobThread(threading.Thread):
         self._proc = None           # Process handle
         self._cwd = cwd             # Path at which to run from
         self._sig_abort = signal.SIGTERM    # default signal to kill process
+        self._queue = Queue()       # output of the ReadThreads
 
         # Make sure the environment is sane it must be all strings
         if env is not None:
@@ -296,6 +325,79 @@ class JobThread(threading.Thread):
         """Abort the running process and return control to the main thread"""
         self._sig_abort = sig
         self._abort = True
+        # Wake up the thread if it's waiting for output
+        self._queue.put((None, None))
+    
+    def _deliver(self, batch):
+        """Pass the batch of output to the callbacks in the GUI thread
+        
+        @param batch: list of (stream name, text) tuples in the order the
+        text was received
+        """
+        jobout = self._job.jobout
+        for name, text in batch:
+            if name == "stdout":
+                jobout.stdoutCallback(self._job, text)
+            else:
+                jobout.stderrCallback(self._job, text)
+    
+    def _flush(self, batch):
+        """Send the batch of output to the GUI thread with a single call
+        
+        Consecutive text from the same stream is joined so the callbacks are
+        called as few times as possible.
+        """
+        combined = []
+        for name, text in batch:
+            if combined and combined[-1][0] == name:
+                combined[-1][1].append(text)
+            else:
+                combined.append((name, [text]))
+        wx.CallAfter(self._deliver, [(name, u"".join(texts)) for name, texts in combined])
+    
+    def _process_output(self):
+        """Collect output from the ReadThreads until the process is finished
+        
+        Waits on the queue at most L{poll_interval} at a time, and once output
+        arrives waits at most L{batch_interval} for more output before
+        delivering the batch.  Whenever the wait times out the process is
+        polled, and once it has exited the output is complete as soon as the
+        queue has been drained.
+        """
+        open_streams = 2
+        batch = []
+        batch_size = 0
+        deadline = None
+        exited = False
+        while open_streams > 0:
+            if deadline is None:
+                timeout = self.poll_interval
+            else:
+                timeout = max(0.0, min(self.poll_interval, deadline - time.time()))
+            try:
+                name, text = self._queue.get(True, timeout)
+            except Empty:
+                # Without a pending batch the wait was a full poll interval,
+                # so nothing is left of the output of an exited process
+                if exited and not batch:
+                    break
+                exited = self._proc.poll() is not None
+            else:
+                if name is None:
+                    if self._abort:
+                        self._kill_process()
+                elif text is None:
+                    open_streams -= 1
+                else:
+                    batch.append((name, text))
+                    batch_size += len(text)
+                    if deadline is None:
+                        deadline = time.time() + self.batch_interval
+            if batch and (batch_size >= self.max_batch_size or open_streams == 0 or time.time() >= deadline):
+                self._flush(batch)
+                batch = []
+                batch_size = 0
+                deadline = None
 
     def run(self):
         """Run the process until finished or aborted. Don't call this
@@ -351,36 +453,26 @@ class JobThread(threading.Thread):
             wx.CallAfter(ProcessManager().jobStartedCallback, self._job)
             wx.CallAfter(self._job.jobout.startupCallback, self._job)
 
-            # Read from stdout while there is output from process
-            out_q = ReadThread("stdout", self._proc.stdout, self._job, self._job.jobout.stdoutCallback)
+            # Read from stdout and stderr until the process closes them
+            out_q = ReadThread("stdout", self._proc.stdout, self._queue)
             out_q.start()
-            err_q = ReadThread("stderr", self._proc.stderr, self._job, self._job.jobout.stderrCallback)
+            err_q = ReadThread("stderr", self._proc.stderr, self._queue)
             err_q.start()
-            try:
-                while self._proc.poll() is None:
-                    out_q.read_queue()
-                    err_q.read_queue()
-                    if self._abort:
-                        self._kill_process()
-                    time.sleep(.2)
-                    #dprint("Poll: %s" % str(self._proc.poll()))
-            except wx.PyDeadObjectError:
-                # Our parent window is dead so kill process and return
+            if self._abort:
                 self._kill_process()
-                return
-            #dprint("Waiting for process to finish...")
-            # Notify of error in running the process
+            self._process_output()
+            
+            # Either the process has exited or both streams have been closed,
+            # in which case the process is about to exit.
             try:
                 self._job.exit_code = self._proc.wait()
             except OSError:
                 self._job.exit_code = -1
-            #dprint("Reading any final output...")
-            err_q.read_queue()
-            #dprint("Waiting for stderr thread join...")
-            err_q.join()
-            #dprint("Waiting for stdout thread join...")
-            out_q.read_queue()
-            out_q.join()
+            
+            # The ReadThreads may still be blocked if a child process holds
+            # the pipes open, so don't wait for them indefinitely
+            out_q.join(self.poll_interval)
+            err_q.join(self.poll_interval)
 
             # Notify that process has exited
             # Pack the exit code as the events value
@@ -0,0 +1,374 @@
+# peppy Copyright (c) 2006-2010 Rob McMullen
+# Licenced under the GPLv2; see http://peppy.flipturn.org for more info
+"""Block decoding of fixed size binary records
+
+A L{RecordDecoder} unpacks many records at once using the same format
+strings as the struct module.  If numpy is available, the struct format is
+converted into a numpy structured dtype with the same field offsets, so a
+whole block of records is decoded by a single call to numpy.frombuffer.
+Without numpy, or for struct formats that don't have a numpy equivalent,
+the records are decoded one at a time with a precompiled struct.Struct.
+
+The L{RecordCache} keeps the formatted strings of the most recently used
+blocks of records so that repainting a view doesn't need to unpack or format
+anything.  Column statistics are calculated by L{RecordStatistics}.
+"""
+
+import struct
+
+from peppy.lib.dictutils import LRUDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+HEX_DIGITS = ["%02x" % i for i in range(256)]
+CHARS = [chr(i) for i in range(256)]
+
+# numpy kind of each struct format character; the size is taken from
+# struct.calcsize so native sizes are handled correctly
+_kinds = {
+    'c': 'u', 'b': 'i', 'B': 'u', '?': 'b',
+    'h': 'i', 'H': 'u', 'i': 'i', 'I': 'u', 'l': 'i', 'L': 'u',
+    'q': 'i', 'Q': 'u', 'f': 'f', 'd': 'f',
+    }
+
+_byteorders = {'@': '=', '=': '=', '<': '<', '>': '>', '!': '>'}
+
+
+def parse_struct_format(format):
+    """Split a struct format string into its byte order and a list of
+    (count, code) items.
+    """
+    byteorder = '@'
+    format = format.strip()
+    if format and format[0] in _byteorders:
+        byteorder = format[0]
+        format = format[1:]
+    items = []
+    count = None
+    for c in format:
+        if c.isdigit():
+            if count is None:
+                count = 0
+            count = count * 10 + int(c)
+        elif c.isspace():
+            continue
+        else:
+            if count is None:
+                count = 1
+            items.append((count, c))
+            count = None
+    return byteorder, items
+
+
+def get_dtype(format):
+    """Return the numpy structured dtype that has the same layout as the
+    struct format, or None if numpy isn't available or the format uses a
+    type that numpy can't represent.
+
+    Each value returned by struct.unpack becomes a field named f0, f1, etc.
+    """
+    if numpy is None:
+        return None
+    byteorder, items = parse_struct_format(format)
+    names = []
+    formats = []
+    offsets = []
+    prefix = byteorder
+    for count, code in items:
+        if code == 'x':
+            prefix += "%dx" % count
+            continue
+        if code not in _kinds:
+            return None
+        size = struct.calcsize(byteorder + code)
+        for i in range(count):
+            # struct only inserts padding before an item, so the offset of
+            # the item is the size of the format up to and including it
+            # minus the size of the item itself
+            prefix += code
+            offsets.append(struct.calcsize(prefix) - size)
+            names.append("f%d" % len(names))
+            if code == '?':
+                formats.append('b1')
+            else:
+                formats.append(_byteorders[byteorder] + _kinds[code] + str(size))
+    return numpy.dtype({'names': names, 'formats': formats,
+                        'offsets': offsets,
+                        'itemsize': struct.calcsize(format)})
+
+
+class FieldStats(object):
+    """Statistics of a single field of the records
+
+    NaN and infinite values of floating point fields are not included in the
+    statistics; the number of them is reported separately.
+    """
+    def __init__(self, minimum, maximum, mean, histogram, bin_edges, nonfinite=0):
+        self.min = minimum
+        self.max = maximum
+        self.mean = mean
+        self.histogram = histogram
+        self.bin_edges = bin_edges
+        self.nonfinite = nonfinite
+
+    def __str__(self):
+        return "min=%s max=%s mean=%s" % (self.min, self.max, self.mean)
+
+
+class RecordDecoder(object):
+    """Decoder for records described by a struct format string"""
+    def __init__(self, format):
+        self.format = format
+        self.struct = struct.Struct(format)
+        self.size = self.struct.size
+        self.dtype = get_dtype(format)
+        byteorder, items = parse_struct_format(format)
+        self.codes = []
+        for count, code in items:
+            if code in 'sp':
+                self.codes.append(code)
+            elif code != 'x':
+                self.codes.extend([code] * count)
+
+    def decodeArray(self, data):
+        """Return the complete records in the data as a numpy structured
+        array without copying the data.
+        """
+        count = len(data) // self.size
+        return numpy.frombuffer(data, dtype=self.dtype, count=count)
+
+    def decode(self, data):
+        """Decode the complete records in the data
+
+        @returns: list of columns, where each column is the list of values
+        of one field, exactly as they would be returned by struct.unpack
+        """
+        count = len(data) // self.size
+        if self.dtype is not None:
+            array = self.decodeArray(data)
+            columns = []
+            chars = None
+            for name, code in zip(self.dtype.names, self.codes):
+                if code == 'c':
+                    if chars is None:
+                        chars = numpy.array(CHARS, dtype=object)
+                    columns.append(chars[array[name]].tolist())
+                else:
+                    columns.append(array[name].tolist())
+            return columns
+        unpack_from = self.struct.unpack_from
+        size = self.size
+        rows = [unpack_from(data, i * size) for i in xrange(count)]
+        if rows:
+            return [list(column) for column in zip(*rows)]
+        return [[] for code in self.codes]
+
+    def formatHex(self, data):
+        """Return the list of two digit hex strings of each byte"""
+        if numpy is not None:
+            digits = numpy.array(HEX_DIGITS, dtype=object)
+            return digits[numpy.frombuffer(data, dtype=numpy.uint8)].tolist()
+        return [HEX_DIGITS[ord(c)] for c in data]
+
+    def formatValues(self, data):
+        """Return the list of columns of the formatted values"""
+        return [[str(value) for value in column] for column in self.decode(data)]
+
+    def getStats(self, reader, length, bins=10, chunk_records=65536):
+        """Calculate the statistics of all fields
+
+        See L{RecordStatistics}, which can also be used to calculate the
+        statistics in a background thread.
+
+        @returns: list of L{FieldStats}, one for each field
+        """
+        return RecordStatistics(self, reader, length, bins, chunk_records).calculate()
+
+
+class RecordStatistics(object):
+    """Calculation of the statistics of all fields of a set of records
+
+    The data is read in chunks so the entire file is never in memory.  The
+    minimum, maximum and mean of every field are found in one pass over the
+    data, and the histograms in a second pass once the range of each field
+    is known.  Requires numpy.
+
+    The calculation may be performed in a background thread: progress is
+    reported to the updater after each chunk and L{stopStatistics} cancels
+    the calculation at the next chunk boundary.
+    """
+    def __init__(self, decoder, reader, length, bins=10, chunk_records=65536):
+        """Prepare the calculation
+
+        @param decoder: L{RecordDecoder} instance
+
+        @param reader: callable taking (start, end) byte offsets and
+        returning the bytes in that range
+
+        @param length: number of bytes of data; an incomplete record at the
+        end is ignored
+        """
+        if decoder.dtype is None:
+            raise ValueError("Statistics need numpy and a format that numpy supports")
+        self.decoder = decoder
+        self.reader = reader
+        self.count = length // decoder.size
+        self.bins = bins
+        self.chunk_size = chunk_records * decoder.size
+        self.stop_request = False
+
+    def stopStatistics(self):
+        """Request that the calculation stop at the next chunk boundary.
+
+        This may be called from a different thread than the one performing the
+        calculation.
+        """
+        self.stop_request = True
+
+    def iterChunks(self, updater, text):
+        """Iterate over the records, decoding a chunk at a time
+
+        Stops early if a stop has been requested.
+        """
+        end = self.count * self.decoder.size
+        for start in xrange(0, end, self.chunk_size):
+            if self.stop_request:
+                return
+            yield self.decoder.decodeArray(self.reader(start, min(start + self.chunk_size, end)))
+            if updater:
+                updater.updateStatus(min(start + self.chunk_size, end), end, text)
+
+    def getFiniteValues(self, values):
+        """Return the values of the field that can be included in the
+        statistics, i.e. without NaN or infinite values
+        """
+        if values.dtype.kind == 'f':
+            return values[numpy.isfinite(values)]
+        return values
+
+    def calculate(self, updater=None):
+        """Calculate the statistics
+
+        @param updater: optional L{ProgressUpdater} to report the progress of
+        each of the two passes over the data
+
+        @returns: list of L{FieldStats}, one for each field, or None if the
+        calculation was stopped
+        """
+        names = self.decoder.dtype.names
+        count = self.count
+        if updater:
+            updater.setNumberOfWorkItems(2)
+
+        minimum = [None] * len(names)
+        maximum = [None] * len(names)
+        total = [0.0] * len(names)
+        valid = [0] * len(names)
+        for array in self.iterChunks(updater, "Finding range of values"):
+            for i, name in enumerate(names):
+                values = self.getFiniteValues(array[name])
+                if len(values) == 0:
+                    continue
+                low = values.min()
+                high = values.max()
+                if minimum[i] is None or low < minimum[i]:
+                    minimum[i] = low
+                if maximum[i] is None or high > maximum[i]:
+                    maximum[i] = high
+                total[i] += values.sum(dtype=numpy.float64)
+                valid[i] += len(values)
+        if updater:
+            updater.finishedWorkItem()
+
+        histograms = [numpy.zeros(self.bins, dtype=numpy.int64) for name in names]
+        edges = [None] * len(names)
+        if count > 0:
+            for array in self.iterChunks(updater, "Calculating histograms"):
+                for i, name in enumerate(names):
+                    if minimum[i] is None:
+                        continue
+                    values = self.getFiniteValues(array[name])
+                    h, edges[i] = numpy.histogram(values, bins=self.bins, range=(float(minimum[i]), float(maximum[i])))
+                    histograms[i] += h
+        if self.stop_request:
+            return None
+
+        stats = []
+        for i, name in enumerate(names):
+            nonfinite = count - valid[i]
+            if valid[i] > 0:
+                mean = total[i] / valid[i]
+                stats.append(FieldStats(minimum[i].item(), maximum[i].item(), mean, histograms[i].tolist(), edges[i].tolist(), nonfinite))
+            else:
+                stats.append(FieldStats(None, None, None, [], [], nonfinite))
+        return stats
+
+
+class RecordBlock(object):
+    """Formatted strings of a block of consecutive records"""
+    def __init__(self, decoder, data):
+        self.data = data
+        self.hex = decoder.formatHex(data)
+        self.values = decoder.formatValues(data)
+
+
+class RecordCache(object):
+    """LRU cache of formatted blocks of records
+
+    The data is read through the reader callable in blocks of a fixed number
+    of records.  The last block is padded with zeros if the data doesn't end
+    on a record boundary.
+    """
+    def __init__(self, decoder, reader, block_records=256, max_blocks=16):
+        """Create the cache
+
+        @param decoder: L{RecordDecoder} instance
+
+        @param reader: callable taking (start, end) byte offsets and
+        returning the bytes in that range
+        """
+        self.decoder = decoder
+        self.reader = reader
+        self.block_records = block_records
+        self.blocks = LRUDict(max_blocks)
+
+    def clear(self):
+        self.blocks.clear()
+
+    def invalidateRecord(self, record):
+        self.blocks.pop(record // self.block_records, None)
+
+    def getBlock(self, index):
+        block = self.blocks.get(index)
+        if block is None:
+            size = self.decoder.size
+            start = index * self.block_records * size
+            data = self.reader(start, start + self.block_records * size)
+            if len(data) % size:
+                data += '\0' * (size - (len(data) % size))
+            block = RecordBlock(self.decoder, data)
+            self.blocks[index] = block
+        return block
+
+    def getHex(self, record, byte):
+        """Return the hex string of the byte within the record"""
+        index, offset = divmod(record, self.block_records)
+        block = self.getBlock(index)
+        return block.hex[offset * self.decoder.size + byte]
+
+    def getValue(self, record, field):
+        """Return the formatted value of the field of the record"""
+        index, offset = divmod(record, self.block_records)
+        block = self.getBlock(index)
+        return block.values[field][offset]
+
+    def getRecordData(self, record):
+        """Return the raw bytes of the record"""
+        index, offset = divmod(record, self.block_records)
+        block = self.getBlock(index)
+        size = self.decoder.size
+        return block.data[offset * size:(offset + 1) * size]
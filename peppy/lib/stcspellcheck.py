@@ -45,6 +45,9 @@ Currently provides:
 @version: 1.3
 
 Changelog::
+    1.4:
+        - Added per-language cache of word verdicts shared by all instances
+        - Added background thread to spell check the entire document
     1.3:
         - Fixed bugs that incorrectly marked English contractions as bad
         - Changed idle time handler to reduce processor usage
@@ -58,10 +61,15 @@ Changelog::
 """
 
 import os
+import re
 import locale
+import threading
+import time
 import wx
 import wx.stc
 
+from peppy.lib.dictutils import LRUDict
+
 # Assume MacPorts install of Enchant
 if wx.Platform == '__WXMAC__':
     if 'PYENCHANT_LIBRARY_PATH' not in os.environ:
@@ -78,6 +86,165 @@ except:
     import traceback
     traceback.print_exc()
 
+
+class WordVerdictCache(object):
+    """Bounded LRU cache of spelling verdicts for a single language.
+
+    Looking up a word in the enchant dictionary is much slower than a
+    dictionary lookup, and natural language text repeats the same words many
+    times, so the result of each lookup is remembered.  The cache is shared
+    by all L{STCSpellCheck} instances using the same language, and it may be
+    used from both the GUI thread and the background spell check thread.
+
+    Enchant dictionaries aren't thread safe, so all access to the dictionary
+    (checking, suggestions, and adding words) goes through the cache and is
+    serialized by its lock.
+    """
+    #: Maximum number of word verdicts kept in each cache
+    max_words = 50000
+
+    # Class attribute to hold the caches of all languages
+    _caches = {}
+
+    def __init__(self, spell, max_words=None):
+        self.spell = spell
+        if max_words is not None:
+            self.max_words = max_words
+        self.verdicts = LRUDict(self.max_words)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def getCache(cls, lang, spell):
+        """Return the cache for the language, creating it if necessary.
+
+        @param lang: language string as used by enchant
+        @param spell: enchant dictionary of the language
+        """
+        cache = cls._caches.get(lang)
+        if cache is None:
+            cache = cls(spell)
+            cls._caches[lang] = cache
+        return cache
+
+    @classmethod
+    def clearCaches(cls):
+        """Remove the caches of all languages.
+
+        Call this if the personal word list changes so that words are looked
+        up in the enchant dictionary again.
+        """
+        cls._caches = {}
+
+    def check(self, word):
+        """Return True if the word is spelled correctly"""
+        self.lock.acquire()
+        try:
+            ok = self.verdicts.get(word)
+            if ok is None:
+                ok = bool(self.spell.check(word))
+                self.misses += 1
+                self.verdicts[word] = ok
+            else:
+                self.hits += 1
+            return ok
+        finally:
+            self.lock.release()
+
+    def suggest(self, word):
+        """Return the list of suggested spellings of the word"""
+        self.lock.acquire()
+        try:
+            return self.spell.suggest(word)
+        finally:
+            self.lock.release()
+
+    def addWord(self, word):
+        """Add the word to the personal word list.
+
+        The cached verdict of the word is replaced so that the word is no
+        longer reported as misspelled.
+        """
+        self.lock.acquire()
+        try:
+            self.spell.add_to_pwl(word)
+            self.verdicts[word] = True
+        finally:
+            self.lock.release()
+
+    def checkWords(self, words):
+        """Check a group of words at once.
+
+        @param words: iterable of words; duplicates are only checked once
+
+        @return: set of the misspelled words
+        """
+        bad = set()
+        for word in set(words):
+            if not self.check(word):
+                bad.add(word)
+        return bad
+
+
+class SpellCheckThread(threading.Thread):
+    """Background thread that spell checks a snapshot of the document.
+
+    The text is processed in chunks of whole lines.  The misspelled words of
+    each chunk are converted into (byte_start, length) tuples in terms of
+    the raw utf-8 positions used by the stc and passed back to the GUI
+    thread to be styled, so the GUI thread never performs any dictionary
+    lookups during a full document check.
+    """
+    #: Approximate number of characters in each chunk
+    chunk_size = 65536
+
+    def __init__(self, spell, text, start=0):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.spell = spell
+        self.cache = spell.getWordCache()
+        self.text = text
+        self.start_pos = start
+        self.word_size = spell._spelling_word_size
+        self.stop_request = False
+
+    def stopCheck(self):
+        """Request that the thread stop at the next chunk boundary"""
+        self.stop_request = True
+
+    def iterChunks(self):
+        """Iterate over the text in chunks that end at a line boundary
+
+        @return: iterator of (unicode_index, chunk) tuples
+        """
+        text = self.text
+        length = len(text)
+        index = 0
+        while index < length:
+            end = text.find(u'\n', index + self.chunk_size)
+            if end < 0:
+                end = length
+            else:
+                end += 1
+            yield index, text[index:end]
+            index = end
+
+    def run(self):
+        pos = self.start_pos
+        for index, chunk in self.iterChunks():
+            if self.stop_request:
+                return
+            ranges, count = self.spell.findMisspelledRanges(chunk, pos, self.cache, self.word_size)
+            if ranges:
+                wx.CallAfter(self.spell.applyRanges, self, ranges)
+            pos += count
+
+            # Give the GUI thread a chance to run
+            time.sleep(0)
+        wx.CallAfter(self.spell.finishBackgroundCheck, self)
+
+
 class STCSpellCheck(object):
     """Spell checking for use with wx.StyledTextControl.
     
@@ -103,6 +270,10 @@ class STCSpellCheck(object):
     _spelling_lang = None
     _spelling_dict = None
     
+    # Regular expression equivalent to the default L{findNextWord}: a word
+    # starts with a letter and continues with letters and apostrophes
+    _spelling_word_regex = re.compile(u"[^\\W\\d_](?:[^\\W\\d_]|')*", re.UNICODE)
+    
     def __init__(self, stc, *args, **kwargs):
         """Mixin must be initialized using this constructor.
         
@@ -125,6 +296,10 @@ class STCSpellCheck(object):
         @kwarg idle_count: number of idle events that have to occur before an
         idle event is actually processed.  This reduces processor usage by
         only processing one out of every idle_count events.
+        
+        @kwarg background: if True (the default), L{startIdleProcessing} checks
+        the entire document in a background thread rather than a page at a
+        time during idle events.
         """
         self.stc = stc
         self.setIndicator(kwargs.get('indicator', 2),
@@ -150,6 +325,10 @@ class STCSpellCheck(object):
         self._no_update = False
         self._last_block = -1
         
+        self._spelling_background = kwargs.get('background', True)
+        self._spelling_thread = None
+        self._spelling_edits = []
+        
         self.clearDirtyRanges()
 
     def setIndicator(self, indicator=None, color=None, style=None):
@@ -270,6 +449,10 @@ class STCSpellCheck(object):
         language.
         """
         return self._spelling_dict is not None
+    
+    def getWordCache(self):
+        """Return the L{WordVerdictCache} for the current language"""
+        return WordVerdictCache.getCache(self._spelling_lang, self._spelling_dict)
 
     @classmethod
     def isEnchantOk(cls):
@@ -343,43 +526,67 @@ class STCSpellCheck(object):
         self.stc.SetStyling(count, 0)
         
         text = self.stc.GetTextRange(start, end) # note: returns unicode
-        unicode_index = 0
-        max_index = len(text)
+        ranges, raw_count = self.findMisspelledRanges(text, start, self.getWordCache())
+        self.styleRanges(ranges)
+    
+    def findMisspelledRanges(self, text, pos, cache, word_size=None):
+        """Find the misspelled words in a block of text.
+        
+        This doesn't use the stc, so it is safe to call from a background
+        thread.
+        
+        @param text: unicode text to check
+        @param pos: raw byte position of the start of the text in the stc
+        @param cache: L{WordVerdictCache} used to check the words
+        @param word_size: minimum size of words to check, or None to use the
+        current minimum word size
+        
+        @return: tuple containing the list of (pos, count) tuples of the
+        misspelled words in terms of raw byte positions and lengths, and the
+        length of the text in raw bytes
+        """
+        if word_size is None:
+            word_size = self._spelling_word_size
+        words = [(start_index, end_index) for start_index, end_index in self.iterWords(text, 0, len(text)) if end_index - start_index >= word_size]
+        bad = cache.checkWords([text[start_index:end_index] for start_index, end_index in words])
         
+        raw_count = len(text.encode('utf-8'))
+        ascii = raw_count == len(text)
+        ranges = []
         last_index = 0 # last character in text a valid raw byte position
-        last_pos = start # raw byte position corresponding to last_index
-        while unicode_index < max_index:
-            start_index, end_index = self.findNextWord(text, unicode_index, max_index)
-            if end_index >= 0:
-                if end_index - start_index >= self._spelling_word_size:
-                    if self._spelling_debug:
-                        print("checking %s at text[%d:%d]" % (repr(text[start_index:end_index]), start_index, end_index))
-                    if not spell.check(text[start_index:end_index]):
-                        # Because unicode characters are stored as utf-8 in the
-                        # stc and the positions in the stc correspond to the
-                        # raw bytes, not the number of unicode characters, we
-                        # have to find out the offset to the unicode chars in
-                        # terms of raw bytes.
-                        
-                        # find the number of raw bytes from the last calculated
-                        # styling position to the start of the word
-                        last_pos += len(text[last_index:start_index].encode('utf-8'))
-                        
-                        # find the length of the word in raw bytes
-                        raw_count = len(text[start_index:end_index].encode('utf-8'))
-                        
-                        if self._spell_check_region(last_pos):
-                            if self._spelling_debug:
-                                print("styling text[%d:%d] = (%d,%d) to %d" % (start_index, end_index, last_pos, last_pos + raw_count, mask))
-                            self.stc.StartStyling(last_pos, mask)
-                            self.stc.SetStyling(raw_count, mask)
-                        elif self._spelling_debug:
-                            print("not in valid spell check region.  styling position corresponding to text[%d:%d] = (%d,%d)" % (start_index, end_index, last_pos, last_pos + raw_count))
-                        last_pos += raw_count
-                        last_index = end_index
-                unicode_index = end_index
+        last_pos = pos # raw byte position corresponding to last_index
+        for start_index, end_index in words:
+            word = text[start_index:end_index]
+            if word not in bad:
+                continue
+            if ascii:
+                ranges.append((pos + start_index, end_index - start_index))
             else:
-                break
+                # Because unicode characters are stored as utf-8 in the stc
+                # and the positions in the stc correspond to the raw bytes,
+                # not the number of unicode characters, we have to find out
+                # the offset to the unicode chars in terms of raw bytes.
+                last_pos += len(text[last_index:start_index].encode('utf-8'))
+                count = len(word.encode('utf-8'))
+                ranges.append((last_pos, count))
+                last_pos += count
+                last_index = end_index
+            if self._spelling_debug:
+                print("misspelled %s at text[%d:%d] = %s" % (repr(word), start_index, end_index, ranges[-1]))
+        return ranges, raw_count
+    
+    def styleRanges(self, ranges):
+        """Mark the ranges as misspelled using the current indicator.
+        
+        @param ranges: list of (pos, count) tuples in raw byte positions
+        """
+        mask = self._spelling_indicator_mask
+        for pos, count in ranges:
+            if self._spell_check_region(pos):
+                self.stc.StartStyling(pos, mask)
+                self.stc.SetStyling(count, mask)
+            elif self._spelling_debug:
+                print("not in valid spell check region: (%d,%d)" % (pos, pos + count))
 
     def checkAll(self):
         """Perform a spell check on the entire document."""
@@ -443,6 +650,30 @@ class STCSpellCheck(object):
             index += 1
         return (-1, -1)
     
+    def iterWords(self, utext, index, length):
+        """Iterate over the valid words in an array of text.
+        
+        Uses a regular expression if L{findNextWord} hasn't been overridden in
+        a subclass, otherwise L{findNextWord} is called repeatedly.
+        
+        @return: iterator of (start, end) index tuples of each word
+        """
+        if self.findNextWord.im_func is STCSpellCheck.findNextWord.im_func:
+            for match in self._spelling_word_regex.finditer(utext, index, length):
+                start, end = match.span()
+                # Don't let the word end in an apostophe because it may be at
+                # the end of a single quoted string.
+                if utext[end - 1] == "'":
+                    end -= 1
+                yield start, end
+        else:
+            while index < length:
+                start, end = self.findNextWord(utext, index, length)
+                if end < 0:
+                    break
+                yield start, end
+                index = end
+    
     def startIdleProcessing(self):
         """Initialize parameters needed for idle block spell checking.
         
@@ -451,9 +682,87 @@ class STCSpellCheck(object):
         of the document.  It initializes parameters needed by the
         L{processIdleBlock} in order to process the document during idle
         time.
+        
+        If background checking is enabled, the entire document is checked
+        in a background thread instead and L{processIdleBlock} only has to
+        handle the regions modified by the user.
         """
-        self._spelling_last_idle_line = 0
         self._idle_ticks = 0
+        if self._spelling_background and self._spelling_dict:
+            self._spelling_last_idle_line = -1
+            self.startBackgroundCheck()
+        else:
+            self._spelling_last_idle_line = 0
+    
+    def startBackgroundCheck(self):
+        """Spell check the entire document in a background thread.
+        
+        Any check already in progress is cancelled.  Misspelled words are
+        styled in batches as the thread finds them.
+        """
+        self.stopBackgroundCheck()
+        if not self._spelling_dict:
+            return
+        self._spelling_thread = SpellCheckThread(self, self.stc.GetText())
+        self._spelling_thread.start()
+    
+    def stopBackgroundCheck(self):
+        """Cancel the background spell check, if any.
+        
+        Any results not yet styled are discarded.
+        """
+        if self._spelling_thread is not None:
+            self._spelling_thread.stopCheck()
+            self._spelling_thread = None
+        self._spelling_edits = []
+    
+    def isBackgroundCheckRunning(self):
+        return self._spelling_thread is not None
+    
+    def applyRanges(self, thread, ranges):
+        """Style a batch of misspelled ranges found by the background thread.
+        
+        The ranges refer to positions in the snapshot of the document taken
+        when the thread was started, so they are adjusted for any changes made
+        to the document since then.  Ranges that touch a modified region are
+        dropped because the modified region is checked again as a dirty range.
+        """
+        if thread is not self._spelling_thread:
+            return
+        if self._spelling_edits:
+            adjusted = []
+            for pos, count in ranges:
+                pos = self.adjustSnapshotPosition(pos, count)
+                if pos >= 0:
+                    adjusted.append((pos, count))
+            ranges = adjusted
+        self.styleRanges(ranges)
+    
+    def adjustSnapshotPosition(self, pos, count):
+        """Convert the position of a word in the background thread's snapshot
+        to its current position.
+        
+        @return: the current position, or -1 if the word has been modified
+        """
+        end = pos + count
+        for start, delta in self._spelling_edits:
+            if delta > 0:
+                last = start
+            else:
+                last = start - delta
+            if start > end:
+                continue
+            elif last < pos:
+                pos += delta
+                end += delta
+            else:
+                return -1
+        return pos
+    
+    def finishBackgroundCheck(self, thread):
+        if thread is self._spelling_thread:
+            self._spelling_thread = None
+            self._spelling_edits = []
         
     def processIdleBlock(self):
         """Process a block of lines during idle time.
@@ -516,14 +825,21 @@ class STCSpellCheck(object):
         are true: there are no suggestions, the word is shorter than the
         minimum length, or the dictionary can't be found.
         """
-        spell = self._spelling_dict
-        if spell and len(word) >= self._spelling_word_size:
-            words = spell.suggest(word)
+        if self._spelling_dict and len(word) >= self._spelling_word_size:
+            words = self.getWordCache().suggest(word)
             if self._spelling_debug:
                 print("suggestions for %s: %s" % (word, words))
             return words
         return []
     
+    def addWord(self, word):
+        """Add a word to the personal word list of the current language.
+        
+        @param word: word that should no longer be marked as misspelled
+        """
+        if self._spelling_dict:
+            self.getWordCache().addWord(word)
+    
     def checkWord(self, pos=None, atend=False):
         """Check the word at the current or specified position.
         
@@ -584,6 +900,10 @@ class STCSpellCheck(object):
         count = end - start
         if deleted:
             count = -count
+        if self._spelling_thread is not None:
+            # Remember the change so that results from the background thread
+            # can be moved to their new positions
+            self._spelling_edits.append((start, count))
         if start == self.current_dirty_end:
             self.current_dirty_end = end
         elif start >= self.current_dirty_start and start < self.current_dirty_end:
@@ -61,6 +61,10 @@ except:
 
 debug=True
 
+# Combine fixed size fields into single struct unpacks; only turned off to
+# compare against field by field unpacking
+use_compiled_parsers=True
+
 # base indent level when printing stuff
 base_indent="    "
 
@@ -334,6 +338,98 @@ class FormatField(Field):
             raise
 
 
+def getSimpleFormat(field):
+    """Return the byte order and the format of a field that can be combined
+    with other fields into a single struct format, or None if it can't.
+
+    Only fields that use the standard L{FormatField} unpack and produce a
+    single value can be combined.
+    """
+    if not isinstance(field,FormatField) or field._name is None:
+        return None
+    if field.__class__.unpack.im_func is not FormatField.unpack.im_func:
+        return None
+    fmt=field._fmt
+    if fmt[0] in "@=<>!":
+        byteorder=fmt[0]
+        fmt=fmt[1:]
+    else:
+        byteorder="@"
+    if byteorder=="!":
+        byteorder=">"
+    if len(struct.unpack(field._fmt,'\0'*field._size))!=1:
+        return None
+    return byteorder,fmt
+
+class CompiledFormat(Field):
+    """Consecutive fixed size fields combined into one struct.Struct
+
+    Created by L{compileTypedef}, not by the user.  Unpacking reads the data
+    for all of the fields with a single read and a single struct unpack.
+    """
+    def __init__(self,fields,byteorder):
+        Field.__init__(self,fields[0]._name)
+        self._fields=fields
+        self._names=[field._name for field in fields]
+        self._single=len(fields)==1
+        self._struct=struct.Struct(byteorder+"".join([getSimpleFormat(field)[1] for field in fields]))
+        self._size=self._struct.size
+
+    def getNumBytes(self,obj):
+        return self._size
+
+    def unpack(self,fh,obj):
+        data=fh.read(self._size)
+        if len(data)<self._size:
+            # Store the fields that are complete, just like the field by
+            # field unpacking would have done before hitting the end
+            offset=0
+            for field in self._fields:
+                if offset+field._size>len(data):
+                    raise EOFError("End of unserializable data in %s" % field._name)
+                setattr(obj,field._name,struct.unpack(field._fmt,data[offset:offset+field._size])[0])
+                offset+=field._size
+        if self._single:
+            setattr(obj,self._name,self._struct.unpack(data)[0])
+        else:
+            obj.__dict__.update(zip(self._names,self._struct.unpack(data)))
+
+    def pack(self,fh,obj):
+        for field in self._fields:
+            field.pack(fh,obj)
+
+def compileTypedef(typedef):
+    """Combine runs of fixed size fields in the typedef
+
+    Consecutive fields with the same explicit byte order that are accepted
+    by L{getSimpleFormat} are replaced by a L{CompiledFormat}; all other
+    fields are used as is and are unpacked field by field.  Native byte
+    order fields are never combined because struct would insert alignment
+    padding between them.
+
+    @returns: list of fields
+    """
+    compiled=[]
+    run=[]
+    runorder=None
+    for field in typedef:
+        simple=getSimpleFormat(field)
+        if simple is not None and simple[0]!="@":
+            if run and simple[0]!=runorder:
+                compiled.append(CompiledFormat(run,runorder))
+                run=[]
+            run.append(field)
+            runorder=simple[0]
+            continue
+        if run:
+            compiled.append(CompiledFormat(run,runorder))
+            run=[]
+        compiled.append(field)
+    if run:
+        compiled.append(CompiledFormat(run,runorder))
+    return compiled
+
+
 class Wrapper(Field):
     def __init__(self,proxy):
         Field.__init__(self,proxy._name,proxy._default)
@@ -819,15 +915,19 @@ class List(Wrapper):
         data=[]
         num=self.getRepeats(obj)
         assert self.debuglevel == 0 or self.dprint("looping %d times for proxy %s" % (num,proxy._name))
+        simple=getSimpleFormat(proxy)
         if isinstance(proxy,Record):
-            for i in range(num):
-                # call superclass unpack that handles Record subclasses
-                assert self.debuglevel == 0 or self.dprint("attempting to read %s.%s" % (obj.__class__.__name__,proxy._name))
-                copy=proxy.getCopy(obj)
-                setattr(copy,"_",obj)
-                setattr(copy,"_listindex",i)
-                proxy.unpack(fh,copy)
-                data.append(copy)
+            data=proxy.unpackMany(fh,num,obj)
+        elif simple is not None and num>0 and use_compiled_parsers:
+            # A list of primitive values is unpacked all at once.  Repeats of
+            # a single type never need alignment padding, so this is safe
+            # for native byte order too.
+            byteorder,fmt=simple
+            size=proxy._size*num
+            raw=fh.read(size)
+            if len(raw)<size:
+                raise EOFError("End of unserializable data in %s" % proxy._name)
+            data=list(struct.unpack(byteorder+fmt*num,raw))
         else:
             copy=proxy.getCopy(obj)
             setattr(copy,"_",obj)
@@ -995,9 +1095,33 @@ class Record(Field):
         self._currentlyprocessing=None
         return length
     
+    def getCompiledTypedef(self):
+        """Return the typedef with runs of fixed size fields combined by
+        L{compileTypedef}.
+        
+        The compiled typedef is cached, and because it is an attribute of
+        the instance it is shared by all copies made by L{getCopy}.
+        """
+        if not use_compiled_parsers:
+            return self.typedef
+        compiled=self.__dict__.get("_compiled")
+        if compiled is None or compiled[0] is not self.typedef:
+            compiled=(self.typedef,compileTypedef(self.typedef))
+            self._compiled=compiled
+        return compiled[1]
+    
+    def getFixedSize(self):
+        """Return the size in bytes of the record if every field in it has
+        been combined into a single L{CompiledFormat}, or None otherwise.
+        """
+        compiled=self.getCompiledTypedef()
+        if len(compiled)==1 and isinstance(compiled[0],CompiledFormat):
+            return compiled[0]._size
+        return None
+    
     def unpack(self,fh,obj):
         assert self.debuglevel == 0 or self.dprint("fh.tell()=%s before=%s" % (fh.tell(),obj))
-        for field in self.typedef:
+        for field in self.getCompiledTypedef():
             self._currentlyprocessing=field
             assert self.debuglevel == 0 or self.dprint("field=%s" % str(field))
             if isinstance(field,Record):
@@ -1011,6 +1135,56 @@ class Record(Field):
         assert self.debuglevel == 0 or self.dprint("fh.tell()=%s after=%s" % (fh.tell(),obj))
         self._currentlyprocessing=None
 
+    def unpackMany(self,fh,num,obj=None):
+        """Unpack a list of records
+        
+        Each record is a copy of this record, with its parent set to obj.
+        If the record has a fixed size, the data for all the records is read
+        at once and unpacked from the single buffer.
+        
+        @param fh: file-like object
+        @param num: number of records
+        @param obj: parent object of the records
+        
+        @returns: list of records
+        """
+        data=[]
+        size=self.getFixedSize()
+        if size is not None and num>0:
+            compiled=self.getCompiledTypedef()[0]
+            raw=fh.read(size*num)
+            cls=self.__class__
+            if cls.getCopy.im_func is Record.getCopy.im_func and not hasattr(self,"__copy__") and not hasattr(self,"__getstate__"):
+                # There are no subrecords to deep copy, so copying the
+                # attributes is equivalent to getCopy and much faster
+                template=dict(self.__dict__)
+                def getCopy(obj):
+                    dup=cls.__new__(cls)
+                    dup.__dict__.update(template)
+                    return dup
+            else:
+                getCopy=self.getCopy
+            unpack_from=compiled._struct.unpack_from
+            names=compiled._names
+            for i in xrange(len(raw)//size):
+                dup=getCopy(obj)
+                dup._=obj
+                dup._listindex=i
+                dup.__dict__.update(zip(names,unpack_from(raw,i*size)))
+                data.append(dup)
+            if len(data)<num:
+                raise EOFError("End of unserializable data in %s" % self._name)
+            return data
+        for i in range(num):
+            # call superclass unpack that handles Record subclasses
+            assert self.debuglevel == 0 or self.dprint("attempting to read %s.%s" % (obj.__class__.__name__,self._name))
+            copy=self.getCopy(obj)
+            setattr(copy,"_",obj)
+            setattr(copy,"_listindex",i)
+            self.unpack(fh,copy)
+            data.append(copy)
+        return data
+
     def pack(self,fh,obj):
         #fh=StringIO()
         for field in self.typedef:
@@ -1170,3 +1344,63 @@ class RecordList(list):
             item._=self.parent
             item._listindex=len(self)
         list.append(self,item)
+
+
+def benchmark(num=100000, repeat=3):
+    """Compare the compiled parsers against field by field unpacking
+
+    @returns: list of (description, field by field time, compiled time)
+    tuples, where the times are the best of the repeats
+    """
+    import time
+    global use_compiled_parsers
+
+    class Fixed(Record):
+        typedef=(
+            ULInt32('index'),
+            SLInt16('x'),
+            SLInt16('y'),
+            LFloat64('value'),
+            FormatField('tag','<4s'),
+            )
+
+    class Variable(Record):
+        typedef=(
+            ULInt32('index'),
+            LFloat64('value'),
+            UBInt8('length'),
+            MetaField('name',lambda s:s.length),
+            )
+
+    fixed=struct.pack('<Ihhd4s',1,2,3,4.0,'abcd')*num
+    variable=struct.pack('<IdB5s',1,2.0,5,'hello')*num
+    tests=[
+        ("%d fixed size records" % num, fixed, MetaList(Fixed('records'),lambda s:num)),
+        ("%d variable size records" % num, variable, MetaList(Variable('records'),lambda s:num)),
+        ("%d integers" % num, fixed[0:num*4], List(ULInt32('values'),num)),
+        ]
+    save=use_compiled_parsers
+    results=[]
+    try:
+        for description,data,field in tests:
+            times=[]
+            for compiled in [False,True]:
+                use_compiled_parsers=compiled
+                best=None
+                for i in range(repeat):
+                    rec=Record(typedef=(field,))
+                    start=time.time()
+                    rec.unserialize(StringIO(data))
+                    elapsed=time.time()-start
+                    if best is None or elapsed<best:
+                        best=elapsed
+                times.append(best)
+            results.append((description,times[0],times[1]))
+    finally:
+        use_compiled_parsers=save
+    return results
+
+
+if __name__ == "__main__":
+    for description,old,new in benchmark():
+        print "%s: field by field %.3fs, compiled %.3fs (%.1fx)" % (description,old,new,old/new)
@@ -87,7 +87,7 @@ Param are possible as well.
 
 """
 
-import os, sys, struct, time, re, types, copy
+import os, sys, struct, time, re, types, copy, weakref
 from cStringIO import StringIO
 from ConfigParser import ConfigParser
 import locale
@@ -1434,15 +1434,69 @@ class FontParam(Param):
 parentclasses={}
 skipclasses=['debugmixin','ClassPrefs','object']
 
+class SubclassRegistryMetaClass(type):
+    """Metaclass that maintains an index of subclasses.
+    
+    Every class created with this metaclass (or a metaclass descended from
+    it) is added to the index of each of its ancestors that also uses the
+    metaclass, so the list of all subclasses of a class is available without
+    walking the class graph.  The index uses weak references so that it
+    doesn't keep dynamically created classes alive.
+    """
+    # Map of class to a WeakKeyDictionary whose keys are all its subclasses.
+    # (weakref.WeakSet would be simpler but requires python 2.7)
+    _registry = weakref.WeakKeyDictionary()
+    
+    def __init__(cls, name, bases, attributes):
+        super(SubclassRegistryMetaClass, cls).__init__(name, bases, attributes)
+        registry = SubclassRegistryMetaClass._registry
+        for base in cls.__mro__[1:]:
+            if isinstance(base, SubclassRegistryMetaClass):
+                try:
+                    subclasses = registry[base]
+                except KeyError:
+                    subclasses = registry[base] = weakref.WeakKeyDictionary()
+                subclasses[cls] = None
+
+def getRegisteredSubclassesOf(parent):
+    """Return the list of all subclasses of a class created with the
+    L{SubclassRegistryMetaClass}.
+    """
+    try:
+        return SubclassRegistryMetaClass._registry[parent].keys()
+    except KeyError:
+        return []
+
 def getAllSubclassesOf(parent=debugmixin, subclassof=None):
     """
-    Recursive call to get all classes that have a specified class
-    in their ancestry.  The call to __subclasses__ only finds the
-    direct, child subclasses of an object, so to find
+    Get all classes that have a specified class in their ancestry.
+    
+    If the parent class was created by the L{SubclassRegistryMetaClass}, the
+    subclasses are returned from the index maintained by the metaclass.
+    Otherwise, the class graph is searched: the call to __subclasses__ only
+    finds the direct, child subclasses of an object, so to find
     grandchildren and objects further down the tree, we have to go
     recursively down each subclasses hierarchy to see if the
     subclasses are of the type we want.
 
+    @param parent: class used to find subclasses
+    @type parent: class
+    @param subclassof: class used to verify type during recursive calls
+    @type subclassof: class
+    @returns: list of classes
+    """
+    if isinstance(parent, SubclassRegistryMetaClass):
+        subclasses = getRegisteredSubclassesOf(parent)
+        if subclassof is not None and subclassof is not parent:
+            subclasses = [kls for kls in subclasses if issubclass(kls, subclassof)]
+        return subclasses
+    return searchAllSubclassesOf(parent, subclassof)
+
+def searchAllSubclassesOf(parent=debugmixin, subclassof=None):
+    """
+    Recursive call to get all classes that have a specified class
+    in their ancestry by walking the class graph.
+
     @param parent: class used to find subclasses
     @type parent: class
     @param subclassof: class used to verify type during recursive calls
@@ -1466,7 +1520,7 @@ def getAllSubclassesOf(parent=debugmixin, subclassof=None):
             subclasses[kls] = 1
         # for each subclass, recurse through its subclasses to
         # make sure we're not missing any descendants.
-        subs=getAllSubclassesOf(parent=kls)
+        subs=searchAllSubclassesOf(parent=kls)
         if len(subs)>0:
             for kls in subs:
                 subclasses[kls] = 1
@@ -1566,6 +1620,68 @@ def getSubclassHierarchy(obj,subclass,debug=0):
     return subclasses
     
 
+class PrefsLookupCache(object):
+    """Cache of resolved classpref lookups.
+    
+    Resolving a classpref requires searching the user settings, the
+    application defaults and the default_classprefs of each class in the class
+    hierarchy.  The result of the search -- the dict that holds the value --
+    is remembered for each class and keyword so that further lookups only
+    need a single dict access.  Because the dict rather than the value is
+    cached, changing the value of an existing setting doesn't require the
+    cache to be invalidated; only changes that could alter the result of the
+    search (loading a config file, converting a section, adding or removing
+    settings) do.
+    
+    The cache is also invalidated automatically if the GlobalPrefs user or
+    default dicts are replaced.
+    """
+    def __init__(self):
+        self.user = None
+        self.default = None
+        self.classes = {}
+        self.resetStats()
+    
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.start_time = time.time()
+    
+    def invalidate(self):
+        self.classes = {}
+        self.invalidations += 1
+    
+    def getClassCache(self, name):
+        """Return the lookup dict for the class with the given name"""
+        if self.user is not GlobalPrefs.user or self.default is not GlobalPrefs.default:
+            self.user = GlobalPrefs.user
+            self.default = GlobalPrefs.default
+            self.invalidate()
+        try:
+            return self.classes[name]
+        except KeyError:
+            cache = self.classes[name] = {}
+            return cache
+    
+    def getStats(self):
+        """Return a dict of statistics about the lookups since the last call to
+        L{resetStats}
+        """
+        lookups = self.hits + self.misses
+        elapsed = time.time() - self.start_time
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'lookups': lookups,
+            'hit_rate': float(self.hits) / max(lookups, 1),
+            'lookups_per_second': lookups / max(elapsed, 1e-6),
+            'cached_keywords': sum([len(c) for c in self.classes.itervalues()]),
+            }
+        return stats
+
+
 class GlobalPrefs(debugmixin):
     debuglevel = 0
     
@@ -1583,6 +1699,27 @@ class GlobalPrefs(debugmixin):
     class_hierarchy={}
     magic_conversion=True
     
+    lookup_cache = PrefsLookupCache()
+    
+    # Map of class to the help text of its params for classes that have
+    # already been processed by setupHierarchyDefaults, and the user and
+    # default dicts that were current at the time
+    hierarchy_setup = {}
+    hierarchy_setup_dicts = (None, None)
+    
+    @classmethod
+    def invalidateLookupCache(cls):
+        """Discard all cached classpref lookups.
+        
+        Must be called after any change to the user or default settings that
+        could change which class provides the value of a classpref.
+        """
+        cls.lookup_cache.invalidate()
+    
+    @classmethod
+    def getLookupStats(cls):
+        return cls.lookup_cache.getStats()
+    
     @classmethod
     def setDefaults(cls, defs):
         """Set system defaults to the dict of dicts.
@@ -1602,6 +1739,7 @@ class GlobalPrefs(debugmixin):
             d[section].update(defaults)
             if section not in p:
                 p[section] = {}
+        cls.invalidateLookupCache()
 
     @classmethod
     def addHierarchy(cls, leaf, classhier, namehier):
@@ -1613,8 +1751,17 @@ class GlobalPrefs(debugmixin):
 
     @classmethod
     def setupHierarchyDefaults(cls, klasshier):
+        # Every class in the hierarchy only needs to be processed once unless
+        # the user or default dicts have been replaced
+        if cls.hierarchy_setup_dicts[0] is not cls.user or cls.hierarchy_setup_dicts[1] is not cls.default:
+            cls.hierarchy_setup = {}
+            cls.hierarchy_setup_dicts = (cls.user, cls.default)
         helptext = {}
         for klass in klasshier:
+            if klass in cls.hierarchy_setup:
+                helptext.update(cls.hierarchy_setup[klass])
+                continue
+            class_helptext = {}
 #            if klass.__name__ == "CommonlyUsedMajorModes":
 #                cls.debuglevel = 1
 #            else:
@@ -1644,7 +1791,7 @@ class GlobalPrefs(debugmixin):
                                 #dprint("Overriding %s.%s with %s" % (klass.__name__, p.keyword, value))
                                 cls.needs_conversion[klass.__name__] = True
                         if p.help:
-                            helptext[p.keyword] = p.help
+                            class_helptext[p.keyword] = p.help
                         if p.isIterableDataType():
                             # For lists, sets, and hashes, the value of the
                             # contents of the classpref can change without
@@ -1679,11 +1826,14 @@ class GlobalPrefs(debugmixin):
                             if p.keyword not in gp:
                                 gp[p.keyword] = p
                         if p.help:
-                            helptext[p.keyword] = p.help
+                            class_helptext[p.keyword] = p.help
+            helptext.update(class_helptext)
+            cls.hierarchy_setup[klass] = class_helptext
         if cls.debuglevel > 1: dprint("default: %s" % cls.default)
         if cls.debuglevel > 1: dprint("user: %s" % cls.user)
         
         cls.setMissingParamData(klasshier, helptext)
+        cls.invalidateLookupCache()
     
     @classmethod
     def setMissingParamData(cls, klasshier, helptext):
@@ -1810,6 +1960,7 @@ class GlobalPrefs(debugmixin):
                 cls.user[section].update(d)
             else:
                 cls.user[section]=d
+        cls.invalidateLookupCache()
     
     @classmethod
     def convertSection(cls, section):
@@ -1894,6 +2045,7 @@ class GlobalPrefs(debugmixin):
                     cls.setDefaultsForUserList(section, option, param, index, d)
                 
             cls.user[section] = d
+            cls.invalidateLookupCache()
     
     @classmethod
     def setDefaultsForUserList(cls, section, option, param, index, d):
@@ -2111,6 +2263,32 @@ class PrefsProxy(debugmixin):
         return subscripts, default_index
     
     def _findNameInHierarchy(self, name, user=True, default=True):
+        """Return the dict that holds the value of the classpref.
+        
+        The result is cached in the L{PrefsLookupCache}, so only the first
+        lookup of a keyword has to search the class hierarchy.
+        """
+        start = self.__dict__['_startSearch']
+        if user and default:
+            key = name
+        else:
+            key = (name, user, default)
+        lookup = GlobalPrefs.lookup_cache
+        try:
+            d = lookup.getClassCache(start)[key]
+            lookup.hits += 1
+            return d
+        except KeyError:
+            pass
+        lookup.misses += 1
+        d = self._searchHierarchy(name, user, default)
+        
+        # Get the class cache again because converting a section during the
+        # search invalidates the cache
+        lookup.getClassCache(start)[key] = d
+        return d
+    
+    def _searchHierarchy(self, name, user=True, default=True):
         klasses=GlobalPrefs.name_hierarchy[self.__dict__['_startSearch']]
         if user:
             d=GlobalPrefs.user
@@ -2190,17 +2368,23 @@ class PrefsProxy(debugmixin):
         if value is None and '[' in name and ']' in name:
             if name in GlobalPrefs.user[index]:
                 del GlobalPrefs.user[index][name]
+                GlobalPrefs.invalidateLookupCache()
             # FIXME: pretty sure this isn't needed
 #            if name in GlobalPrefs.default[index]:
 #                #dprint("Deleting default value of %s" % name)
 #                del GlobalPrefs.default[index][name]
         else:
-            GlobalPrefs.user[index][name]=value
+            d = GlobalPrefs.user[index]
+            if name not in d:
+                # A new user setting may shadow a value from a superclass
+                GlobalPrefs.invalidateLookupCache()
+            d[name]=value
 
     _set = __setattr__
 
     def _del(self, name):
         del GlobalPrefs.user[self.__dict__['_startSearch']][name]
+        GlobalPrefs.invalidateLookupCache()
         
     def _getValue(self,klass,name):
         d=GlobalPrefs.user
@@ -2238,7 +2422,7 @@ class PrefsProxy(debugmixin):
         return [cls for cls in GlobalPrefs.class_hierarchy[self.__dict__['_startSearch']]]
 
 
-class ClassPrefsMetaClass(type):
+class ClassPrefsMetaClass(SubclassRegistryMetaClass):
     def __init__(cls, name, bases, attributes):
         """Add prefs attribute to class attributes.
 
@@ -2248,6 +2432,7 @@ class ClassPrefsMetaClass(type):
         accessed through self.prefs changes the class prefs.
         Instance prefs are maintained by the class itself.
         """
+        super(ClassPrefsMetaClass, cls).__init__(name, bases, attributes)
         #dprint('Bases: %s' % str(bases))
         expanded = [cls]
         for base in bases:
@@ -2437,6 +2622,7 @@ class ClassPrefs(object):
                         if k in GlobalPrefs.user[name]:
                             del GlobalPrefs.user[name][k]
                     #dprint("after: %s: %s" % (name, GlobalPrefs.user[name]))
+        GlobalPrefs.invalidateLookupCache()
 
     def classprefsDictFromLocals(self):
         """Return a dict copy of the local settings"""
@@ -3085,6 +3271,7 @@ class PrefDialog(wx.Dialog):
             page_locals = page.applyPreferences()
             if page_locals:
                 locals.update(page_locals)
+        GlobalPrefs.invalidateLookupCache()
         return locals
 
 if __name__ == "__main__":
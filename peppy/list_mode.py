@@ -5,10 +5,9 @@
 Abstract major mode used to represent data as a sortable list.
 """
 
-import os
+import os, locale
 
 import wx
-from wx.lib.mixins.listctrl import ColumnSorterMixin
 
 from peppy.lib.column_autosize import *
 
@@ -30,29 +29,191 @@ class ListModeActionMixin(object):
         return focus == self.mode.list or focus.GetParent() == self.mode.list
 
 
-class SortableListCtrl(wx.ListCtrl, ColumnAutoSizeMixin, ColumnSorterMixin):
+def getSortableValue(value):
+    """Convert a raw value into a key that sorts strings using the current
+    locale.
+    
+    This is the precomputed equivalent of the locale.strcoll comparison used
+    by the wx ColumnSorterMixin.
+    """
+    if isinstance(value, unicode):
+        return locale.strxfrm(value.encode('utf-8'))
+    elif isinstance(value, str):
+        return locale.strxfrm(value)
+    return value
+
+
+class SortableListCtrl(wx.ListCtrl, ColumnAutoSizeMixin):
+    """Virtual list control that displays the items of a L{ListMode}
+    
+    The list control doesn't store any rows itself.  The raw values of each
+    item are stored in L{itemDataMap} in the order they were added, and the
+    row order of the display is a list of indexes into itemDataMap.  The
+    strings for each row are only created by the L{ListMode} when the row is
+    displayed, and sorting reorders the index list using precomputed sort
+    keys rather than moving items around in the control.
+    """
     def __init__(self, mode):
         self.mode = mode
-        wx.ListCtrl.__init__(self, mode, style=wx.LC_REPORT)
+        wx.ListCtrl.__init__(self, mode, style=wx.LC_REPORT|wx.LC_VIRTUAL)
         ColumnAutoSizeMixin.__init__(self)
 
         self.mode.createColumns(self)
-        self.itemDataMap = {}
-        ColumnSorterMixin.__init__(self, self.GetColumnCount())
+        self.clearItems()
+        
+        # Current sort column and sort direction of each column, as in the
+        # wx ColumnSorterMixin
+        self.sort_col = -1
+        self.sort_flags = [0] * self.GetColumnCount()
+        
+        # Background color attributes, keyed on the color
+        self.attrs = {}
+        
         # Assign icons for up and down arrows for column sorter
         getIconStorage().assignList(self)
+        self.Bind(wx.EVT_LIST_COL_CLICK, self.OnColClick)
     
-    # Used by the ColumnSorterMixin, see wx/lib/mixins/listctrl.py
-    def GetListCtrl(self):
-        return self
+    def clearItems(self):
+        # Raw values of the items, in the order they were added
+        self.itemDataMap = []
+        
+        # Display strings of the items that have been shown, keyed on the
+        # index into itemDataMap
+        self.itemStrings = {}
+        
+        # Display order: list of indexes into itemDataMap
+        self.order = []
+        self.SetItemCount(0)
+    
+    def setItems(self, items):
+        """Replace all the items in the list
+        
+        @param items: list of raw values as returned by
+        L{ListMode.getItemRawValues}
+        """
+        self.itemDataMap = items
+        self.itemStrings = {}
+        self.order = range(len(items))
+        self.SetItemCount(len(items))
+        self.Refresh()
+    
+    def appendItems(self, items):
+        """Add items to the end of the list without touching existing rows"""
+        start = len(self.itemDataMap)
+        self.itemDataMap.extend(items)
+        self.order.extend(xrange(start, len(self.itemDataMap)))
+        self.SetItemCount(len(self.order))
+    
+    def invalidateItems(self, data_indexes):
+        """Discard the cached strings of the items so they are regenerated
+        from the raw values the next time they are displayed.
+        
+        @param data_indexes: list of indexes into itemDataMap
+        """
+        for data_index in data_indexes:
+            self.itemStrings.pop(data_index, None)
+        self.Refresh()
+    
+    def GetItemData(self, index):
+        return self.order[index]
+    
+    def getRawValues(self, index):
+        """Return the raw values of the item displayed in the row"""
+        return self.itemDataMap[self.order[index]]
+    
+    def getStrings(self, data_index):
+        try:
+            return self.itemStrings[data_index]
+        except KeyError:
+            values = self.itemDataMap[data_index]
+            if isinstance(values, list):
+                # Make a copy of the list so the mode can change it in place
+                values = values[:]
+            strings = list(self.mode.convertRawValuesToStrings(values))
+            self.itemStrings[data_index] = strings
+            return strings
+    
+    def SetStringItem(self, index, col, label, imageId=-1):
+        """Change the text displayed in a cell of the row"""
+        self.getStrings(self.order[index])[col] = label
+        self.RefreshItem(index)
+    
+    def getStringItem(self, index, col):
+        """Return the text displayed in a cell of the row"""
+        return self.getStrings(self.order[index])[col]
+    
+    def OnGetItemText(self, index, col):
+        return self.getStrings(self.order[index])[col]
+    
+    def OnGetItemImage(self, index):
+        return -1
+    
+    def OnGetItemAttr(self, index):
+        color = self.mode.getListItemBackgroundColor(index)
+        key = color.Get()
+        try:
+            return self.attrs[key]
+        except KeyError:
+            attr = wx.ListItemAttr()
+            attr.SetBackgroundColour(color)
+            self.attrs[key] = attr
+            return attr
     
     def GetSortImages(self):
         down = getIconStorage("icons/bullet_arrow_down.png")
         up = getIconStorage("icons/bullet_arrow_up.png")
         return (down, up)
-
-    def GetSecondarySortValues(self, col, key1, key2):
-        return self.mode.GetSecondarySortValues(col, key1, key2, self.itemDataMap)
+    
+    def GetSortState(self):
+        return (self.sort_col, self.sort_flags[self.sort_col])
+    
+    def SortListItems(self, col=-1, ascending=1):
+        """Sort the list by the column, or by the current sort column if
+        col is -1.
+        """
+        old_col = self.sort_col
+        if col != -1:
+            self.sort_col = col
+            self.sort_flags[col] = ascending
+        self.sortItems()
+        self.updateSortImages(old_col)
+    
+    def OnColClick(self, evt):
+        old_col = self.sort_col
+        col = evt.GetColumn()
+        self.sort_col = col
+        self.sort_flags[col] = int(not self.sort_flags[col])
+        self.sortItems()
+        self.updateSortImages(old_col)
+        evt.Skip()
+        self.OnSortOrderChanged()
+    
+    def sortItems(self):
+        """Reorder the rows by the current sort column
+        
+        The sort keys are computed once per item rather than once per
+        comparison, and the selected items remain selected after the sort.
+        """
+        col = self.sort_col
+        if col < 0 or not self.order:
+            return
+        selected = [self.order[index] for index in self.mode.getSelectedIndexes()]
+        self.mode.setSelectedIndexes([])
+        keys = [self.mode.getSortKey(col, values) for values in self.itemDataMap]
+        self.order.sort(key=keys.__getitem__, reverse=not self.sort_flags[col])
+        if selected:
+            selected = set(selected)
+            indexes = [i for i, data_index in enumerate(self.order) if data_index in selected]
+            self.mode.setSelectedIndexes(indexes)
+        self.Refresh()
+    
+    def updateSortImages(self, old_col):
+        images = self.GetSortImages()
+        if self.sort_col != -1 and images[0] != -1:
+            img = images[self.sort_flags[self.sort_col]]
+            if old_col != -1:
+                self.ClearColumnImage(old_col)
+            self.SetColumnImage(self.sort_col, img)
     
     def OnSortOrderChanged(self):
         self.mode.setListItemBackgroundColors()
@@ -137,18 +298,31 @@ class ListMode(wx.Panel, MajorMode):
         index = evt.GetIndex()
         self.dprint("deselected %d" % index)
 
-    def GetSecondarySortValues(self, col, key1, key2, itemDataMap):
-        return (itemDataMap[key1][1], itemDataMap[key2][1])
+    def getSortKey(self, col, raw_values):
+        """Return the key used to sort an item by the specified column.
+        
+        Items with the same value in the sort column are ordered by the value
+        returned by L{getSecondarySortValue}.
+        """
+        return (getSortableValue(raw_values[col]),
+                getSortableValue(self.getSecondarySortValue(col, raw_values)))
+    
+    def getSecondarySortValue(self, col, raw_values):
+        """Return the value used to order items that have the same value in
+        the sort column.
+        """
+        return raw_values[1]
 
     def setSelectedIndexes(self, indexes):
         """Highlight the rows contained in the indexes array"""
         
         list_count = self.list.GetItemCount()
-        for index in range(list_count):
-            if index in indexes:
-                self.list.SetItemState(index, wx.LIST_STATE_SELECTED, wx.LIST_STATE_SELECTED)
-            else:
+        for index in self.getSelectedIndexes():
+            if index not in indexes:
                 self.list.SetItemState(index, 0, wx.LIST_STATE_SELECTED)
+        for index in indexes:
+            if index < list_count:
+                self.list.SetItemState(index, wx.LIST_STATE_SELECTED, wx.LIST_STATE_SELECTED)
 
     def getSelectedIndexes(self):
         """Return an array of indexes that are currently selected."""
@@ -187,58 +361,44 @@ class ListMode(wx.Panel, MajorMode):
     def resetList(self, msg=None):
         """Reset the list.
         
-        No optimization here, just rebuild the entire list.
+        The raw values of all the items are regenerated, but the strings for
+        each row are only created when the row is displayed.
         """
         if self.updating:
             # don't process if we're currently updating the list
             dprint("skipping an update while we're in the middle of an execute")
             return
         
-        # FIXME: Freeze doesn't seem to work -- on windows, this list is built
-        # so slowly that you can see columns being resized.
         self.list.Freeze()
-        list_count = self.list.GetItemCount()
-        index = 0
-        cumulative = 0
-        cache = []
-        show = -1
-        self.list.itemDataMap = {}
-        for item in self.getListItems():
-            self.insertListItem(item, index, list_count)
-            index += 1
-        
-        if index < list_count:
-            for i in range(index, list_count):
-                # always delete the first item because the list gets
-                # shorter by one each time.
-                self.list.DeleteItem(index)
-        if show >= 0:
-            self.list.EnsureVisible(show)
-
+        items = []
+        for index, item in enumerate(self.getListItems()):
+            items.append(self.getItemRawValues(index, item))
+        self.list.setItems(items)
         self.list.ResizeColumns()
         self.list.Thaw()
         
         self.resetListPostHook()
     
-    def insertListItem(self, item, index, list_count=None):
-        if list_count is None:
-            list_count = self.list.GetItemCount()
-        values = self.getItemRawValues(index, item)
-        self.list.itemDataMap[index] = values
-        
-        if isinstance(values, list):
-            # Make a copy of the list so the user can change it in place
-            values = values[:]
-        values = self.convertRawValuesToStrings(values)
-            
-        if index >= list_count:
-            self.list.InsertStringItem(sys.maxint, values[0])
-        else:
-            self.list.SetStringItem(index, 0, values[0])
-        for col in range(1, self.list.GetColumnCount()):
-            self.list.SetStringItem(index, col, values[col])
-        self.list.SetItemData(index, index)
+    def appendListItems(self, items):
+        """Add items to the end of the list
         
+        Only the new items are processed, so this is suitable for adding items
+        to the list as they become available.
+        """
+        start = len(self.list.itemDataMap)
+        values = []
+        for index, item in enumerate(items):
+            values.append(self.getItemRawValues(start + index, item))
+        self.list.appendItems(values)
+    
+    def getEntryFromIndex(self, index):
+        """Return the raw values of the item displayed at the list index.
+        
+        The list can be reordered by sorting, so the index doesn't necessarily
+        correspond to the order in which items were added.
+        """
+        return self.list.getRawValues(index)
+    
     def resetListPostHook(self):
         """Hook for processing after the list is reset
         """
@@ -258,7 +418,7 @@ class ListMode(wx.Panel, MajorMode):
         equal to the number of columns in the ListCtrl.  If there are a larger
         number of entries than columns in the ListCtrl, those entries will
         not be displayed in the ListCtrl but would be available for later
-        reference in itemDataMap.
+        reference through L{getEntryFromIndex}.
         """
         raise NotImplementedError
     
@@ -273,14 +433,16 @@ class ListMode(wx.Panel, MajorMode):
     def setListItemBackgroundColors(self, start_index=0):
         """Sets the background colors of items in the list
         
+        The colors are supplied on demand by L{getListItemBackgroundColor}
+        as the rows are displayed, so this only needs to refresh the rows.
+        
         @kwarg start_index: index number to start highlighting (the implication
         being that the indexes above this index already have the correct
         highlighting)
         """
         list_count = self.list.GetItemCount()
-        for index in range(start_index, list_count):
-            color = self.getListItemBackgroundColor(index)
-            self.list.SetItemBackgroundColour(index, color)
+        if start_index < list_count:
+            self.list.RefreshItems(start_index, list_count - 1)
     
     def getListItemBackgroundColor(self, index):
         """Determine the background color for an item
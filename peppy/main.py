@@ -27,6 +27,7 @@ from peppy.lib.gaugesplash import *
 from peppy.lib.loadfileserver import LoadFileProxy
 from peppy.lib.userparams import *
 from peppy.lib.processmanager import *
+from peppy.lib.idlescheduler import getIdleScheduler
 from peppy.lib.textutil import piglatin
 from peppy.lib.controls import CredentialsDialog
 
@@ -352,6 +353,7 @@ class Peppy(wx.App, ClassPrefs, debugmixin):
         IntParam('binary_percentage', 10, 'Percentage of non-displayable characters that results in peppy guessing that the file is binary'),
         IntParam('magic_size', 1024, 'Size of initial buffer used to guess the type of the file.'),
         FloatParam('minimum_idle_delay', 0.5, 'Minimum delay (in seconds) between idle event updates to prevent a slowdown by propagating too many idle events in a short time period.'),
+        FloatParam('idle_time_budget', 0.02, 'Maximum time (in seconds) that background tasks may use in a single idle event before giving control back to the user interface.'),
         BoolParam('load_threaded', True, 'Load files in a separate thread?'),
         BoolParam('show_splash', False, 'Show the splash screen on start?'),
         StrParam('default_text_encoding', 'latin1', 'Default file encoding if otherwise not specified in the file'),
@@ -406,7 +408,8 @@ class Peppy(wx.App, ClassPrefs, debugmixin):
         self.toolbar_actions=[]
         self.keyboard_actions=[]
         self.bufferhandlers=[]
-        self.last_idle_update = 0
+        self.idle_scheduler = getIdleScheduler()
+        self.normal_idle_task = self.idle_scheduler.addTask(self.processNormalIdleTask, "frame updates", priority=self.idle_scheduler.LOW, repeat=True)
         
         vfs.register_authentication_callback(self.showCredentialsDialog)
         
@@ -503,21 +506,30 @@ class Peppy(wx.App, ClassPrefs, debugmixin):
         because toolbars need to update their enable state continually, if
         idle events were processed on all frames, there would be a noticeable
         delay after only a few frames were open.
+        
+        Other work is performed by the tasks of the L{IdleScheduler}, which
+        are limited to the idle_time_budget in each idle event.  More idle
+        events are requested as long as the scheduler has work to do.
         """
         top = self.getTopFrame()
         if top:
             #dprint("Processing priority idle event on %s" % top)
             top.processPriorityIdleEvent()
-            
-        if time.time() < self.last_idle_update + self.classprefs.minimum_idle_delay:
-            # don't do idle events too often
-            #dprint("Skipping normal idle event because it happened too quickly")
-            return
         
+        self.idle_scheduler.budget = self.classprefs.idle_time_budget
+        if self.idle_scheduler.process():
+            evt.RequestMore()
+    
+    def processNormalIdleTask(self):
+        """Idle task for the expensive idle functions of the top frame
+        
+        Runs at most once every minimum_idle_delay seconds.
+        """
+        self.normal_idle_task.interval = self.classprefs.minimum_idle_delay
+        top = self.getTopFrame()
         if top:
             #dprint("Processing normal idle event on %s" % top)
             top.processNormalIdleEvent()
-        self.last_idle_update = time.time()
 
     def bootstrapCommandLineOptions(self):
         """Process a small number of configuration options before
@@ -46,6 +46,7 @@ from peppy.lib.iconstorage import *
 from peppy.lib.controls import *
 from peppy.lib.springtabs import SpringTabs
 from peppy.lib.serializer import PickleSerializerMixin
+from peppy.lib.idlescheduler import getIdleScheduler
 
 
 class MajorModeLayout(ClassPrefs, debugmixin):
@@ -1099,6 +1100,10 @@ class MajorMode(ContextMenuMixin, ClassPrefs, debugmixin):
         user code to the delete process.
         """
         self.deleteWindowPreHook()
+        
+        # Idle tasks hold references to the mode, so they must be removed
+        # explicitly
+        getIdleScheduler().cancelTasks(self)
 
         # remove the mode as one of the buffer's listeners
         self.buffer.removeViewer(self)
@@ -1260,11 +1265,33 @@ class MajorMode(ContextMenuMixin, ClassPrefs, debugmixin):
         for the major mode instance.
         """
         #dprint(u"Idle starting for %s at %f" % (self.buffer.url, time.time()))
-        if self.pending_idle_messages:
-            self.processPendingIdleMessages()
         self.idlePostHook()
         #dprint(u"Idle finished for %s at %f" % (self.buffer.url, time.time()))
     
+    def isActiveMajorMode(self):
+        """Return True if the mode is ready for idle events and is the
+        currently displayed mode in its frame.
+        """
+        return self.ready_for_idle_events and self.frame.getActiveMajorMode() == self
+    
+    def addIdleTask(self, func, name=None, priority=50, active_only=False, **kwargs):
+        """Schedule an idle task owned by this major mode
+        
+        The task is run by the application's L{IdleScheduler} within the idle
+        time budget, and is cancelled when the mode is deleted.
+        
+        @param active_only: if True, the task only runs while this mode is
+        the active mode of its frame; otherwise it runs as soon as the mode is
+        ready for idle events.
+        
+        See L{IdleScheduler.addTask} for the other arguments.
+        """
+        if active_only:
+            ready = self.isActiveMajorMode
+        else:
+            ready = self.isReadyForIdleEvents
+        return getIdleScheduler().addTask(func, name, priority, owner=self, ready=ready, **kwargs)
+    
     def sendMessageWhenIdle(self, topic, **kwargs):
         """Defers a pubsub3 message until idle processing
         
@@ -1274,17 +1301,20 @@ class MajorMode(ContextMenuMixin, ClassPrefs, debugmixin):
         if topic not in self.pending_idle_messages:
             #dprint("deferring till idle: %s, %s" % (topic, kwargs))
             self.pending_idle_messages[topic] = kwargs
+            self.addIdleTask(self.processPendingIdleMessages, "idle messages", active_only=True)
     
     def processPendingIdleMessages(self):
         """Idle message handler for messages deferred by L{sendMessageWhenIdle}
         
-        Called internally by L{idleHandler} and shouldn't be called directly.
+        Called as an idle task and shouldn't be called directly.  Only one
+        message is sent per call so that expensive message handlers (like
+        fold hierarchy updates) are spread over several idle events.
         """
-        messages = self.pending_idle_messages
-        self.pending_idle_messages = {}
-        for topic, kwargs in messages.iteritems():
+        if self.pending_idle_messages:
+            topic, kwargs = self.pending_idle_messages.popitem()
             #dprint("Sending: %s, %s" % (topic, kwargs))
             pub.sendMessage(topic, **kwargs)
+        return bool(self.pending_idle_messages)
 
     def idlePostHook(self):
         """Hook for subclasses to process during idle time.
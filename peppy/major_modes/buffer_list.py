@@ -169,9 +169,6 @@ class BufferListMode(ListMode):
         ListMode.__init__(self, parent, wrapper, buffer, frame)
         self.setSelectedIndexes([0])
     
-    def GetSecondarySortValues(self, col, key1, key2, itemDataMap):
-        return (itemDataMap[key1][1], itemDataMap[key2][1])
-
     def createListenersPostHook(self):
         pub.subscribe(self.psBufferChanged, 'buffer.opened')
         pub.subscribe(self.psBufferChanged, 'buffer.modified')
@@ -209,7 +206,7 @@ class BufferListMode(ListMode):
         
         Note that in the current implementation, the key is the URL.
         """
-        key = self.list.GetItem(index, 4).GetText()
+        key = self.getEntryFromIndex(index)[4]
         return key
 
     def getFlags(self, key):
@@ -242,7 +239,7 @@ class BufferListMode(ListMode):
                 flags = "".join(tmp)
                 self.flags[key] = flags
                 self.list.SetStringItem(index, 0, flags)
-                self.list.itemDataMap[index][0] = flags
+                self.getEntryFromIndex(index)[0] = flags
     
     def clearFlags(self):
         """Clear all flags for the selected items."""
@@ -251,7 +248,7 @@ class BufferListMode(ListMode):
             key = self.getKeyFromIndex(index)
             self.flags[key] = ""
             self.list.SetStringItem(index, 0, self.flags[key])
-            self.list.itemDataMap[index][0] = self.flags[key]
+            self.getEntryFromIndex(index)[0] = self.flags[key]
  
     def execute(self):
         """Operate on all the flags for each of the buffers.
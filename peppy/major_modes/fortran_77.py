@@ -28,6 +28,8 @@ class F77ContinuationLine(LineOrRegionMutateAction):
     default_menu = ("Fortran", -100)
     key_bindings = {'emacs': 'C-c C-7',
                     }
+    independent_lines = True
+    
     def mutateLines(self, lines):
         modified = []
         for line in lines:
@@ -1,6 +1,6 @@
 # peppy Copyright (c) 2006-2010 Rob McMullen
 # Licenced under the GPLv2; see http://peppy.flipturn.org for more info
-import os,struct
+import os,struct,mmap,bisect,threading
 
 import wx
 import wx.stc
@@ -8,11 +8,18 @@ import wx.grid as Grid
 from wx.lib.evtmgr import eventManager
 import wx.lib.newevent
 
+import peppy.vfs as vfs
+
 from peppy.yapsy.plugins import *
 from peppy.actions import *
 from peppy.major import *
 from peppy.stcinterface import *
 from peppy.actions.minibuffer import *
+from peppy.actions.base import BufferBusyActionMixin
+from peppy.lib.bufferedreader import BlockCacheReader
+from peppy.lib.piecetable import PieceTable
+from peppy.lib.recorddecoder import RecordDecoder, RecordCache, RecordStatistics
+from peppy.lib.threadutils import ThreadStatus
 
 
 class OpenHexEditor(SelectAction):
@@ -104,6 +111,24 @@ class ShowRecordNumbers(WorksWithHexEdit, ToggleAction):
         self.mode.table.showRecordNumbers(self.mode, not self.mode.table._show_record_numbers)
     
 
+class ShowFieldStatistics(WorksWithHexEdit, BufferBusyActionMixin, SelectAction):
+    """Show statistics of the field under the cursor
+    
+    Calculates the minimum, maximum, mean, and a histogram of the values of
+    the current field over all records in the file.  The calculation is
+    performed in a background thread and can be cancelled from the status
+    bar.
+    """
+    name = "Field Statistics..."
+    default_menu = ("View", 552)
+
+    def isActionAvailable(self):
+        return self.mode.table.decoder.dtype is not None
+    
+    def action(self, index=-1, multiplier=1):
+        self.mode.showFieldStatistics()
+    
+
 class HugeTable(Grid.PyGridTableBase,debugmixin):
     def __init__(self,stc,format="16c"):
         Grid.PyGridTableBase.__init__(self)
@@ -119,12 +144,13 @@ class HugeTable(Grid.PyGridTableBase,debugmixin):
     def setFormat(self, format):
         if format:
             try:
-                nbytes = struct.calcsize(format)
+                decoder = RecordDecoder(format)
             except struct.error:
                 raise
             
             self.format = format
-            self.nbytes = nbytes
+            self.decoder = decoder
+            self.nbytes = decoder.size
             self._hexcols = self.nbytes
             self.parseFormat(self.format)
             self._cols = self._hexcols + self._textcols
@@ -330,52 +356,51 @@ class HugeTable(Grid.PyGridTableBase,debugmixin):
         else:
             return False
     
-    def invalidateCache(self, max=100):
-        self._cache = {}
-        self._cache_max = max
-        self._cache_fifo = []
+    def invalidateCache(self, max=16):
+        # LRU cache of blocks of rows that are unpacked and formatted all at
+        # once, so painting the grid only needs to look up the strings
+        self._cache = RecordCache(self.decoder, self.getBinaryData, max_blocks=max)
+        self._stats = None
     
     def invalidateCacheRow(self, row):
-        if row in self._cache:
-            del self._cache[row]
-            self._cache_fifo.remove(row)
+        self._cache.invalidateRecord(row)
+        self._stats = None
+    
+    def getBinaryData(self, start, end):
+        return self.stc.GetBinaryData(start, end)
     
     def getRowData(self, row):
-        if len(self._cache_fifo) > self._cache_max:
-            amt = self._cache_max / 8
-            remove = self._cache_fifo[:amt]
-            self._cache_fifo = self._cache_fifo[amt:]
-            for r in remove:
-                if r != row:
-                    del self._cache[r]
-                else:
-                    # add back the row that we didn't remove
-                    self._cache_fifo.append(row)
-            #dprint("Removed 1/8 of the cache: %d elements: %s.  cache=%s" % (amt, str(remove), str(self._cache_fifo)))
-        if row not in self._cache:
-            startpos = row*self.nbytes
-            endpos = startpos + self.nbytes
-            data = self.stc.GetBinaryData(startpos,endpos)
-            
-            # pad data with dummy bytes if we've hit the end of file and it's
-            # not an even multiple of the column size
-            if len(data) < self.nbytes:
-                data += '\0' * (self.nbytes - len(data))
-            
-            s = struct.unpack(self.format, data)
-            self._cache[row] = (data, s)
-            #dprint("Storing cached data for row %d: %s, %s" % (row, repr(data), str(s)))
-            
-            self._cache_fifo.append(row)
-        return self._cache[row]
+        data = self._cache.getRecordData(row)
+        return (data, struct.unpack(self.format, data))
+    
+    def getStats(self):
+        """Return the list of L{FieldStats} of each text column, or None if
+        the statistics haven't been calculated since the data or the format
+        last changed.
+        """
+        return self._stats
+    
+    def createStatistics(self):
+        """Return a L{RecordStatistics} to calculate the statistics over all
+        the records in the file
+        """
+        return RecordStatistics(self.decoder, self.getBinaryData, self.stc.GetLength())
+    
+    def setStats(self, decoder, stats):
+        """Cache the statistics calculated using the decoder
+        
+        The statistics are discarded if the format has changed since the
+        calculation was started.
+        """
+        if decoder is self.decoder:
+            self._stats = stats
     
     def GetValue(self, row, col):
-        data, s = self.getRowData(row)
         if col<self._hexcols:
-            return "%02x" % ord(data[col])
+            return self._cache.getHex(row, col)
         else:
             col -= self._hexcols
-            return str(s[col])
+            return self._cache.getValue(row, col)
 
     def SetValue(self, row, col, value):
         if col<self._hexcols:
@@ -810,6 +835,242 @@ class WaitThread(Thread):
 
 
 
+class FieldStatisticsThread(threading.Thread):
+    """Background thread to calculate the statistics of all the fields of
+    the records in the L{HexEditMode}.
+
+    Uses peppy.lib.threadutils.ThreadStatus to communicate with GUI thread
+    """
+    def __init__(self, statistics, updater):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.statistics = statistics
+        self.updater = updater
+
+    def stopStatistics(self):
+        self.statistics.stopStatistics()
+
+    def run(self):
+        try:
+            stats = self.statistics.calculate(updater=self.updater)
+            if stats is None:
+                self.updater.reportFailure("Cancelled field statistics.")
+            else:
+                self.updater.reportSuccess("Finished field statistics.", stats)
+        except:
+            import traceback
+            error = traceback.format_exc()
+            self.updater.reportFailure(error)
+
+
+class FieldStatisticsStatus(ThreadStatus):
+    """Report the status of a L{FieldStatisticsThread} to the mode's status
+    bar and show the statistics of the field when finished.
+    """
+    def __init__(self, mode, decoder, field):
+        ThreadStatus.__init__(self)
+        self.mode = mode
+        self.decoder = decoder
+        self.field = field
+        self.thread = None
+    
+    def updateStatusGUI(self, perc, text=None):
+        if self.mode.status_info.isCancelled():
+            self.thread.stopStatistics()
+        self.mode.status_info.updateProgress(int(perc), text)
+    
+    def reportSuccessGUI(self, text, data):
+        self.mode.buffer.setBusy(False)
+        self.mode.status_info.stopProgress(text)
+        self.mode.table.setStats(self.decoder, data)
+        self.mode.showFieldStatisticsDialog(self.field, data[self.field])
+    
+    def reportFailureGUI(self, text):
+        self.mode.buffer.setBusy(False)
+        self.mode.status_info.stopProgress(text)
+
+
+class UndoableBinaryChange(UndoableItem):
+    """Undo record for a single call to L{HexEditSTC.SetBinaryData}"""
+    def __init__(self, start, old, new):
+        self.start = start
+        self.old = old
+        self.new = new
+
+    def undo(self, stc):
+        stc.replaceBinaryData(self.start, self.start + len(self.new), self.old)
+
+    def redo(self, stc):
+        stc.replaceBinaryData(self.start, self.start + len(self.old), self.new)
+
+
+class BinaryModifiedEvent(object):
+    """Stand-in for the wx.stc.StyledTextEvent that is passed to the modify
+    callbacks of the L{HexEditSTC}
+    """
+    def __init__(self, pos, text):
+        self.pos = pos
+        self.text = text
+
+    def GetModificationType(self):
+        return wx.stc.STC_MOD_DELETETEXT | wx.stc.STC_MOD_INSERTTEXT
+
+    def GetPosition(self):
+        return self.pos
+
+    def GetLinesAdded(self):
+        return 0
+
+    def GetLength(self):
+        return len(self.text)
+
+    def GetText(self):
+        return self.text
+
+
+class HexEditSTC(UndoMixin, NonResidentSTC, debugmixin):
+    """Storage for the hex editor that reads the file on demand
+
+    Local files are memory mapped and other files are read through a block
+    cache, so the file is never loaded into memory in its entirety and huge
+    files open instantly.  Edits are kept in a L{PieceTable} overlay until the
+    file is saved.  If the length of the file hasn't changed, saving only
+    writes the modified pages back into the original file.
+    """
+    def __init__(self, parent=None, copy=None):
+        NonResidentSTC.__init__(self, parent, copy)
+        UndoMixin.__init__(self)
+        self.url = None
+        self.fh = None
+        self.mmap = None
+        self.table = PieceTable()
+        self.change_callback = None
+        self.modified_callbacks = []
+        self.save_url = None
+        self.temp_url = None
+        self.inplace_fh = None
+
+    def open(self, buffer, message=None):
+        self.openURL(buffer.url)
+
+    def openURL(self, url):
+        """Replace the contents with the unmodified data from the url"""
+        self.closeURL()
+        self.url = url
+        if not vfs.exists(url):
+            # New file that will be created when it's saved
+            self.table = PieceTable()
+        elif url.scheme == 'file':
+            self.fh = open(unicode(url.path), 'rb')
+            size = os.fstat(self.fh.fileno()).st_size
+            try:
+                if size > 0:
+                    self.mmap = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError, OverflowError), e:
+                # Files larger than the address space can't be mapped
+                self.dprint("Can't mmap %s: %s" % (url, e))
+            if self.mmap is not None:
+                self.table = PieceTable(self.mmap, size)
+            else:
+                self.table = PieceTable(BlockCacheReader(self.fh), size)
+        else:
+            self.fh = vfs.open(url)
+            self.table = PieceTable(BlockCacheReader(self.fh))
+        self.dprint("Opened %s: %d bytes" % (url, len(self.table)))
+
+    def closeURL(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def revertEncoding(self, buffer, url=None, message=None, encoding=None, allow_undo=False):
+        if url is None:
+            url = buffer.url
+        self.openURL(url)
+        self.EmptyUndoBuffer()
+        self.fireModified(0, "")
+
+    def GetLength(self):
+        return len(self.table)
+
+    GetTextLength = GetLength
+
+    def GetBinaryData(self, start=0, end=-1):
+        return self.table.read(start, end)
+
+    def SetBinaryData(self, start, end, bytes):
+        old = self.replaceBinaryData(start, end, bytes)
+        self.undoMixinSaveUndoableItem(UndoableBinaryChange(start, old, bytes))
+
+    def replaceBinaryData(self, start, end, bytes):
+        """Replace the bytes without saving an undo record
+
+        @returns: the bytes that were replaced
+        """
+        old = self.table.replace(start, end, bytes)
+        self.fireModified(start, bytes)
+        return old
+
+    def addDocumentChangeEvent(self, callback):
+        self.change_callback = callback
+
+    def removeDocumentChangeEvent(self):
+        self.change_callback = None
+
+    def addModifyCallback(self, func):
+        self.modified_callbacks.append(func)
+
+    def removeModifyCallback(self, func):
+        if func in self.modified_callbacks:
+            self.modified_callbacks.remove(func)
+
+    def fireModified(self, pos, bytes):
+        evt = BinaryModifiedEvent(pos, bytes)
+        for cb in self.modified_callbacks:
+            cb(evt)
+        if self.change_callback:
+            self.change_callback(evt)
+
+    def openFileForWriting(self, url):
+        self.save_url = url
+        if url == self.url and vfs.exists(url):
+            if url.scheme == 'file' and self.table.canWriteChanges():
+                self.inplace_fh = open(unicode(url.path), 'r+b')
+                return self.inplace_fh
+
+            # The original file is still being read while the new copy is
+            # written, so the new copy can't overwrite it directly.
+            self.temp_url = vfs.get_child_reference(vfs.get_dirname(url), vfs.get_filename(url) + u".tmp")
+            return vfs.open_write(self.temp_url)
+        return vfs.open_write(url)
+
+    def writeTo(self, fh, url):
+        if fh is not None and fh is self.inplace_fh:
+            count = self.table.writeChanges(fh)
+        else:
+            count = self.table.write(fh)
+        self.dprint("Wrote %d bytes to %s" % (count, url))
+
+    def closeFileAfterWriting(self, fh):
+        fh.close()
+        if self.temp_url is not None:
+            self.closeURL()
+            vfs.replace(self.temp_url, self.save_url)
+            self.temp_url = None
+        self.inplace_fh = None
+
+        # The saved file now contains all the edits, so start over with an
+        # empty overlay.  The undo history remains valid because the offsets
+        # and the bytes are the same.
+        self.openURL(self.save_url)
+
+    def Destroy(self):
+        self.closeURL()
+
+
 class HexEditMode(STCInterface, Grid.Grid, MajorMode):
     """
     View for editing in hexidecimal notation.
@@ -820,6 +1081,8 @@ class HexEditMode(STCInterface, Grid.Grid, MajorMode):
     icon='icons/tux.png'
     mimetype = 'application/octet-stream'
     
+    stc_class = HexEditSTC
+    
     @classmethod
     def verifyCompatibleSTC(self, stc_class):
         return hasattr(stc_class, 'GetBinaryData')
@@ -948,11 +1211,64 @@ class HexEditMode(STCInterface, Grid.Grid, MajorMode):
     def GetColumn(self, pos):
         return self.GetGridCursorCol()
 
+    def showFieldStatistics(self):
+        """Show the statistics of the field under the cursor
+        
+        If the statistics aren't cached, they are calculated in a background
+        thread and shown when the calculation finishes.
+        """
+        table = self.table
+        col = self.GetGridCursorCol()
+        field = table.getTextCol(col)
+        if field < 0:
+            # In the hex digits, so use the field that contains the byte
+            field = bisect.bisect_right(table.offsets, col) - 1
+        stats = table.getStats()
+        if stats is not None:
+            self.showFieldStatisticsDialog(field, stats[field])
+            return
+        status = FieldStatisticsStatus(self, table.decoder, field)
+        thread = FieldStatisticsThread(table.createStatistics(), status)
+        status.thread = thread
+        self.buffer.setBusy(True)
+        self.status_info.startProgress("Calculating field statistics...", 100, cancel=True, delay=0.5)
+        thread.start()
+    
+    def showFieldStatisticsDialog(self, field, stats):
+        table = self.table
+        lines = ["Field %d (%s)" % (field, table.types[field]), "",
+                 "min = %s" % stats.min,
+                 "max = %s" % stats.max,
+                 "mean = %s" % stats.mean]
+        if stats.nonfinite:
+            lines.append("NaN or infinite = %d" % stats.nonfinite)
+        lines.append("")
+        for i, count in enumerate(stats.histogram):
+            lines.append("%g to %g: %d" % (stats.bin_edges[i], stats.bin_edges[i + 1], count))
+        dlg = wx.MessageDialog(self.frame, "\n".join(lines), "Field Statistics", wx.OK | wx.ICON_INFORMATION)
+        dlg.ShowModal()
+        dlg.Destroy()
+
     def GotoPos(self, pos):
+        pos = max(0, min(pos, self.table.stc.GetLength() - 1))
         row, col=self.GetTable().getCursorPosition(pos, self.GetGridCursorCol())
         self.SetGridCursor(row,col)
         self.MakeCellVisible(row,col)
     
+    def CanUndo(self):
+        return self.buffer.stc.CanUndo()
+
+    def Undo(self):
+        self.buffer.stc.Undo()
+        self.OnUnderlyingUpdate(None)
+
+    def CanRedo(self):
+        return self.buffer.stc.CanRedo()
+
+    def Redo(self):
+        self.buffer.stc.Redo()
+        self.OnUnderlyingUpdate(None)
+
     def addUpdateUIEvent(self, callback):
         """Add the equivalent to STC_UPDATEUI event for UI changes.
 
@@ -1047,4 +1363,4 @@ class HexEditPlugin(IPeppyPlugin, debugmixin):
 
     def getActions(self):
         return [OpenHexEditor, GotoOffset, HexRecordFormat, ShowHexDigits,
-                ShowRecordNumbers]
+                ShowRecordNumbers, ShowFieldStatistics]
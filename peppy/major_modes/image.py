@@ -15,13 +15,12 @@ editing will be left to a different major mode.
 """
 
 import os
-from cStringIO import StringIO
 
 import wx
-import wx.stc
-from wx.lib.evtmgr import eventManager
 import wx.lib.newevent
 
+import peppy.vfs as vfs
+
 from peppy.actions import *
 from peppy.major import *
 from peppy.lib.bitmapscroller import *
@@ -82,6 +81,65 @@ class RectangularSelect(ImageActionMixin, ToggleAction):
             mode.setSelector(RubberBand)
 
 
+class ImageSTC(NonResidentSTC, debugmixin):
+    """Storage for an image that is decoded directly from the file
+    
+    The bytes of the file are never loaded into a styled text control;
+    instead, the image is decoded by wx directly from the file on the local
+    filesystem, or streamed from the vfs file handle for other schemes.
+    """
+    def __init__(self, parent=None, copy=None):
+        NonResidentSTC.__init__(self, parent, copy)
+        self.url = None
+        self.image = None
+    
+    def open(self, buffer, message=None):
+        """Decode the image
+        
+        Called from the loading thread, so only the wx.Image is created here;
+        the bitmaps are created by the major mode in the GUI thread.
+        """
+        self.url = buffer.url
+        self.image = self.loadImage(self.url)
+    
+    def loadImage(self, url):
+        # Can't use wx.ImageFromStream(fh), because a malformed image
+        # causes python to crash.
+        img = wx.EmptyImage()
+        if url.scheme == 'file':
+            # Let wx read the file itself so the bytes of the file are never
+            # copied into a python string
+            path = unicode(url.path)
+            self.dprint("Loading %s from disk" % path)
+            ok = img.LoadFile(path, wx.BITMAP_TYPE_ANY)
+        else:
+            fh = vfs.open(url)
+            try:
+                ok = img.LoadStream(fh)
+            finally:
+                fh.close()
+        if not ok:
+            raise TypeError("Bad image -- either it really isn't an image, or wxPython doesn't support the image format.")
+        return img
+    
+    def revertEncoding(self, buffer, url=None, message=None, encoding=None, allow_undo=False):
+        if url is None:
+            url = buffer.url
+        self.image = self.loadImage(url)
+    
+    def getImage(self):
+        return self.image
+    
+    def CanSave(self):
+        return False
+    
+    def GetLength(self):
+        return vfs.get_size(self.url)
+    
+    def Destroy(self):
+        self.image = None
+
+
 class ImageViewMode(BitmapScroller, STCInterface, MajorMode):
     """
     Major mode for viewing images.  Eventually this may contain more
@@ -93,8 +151,11 @@ class ImageViewMode(BitmapScroller, STCInterface, MajorMode):
     keyword="ImageView"
     icon='icons/picture.png'
 
+    stc_class = ImageSTC
+
     default_classprefs = (
         StrParam('extensions', 'jpg jpeg gif bmp png ico', fullwidth=True),
+        IntParam('preview_size', 2048, 'Images wider or taller than this number of pixels are\ninitially displayed as a downsampled preview\n(0 to always display at full size)'),
         )
 
     def __init__(self, parent, wrapper, buffer, frame):
@@ -103,51 +164,28 @@ class ImageViewMode(BitmapScroller, STCInterface, MajorMode):
         self.update()
         
     def update(self):
-        bytes = self.buffer.stc.GetBinaryData()
-        #dprint(repr(bytes))
-        fh = StringIO(bytes)
-
-        # Can't use wx.ImageFromStream(fh), because a malformed image
-        # causes python to crash.
-        img = wx.EmptyImage()
-        if img.LoadStream(fh):
-            self.setImage(img)
-        else:
-            raise TypeError("Bad image -- either it really isn't an image, or wxPython doesn't support the image format.")
-
-    def createListenersPostHook(self):
-        eventManager.Bind(self.underlyingSTCChanged, wx.stc.EVT_STC_MODIFIED,
-                          self.buffer.stc)
-
-        # Thread stuff for the underlying change callback
-        self.waiting=None
-
-    def removeListenersPostHook(self):
-        """
-        Clean up the event manager hook that we needed to find out
-        when the buffer had been changed by some other view of the
-        buffer.
-        """
-        assert self.dprint("unregistering %s" % self.underlyingSTCChanged)
-        eventManager.DeregisterListener(self.underlyingSTCChanged)        
+        img = self.buffer.stc.getImage()
+        self.setImage(img, zoom=self.getPreviewZoom(img))
+    
+    def getPreviewZoom(self, img):
+        """Return the initial zoom factor of the image
         
-    def underlyingSTCChanged(self,evt):
+        Large images are displayed zoomed out by a power of two so the scaled
+        bitmap is no larger than the preview size, rather than creating a
+        bitmap of the full image.  The full resolution is still available by
+        zooming in.
         """
-        Update the image when it has been changed by another view of
-        the data.
-
-        @param evt: EVT_STC_MODIFIED event 
-        """
-        # Since we can never edit the image directly, we don't need to
-        # short-circuit this callback like we do with hexedit mode.
-        # Every change that we get here means that the image has
-        # changed.
-
-        # FIXME: don't actually perform the complete update right now
-        # because it's probably too slow.  Queue it for later and put
-        # it in a thread.
-        # self.update()
-        pass
+        limit = self.classprefs.preview_size
+        zoom = 1.0
+        if limit > 0:
+            size = max(img.GetWidth(), img.GetHeight())
+            while size * zoom > limit and zoom > self.min_zoom:
+                zoom /= 2
+        return zoom
+    
+    def revertPostHook(self):
+        self.update()
+        MajorMode.revertPostHook(self)
 
     def CanCopy(self):
         return True
@@ -16,6 +16,8 @@ from peppy.sidebar import *
 
 from wx.lib.pubsub import Publisher
 
+from peppy.lib.idlescheduler import getIdleScheduler
+
 USE_DEBUG_LEAK = False
 if USE_DEBUG_LEAK:
     gc.enable()
@@ -41,6 +43,22 @@ class DebugGarbage(SelectAction):
         print "--summary: %d objects" % (len(gc.garbage))
 
 
+class DebugIdleTasks(SelectAction):
+    """Show timing statistics of the idle tasks"""
+    name = "Idle Task Statistics"
+    default_menu = (("Tools/Debug", -1000), 600)
+
+    def action(self, index=-1, multiplier=1):
+        scheduler = getIdleScheduler()
+        print "\nIDLE TASKS (budget %.1fms):" % (scheduler.budget * 1000)
+        for task in scheduler.tasks:
+            print "  %s" % task
+        print "\nIDLE TASK STATISTICS:"
+        for stats in scheduler.getAllStats():
+            print "  %s" % stats
+        scheduler.resetStats()
+
+
 class DebugClass(Sidebar, wx.CheckListBox, debugmixin):
     """Turn debug printing on or off for the listed classes.
 
@@ -172,5 +190,6 @@ class DebugClassPlugin(IPeppyPlugin):
         # Don't show menu if in optimize mode
         if __debug__:
             yield DebugGarbage
+            yield DebugIdleTasks
         else:
             raise StopIteration
@@ -64,6 +64,17 @@ class DebugKeypress(ToggleAction):
         AcceleratorList.debug = not AcceleratorList.debug
 
 
+class DebugKeymapStats(SelectAction):
+    """Show timing statistics of the keymap rebuilds and keystroke lookups"""
+    name = "Keymap Statistics"
+    default_menu = (("Tools/Debug", -1000), 110)
+    
+    def action(self, index=-1, multiplier=1):
+        print "\nKEYMAP STATISTICS (%d cached keymaps):" % len(CompiledKeymap.cache)
+        print AcceleratorList.stats
+        AcceleratorList.stats.reset()
+
+
 class EditKeybindings(SelectAction):
     """Display and edit key bindings."""
     name = "Key Bindings..."
@@ -520,7 +531,7 @@ class KeybindingMode(ListMode):
         index = self.list.GetFirstSelected()
         if index == -1:
             return None
-        actionwrapper = self.list.itemDataMap[index][0]
+        actionwrapper = self.getEntryFromIndex(index)[0]
         return actionwrapper.action
 
     def getPopupActions(self, evt, x, y):
@@ -811,6 +822,7 @@ class KeyboardConf(IPeppyPlugin):
     def getActions(self):
         yield ShowModeKeys
         yield DebugKeypress
+        yield DebugKeymapStats
         yield EditKeybindings
         
     def getCompatibleActions(self, modecls):
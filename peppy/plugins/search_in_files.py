@@ -648,18 +648,9 @@ class SearchMode(ListMode):
     def getItemRawValues(self, index, item):
         return (item.short, item.line, item.text, item.url)
     
-    def appendListItems(self, items):
-        self.list.Freeze()
-        index = self.list.GetItemCount()
-        for item in items:
-            self.insertListItem(item, index)
-            index += 1
-        self.list.Thaw()
-    
     def OnItemActivated(self, evt):
         index = evt.GetIndex()
-        orig_index = self.list.GetItemData(index)
-        values = self.list.itemDataMap[orig_index]
+        values = self.getEntryFromIndex(index)
         dprint(values)
         self.frame.findTabOrOpen(values[3], options={'line':values[1] - 1})
 
@@ -66,6 +66,7 @@ class Tabify(LineOrRegionMutateAction):
     """Replace spaces with tabs at the start of lines."""
     name = "&Tabify"
     default_menu = (("Transform/Whitespace", -800), 100)
+    independent_lines = True
 
     def mutateLines(self, lines):
         out = []
@@ -83,6 +84,7 @@ class Untabify(LineOrRegionMutateAction):
     """Replace tabs with spaces at the start of lines."""
     name = "&Untabify"
     default_menu = ("Transform/Whitespace", 110)
+    independent_lines = True
 
     def mutateLines(self, lines):
         out = []
@@ -102,6 +104,7 @@ class RemoveTrailingWhitespace(LineOrRegionMutateAction):
     """
     name = "Remove Trailing Whitespace"
     default_menu = ("Transform/Whitespace", 200)
+    independent_lines = True
 
     def mutateLines(self, lines):
         regex = re.compile('(.*?)([\t ]+)([\r\n]+)?$')
@@ -124,6 +127,7 @@ class RemoveBlankLines(LineOrRegionMutateAction):
     """
     name = "Remove Blank Lines"
     default_menu = ("Transform/Whitespace", 300)
+    independent_lines = True
 
     def mutateLines(self, lines):
         regex = re.compile('^[\t ]*[\r\n]+?$')
@@ -224,6 +228,9 @@ class Backslashify(LineOrRegionMutateAction):
     """
     name = "Backslashify"
     default_menu = ("Transform", 910)
+    
+    # mutateLines uses the stc to find the line separator
+    background_safe = False
 
     def isActionAvailable(self):
         """The action is only available if a region has multiple lines."""
@@ -251,6 +258,7 @@ class UnBackslashify(LineOrRegionMutateAction):
     alias = "remove-backslashes"
     name = "Remove Backslashes"
     default_menu = ("Transform", 911)
+    independent_lines = True
 
     def isActionAvailable(self):
         """The action is only available if a region has multiple lines."""
@@ -262,7 +270,6 @@ class UnBackslashify(LineOrRegionMutateAction):
         """
         out = []
         regex = re.compile(r"(.*?)\s*\\(\s)*$")
-        eol = self.mode.getLinesep()
         for line in lines:
             match = regex.match(line)
             if match:
@@ -422,6 +429,9 @@ class JoinLines(LineOrRegionMutateAction):
     name = "Join Lines"
     default_menu = ("Transform", 610)
     key_bindings = {'default': 'M-j',}
+    
+    # mutateLines uses the stc to find the line separator
+    background_safe = False
 
     def mutateLines(self, lines):
         if len(lines) <= 1:
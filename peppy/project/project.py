@@ -329,13 +329,16 @@ class ProjectInfo(CTAGS):
         filename = str(url.path)
         dprint(filename)
         if lang == "fortran":
-            stats = FortranStaticAnalysis(serialized_filename=filename, regenerate=regenerate)
+            # The previous results are always loaded, even when regenerating,
+            # because only the source files that have changed since the last
+            # analysis need to be scanned again.
+            stats = FortranStaticAnalysis(serialized_filename=filename)
             if not regenerate and not stats.isEmpty():
                 return url
-            for source in self.walkProjectDir(["*.f", "*.f90"]):
-                print source
-                stats.scan(source)
-            stats.analyze()
+            sources = list(self.walkProjectDir(["*.f", "*.f90"]))
+            # Scan in this process: a process pool would fork the GUI
+            changed = stats.update(sources, processes=1)
+            dprint("Scanned %d of %d source files" % (len(changed), len(sources)))
             stats.summary()
             dprint(filename)
             stats.saveStateToFile()
@@ -291,6 +291,45 @@ class PeppyBaseSTC(wx.stc.StyledTextCtrl, STCInterface, debugmixin):
             self.refstc.encoded = None
             raise
     
+    def getSnapshotEncoder(self):
+        """Return a callable that encodes a snapshot of the document
+        
+        Only the magic comments are examined and the document text copied
+        here; the conversion to the file's encoding happens in the callable.
+        The encoding of the document isn't changed as it is in
+        L{prepareEncoding}, so this is suitable for autosave copies.
+        """
+        numchars = self.GetTextLength()
+        header = self.GetTextRange(0, min(numchars, 1024))
+        encoding, bom = detectEncoding(header)
+        if not encoding and self.refstc.encoding:
+            encoding = self.refstc.encoding
+            bom = self.refstc.bom
+        
+        if not encoding:
+            # Binary data is stored as styled text; see prepareEncoding
+            styled = self.GetStyledText(0, numchars)
+            def encode():
+                return styled[0:numchars*2:2]
+            return encode
+        
+        if hasattr(self, 'GetTextRaw') and self.GetCodePage() == wx.stc.STC_CP_UTF8:
+            # The raw text avoids the conversion to unicode in the GUI thread,
+            # and doesn't need any conversion at all if the file is utf-8
+            txt = self.GetTextRaw()
+            utf8 = True
+        else:
+            txt = self.GetText()
+            utf8 = False
+        def encode():
+            bytes = bom or ""
+            if utf8:
+                if codecs.lookup(encoding).name == 'utf-8':
+                    return bytes + txt
+                return bytes + txt.decode('utf-8').encode(encoding)
+            return bytes + txt.encode(encoding)
+        return encode
+    
     def openFileForWriting(self, url):
         return vfs.open_write(url)
 
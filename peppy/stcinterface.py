@@ -164,6 +164,18 @@ class STCInterface(object):
         """
         pass
     
+    def getSnapshotEncoder(self):
+        """Return a callable that returns the encoded bytes of a snapshot of
+        the document.
+        
+        The snapshot is taken when this method is called, but the encoding is
+        deferred until the callable is called so that it can be performed in
+        a background thread.  Return None if the document can't be encoded
+        outside of the GUI thread, in which case L{prepareEncoding} and
+        L{writeTo} are used instead.
+        """
+        return None
+    
     def openFileForWriting(self, url):
         """Return a file handle that has been opened for writing"""
         return None
@@ -54,6 +54,10 @@ __all__ = [
     'open_numpy_mmap',
     'open_write',
     'get_metadata',
+    'get_entry_metadata',
+    'get_folder_metadata',
+    'get_child_reference',
+    'replace',
     'copy',
     'move',
     'get_names',
@@ -16,6 +16,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # Import from the Standard Library
+import sys
 from datetime import datetime
 from os import (listdir, makedirs, mkdir, remove, rename, rmdir, stat, walk,
                 access, chmod, R_OK, W_OK)
@@ -234,6 +235,25 @@ class FileFS(BaseFS):
             cls.remove(src)
 
 
+    @classmethod
+    def replace(cls, source, target):
+        """Move the source to the target using an atomic rename where the
+        operating system supports it, replacing the target if it exists.
+        """
+        src = unicode(source.path)
+        dst = unicode(target.path)
+        try:
+            target_exists = exists(dst)
+        except UnicodeEncodeError:
+            src = src.encode('utf-8')
+            dst = dst.encode('utf-8')
+            target_exists = exists(dst)
+        if sys.platform == 'win32' and target_exists:
+            # Windows can't rename over an existing file
+            remove(dst)
+        rename(src, dst)
+
+
     ######################################################################
     # Folders only
     @classmethod
@@ -249,6 +269,24 @@ class FileFS(BaseFS):
             if names and isinstance(names[0], str):
                 names = [n.decode('utf-8') for n in names]
         return names
+
+
+    @classmethod
+    def get_folder_metadata(cls, reference, names):
+        """Return the metadata of the named entries in the folder using a
+        single stat call per entry.
+        """
+        from peppy.vfs.utils import get_child_reference, get_stat_metadata
+        for name in names:
+            child = get_child_reference(reference, name)
+            try:
+                attrs = cls.unicode_wrapper(child, stat)
+                metadata = get_stat_metadata(child, attrs)
+                metadata['can_read'] = cls.can_read(child)
+                metadata['can_write'] = cls.can_write(child)
+            except (OSError, IOError):
+                metadata = None
+            yield name, metadata
         
 
 
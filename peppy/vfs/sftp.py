@@ -2,6 +2,7 @@
 # Licenced under the GPLv2; see http://peppy.flipturn.org for more info
 import os, stat
 import getpass
+import thread, threading, weakref
 from binascii import hexlify
 from datetime import datetime
 from StringIO import StringIO
@@ -14,6 +15,7 @@ from itools.uri.generic import Authority
 from itools.core.cache import LRUCache
 
 from peppy.debug import dprint
+from peppy.lib.dictutils import TimeExpiringDict
 import pprint
 pp = pprint.PrettyPrinter(indent=0)
 
@@ -37,17 +39,132 @@ def get_transport(transport_key):
     return t
 
 
+class SFTPConnectionPool(object):
+    """Pool of SFTP channels multiplexed over a single authenticated
+    transport to a host.
+
+    An SFTPClient can't be used by more than one thread at a time because
+    responses to concurrent requests on the same channel get mixed up, so
+    each thread is given its own channel.  Channels of threads that have
+    exited are reused by new threads, and up to max_idle unused channels are
+    kept open so they don't have to be renegotiated.
+    """
+    max_idle = 4
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.clients = {}
+        self.threads = {}
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def is_active(self):
+        return self.transport.is_active()
+
+    def _release_dead_threads(self):
+        for ident, ref in self.threads.items():
+            t = ref()
+            if t is None or not t.isAlive():
+                del self.threads[ident]
+                client = self.clients.pop(ident)
+                if len(self.idle) < self.max_idle:
+                    self.idle.append(client)
+                else:
+                    client.close()
+
+    def get_client(self):
+        """Return the SFTPClient that the calling thread should use"""
+        ident = thread.get_ident()
+        self.lock.acquire()
+        try:
+            client = self.clients.get(ident)
+            if client is not None and not client.get_channel().closed:
+                return client
+            self._release_dead_threads()
+            client = None
+            while self.idle and client is None:
+                client = self.idle.pop()
+                if client.get_channel().closed:
+                    client = None
+            if client is None:
+                client = paramiko.SFTPClient.from_transport(self.transport)
+            self.clients[ident] = client
+            self.threads[ident] = weakref.ref(threading.currentThread())
+            return client
+        finally:
+            self.lock.release()
+
+    def get_num_channels(self):
+        return len(self.clients) + len(self.idle)
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for client in self.clients.values() + self.idle:
+                client.close()
+            self.clients = {}
+            self.threads = {}
+            self.idle = []
+        finally:
+            self.lock.release()
+
+
+class SFTPWriteFile(object):
+    """Wrapper around an SFTPFile opened for writing that removes the cached
+    attributes of the file when it is closed.
+    """
+    def __init__(self, fh, ref, purge):
+        self.fh = fh
+        self.ref = ref
+        self.purge = purge
+
+    def __getattr__(self, name):
+        return getattr(self.fh, name)
+
+    def __iter__(self):
+        return iter(self.fh)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        try:
+            self.fh.close()
+        finally:
+            self.purge(self.ref)
+
 
 class SFTPFS(BaseFS):
     temp_file_class = TempFile
     
     credentials = {}
+    
+    # Map of host to the L{SFTPConnectionPool} for that host
     connection_cache = {}
     
+    # Attributes of recently used paths, shared by all the predicates so that
+    # a sequence like exists/is_file/get_size only makes one request.  Paths
+    # that don't exist are stored as None.
+    attr_cache = TimeExpiringDict(5)
+    
+    # The cache is used by the GUI thread and background threads like the
+    # metadata loader of dired, so all access goes through this lock
+    cache_lock = threading.Lock()
+    
+    # Files up to this size are read using paramiko's prefetch, which
+    # pipelines read requests for the whole file instead of waiting for each
+    # block to arrive before requesting the next.
+    prefetch_limit = 32 * 1024 * 1024
+    
+    buffer_size = 65536
+    
     debug = False
 
     @classmethod
-    def _get_sftp(cls, ref):
+    def _get_transport_key(cls, ref):
         hostname = ref.authority.host
         if ref.authority.port:
             try:
@@ -56,6 +173,11 @@ class SFTPFS(BaseFS):
                 raise OSError("[Errno 2] Invalid port specification: %s" % ref.authority.port)
         else:
             port = 22
+        return hostname, port
+
+    @classmethod
+    def _get_authenticated_transport(cls, ref):
+        hostname, port = cls._get_transport_key(ref)
         if ref.authority.userinfo:
             if ":" in ref.authority.userinfo:
                 username, passwd = ref.authority.userinfo.split(":")
@@ -77,8 +199,7 @@ class SFTPFS(BaseFS):
                 t = cls._password_auth(transport_key, username, passwd)
 
             if t.is_authenticated():
-                sftp = paramiko.SFTPClient.from_transport(t)
-                return sftp
+                return t
         
         raise OSError("[Errno 2] Incomplete URL: '%s'" % ref)
     
@@ -171,28 +292,82 @@ class SFTPFS(BaseFS):
                 passwd = ""
 
     @classmethod
-    def _get_client(cls, ref):
-        client = None
+    def _get_pool(cls, ref):
+        pool = None
         newref = cls._copy_root_reference_without_username(ref)
         if newref in cls.connection_cache:
-            client = cls.connection_cache[newref]
-            if cls.debug: dprint("Found cached sftp connection: %s" % client)
-            transport = client.get_channel().get_transport()
-            if not transport.is_active():
-                dprint("Cached channel closed.  Opening new connection for %s" % ref)
-                client = None
+            pool = cls.connection_cache[newref]
+            if cls.debug: dprint("Found cached sftp connection: %s" % pool)
+            if not pool.is_active():
+                dprint("Cached transport closed.  Opening new connection for %s" % ref)
+                pool = None
             
-        if client is None:
-            client = cls._get_sftp(ref)
-            if cls.debug: dprint("Creating sftp connection: %s" % client)
-            cls.connection_cache[newref] = client
-        return client
-        
+        if pool is None:
+            t = cls._get_authenticated_transport(ref)
+            pool = SFTPConnectionPool(t)
+            if cls.debug: dprint("Creating sftp connection: %s" % pool)
+            cls.connection_cache[newref] = pool
+        return pool
+
+    @classmethod
+    def _get_client(cls, ref):
+        return cls._get_pool(ref).get_client()
+    
+    @classmethod
+    def _get_cache_key(cls, ref):
+        path = str(ref.path)
+        if len(path) > 1:
+            path = path.rstrip("/")
+        return (ref.authority.host, ref.authority.port, path)
+    
+    @classmethod
+    def _purge_cache(cls, *refs):
+        """Remove the cached attributes of the references and of anything
+        contained in them if they are folders.
+        """
+        cls.cache_lock.acquire()
+        try:
+            for ref in refs:
+                key = cls._get_cache_key(ref)
+                if cls.debug: dprint("Removing cache for %s" % str(key))
+                cls.attr_cache.pop(key, None)
+                prefix = key[2].rstrip("/") + "/"
+                for other in cls.attr_cache.keys():
+                    if other[0:2] == key[0:2] and other[2].startswith(prefix):
+                        cls.attr_cache.pop(other, None)
+        finally:
+            cls.cache_lock.release()
+    
+    @classmethod
+    def _set_cached_attrs(cls, key, attrs):
+        cls.cache_lock.acquire()
+        try:
+            cls.attr_cache[key] = attrs
+        finally:
+            cls.cache_lock.release()
+    
     @classmethod
     def _stat(cls, ref):
-        client = cls._get_client(ref)
-        attrs = client.stat(str(ref.path))
-        if cls.debug: dprint("%s: %s" % (ref, repr(attrs)))
+        key = cls._get_cache_key(ref)
+        cls.cache_lock.acquire()
+        try:
+            found = key in cls.attr_cache
+            if found:
+                attrs = cls.attr_cache[key]
+        finally:
+            cls.cache_lock.release()
+        if found:
+            if cls.debug: dprint("attr_cache hit: %s" % str(key))
+        else:
+            client = cls._get_client(ref)
+            try:
+                attrs = client.stat(key[2])
+            except IOError:
+                attrs = None
+            cls._set_cached_attrs(key, attrs)
+            if cls.debug: dprint("%s: %s" % (ref, repr(attrs)))
+        if attrs is None:
+            raise IOError("[Errno 2] No such file or directory: '%s'" % ref)
         return attrs
     
     @classmethod
@@ -285,9 +460,15 @@ class SFTPFS(BaseFS):
     def _save_file(cls, ref, data):
         client = cls._get_client(ref)
         path = str(ref.path)
-        fh = client.open(path, mode='w')
-        fh.write(data)
-        fh.close()
+        fh = client.open(path, mode='w', bufsize=cls.buffer_size)
+        # Don't wait for the acknowledgement of each block before sending the
+        # next one; any error is reported when the file is closed
+        fh.set_pipelined(True)
+        try:
+            fh.write(data)
+        finally:
+            fh.close()
+            cls._purge_cache(ref)
 
     @classmethod
     def make_folder(cls, ref):
@@ -304,6 +485,7 @@ class SFTPFS(BaseFS):
         path = str(ref.path)
         if cls.debug: dprint(path)
         client.mkdir(path)
+        cls._purge_cache(ref)
 
     @classmethod
     def remove(cls, ref):
@@ -323,6 +505,7 @@ class SFTPFS(BaseFS):
             client.rmdir(str(ref.path))
         else:
             client.remove(str(ref.path))
+        cls._purge_cache(ref)
     
     @classmethod
     def walk(cls, client, top, topdown=True, onerror=None):
@@ -353,11 +536,22 @@ class SFTPFS(BaseFS):
         if not topdown:
             yield top, dirs, nondirs
     
+    @classmethod
+    def _prefetch(cls, fh, size):
+        """Start pipelined reads of the entire file"""
+        try:
+            fh.prefetch(size)
+        except TypeError:
+            # Older versions of paramiko stat the file to find the size
+            fh.prefetch()
+
     @classmethod
     def open(cls, ref, mode=None):
-        if not cls.exists(ref):
+        try:
+            attrs = cls._stat(ref)
+        except IOError:
             raise OSError("[Errno 2] No such file or directory: '%s'" % ref)
-        if not cls.is_file(ref):
+        if not stat.S_ISREG(attrs.st_mode):
             raise OSError("[Errno 20] Not a file: '%s'" % ref)
         client = cls._get_client(ref)
         path = str(ref.path)
@@ -365,12 +559,19 @@ class SFTPFS(BaseFS):
             # write truncates
             fh = cls.temp_file_class(ref, cls._save_file, "")
         elif mode == APPEND:
-            fh = client.open(path, mode='a')
+            fh = client.open(path, mode='a', bufsize=cls.buffer_size)
+            fh.set_pipelined(True)
+            cls._purge_cache(ref)
+            fh = SFTPWriteFile(fh, ref, cls._purge_cache)
         elif mode == READ_WRITE:
             # Open for read/write but don't position at end of file, i.e. "r+b"
             fh = client.open(path, mode='r+')
+            cls._purge_cache(ref)
+            fh = SFTPWriteFile(fh, ref, cls._purge_cache)
         else:
-            fh = client.open(path, mode='r')
+            fh = client.open(path, mode='r', bufsize=cls.buffer_size)
+            if 0 < attrs.st_size <= cls.prefetch_limit:
+                cls._prefetch(fh, attrs.st_size)
         return fh
 
     @classmethod
@@ -380,6 +581,7 @@ class SFTPFS(BaseFS):
 
         client = cls._get_client(source)
         client.rename(str(source.path), str(target.path))
+        cls._purge_cache(source, target)
 
     @classmethod
     def get_names(cls, ref):
@@ -392,6 +594,35 @@ class SFTPFS(BaseFS):
         if cls.debug: dprint(filenames)
         return filenames
 
+    @classmethod
+    def get_folder_metadata(cls, ref, names):
+        """Return the metadata of the entries in the folder using a single
+        directory listing request rather than a stat request per entry.
+        """
+        client = cls._get_client(ref)
+        path = str(ref.path)
+        if not path.endswith("/"):
+            path += "/"
+        remaining = set(names)
+        for attrs in client.listdir_attr(path):
+            name = attrs.filename
+            if name not in remaining:
+                continue
+            remaining.discard(name)
+            child = utils.get_child_reference(ref, name)
+            try:
+                if stat.S_ISLNK(attrs.st_mode):
+                    # Listings don't follow symbolic links
+                    attrs = cls._stat(child)
+                else:
+                    cls._set_cached_attrs(cls._get_cache_key(child), attrs)
+                metadata = utils.get_stat_metadata(child, attrs)
+            except IOError:
+                metadata = None
+            yield name, metadata
+        for name in remaining:
+            yield name, None
+
 try:
     import paramiko
     
@@ -220,6 +220,124 @@ def get_metadata(ref):
         'size': fs.get_size(ref),
         }
 
+# extension to vfs to return the reference of a named entry in a folder
+def get_child_reference(ref, name):
+    """Return the reference to the named entry in the folder
+    
+    The name is quoted to remove any special meaning of the ? and #
+    characters in the name.
+    """
+    if not isinstance(ref, Reference):
+        ref = get_reference(ref)
+    if isinstance(name, unicode):
+        name = name.encode("utf-8")
+    import urllib
+    return ref.resolve2(urllib.quote(name))
+
+def get_mimetype_from_name(ref):
+    """Guess the MIME type of a regular file from the extension of its name
+    
+    Uses the same heuristic as L{BaseFS.get_mimetype} but doesn't need to
+    query the file system.
+    """
+    from mimetypes import guess_type
+    name = ref.path[-1]
+    name, extension, language = FileName.decode(name)
+    if extension is not None:
+        mimetype, encoding = guess_type('.%s' % extension)
+        if mimetype is not None:
+            return mimetype
+    return 'application/octet-stream'
+
+def get_stat_metadata(ref, attrs):
+    """Create the metadata dictionary of L{get_entry_metadata} from the
+    result of a stat call.
+    
+    @param attrs: object with st_mode, st_size, and st_mtime attributes, like
+    the result of os.stat or an SFTPAttributes object
+    """
+    import stat
+    from datetime import datetime
+    mode = attrs.st_mode
+    is_folder = stat.S_ISDIR(mode)
+    if is_folder:
+        mimetype = 'inode/directory'
+    elif stat.S_ISREG(mode):
+        mimetype = get_mimetype_from_name(ref)
+    else:
+        mimetype = 'application/x-not-regular-file'
+    return {
+        'mimetype': mimetype,
+        'description': '',
+        'mtime': datetime.fromtimestamp(attrs.st_mtime),
+        'size': attrs.st_size,
+        'is_folder': is_folder,
+        'can_read': bool(mode & (stat.S_IRUSR|stat.S_IRGRP|stat.S_IROTH)),
+        'can_write': bool(mode & (stat.S_IWUSR|stat.S_IWGRP|stat.S_IWOTH)),
+        }
+
+# extension to vfs to return the metadata needed to display an entry in a
+# folder listing
+def get_entry_metadata(ref):
+    """Return the metadata of L{get_metadata} along with the is_folder,
+    can_read, and can_write flags of the reference.
+    """
+    if not isinstance(ref, Reference):
+        ref = get_reference(ref)
+    fs = get_file_system(ref.scheme)
+    metadata = dict(get_metadata(ref))
+    metadata['is_folder'] = fs.is_folder(ref)
+    metadata['can_read'] = fs.can_read(ref)
+    metadata['can_write'] = fs.can_write(ref)
+    return metadata
+
+# extension to vfs to return the metadata of many entries in a folder
+def get_folder_metadata(ref, names):
+    """Generator returning the metadata of the named entries in the folder
+    
+    File systems that are able to return the attributes of all the entries
+    in a folder with a single request (e.g. a directory listing with
+    attributes) provide a get_folder_metadata classmethod that is used
+    instead of querying each entry individually.
+    
+    @returns: generator yielding a (name, metadata) tuple for each name,
+    where metadata is the dictionary returned by L{get_entry_metadata} or
+    None if the entry couldn't be queried.  The tuples may not be returned in
+    the same order as the names.
+    """
+    if not isinstance(ref, Reference):
+        ref = get_reference(ref)
+    fs = get_file_system(ref.scheme)
+    if hasattr(fs, 'get_folder_metadata'):
+        return fs.get_folder_metadata(ref, names)
+    return _get_folder_metadata(ref, names)
+
+def _get_folder_metadata(ref, names):
+    for name in names:
+        try:
+            metadata = get_entry_metadata(get_child_reference(ref, name))
+        except (OSError, IOError):
+            metadata = None
+        yield name, metadata
+
+def replace(source, target):
+    """Move the source to the target, replacing the target if it exists.
+    
+    File systems that support an atomic rename over an existing file provide
+    a replace classmethod; otherwise the target is removed before the source
+    is moved.
+    """
+    if not isinstance(source, Reference):
+        source = get_reference(source)
+    if not isinstance(target, Reference):
+        target = get_reference(target)
+    fs = get_file_system(source.scheme)
+    if hasattr(fs, 'replace') and source.scheme == target.scheme:
+        return fs.replace(source, target)
+    if exists(target):
+        remove(target)
+    move(source, target)
+
 # Register a callback that the vfs can use to prompt the user for a
 # username/password combination.  The callback function should take four
 # arguments and return a username, password pair if successful or (None, None)
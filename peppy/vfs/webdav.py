@@ -224,6 +224,43 @@ class WebDavFS(BaseFS):
         size = cls._get_metadata(ref, 'getcontentlength', 0)
         return int(size)
 
+    @classmethod
+    def get_folder_metadata(cls, ref, names):
+        """Return the metadata of the entries in the folder from the responses
+        of the single depth 1 PROPFIND request of the folder.
+        
+        Entries not found in the folder's responses are queried individually.
+        """
+        folder, status, responses = cls._propfind(ref)
+        for name in names:
+            child = utils.get_child_reference(ref, name)
+            found = None
+            if responses:
+                found = cls._get_response_from_ref(child, responses)
+            try:
+                if found:
+                    path, response = found
+                    mimetype = response.get('getcontenttype', 'application/octet-stream')
+                    mtime = response.get('getlastmodified')
+                    if mtime is not None:
+                        mtime = HTTPDate.decode(mtime)
+                    else:
+                        mtime = cls.non_existent_time
+                    metadata = {
+                        'mimetype': mimetype,
+                        'description': '',
+                        'mtime': mtime,
+                        'size': int(response.get('getcontentlength', 0)),
+                        'is_folder': mimetype == "httpd/unix-directory",
+                        'can_read': True,
+                        'can_write': response.get('lockdiscovery') is None,
+                        }
+                else:
+                    metadata = utils.get_entry_metadata(child)
+            except (OSError, IOError):
+                metadata = None
+            yield name, metadata
+
     @classmethod
     def make_file(cls, ref):
         folder_path = utils.get_dirname(ref)
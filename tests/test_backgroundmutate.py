@@ -0,0 +1,89 @@
+import os,sys,re
+
+from mock_wx import *
+
+from peppy.actions.base import MutateThread, MutateStatus
+
+from nose.tools import *
+
+
+class FakeStatusInfo(object):
+    def __init__(self):
+        self.cancelled = False
+        self.message = None
+    def isCancelled(self):
+        return self.cancelled
+    def updateProgress(self, perc, text=None):
+        pass
+    def stopProgress(self, text):
+        self.message = text
+
+class FakeBuffer(object):
+    busy = True
+    def setBusy(self, state):
+        self.busy = state
+
+class FakeMode(object):
+    def __init__(self):
+        self.status_info = FakeStatusInfo()
+        self.buffer = FakeBuffer()
+    def GetTextLength(self):
+        return 100
+
+class FakeAction(object):
+    def __init__(self):
+        self.applied = None
+    def getName(self):
+        return "Sort Lines"
+    def applyBackgroundMutate(self, s, pos, end, orig, data):
+        self.applied = data
+
+class DirectMutateStatus(MutateStatus):
+    """Call the GUI callbacks directly rather than through wx.CallAfter"""
+    def updateStatus(self, cur=-1, max=-1, text=None):
+        self.updateStatusGUI(self.calcPercentComplete(cur, max), text)
+    def reportSuccess(self, text, data=None):
+        self.reportSuccessGUI(text, data)
+    def reportFailure(self, text):
+        self.reportFailureGUI(text)
+
+
+class TestMutateStatus(object):
+    def setup(self):
+        self.mode = FakeMode()
+        self.action = FakeAction()
+        self.lines = ["c\n", "a\n", "b\n", "d\n"]
+
+    def run(self, func, chunk_size=0):
+        status = DirectMutateStatus(self.action, self.mode, 0, 100)
+        thread = MutateThread(func, self.lines, chunk_size, status)
+        status.thread = thread
+        thread.run()
+        return thread
+
+    def testComplete(self):
+        self.run(sorted)
+        eq_(["a\n", "b\n", "c\n", "d\n"], self.action.applied)
+        eq_("Completed.", self.mode.status_info.message)
+        assert not self.mode.buffer.busy
+
+    def testCancelThenComplete(self):
+        def cancel_while_running(lines):
+            self.mode.status_info.cancelled = True
+            return sorted(lines)
+        self.run(cancel_while_running)
+        eq_(None, self.action.applied)
+        eq_("Cancelled; Sort Lines not applied.", self.mode.status_info.message)
+        assert not self.mode.buffer.busy
+
+    def testCancelChunked(self):
+        self.mode.status_info.cancelled = True
+        calls = []
+        def upper(lines):
+            calls.append(lines)
+            return [line.upper() for line in lines]
+        thread = self.run(upper, chunk_size=2)
+        eq_(1, len(calls))
+        assert thread.stop_request
+        eq_(None, self.action.applied)
+        eq_("Cancelled.", self.mode.status_info.message)
@@ -0,0 +1,84 @@
+import os,sys,re,time,shutil,tempfile,threading
+
+import peppy.vfs as vfs
+from peppy.lib.backgroundwriter import *
+
+from nose.tools import *
+
+class TestBackgroundWriter(object):
+    def setup(self):
+        self.dir = tempfile.mkdtemp(prefix="peppy-writer-")
+        self.writer = BackgroundWriter()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def getURL(self, name):
+        return vfs.get_child_reference(vfs.normalize(self.dir + "/"), name)
+
+    def read(self, name):
+        return open(os.path.join(self.dir, name), "rb").read()
+
+    def testWrite(self):
+        url = self.getURL("#test.txt#")
+        self.writer.write("test", url, "first")
+        self.writer.wait("test")
+        eq_("first", self.read("#test.txt#"))
+        self.writer.write("test", url, lambda: "second")
+        self.writer.wait()
+        eq_("second", self.read("#test.txt#"))
+        eq_(["#test.txt#"], os.listdir(self.dir))
+
+    def testCoalesce(self):
+        blocked = threading.Event()
+        release = threading.Event()
+        def block():
+            blocked.set()
+            release.wait()
+            return "blocker"
+        calls = []
+        def data(text):
+            def encode():
+                calls.append(text)
+                return text
+            return encode
+        self.writer.write("blocker", self.getURL("blocker"), block)
+        blocked.wait()
+        for i in range(10):
+            self.writer.write("test", self.getURL("test"), data(str(i)))
+        assert self.writer.isPending("test")
+        release.set()
+        self.writer.wait()
+        eq_(["9"], calls)
+        eq_("9", self.read("test"))
+        eq_(2, self.writer.written)
+
+    def testCancel(self):
+        blocked = threading.Event()
+        release = threading.Event()
+        def block():
+            blocked.set()
+            release.wait()
+            return "blocker"
+        self.writer.write("blocker", self.getURL("blocker"), block)
+        blocked.wait()
+        self.writer.write("test", self.getURL("test"), "test")
+        self.writer.cancel("test")
+        assert not self.writer.isPending("test")
+        release.set()
+        self.writer.wait()
+        eq_(["blocker"], os.listdir(self.dir))
+
+    def testFailure(self):
+        errors = []
+        def fail():
+            raise IOError("failed")
+        def callback(request, error):
+            errors.append(error)
+        url = self.getURL("test")
+        self.writer.write("test", url, "original")
+        self.writer.write("fail", url, fail, callback)
+        self.writer.wait()
+        eq_(1, len(errors))
+        eq_("original", self.read("test"))
+        eq_(["test"], os.listdir(self.dir))
@@ -1,4 +1,5 @@
 import os,sys,re
+from cStringIO import StringIO
 
 from peppy.lib.bufferedreader import *
 
@@ -54,3 +55,106 @@ class TestBufferedReader:
         eq_('ghijklmnop', self.b.read(10))
         self.b.seek(self.b.len)
         eq_('klmnop', self.b.read(6))
+
+class TestBlockCacheReader:
+    def setup(self):
+        self.s = "".join([chr(i % 256) for i in range(10000)])
+        self.fh = StringIO(self.s)
+        self.b = BlockCacheReader(self.fh, block_size=64, max_blocks=4, bypass_size=1000)
+        
+    def test_basic(self):
+        eq_(self.s[0:10], self.b.read(10))
+        eq_(self.s[10:100], self.b.read(90))
+        self.b.seek(9990)
+        eq_(self.s[9990:], self.b.read(100))
+        eq_('', self.b.read(10))
+        
+    def test_seek(self):
+        for pos, size in [(5000, 10), (60, 10), (0, 200), (9999, 1), (5010, 300), (1, 2000)]:
+            self.b.seek(pos)
+            eq_(self.s[pos:pos + size], self.b.read(size))
+            eq_(pos + len(self.s[pos:pos + size]), self.b.tell())
+        self.b.seek(-10, 2)
+        eq_(self.s[-10:], self.b.read())
+        
+    def test_lru(self):
+        for pos in [0, 64, 128, 192, 0, 256]:
+            self.b.seek(pos)
+            self.b.read(1)
+        # block 1 was the least recently used and should have been dropped
+        eq_([0, 2, 3, 4], sorted(self.b.blocks.keys()))
+        eq_(1, self.b.hits)
+        eq_(5, self.b.misses)
+        
+    def test_clone(self):
+        self.b.seek(100)
+        other = self.b.clone()
+        eq_(0, other.tell())
+        eq_(self.s[0:10], other.read(10))
+        eq_(100, self.b.tell())
+        eq_(self.s[100:110], self.b.read(10))
+        # the clone shares the cache
+        self.b.seek(0)
+        self.b.read(10)
+        eq_(1, self.b.hits)
+        
+    def test_threads(self):
+        import threading, random
+        errors = []
+        def worker(seed):
+            fh = self.b.clone()
+            r = random.Random(seed)
+            for i in range(500):
+                pos = r.randint(0, 9999)
+                size = r.choice([10, 100, 2000])
+                fh.seek(pos)
+                if fh.read(size) != self.s[pos:pos + size]:
+                    errors.append((seed, pos, size))
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        eq_([], errors)
+
+class TestDecompressingReader:
+    def setup(self):
+        import random
+        r = random.Random(1234)
+        self.s = "".join([chr(r.randint(0, 15)) for i in range(100000)])
+        
+    def compress(self, module):
+        fh = StringIO()
+        if module == 'gzip':
+            import gzip
+            z = gzip.GzipFile(fileobj=fh, mode='wb')
+            z.write(self.s[:60000])
+            z.close()
+            # multi-member gzip file
+            z = gzip.GzipFile(fileobj=fh, mode='wb')
+            z.write(self.s[60000:])
+            z.close()
+            fh.seek(0)
+            return getGzipReader(fh, seek_point_interval=10000, chunk_size=1000)
+        import bz2
+        fh.write(bz2.compress(self.s))
+        fh.seek(0)
+        return getBz2Reader(fh, chunk_size=1000)
+    
+    def check_seek(self, module):
+        b = self.compress(module)
+        for pos, size in [(5000, 10), (60, 10), (0, 200), (99999, 10), (59990, 20), (30000, 40000), (1, 2)]:
+            b.seek(pos)
+            eq_(self.s[pos:pos + size], b.read(size))
+        eq_(len(self.s), b.getSize())
+        b.seek(-10, 2)
+        eq_(self.s[-10:], b.read())
+        return b
+    
+    def test_gzip(self):
+        b = self.check_seek('gzip')
+        assert len(b.seek_points) > 5
+        
+    def test_bz2(self):
+        b = self.check_seek('bz2')
+        eq_(1, len(b.seek_points))
@@ -7,6 +7,7 @@ from mock_wx import *
 from peppy.stcbase import *
 from peppy.fundamental import *
 from peppy.plugins.cpp_mode import *
+from peppy.lib.autoindent import AutoindentCache
 from peppy.debug import *
 
 from nose.tools import *
@@ -172,3 +173,53 @@ void main(void)
         prepareSTC(self.stc, "if (blah(blah,\n    blah))\n    stuff|\n")
         pos = self.stc.GetCurrentPos()
         assert not self.autoindent.isInsideStatement(self.stc, pos)
+
+    def testCachedInsideStatement(self):
+        # The paren count at the start of each line is cached, so an edit
+        # above the cursor must invalidate the count of the following lines
+        prepareSTC(self.stc, "stuff;\nif (blah(blah,\n    blah))\n    stuff|\n")
+        pos = self.stc.GetCurrentPos()
+        assert not self.autoindent.isInsideStatement(self.stc, pos)
+        cache = AutoindentCache.getCache(self.stc)
+        assert cache is not None
+        eq_(0, cache.get((self.autoindent, 'parens'), 3))
+
+        # Remove one of the close parens on line 2
+        start = self.stc.GetText().find("))")
+        self.stc.SetTargetStart(start)
+        self.stc.SetTargetEnd(start + 1)
+        self.stc.ReplaceTarget("")
+        self.stc.Colourise(0, self.stc.GetTextLength())
+        eq_(None, cache.get((self.autoindent, 'parens'), 3))
+        pos = self.stc.GetLineEndPosition(3)
+        assert self.autoindent.isInsideStatement(self.stc, pos)
+
+    def reindentLines(self, text):
+        prepareSTC(self.stc, "|" + text)
+        for line in range(self.stc.GetLineCount()):
+            self.stc.GotoLine(line)
+            self.autoindent.processTab(self.stc)
+            self.stc.Colourise(0, self.stc.GetTextLength())
+        return self.stc.GetText()
+
+    def testReindentLines(self):
+        # Reindenting each line in turn uses the values cached for the lines
+        # above it, which must give the same result as not using the cache
+        text = """\
+void main(void)
+{
+if (blah) {
+stuff(blah,
+blah);
+for (i=0; i<5; i++) {
+more(i);
+}
+}
+return;
+}
+"""
+        cached = self.reindentLines(text)
+        assert AutoindentCache.getCache(self.stc) is not None
+        self.stc._autoindent_cache = None
+        eq_(self.reindentLines(text), cached)
+        eq_("    return;", self.stc.GetLine(9).rstrip())
@@ -0,0 +1,48 @@
+import os,sys,re
+
+from peppy.lib.dictutils import *
+
+from nose.tools import *
+
+class TestLRUDict(object):
+    def setup(self):
+        self.d = LRUDict(3)
+        for key in "abc":
+            self.d[key] = key.upper()
+
+    def testEvict(self):
+        eq_(["a", "b", "c"], self.d.keys())
+        eq_("A", self.d["a"])
+        self.d["d"] = "D"
+        eq_(["c", "a", "d"], self.d.keys())
+        assert "b" not in self.d
+        eq_(3, len(self.d))
+
+    def testContainsDoesntTouch(self):
+        assert "a" in self.d
+        self.d["d"] = "D"
+        assert "a" not in self.d
+
+    def testUpdate(self):
+        self.d["a"] = "x"
+        eq_(["b", "c", "a"], self.d.keys())
+        eq_("x", self.d.get("a"))
+        eq_(3, len(self.d))
+
+    def testPop(self):
+        eq_("B", self.d.pop("b"))
+        eq_(None, self.d.pop("b", None))
+        assert_raises(KeyError, self.d.pop, "b")
+        eq_(("a", "A"), self.d.popitem())
+        del self.d["c"]
+        eq_([], self.d.keys())
+        assert_raises(KeyError, self.d.popitem)
+        self.d["e"] = "E"
+        eq_(["e"], self.d.keys())
+
+    def testClear(self):
+        self.d.clear()
+        eq_(0, len(self.d))
+        eq_(None, self.d.get("a"))
+        self.d["a"] = 1
+        eq_(["a"], list(self.d))
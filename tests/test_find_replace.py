@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 import os,sys,re
 from cStringIO import StringIO
 
@@ -96,3 +97,79 @@ class TestFindRegex(TestFind):
     def testFindEnd3(self):
         self.service.setFindString("$")
         self.findAll([(6,0), (13,6), (20,13), (27,20), (42,27), (48,42), (55,48), (-1,55)])
+
+
+class TestReplaceAll(object):
+    service = FindService
+    
+    def setUp(self):
+        self.stc = getSTC(stcclass=FundamentalMode, lexer="None")
+        self.settings = FindSettings()
+        self.service = self.__class__.service(self.stc, self.settings)
+    
+    def replaceAll(self, text, find, replace, start=0):
+        self.stc.SetText(text)
+        self.service.setFindString(find)
+        self.service.setReplaceString(replace)
+        count, pos = self.service.doReplaceAll(start)
+        return self.stc.GetText(), count
+
+    def testSmartCase(self):
+        eq_(self.replaceAll(u"Foo foo FOO fOo", u"foo", u"bar"),
+            (u"Bar bar BAR bAr", 4))
+
+    def testUnicode(self):
+        eq_(self.replaceAll(u"éfoo éfoo foo", u"foo", u"bär", 3),
+            (u"éfoo ébär bär", 2))
+
+    def testUndo(self):
+        self.stc.EmptyUndoBuffer()
+        eq_(self.replaceAll(u"a a a a", u"a", u"bb"), (u"bb bb bb bb", 4))
+        self.stc.Undo()
+        eq_(self.stc.GetText(), u"a a a a")
+
+
+class TestReplaceAllRegex(TestReplaceAll):
+    service = FindRegexService
+
+    def testGroups(self):
+        eq_(self.replaceAll(u"line 1\né line 22\n", u"line ([0-9]+)", u"\\1-\\Uline"),
+            (u"1-LINE\né 22-LINE\n", 2))
+
+    def testStartOfLine(self):
+        eq_(self.replaceAll(u"ab\nécd\n", u"^", u"> "),
+            (u"> ab\n> écd\n> ", 3))
+
+
+class TestMatchIndex(object):
+    def setUp(self):
+        self.stc = getSTC(stcclass=FundamentalMode, lexer="None")
+        self.stc.SetText("line 0\nline 1\nline a\nline 3\nblah blah blah\nstuff\nthings")
+        self.settings = FindSettings()
+        self.service = FindService(self.stc, self.settings)
+        self.service.setFindString("line")
+        self.index = MatchIndex(self.stc, self.service)
+        self.index.start()
+        self.scan()
+    
+    def tearDown(self):
+        self.index.stop()
+    
+    def scan(self):
+        while self.index.pending:
+            self.index.scanChunk()
+    
+    def testCount(self):
+        eq_(self.index.getCount(), 4)
+        eq_(self.index.findNext(0, 4), (7, 11))
+        eq_(self.index.findPrev(21), (14, 18))
+    
+    def testModify(self):
+        self.stc.InsertText(0, "line line\n")
+        self.scan()
+        eq_(self.index.starts, [0, 5, 10, 17, 24, 31])
+        self.stc.SetTargetStart(17)
+        self.stc.SetTargetEnd(23)
+        self.stc.ReplaceTarget("")
+        self.scan()
+        eq_(self.index.starts, [0, 5, 10, 18, 25])
@@ -0,0 +1,142 @@
+import os,sys,re,time,shutil,tempfile
+
+from peppy.lib.fortran_static import *
+
+from nose.tools import *
+
+main_f = """\
+      PROGRAM MAIN
+      X = AREA(2.0)
+      CALL SETUP(X)
+      STOP
+      END
+"""
+
+setup_f = """\
+      SUBROUTINE SETUP(X)
+      CALL REPORT(X)
+      Y = SCALE(X) + AREA(X)
+      RETURN
+      END
+      SUBROUTINE REPORT(X)
+      RETURN
+      END
+"""
+
+area_f = """\
+      REAL FUNCTION AREA(R)
+      AREA = 3.14159*R*R
+      RETURN
+      END
+"""
+
+class TestIncrementalUpdate(object):
+    def setup(self):
+        self.dir = tempfile.mkdtemp(prefix="peppy-fortran-")
+        self.files = []
+        for name, text in [("main.f", main_f), ("setup.f", setup_f), ("area.f", area_f)]:
+            self.files.append(self.write(name, text))
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, text):
+        filename = os.path.join(self.dir, name)
+        fh = open(filename, "w")
+        fh.write(text)
+        fh.close()
+        # make sure the modification time changes even on filesystems with
+        # coarse timestamps
+        stat = os.stat(filename)
+        os.utime(filename, (stat.st_atime, stat.st_mtime + len(self.files) + 10))
+        return filename
+
+    def scanAll(self):
+        stats = FortranStaticAnalysis()
+        for filename in self.files:
+            stats.scan(filename)
+        stats.analyze()
+        stats.summary()
+        return stats
+
+    def assertSameGraph(self, stats):
+        full = self.scanAll()
+        eq_(sorted(full.callables.keys()), sorted(stats.callables.keys()))
+        for name, c in full.callables.iteritems():
+            other = stats.callables[name]
+            eq_(c.callees, other.callees)
+            eq_(c.called_by, other.called_by)
+            eq_(c.num_calls, other.num_calls)
+
+    def testUpdate(self):
+        stats = FortranStaticAnalysis()
+        eq_(3, len(stats.update(self.files, 1)))
+        self.assertSameGraph(stats)
+        eq_(set(["area", "setup"]), stats.callables["main"].callees)
+        eq_(set(["main", "setup"]), stats.callables["area"].called_by)
+        eq_(0, len(stats.update(self.files, 1)))
+
+    def testChangedFile(self):
+        stats = FortranStaticAnalysis()
+        stats.update(self.files, 1)
+        unchanged = stats.callables["main"]
+        self.write("area.f", area_f + """\
+      REAL FUNCTION SCALE(R)
+      SCALE = 2.0*R
+      RETURN
+      END
+""")
+        eq_([self.files[2]], stats.update(self.files, 1))
+        assert stats.callables["main"] is unchanged
+        eq_(set(["report", "scale", "area"]), stats.callables["setup"].callees)
+        eq_(set(["setup"]), stats.callables["scale"].called_by)
+        self.assertSameGraph(stats)
+
+    def testRemovedFile(self):
+        stats = FortranStaticAnalysis()
+        stats.update(self.files, 1)
+        self.files.pop()
+        stats.update(self.files, 1)
+        assert "area" not in stats.callables
+        eq_(set(["setup"]), stats.callables["main"].callees)
+        self.assertSameGraph(stats)
+
+    def testSerialized(self):
+        stats = FortranStaticAnalysis()
+        stats.update(self.files, 1)
+        filename = os.path.join(self.dir, "test.static-analysis")
+        stats.saveStateToFile(filename)
+        loaded = FortranStaticAnalysis(serialized_filename=filename)
+        eq_(0, len(loaded.update(self.files, 1)))
+        self.assertSameGraph(loaded)
+
+    def testPool(self):
+        stats = FortranStaticAnalysis()
+        stats.min_files_for_pool = 1
+        eq_(3, len(stats.update(self.files, 2)))
+        self.assertSameGraph(stats)
+
+    def testNoPool(self):
+        import multiprocessing
+        def no_pool(processes=None):
+            raise AssertionError("process pool started")
+        saved = multiprocessing.Pool
+        multiprocessing.Pool = no_pool
+        try:
+            stats = FortranStaticAnalysis()
+            stats.min_files_for_pool = 1
+            # The default is to scan in the current process
+            eq_(3, len(stats.update(self.files)))
+            self.assertSameGraph(stats)
+
+            # A frozen executable can't start worker processes
+            sys.frozen = True
+            try:
+                stats = FortranStaticAnalysis()
+                stats.min_files_for_pool = 1
+                eq_(3, len(stats.update(self.files, 2)))
+            finally:
+                del sys.frozen
+            self.assertSameGraph(stats)
+        finally:
+            multiprocessing.Pool = saved
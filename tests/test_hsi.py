@@ -3,7 +3,7 @@
 Test the capabilities of HSI.Cube
 
 """
-import os,os.path,sys,re,time,commands
+import os,os.path,sys,re,time,commands,gzip,shutil,tempfile
 
 from nose.tools import *
 
@@ -11,6 +11,8 @@ import peppy.vfs as vfs
 
 import peppy.hsi.common as HSI
 import peppy.hsi.ENVI as ENVI
+from peppy.hsi.reduce import CubeReduction
+from peppy.hsi.filter import RGBMapper, PaletteMapper, ContrastFilter, BandStatisticsCache
 
 from cStringIO import StringIO
 import numpy
@@ -272,6 +274,47 @@ class testFilenames(object):
         eq_(format.format_id, 'ENVI')
         
 
+class testCompressedCube(object):
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.data = numpy.arange(5*4*3, dtype=numpy.int16)
+        fh = open(os.path.join(self.dir, 'test.hdr'), 'wb')
+        fh.write(fakeNmFile)
+        fh.close()
+        fh = gzip.open(os.path.join(self.dir, 'test.bil.gz'), 'wb')
+        fh.write(self.data.tostring())
+        fh.close()
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+    def testGzip(self):
+        h = ENVI.Header(os.path.join(self.dir, 'test.bil.gz'))
+        cube = h.getCube()
+        assert(cube.isDataLoaded())
+        assert isinstance(cube.cube_io, HSI.FileCubeReader)
+        raw = self.data.reshape((4, 3, 5))
+        for band in range(3):
+            eq_(cube.getBand(band).tolist(), raw[:, band, :].tolist())
+        eq_(cube.cube_io.getFocalPlaneRaw(2).tolist(), raw[2].tolist())
+
+    def testFocalPlaneCache(self):
+        h = ENVI.Header(os.path.join(self.dir, 'test.bil.gz'))
+        cube = h.getCube()
+        cache = HSI.FocalPlaneCache(cube, radius=2)
+        assert cache.reader is not cube.cube_io
+        fh = cube.cube_io.fh
+        fh.seek(10)
+        cache.setCenter(1)
+        while cache.prefetch(0.0):
+            pass
+        # prefetching reads through its own view of the file
+        eq_(fh.tell(), 10)
+        raw = self.data.reshape((4, 3, 5))
+        for line in range(4):
+            eq_(cache.getFocalPlane(line).tolist(), raw[line].tolist())
+
+
 class testGuessBands(object):
     def setup(self):
         self.cube = HSI.newCube("bsq")
@@ -329,3 +372,174 @@ class testGuessBands(object):
         eq_(bands,[7])
         bands = self.cube.getBandListByWavelength(680.0,units='nm')
         eq_(bands,[7])
+
+
+class testCubeReduction(object):
+    def getReference(self, cube):
+        # Full cube in (lines, samples, bands) order to match the BIP output
+        # of the reduction
+        bands = [cube.getBandRaw(i) for i in range(cube.bands)]
+        return numpy.dstack(bands)
+    
+    def checkReduction(self, interleave, operator, axis, func):
+        cube = fakeCube(interleave)
+        ref = self.getReference(cube)
+        index = ['lines', 'samples', 'bands'].index(axis)
+        expected = numpy.expand_dims(func(ref, axis=index), index)
+        output = CubeReduction(cube, operator, axis).reduce()
+        data = output.getNumpyArray()
+        eq_(data.shape, expected.shape)
+        assert numpy.allclose(data, expected)
+    
+    def testReductions(self):
+        funcs = {'Mean': numpy.mean,
+                 'Median': numpy.median,
+                 'Minimum': numpy.amin,
+                 'Maximum': numpy.amax,
+                 'Std Dev': numpy.std,
+                 }
+        for interleave in ['bil', 'bip', 'bsq']:
+            for axis in ['lines', 'samples', 'bands']:
+                for operator, func in funcs.iteritems():
+                    yield self.checkReduction, interleave, operator, axis, func
+    
+    def testStop(self):
+        cube = fakeCube('bil')
+        reduction = CubeReduction(cube, 'Mean', 'lines')
+        reduction.stopReduction()
+        eq_(reduction.reduce(), None)
+
+
+class testLookupTables(object):
+    def getRaw(self, dtype):
+        info = numpy.iinfo(dtype)
+        raw = numpy.linspace(info.min, info.max, 40 * 30).reshape(40, 30)
+        return raw.astype(dtype)
+    
+    def checkGray(self, dtype):
+        raw = self.getRaw(dtype)
+        mapper = RGBMapper()
+        eq_(mapper.getGrayMapping(raw).tolist(), mapper.getGray(raw).tolist())
+    
+    def checkPalette(self, dtype):
+        raw = self.getRaw(dtype)
+        mapper = PaletteMapper('bone')
+        gray = mapper.getGray(raw)
+        expected = mapper.colormap(gray, bytes=True)[:,:,0:3]
+        eq_(mapper.getRGB(40, 30, [raw]).tolist(), expected.tolist())
+    
+    def checkContrast(self, dtype):
+        raw = self.getRaw(dtype)
+        contrast = ContrastFilter(0.1)
+        filtered = contrast.getPlane(raw)
+        minval, maxval = int(raw.min()), int(raw.max())
+        h, edges = numpy.histogram(raw, contrast.bins, range=(minval, maxval + 1))
+        lo, hi = contrast.getScaledRange(h, minval, maxval, raw.size)
+        eq_(filtered.min(), lo)
+        eq_(filtered.max(), hi)
+    
+    def testContrastCutPoints(self):
+        # Cut points are at the edges of the 256 bins spanning the data, not
+        # at the exact percentiles
+        raw = (numpy.arange(1000) % 700).reshape(20, 50)
+        for dtype, expected in [('u1', (19, 220)), ('<i2', (49, 595)),
+                                ('>u2', (49, 595))]:
+            filtered = ContrastFilter(0.1).getPlane(raw.astype(dtype))
+            eq_((filtered.min(), filtered.max()), expected)
+        raw = numpy.array([-500] * 10 + range(-100, 400) + [3000] * 10, dtype=numpy.int16)
+        filtered = ContrastFilter(0.05).getPlane(raw.reshape(8, 65))
+        eq_((filtered.min(), filtered.max()), (-77, 361))
+    
+    def testTypes(self):
+        for dtype in ['u1', 'i1', '<u2', '>u2', '<i2', '>i2']:
+            dtype = numpy.dtype(dtype)
+            yield self.checkGray, dtype
+            yield self.checkPalette, dtype
+            yield self.checkContrast, dtype
+
+
+class testBandStatisticsCache(object):
+    def testWeak(self):
+        cache = BandStatisticsCache(2)
+        raw = numpy.arange(12, dtype=numpy.uint8).reshape(3, 4)
+        stats = cache.get(raw)
+        assert cache.get(raw) is stats
+        eq_(1, len(cache.cache))
+        
+        # The cache doesn't keep the array alive
+        del raw
+        eq_(0, len(cache.cache))
+    
+    def testLRU(self):
+        cache = BandStatisticsCache(2)
+        arrays = [numpy.arange(12, dtype=numpy.uint8) + i for i in range(3)]
+        stats = [cache.get(raw) for raw in arrays]
+        eq_(2, len(cache.cache))
+        assert cache.get(arrays[2]) is stats[2]
+        assert cache.get(arrays[0]) is not stats[0]
+        eq_(stats[0].minval, cache.get(arrays[0]).minval)
+
+
+class testFocalPlaneCache(object):
+    def getCube(self, interleave):
+        cube = fakeCube(interleave)
+        # the fake header has more bad band entries than bands
+        cube.bbl = cube.bbl[0:cube.bands]
+        return cube
+    
+    def checkSpectra(self, interleave):
+        cube = self.getCube(interleave)
+        cache = HSI.FocalPlaneCache(cube, max_planes=2, radius=1)
+        for line in range(cube.lines):
+            for sample in range(cube.samples):
+                eq_(cache.getSpectra(line, sample).tolist(),
+                    cube.getSpectra(line, sample).tolist())
+        eq_(cache.misses, cube.lines)
+        eq_(len(cache.planes), 2)
+    
+    def testSpectra(self):
+        for interleave in ['bil', 'bip', 'bsq']:
+            yield self.checkSpectra, interleave
+    
+    def testPrefetch(self):
+        cube = self.getCube('bsq')
+        cache = HSI.FocalPlaneCache(cube, radius=2)
+        cache.setCenter(1)
+        eq_(cache.pending, [2, 0, 3])
+        while cache.prefetch(0.0):
+            pass
+        eq_(sorted(cache.planes.keys()), [0, 2, 3])
+        cache.getSpectra(2, 0)
+        eq_(cache.misses, 0)
+        eq_(cache.hits, 1)
+
+
+class testBenchmark(object):
+    def testRun(self):
+        from peppy.hsi.benchmark import CubeBenchmark
+        bench = CubeBenchmark(sizes=['tiny'], interleaves=['bil', 'bsq'],
+                              datatypes=['int16'], repeat=1)
+        results = bench.run()
+        eq_(len(results), 2 * 2 * len(bench.getOperations()))
+        for result in results:
+            assert result['best'] >= 0.0
+            assert result['reader'] in ['mmap', 'file']
+    
+    def testCleanup(self):
+        from peppy.hsi.benchmark import CubeBenchmark
+        from peppy.hsi.filter import band_statistics
+        class Recorder(CubeBenchmark):
+            def openCube(self, filename, reader):
+                cube = CubeBenchmark.openCube(self, filename, reader)
+                self.cubes.append(cube)
+                return cube
+            def clearCache(self, cube):
+                CubeBenchmark.clearCache(self, cube)
+                eq_(len(band_statistics.cache), 0)
+        bench = Recorder(sizes=['tiny'], interleaves=['bsq'],
+                         datatypes=['int16'], readers=['file'], repeat=2)
+        bench.cubes = []
+        bench.run()
+        assert len(bench.cubes) > 1
+        for cube in bench.cubes:
+            eq_(cube.cube_io, None)
@@ -0,0 +1,121 @@
+import os,sys,re,time
+
+from peppy.lib.idlescheduler import *
+
+from nose.tools import *
+
+class Counter(object):
+    def __init__(self, count, log=None, name=None, delay=0.0):
+        self.count = count
+        self.log = log
+        self.name = name
+        self.delay = delay
+
+    def __call__(self):
+        if self.log is not None:
+            self.log.append(self.name)
+        if self.delay:
+            time.sleep(self.delay)
+        self.count -= 1
+        return self.count > 0
+
+class TestIdleScheduler(object):
+    def setup(self):
+        self.scheduler = IdleScheduler(budget=0.05)
+
+    def testPriority(self):
+        log = []
+        self.scheduler.addTask(Counter(1, log, "low"), "low", IdleScheduler.LOW)
+        self.scheduler.addTask(Counter(1, log, "high"), "high", IdleScheduler.HIGH)
+        eq_(False, self.scheduler.process())
+        eq_(["high", "low"], log)
+        eq_(0, len(self.scheduler.tasks))
+
+    def testBudget(self):
+        log = []
+        self.scheduler.addTask(Counter(10, log, "slow", 0.03), "slow")
+        self.scheduler.addTask(Counter(10, log, "other"), "other")
+        eq_(True, self.scheduler.process())
+        eq_(["slow", "other", "slow"], log)
+        eq_(True, self.scheduler.process())
+        # same priority tasks are run round robin
+        eq_(["slow", "other", "slow", "other", "slow", "other", "slow"], log)
+        stats = self.scheduler.getStats("slow")
+        eq_(4, stats.calls)
+        assert stats.total_time >= 0.12
+
+    def testCoalesce(self):
+        counter = Counter(3)
+        task1 = self.scheduler.addTask(counter, "count", owner=counter)
+        task2 = self.scheduler.addTask(counter, "count", owner=counter)
+        assert task1 is task2
+        eq_(1, len(self.scheduler.tasks))
+
+    def testCancel(self):
+        class Owner(object):
+            pass
+        owner1 = Owner()
+        owner2 = Owner()
+        self.scheduler.addTask(Counter(3), "a", owner=owner1)
+        self.scheduler.addTask(Counter(3), "b", owner=owner2)
+        self.scheduler.cancelTasks(owner1)
+        eq_(["b"], [t.name for t in self.scheduler.tasks])
+        del owner2
+        eq_(False, self.scheduler.process())
+        eq_(0, len(self.scheduler.tasks))
+
+    def testRepeat(self):
+        log = []
+        task = self.scheduler.addTask(Counter(0, log, "repeat"), "repeat", repeat=True, interval=10.0)
+        eq_(False, self.scheduler.process())
+        eq_(False, self.scheduler.process())
+        eq_(["repeat"], log)
+        task.next_time = 0.0
+        self.scheduler.process()
+        eq_(["repeat", "repeat"], log)
+        eq_(1, len(self.scheduler.tasks))
+
+    def testReady(self):
+        log = []
+        ready = []
+        self.scheduler.addTask(Counter(1, log, "wait"), "wait", ready=lambda: bool(ready))
+        eq_(False, self.scheduler.process())
+        eq_([], log)
+        ready.append(True)
+        eq_(False, self.scheduler.process())
+        eq_(["wait"], log)
+
+    def testException(self):
+        def fail():
+            raise RuntimeError("failed")
+        self.scheduler.addTask(fail, "fail")
+        eq_(False, self.scheduler.process())
+        eq_(0, len(self.scheduler.tasks))
+        eq_(1, self.scheduler.getStats("fail").calls)
+
+    def testRepeatMore(self):
+        log = []
+        counter = Counter(10**9, log, "more")
+        self.scheduler.addTask(counter, "more", repeat=True)
+        eq_(True, self.scheduler.process())
+        assert len(log) > 1
+        counter.count = 1
+        eq_(False, self.scheduler.process())
+        eq_(1, len(self.scheduler.tasks))
+
+    def testBoundMethodOwner(self):
+        class Owner(object):
+            def __init__(self):
+                self.calls = 0
+            def work(self):
+                self.calls += 1
+                return True
+            def isReady(self):
+                return True
+        owner = Owner()
+        self.scheduler.addTask(owner.work, "work", owner=owner, ready=owner.isReady, repeat=True)
+        eq_(True, self.scheduler.process())
+        assert owner.calls > 0
+        del owner
+        eq_(False, self.scheduler.process())
+        eq_(0, len(self.scheduler.tasks))
@@ -8,6 +8,7 @@ from peppy.stcbase import *
 from peppy.fundamental import *
 from peppy.major_modes.python import *
 from peppy.major_modes.fortran_77 import *
+from peppy.lib.autoindent import AutoindentCache
 from peppy.debug import *
 
 from nose.tools import *
@@ -397,3 +398,50 @@ class TestFortran77Indent(object):
 
         for test in splittests(tests):
             yield self.checkReindentAction, test
+
+    def testCachedContentLine(self):
+        prepareSTC(self.stc, "      IF (BLAH) THEN\n\nC     comment\n\n|          B=1.0\n")
+        eq_(0, self.autoindent.findPrevContentLine(self.stc, 4))
+        cache = AutoindentCache.getCache(self.stc)
+        assert cache is not None
+        eq_(0, cache.get((self.autoindent, 'content'), 3))
+
+        # Content added to the blank line below the IF is found instead
+        self.stc.InsertText(self.stc.PositionFromLine(1), "      A=1.0")
+        self.stc.Colourise(0, self.stc.GetTextLength())
+        eq_(None, cache.get((self.autoindent, 'content'), 3))
+        eq_(1, self.autoindent.findPrevContentLine(self.stc, 4))
+
+    def reindentLines(self, text):
+        prepareSTC(self.stc, "|" + text)
+        for line in range(self.stc.GetLineCount()):
+            self.stc.GotoLine(line)
+            self.autoindent.processTab(self.stc)
+            self.stc.Colourise(0, self.stc.GetTextLength())
+        return self.stc.GetText()
+
+    def testReindentLines(self):
+        # Reindenting each line in turn uses the values cached for the lines
+        # above it, which must give the same result as not using the cache
+        text = """\
+      PROGRAM sample
+      IF (BLAH) THEN
+B=1.0
+
+C     comment
+      DO 10 I=1,5
+      CALL SOMEFUNC(B)
+10    CONTINUE
+      ELSE
+B=2.0
+      ENDIF
+"""
+        cached = self.reindentLines(text)
+        saved = AutoindentCache.getCache(self.stc)
+        assert saved is not None
+        self.stc._autoindent_cache = None
+        try:
+            eq_(self.reindentLines(text), cached)
+        finally:
+            self.stc._autoindent_cache = saved
+        eq_("          B=1.0", self.stc.GetLine(2).rstrip())
@@ -0,0 +1,76 @@
+import os,sys,re,random
+from difflib import SequenceMatcher
+
+from peppy.lib.linediff import *
+
+from nose.tools import *
+
+def apply_opcodes(a, b, opcodes):
+    result = []
+    i = j = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        eq_((i, j), (i1, j1))
+        if tag == 'equal':
+            eq_(a[i1:i2], b[j1:j2])
+        result.extend(b[j1:j2])
+        i, j = i2, j2
+    eq_((len(a), len(b)), (i, j))
+    return result
+
+def lcs_length(a, b):
+    lengths = [[0] * (len(b) + 1) for i in range(len(a) + 1)]
+    for i in range(len(a) - 1, -1, -1):
+        for j in range(len(b) - 1, -1, -1):
+            if a[i] == b[j]:
+                lengths[i][j] = lengths[i + 1][j + 1] + 1
+            else:
+                lengths[i][j] = max(lengths[i + 1][j], lengths[i][j + 1])
+    return lengths[0][0]
+
+class TestLineDiff(object):
+    def testSimple(self):
+        a = "one two three four five".split()
+        b = "one three four 4.5 five six".split()
+        opcodes = get_line_opcodes(a, b)
+        eq_([('equal', 0, 1, 0, 1), ('delete', 1, 2, 1, 1),
+             ('equal', 2, 4, 1, 3), ('insert', 4, 4, 3, 4),
+             ('equal', 4, 5, 4, 5), ('insert', 5, 5, 5, 6)], opcodes)
+        eq_(SequenceMatcher(None, a, b).get_opcodes(), opcodes)
+
+    def testEmpty(self):
+        eq_([], get_line_opcodes([], []))
+        eq_([('insert', 0, 0, 0, 2)], get_line_opcodes([], ["a", "b"]))
+        eq_([('delete', 0, 2, 0, 0)], get_line_opcodes(["a", "b"], []))
+        eq_([(2, 0, 0)], get_matching_blocks([1, 2], []))
+
+    def testRandom(self):
+        random.seed(1234)
+        for count in range(500):
+            a = [random.randint(0, 5) for i in range(random.randint(0, 30))]
+            b = [random.randint(0, 5) for i in range(random.randint(0, 30))]
+            eq_(b, apply_opcodes(a, b, get_opcodes(a, b)))
+
+    def testMinimal(self):
+        # Without unique lines the Myers algorithm finds a minimal diff
+        random.seed(5678)
+        for count in range(200):
+            a = [random.randint(0, 2) * 2 for i in range(random.randint(0, 20))]
+            b = [random.randint(0, 2) * 2 for i in range(random.randint(0, 20))]
+            a = a + a
+            b = b + b
+            blocks = get_matching_blocks(a, b)
+            eq_(lcs_length(a, b), sum([n for i, j, n in blocks]))
+
+    def testLarge(self):
+        random.seed(42)
+        a = ["line %d" % i for i in range(20000)]
+        b = a[:]
+        for i in range(200):
+            pos = random.randrange(len(b))
+            if i % 3 == 0:
+                del b[pos]
+            elif i % 3 == 1:
+                b.insert(pos, "new line %d" % i)
+            else:
+                b[pos] += " changed"
+        eq_(b, apply_opcodes(a, b, get_line_opcodes(a, b)))
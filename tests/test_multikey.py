@@ -0,0 +1,116 @@
+import os,sys,re
+
+import wx
+
+from peppy.lib.multikey import *
+
+from nose.tools import *
+
+class Action(object):
+    default_menu = None
+
+    def __init__(self, name):
+        self.name = name
+
+class TestCompiledKeymap(object):
+    def setup(self):
+        CompiledKeymap.clearCache()
+        self.save = Action("save")
+        self.home = Action("home")
+
+    def getList(self, *bindings):
+        accel = AcceleratorList()
+        for key_binding, action in bindings:
+            accel.addKeyBinding(key_binding, action)
+        accel.rebuildKeyBindings()
+        return accel
+
+    def testLevels(self):
+        accel = self.getList(("C-x C-s", self.save), ("C-a", self.home))
+        ids, action = accel.findKeyBinding("C-x C-s")
+        eq_(2, len(ids))
+        assert action is self.save
+        assert ids[0] in accel.keymap.id_next_level
+        ids, action = accel.findKeyBinding("C-a")
+        assert action is self.home
+        bindings = {}
+        accel.getCurrentKeyBindings(bindings)
+        eq_(["C-a", "C-x C-s"], sorted(bindings.keys()))
+
+    def testShared(self):
+        accel1 = self.getList(("C-x C-s", self.save), ("C-a", self.home))
+        accel2 = self.getList(("C-a", Action("other")), ("C-x C-s", Action("other")))
+        assert accel1.keymap is accel2.keymap
+        accel3 = self.getList(("C-x C-s", self.save))
+        assert accel1.keymap is not accel3.keymap
+
+    def testPlaceholder(self):
+        accel = self.getList(("C-a", None), ("Ctrl-A", self.home))
+        eq_(1, len(accel.keymap.shared_bindings))
+        ids, action = accel.findKeyBinding("C-a")
+        assert action is self.home
+
+    @raises(DuplicateKeyError)
+    def testDuplicate(self):
+        self.getList(("C-a", self.save), ("Ctrl-A", self.home))
+
+    def testEviction(self):
+        first = CompiledKeymap.get(["C-a"])
+        for i in range(32):
+            CompiledKeymap.get(["C-x %s %s" % (chr(97 + i / 26), chr(97 + i % 26))])
+        eq_(32, len(CompiledKeymap.cache))
+        assert CompiledKeymap.get(["C-x b f"]) is CompiledKeymap.get(["C-x b f"])
+        assert CompiledKeymap.get(["C-a"]) is not first
+
+
+class KeystrokeAction(Action):
+    def __init__(self, name):
+        Action.__init__(self, name)
+        self.count = 0
+
+    def actionWorksWithCurrentFocus(self):
+        return True
+
+    def actionKeystroke(self, evt, multiplier=1):
+        self.count += 1
+
+class StatusFrame(object):
+    def SetStatusText(self, text, column=0):
+        self.text = text
+
+class TestCancelKeys(object):
+    def setup(self):
+        CompiledKeymap.clearCache()
+        self.save = KeystrokeAction("save")
+        self.cancel = KeystrokeAction("cancel")
+        self.accel = AcceleratorManager()
+        self.accel.addKeyBinding("C-x C-s", self.save)
+        self.accel.addCancelKeyBinding("C-g", self.cancel)
+        self.accel.addCancelKeyBinding("M-ESC ESC", self.cancel)
+        self.accel.addCancelKeys()
+        self.accel.rebuildAllKeyBindings()
+        self.accel.frame = StatusFrame()
+
+    def press(self, key_binding):
+        for keystroke in KeyAccelerator.split(key_binding):
+            processed = self.accel.processMultiKey(None, keystroke)
+        return processed
+
+    def testRoot(self):
+        assert self.press("C-g")
+        eq_(1, self.cancel.count)
+        assert self.accel.isRoot()
+
+    def testMultiKeyLevel(self):
+        assert self.press("C-x C-g")
+        eq_(1, self.cancel.count)
+        assert self.accel.isRoot()
+        assert self.press("C-x M-ESC ESC")
+        eq_(2, self.cancel.count)
+        assert self.press("C-x C-s")
+        eq_(1, self.save.count)
+
+    def testUndefined(self):
+        assert self.press("C-x")
+        assert not self.accel.processMultiKey(None, KeyAccelerator.split("C-a")[0])
+        eq_(0, self.cancel.count)
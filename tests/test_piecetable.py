@@ -0,0 +1,106 @@
+import os,sys,re
+from cStringIO import StringIO
+import StringIO as pyStringIO
+
+from peppy.lib.piecetable import *
+
+from nose.tools import *
+
+class TestPieceTable(object):
+    def setup(self):
+        self.original = "".join([chr(i % 256) for i in range(1000)])
+        self.table = PieceTable(StringIO(self.original))
+        self.table.page_size = 100
+        self.expected = list(self.original)
+
+    def replace(self, start, end, bytes):
+        self.table.replace(start, end, bytes)
+        self.expected[start:end] = list(bytes)
+        eq_("".join(self.expected), self.table.read())
+        eq_(len(self.expected), len(self.table))
+
+    def testRead(self):
+        eq_(1000, len(self.table))
+        eq_(self.original[10:20], self.table.read(10, 20))
+        eq_(self.original[990:], self.table.read(990, 2000))
+        eq_("", self.table.read(1000, 1010))
+        assert not self.table.isModified()
+
+    def testReplace(self):
+        self.replace(10, 12, "ab")
+        self.replace(5, 15, "xyz")
+        self.replace(0, 0, "inserted")
+        self.replace(500, 600, "")
+        self.replace(len(self.expected), len(self.expected), "end")
+        eq_("xyz", self.table.read(13, 16))
+        assert self.table.isModified()
+
+    def testCoalesce(self):
+        for i in range(50):
+            self.replace(200 + i, 201 + i, "x")
+        eq_(3, len(self.table.pieces))
+        eq_([(200, 250)], self.table.getModifiedRanges())
+
+    def testUndoDelete(self):
+        old = self.table.read(100, 200)
+        self.replace(100, 200, "")
+        self.replace(100, 100, old)
+        eq_(3, len(self.table.pieces))
+        eq_([(100, 200)], self.table.getModifiedRanges())
+
+    def testEmpty(self):
+        table = PieceTable()
+        eq_(0, len(table))
+        table.replace(0, 0, "abc")
+        eq_("abc", table.read())
+
+    def testWriteChanges(self):
+        self.replace(150, 152, "ab")
+        self.replace(420, 421, "c")
+        self.replace(499, 501, "de")
+        eq_([(100, 200), (400, 600)], self.table.getModifiedPages())
+        fh = StringIO()
+        fh.write(self.original)
+        eq_(300, self.table.writeChanges(fh))
+        eq_("".join(self.expected), fh.getvalue())
+
+    def testWriteChangesLengthChanged(self):
+        self.replace(150, 150, "ab")
+        assert not self.table.canWriteChanges()
+        assert_raises(ValueError, self.table.writeChanges, StringIO())
+        fh = StringIO()
+        eq_(1002, self.table.write(fh, chunk_size=64))
+        eq_("".join(self.expected), fh.getvalue())
+
+    def checkInPlace(self, direction):
+        # The original is read from the same file that is being updated
+        fh = pyStringIO.StringIO(self.original)
+        table = PieceTable(fh)
+        table.page_size = 100
+        table.pieces = self.table.pieces
+        table.calcOffsets()
+        eq_(direction, table.getMoveDirection())
+        assert table.canWriteChanges()
+        table.writeChanges(fh, chunk_size=64)
+        eq_("".join(self.expected), fh.getvalue())
+
+    def testWriteChangesMovedDown(self):
+        self.replace(10, 20, "")
+        self.replace(500, 500, "0123456789")
+        eq_([(0, 600)], self.table.getModifiedPages())
+        self.checkInPlace(-1)
+
+    def testWriteChangesMovedUp(self):
+        self.replace(10, 10, "0123456789")
+        self.replace(510, 520, "")
+        eq_([(0, 600)], self.table.getModifiedPages())
+        self.checkInPlace(1)
+
+    def testWriteChangesMovedBoth(self):
+        self.replace(0, 0, "01234")
+        self.replace(305, 310, "")
+        self.replace(600, 605, "")
+        self.replace(900, 900, "56789")
+        eq_(None, self.table.getMoveDirection())
+        assert not self.table.canWriteChanges()
+        assert_raises(ValueError, self.table.writeChanges, StringIO())
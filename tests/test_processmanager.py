@@ -0,0 +1,68 @@
+import os,sys,re,threading
+
+import __builtin__
+__builtin__._ = str
+
+from peppy.lib.processmanager import JobThread
+
+from nose.tools import *
+
+
+class StubProcess(object):
+    """Replacement for subprocess.Popen that exits when told to"""
+    def __init__(self):
+        self.returncode = None
+    def poll(self):
+        return self.returncode
+
+class RecordingJobThread(JobThread):
+    """Keep the batches rather than passing them to the GUI thread"""
+    poll_interval = 0.01
+    batch_interval = 0.01
+
+    def __init__(self):
+        JobThread.__init__(self, None, "stub")
+        self._proc = StubProcess()
+        self.batches = []
+    def _flush(self, batch):
+        self.batches.append(list(batch))
+    def getOutput(self):
+        return "".join([text for batch in self.batches for name, text in batch])
+
+
+class TestProcessOutput(object):
+    def setup(self):
+        self.job = RecordingJobThread()
+        self.reader = threading.Thread(target=self.job._process_output)
+        self.reader.setDaemon(True)
+        self.reader.start()
+
+    def testStreamsClosed(self):
+        self.job._queue.put(("stdout", "hello "))
+        self.job._queue.put(("stdout", "world\n"))
+        self.job._queue.put(("stdout", None))
+        self.job._queue.put(("stderr", None))
+        self.reader.join(5)
+        assert not self.reader.isAlive()
+        eq_("hello world\n", self.job.getOutput())
+
+    def testExitedWithStreamsOpen(self):
+        # A child process that inherited the pipes keeps them open after
+        # the process itself exits, so the streams are never closed
+        self.job._queue.put(("stdout", "hello\n"))
+        self.job._proc.returncode = 0
+        self.job._queue.put(("stderr", "done\n"))
+        self.reader.join(5)
+        assert not self.reader.isAlive()
+        eq_("hello\ndone\n", self.job.getOutput())
+
+    def testRunning(self):
+        self.job._queue.put(("stdout", "hello\n"))
+        self.reader.join(0.2)
+        assert self.reader.isAlive()
+        eq_("hello\n", self.job.getOutput())
+        self.job._queue.put(("stdout", "world\n"))
+        self.job._proc.returncode = 0
+        self.reader.join(5)
+        assert not self.reader.isAlive()
+        eq_("hello\nworld\n", self.job.getOutput())
@@ -0,0 +1,133 @@
+import os,sys,re,struct
+
+from peppy.lib.recorddecoder import *
+from peppy.lib.threadutils import ProgressUpdater
+
+from nose.tools import *
+
+class Updater(ProgressUpdater):
+    """Record the percentage complete of each progress update"""
+    def __init__(self, stop=None):
+        ProgressUpdater.__init__(self)
+        self.percents = []
+        self.stop = stop
+    def updateStatus(self, cur=-1, max=-1, text=None):
+        self.percents.append(self.calcPercentComplete(cur, max))
+        if self.stop:
+            self.stop()
+
+class TestRecordDecoder(object):
+    def setup(self):
+        self.data = "".join([chr((i * 7) % 256) for i in range(4096)])
+
+    def checkFormat(self, format):
+        decoder = RecordDecoder(format)
+        count = len(self.data) / decoder.size
+        expected = [struct.unpack_from(format, self.data, i * decoder.size) for i in range(count)]
+        expected = [list(column) for column in zip(*expected)]
+        eq_(expected, decoder.decode(self.data))
+
+    def testFormats(self):
+        for format in ["16c", "ci", "@bhd", "<hHiI", ">2f3x2d", "=qQ?c", "!4B"]:
+            yield self.checkFormat, format
+
+    def testDtype(self):
+        if numpy is None:
+            return
+        eq_(None, get_dtype("2p"))
+        dtype = get_dtype("ci")
+        eq_(8, dtype.itemsize)
+        eq_(4, dtype.fields['f1'][1])
+
+    def testFormat(self):
+        decoder = RecordDecoder("<2h")
+        eq_(["01", "00", "ff", "ff"], decoder.formatHex("\x01\x00\xff\xff"))
+        eq_([["1"], ["-1"]], decoder.formatValues("\x01\x00\xff\xff"))
+
+    def testStats(self):
+        if numpy is None:
+            return
+        decoder = RecordDecoder("<Bh")
+        data = struct.pack("<BhBhBhBh", 1, -5, 2, 10, 3, 0, 10, 5)
+        reader = lambda start, end: data[start:end]
+        stats = decoder.getStats(reader, len(data) + 1, bins=3, chunk_records=3)
+        eq_(1, stats[0].min)
+        eq_(10, stats[0].max)
+        eq_(4.0, stats[0].mean)
+        eq_([3, 0, 1], stats[0].histogram)
+        eq_(-5, stats[1].min)
+        eq_(10, stats[1].max)
+        eq_([1, 1, 2], stats[1].histogram)
+
+    def testStatsNaN(self):
+        if numpy is None:
+            return
+        decoder = RecordDecoder("<fd")
+        nan = float('nan')
+        inf = float('inf')
+        data = struct.pack("<fdfdfdfd", 1.0, nan, nan, nan, 3.0, -inf, 8.0, nan)
+        reader = lambda start, end: data[start:end]
+        stats = decoder.getStats(reader, len(data), bins=2, chunk_records=2)
+        eq_(1.0, stats[0].min)
+        eq_(8.0, stats[0].max)
+        eq_(4.0, stats[0].mean)
+        eq_([2, 1], stats[0].histogram)
+        eq_(1, stats[0].nonfinite)
+        eq_(None, stats[1].min)
+        eq_([], stats[1].histogram)
+        eq_(4, stats[1].nonfinite)
+
+    def testStatsProgress(self):
+        if numpy is None:
+            return
+        decoder = RecordDecoder("<Bh")
+        data = struct.pack("<BhBhBhBh", 1, -5, 2, 10, 3, 0, 10, 5)
+        reader = lambda start, end: data[start:end]
+        updater = Updater()
+        stats = RecordStatistics(decoder, reader, len(data), bins=3, chunk_records=3).calculate(updater)
+        eq_([3, 0, 1], stats[0].histogram)
+        eq_([37.5, 50.0, 87.5, 100.0], updater.percents)
+
+    def testStatsStop(self):
+        if numpy is None:
+            return
+        decoder = RecordDecoder("<Bh")
+        data = struct.pack("<BhBhBhBh", 1, -5, 2, 10, 3, 0, 10, 5)
+        reads = []
+        def reader(start, end):
+            reads.append(start)
+            return data[start:end]
+        calc = RecordStatistics(decoder, reader, len(data), bins=3, chunk_records=2)
+        eq_(None, calc.calculate(Updater(calc.stopStatistics)))
+        eq_([0], reads)
+
+class TestRecordCache(object):
+    def setup(self):
+        self.data = "".join([chr(i % 256) for i in range(1001)])
+        self.reads = []
+        self.cache = RecordCache(RecordDecoder("<4B"), self.read, block_records=10, max_blocks=2)
+
+    def read(self, start, end):
+        self.reads.append(start)
+        return self.data[start:end]
+
+    def testLookup(self):
+        eq_("29", self.cache.getHex(10, 1))
+        eq_("42", self.cache.getValue(10, 2))
+        eq_("\x28\x29\x2a\x2b", self.cache.getRecordData(10))
+        eq_([40], self.reads)
+
+    def testPadding(self):
+        eq_("e8", self.cache.getHex(250, 0))
+        eq_("0", self.cache.getValue(250, 1))
+
+    def testLRU(self):
+        self.cache.getHex(0, 0)
+        self.cache.getHex(10, 0)
+        self.cache.getHex(0, 0)
+        self.cache.getHex(20, 0)
+        self.cache.getHex(0, 0)
+        eq_([0, 40, 80], self.reads)
+        self.cache.invalidateRecord(5)
+        self.cache.getHex(0, 0)
+        eq_([0, 40, 80, 0], self.reads)
@@ -0,0 +1,59 @@
+import os,sys,re
+
+import wx
+
+from peppy.lib.stcspellcheck import WordVerdictCache
+
+from nose.tools import *
+
+
+class StubDict(object):
+    """Enchant dictionary replacement that counts the lookups"""
+    def __init__(self, words):
+        self.words = set(words)
+        self.checked = []
+    def check(self, word):
+        self.checked.append(word)
+        return word in self.words
+    def suggest(self, word):
+        return [w for w in sorted(self.words) if w[0] == word[0]]
+    def add_to_pwl(self, word):
+        self.words.add(word)
+
+
+class TestWordVerdictCache(object):
+    def setup(self):
+        self.spell = StubDict(["the", "quick", "brown", "fox"])
+        self.cache = WordVerdictCache(self.spell, 3)
+
+    def testHits(self):
+        assert self.cache.check("the")
+        assert not self.cache.check("teh")
+        assert self.cache.check("the")
+        assert not self.cache.check("teh")
+        eq_(["the", "teh"], self.spell.checked)
+        eq_(2, self.cache.hits)
+        eq_(2, self.cache.misses)
+
+    def testEviction(self):
+        assert self.cache.check("the")
+        assert not self.cache.check("teh")
+        assert not self.cache.check("qiuck")
+        # "the" is used again, so "teh" is the least recently used
+        self.spell.checked = []
+        assert self.cache.check("the")
+        assert self.cache.check("fox")
+        eq_(3, len(self.cache.verdicts))
+        assert "teh" not in self.cache.verdicts
+        assert not self.cache.check("teh")
+        eq_(["fox", "teh"], self.spell.checked)
+
+    def testAddWord(self):
+        assert not self.cache.check("peppy")
+        self.cache.addWord("peppy")
+        assert self.cache.check("peppy")
+        eq_(["peppy"], self.spell.checked)
+        eq_(set(), self.cache.checkWords(["peppy", "fox"]))
+
+    def testSuggest(self):
+        eq_(["quick"], self.cache.suggest("qiuck"))
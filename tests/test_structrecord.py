@@ -6,7 +6,7 @@ Test the packing and unpacking of structrecord
 
 
 
-import os,os.path,sys,re,time,commands
+import os,os.path,sys,re,time,commands,struct
 from optparse import OptionParser
 from peppy.lib.structrecord import *
 
@@ -1024,6 +1024,54 @@ class Testchecksum(BaseTest):
         checksum=67108874,
         )
 
+class Fixedpoint(Record):
+    typedef=(
+        SLInt16('x'),
+        SLInt16('y'),
+        ULInt8('flag'),
+        )
+
+class Testcompiledlist1(BaseTest):
+    typedef=(
+        SLInt8('num'),
+        MetaList(Fixedpoint('points'),lambda vals:vals.num),
+        MetaList(FormatField('values','H'),lambda vals:vals.num),
+        )
+    raw="\x02\x01\x00\xff\xff\x07\x02\x00\x03\x00\x08"+struct.pack("HH",5,6)
+    values=ExampleData(
+        num=2,
+        points=[ExampleData(x=1,y=-1,flag=7),ExampleData(x=2,y=3,flag=8)],
+        values=[5,6],
+        )
+
+def testCompileTypedef():
+    typedef=(
+        SLInt16('a'),
+        SLInt32('b'),
+        SBInt16('c'),
+        FormatField('d','i'),
+        MetaField('e',lambda vals:vals.a),
+        FormatField('f','<4s'),
+        )
+    compiled=compileTypedef(typedef)
+    eq_(5,len(compiled))
+    eq_(['a','b'],compiled[0]._names)
+    eq_(6,compiled[0].getNumBytes(None))
+    eq_(['c'],compiled[1]._names)
+    eq_(typedef[3],compiled[2])
+    eq_(typedef[4],compiled[3])
+    eq_(5,Fixedpoint('test').getFixedSize())
+
+def testCompiledPartial():
+    rec=Record(typedef=(SLInt16('a'),SLInt16('b'),SLInt16('c')))
+    try:
+        rec.unserialize(StringIO("\x01\x00\x02\x00\x03"))
+        assert False
+    except EOFError:
+        pass
+    eq_(1,rec.a)
+    eq_(2,rec.b)
+
     
 if __name__ == "__main__":
     import nose
@@ -157,6 +157,57 @@ wheels = 1800
         eq_(1800, truck.classprefs.wheels)
 
 
+class testLookupCache(object):
+    def setup(self):
+        GlobalPrefs.default = copy.deepcopy(def_save)
+        GlobalPrefs.user = copy.deepcopy(user_save)
+        GlobalPrefs.lookup_cache.resetStats()
+
+    def testHits(self):
+        truck = ShortBedPickupTruck()
+        eq_(4, truck.classprefs.wheels)
+        stats = GlobalPrefs.getLookupStats()
+        eq_(1, stats['misses'])
+        for i in range(10):
+            eq_(4, truck.classprefs.wheels)
+        stats = GlobalPrefs.getLookupStats()
+        eq_(1, stats['misses'])
+        eq_(10, stats['hits'])
+
+    def testShadowing(self):
+        truck = ShortBedPickupTruck()
+        eq_(4, truck.classprefs.wheels)
+        Truck.classprefs.wheels = 6
+        eq_(6, truck.classprefs.wheels)
+        truck.classprefs.wheels = 8
+        eq_(8, truck.classprefs.wheels)
+        eq_(6, Truck.classprefs.wheels)
+        truck.classprefs._del('wheels')
+        eq_(6, truck.classprefs.wheels)
+
+    def testReadConfig(self):
+        truck = Truck()
+        eq_('no wings on this puppy', truck.classprefs.wings)
+        fh = StringIO("[Truck]\nwings = flappy\n")
+        GlobalPrefs.readConfig(fh)
+        GlobalPrefs.convertConfig()
+        eq_('flappy', truck.classprefs.wings)
+
+
+class testSubclassRegistry(object):
+    def testSubclasses(self):
+        eq_(set([PickupTruck, ShortBedPickupTruck, EighteenWheeler]),
+            set(getAllSubclassesOf(Truck)))
+        eq_(set([EighteenWheeler]), set(getAllSubclassesOf(TrailerMixin)))
+        eq_([], getAllSubclassesOf(EighteenWheeler))
+        eq_(set(searchAllSubclassesOf(Vehicle)), set(getAllSubclassesOf(Vehicle)))
+
+    def testDynamicSubclass(self):
+        Hovercraft = type('Hovercraft', (Vehicle,), {})
+        assert Hovercraft in getAllSubclassesOf(Vehicle)
+        assert Hovercraft.classprefs.wings
+
+
 class testUserList(object):
     def setup(self):
         GlobalPrefs.default = copy.deepcopy(def_save)
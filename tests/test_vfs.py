@@ -163,6 +163,28 @@ class FileTestCase(TestCase):
         vfs.remove('vfs/truncate.txt')
 
 
+    def test22_folder_metadata(self):
+        names = ['hello.txt', 'missing.txt']
+        metadata = dict(vfs.get_folder_metadata(vfs.normalize('vfs'), names))
+        self.assertEqual(metadata['missing.txt'], None)
+        hello = metadata['hello.txt']
+        self.assertEqual(hello['size'], 12)
+        self.assertEqual(hello['is_folder'], False)
+        self.assertEqual(hello['can_read'], True)
+
+
+    def test23_replace(self):
+        vfs.copy('vfs/hello.txt', 'vfs/hello.txt.bak')
+        with vfs.make_file('vfs/replaced.txt') as file:
+            file.write('bye\n')
+        vfs.replace(vfs.normalize('vfs/hello.txt.bak'),
+                    vfs.normalize('vfs/replaced.txt'))
+        self.assertEqual(open('vfs/replaced.txt').read(), 'hello world\n')
+        self.assertEqual(vfs.exists('vfs/hello.txt.bak'), False)
+        # Remove temporary file
+        vfs.remove('vfs/replaced.txt')
+
+
 
 class FilePermissions(TestCase):
     """